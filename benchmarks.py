@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Suite di benchmark dei percorsi critici, con baseline salvate e soglia di regressione
+Copre la generazione della Color Tree, i 24 pattern, la catena di effetti, l'invio MIDI su una
+porta di loopback, la sintesi delle note pygame, il disegno dell'albero in Tk e il jitter del
+loop di riproduzione. Gira senza display: i casi che richiedono Tk o un mixer audio vengono
+saltati (con il motivo) se non disponibili.
+
+Uso:
+  python benchmarks.py                      # esegue e confronta con la baseline
+  python benchmarks.py --save               # esegue e aggiorna la baseline
+  python benchmarks.py --filter pattern --threshold 1.5 --json risultati.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import chord_generator
+from chord_generator import ChordGenerator, MIDIOutput, MIDIScaleGenerator, Note
+from metrics import write_json
+from midi_effects import build_stages
+from pattern_engine import PatternEngine, PatternType
+
+try:
+    import mido
+    MIDI_AVAILABLE = True
+except ImportError:
+    MIDI_AVAILABLE = False
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+BASELINE_VERSION = 1
+# Un risultato è una regressione se supera la baseline di questo fattore (più la tolleranza)
+DEFAULT_THRESHOLD = 1.25
+# Campioni per benchmark
+DEFAULT_REPEAT = 7
+# Ciclo di riferimento (~1 ms) e durata della calibrazione iniziale
+REFERENCE_LOOPS = 5000
+CALIBRATION_SECONDS = 0.5
+# Riesecuzioni dei benchmark oltre la soglia prima di dichiarare una regressione
+DEFAULT_CONFIRM = 2
+CONFIRM_PAUSE = 1.0
+
+# Parametri con tutti gli effetti attivi, per la catena completa
+ALL_EFFECTS = {'octave_add': 1, 'velocity_curve': "exponential", 'velocity_intensity': 1.2,
+               'accent_enabled': True, 'accent_pattern': "every_other", 'accent_strength': 0.6,
+               'delay_enabled': True, 'delay_time': 0.2, 'delay_feedback': 0.4, 'delay_mix': 0.5,
+               'delay_type': "Standard", 'delay_repeats': 4, 'repeater_enabled': True, 'repeat_count': 2,
+               'repeat_timing': "immediate", 'humanize_timing': 0.01, 'humanize_velocity': 8}
+
+
+class BenchmarkSkipped(Exception):
+    """Il benchmark non può girare in questo ambiente (es. nessun display)"""
+
+
+@dataclass
+class BenchmarkResult:
+    """Campioni di un benchmark; value è il migliore o la mediana (più basso è meglio)"""
+    name: str
+    samples: List[float]
+    unit: str = "us"
+    # "min" per i tempi di CPU (il rumore del sistema può solo allungarli), "median" per le misure reali
+    statistic: str = "min"
+    # Margine assoluto aggiunto alla soglia, per le misure rumorose (stessa unità del valore)
+    tolerance: float = 0.0
+    extra: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def value(self) -> float:
+        return min(self.samples) if self.statistic == "min" else statistics.median(self.samples)
+
+    def as_dict(self) -> dict:
+        result = {'value': round(self.value, 3), 'unit': self.unit, 'statistic': self.statistic,
+                  'median': round(statistics.median(self.samples), 3), 'max': round(max(self.samples), 3),
+                  'samples': len(self.samples)}
+        if self.tolerance:
+            result['tolerance'] = self.tolerance
+        result.update(self.extra)
+        return result
+
+
+def _reference_loop() -> float:
+    """Durata (s) di un ciclo Python fisso, usato per misurare la velocità attuale della CPU"""
+    start = time.perf_counter()
+    # Aritmetica e allocazioni di piccoli oggetti, come nei percorsi misurati
+    pairs = [(value, {'note': value & 127}) for value in range(REFERENCE_LOOPS)]
+    sum(pair[1]['note'] * pair[0] for pair in pairs)
+    return time.perf_counter() - start
+
+
+_calibration: Optional[float] = None
+
+
+def calibration() -> float:
+    """Durata minima del ciclo di riferimento, misurata una volta su CALIBRATION_SECONDS"""
+    global _calibration
+    if _calibration is None:
+        deadline = time.perf_counter() + CALIBRATION_SECONDS
+        best = _reference_loop()
+        while time.perf_counter() < deadline:
+            best = min(best, _reference_loop())
+        _calibration = best
+    return _calibration
+
+
+def time_operation(name: str, operation: Callable[[], object], number: int = 1,
+                   repeat: int = DEFAULT_REPEAT, warmup: int = 1, calibrate: bool = True,
+                   tolerance: float = 0.0) -> BenchmarkResult:
+    """Microsecondi per chiamata: ogni campione esegue number chiamate (garbage collector sospeso)
+
+    Con calibrate ogni campione è preceduto dal ciclo di riferimento e riscalato sulla velocità di
+    calibrazione, così le variazioni di frequenza della CPU (o il carico di altre macchine virtuali)
+    si compensano. Il ciclo è codice Python puro: il lavoro vettoriale numpy va misurato senza.
+    """
+    for _ in range(warmup):
+        operation()
+    nominal = calibration() if calibrate else None
+    samples = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            speed = nominal / _reference_loop() if calibrate else 1.0
+            start = time.perf_counter()
+            for _ in range(number):
+                operation()
+            samples.append((time.perf_counter() - start) / number * 1_000_000 * speed)
+    finally:
+        if enabled:
+            gc.enable()
+    return BenchmarkResult(name, samples, tolerance=tolerance)
+
+
+# ---- Registro dei benchmark ----
+
+BENCHMARKS: "OrderedDict[str, Callable[[int], List[BenchmarkResult]]]" = OrderedDict()
+
+
+def benchmark(name: str):
+    """Registra una funzione (repeat) -> lista di risultati"""
+    def decorator(function):
+        BENCHMARKS[name] = function
+        return function
+    return decorator
+
+
+def _cell(root: Note = Note.C, level: int = 7, position: int = 3):
+    return next(cell for cell in ChordGenerator().generate_color_tree(root)[level - 1] if cell.position == position)
+
+
+class LoopbackPort(mido.ports.BaseOutput if MIDI_AVAILABLE else object):
+    """Porta MIDI in memoria: i messaggi inviati tornano come byte in una coda limitata"""
+
+    def __init__(self, maxlen: int = 4096):
+        super().__init__(name="loopback")
+        self.received = deque(maxlen=maxlen)
+
+    def _send(self, message):
+        self.received.append(message.bytes())
+
+
+class RecordingOutput:
+    """Uscita MIDI che registra l'istante di ogni Note On (per il jitter del loop)"""
+
+    def __init__(self):
+        self.initialized = True
+        self.output_port = object()
+        self.note_on_times = []
+
+    def send_note_on(self, note, velocity=64, channel=0):
+        self.note_on_times.append(time.perf_counter())
+        return True
+
+    def send_note_off(self, note, channel=0):
+        return True
+
+    def stop_all_notes(self):
+        pass
+
+
+@benchmark("color_tree")
+def bench_color_tree(repeat: int) -> List[BenchmarkResult]:
+    """Color Tree completa di tutte le 12 root"""
+    generator = ChordGenerator()
+
+    def operation():
+        for root in Note:
+            generator.generate_color_tree(root)
+
+    return [time_operation("color_tree.all_roots", operation, number=5, repeat=repeat)]
+
+
+@benchmark("pattern_notes")
+def bench_pattern_notes(repeat: int) -> List[BenchmarkResult]:
+    """generate_pattern_notes per ognuno dei 24 pattern su una cella di 7 note"""
+    engine = PatternEngine(MIDIScaleGenerator())
+    cell = _cell()
+    results = []
+
+    def operation(pattern):
+        random.seed(0)  # i pattern casuali fanno lo stesso lavoro a ogni chiamata
+        return engine.generate_pattern_notes(cell, pattern, 4, 0.3)
+
+    for pattern in PatternType:
+        results.append(time_operation(f"pattern_notes.{pattern.value}", lambda: operation(pattern),
+                                      number=200, repeat=repeat))
+    return results
+
+
+@benchmark("effects")
+def bench_effects(repeat: int) -> List[BenchmarkResult]:
+    """Ogni stadio e l'intera catena di effetti su un buffer di 4 ottave (senza cache della catena)"""
+    engine = PatternEngine(MIDIScaleGenerator())
+    buffer = engine.compile_pattern(_cell(), PatternType.UP_DOWN, duration_octaves=4)
+    stages = build_stages(ALL_EFFECTS)
+    results = []
+
+    def process(stage):
+        random.seed(0)  # humanize uguale a ogni chiamata
+        return stage.process(buffer)
+
+    for stage in stages:
+        results.append(time_operation(f"effects.{stage.name}", lambda: process(stage),
+                                      number=50, repeat=repeat))
+
+    def chain():
+        random.seed(0)
+        result = buffer
+        for stage in stages:
+            result = stage.process(result)
+        return result
+
+    results.append(time_operation("effects.chain", chain, number=20, repeat=repeat))
+    results[-1].extra['events_out'] = len(chain())
+    return results
+
+
+@benchmark("midi_output")
+def bench_midi_output(repeat: int) -> List[BenchmarkResult]:
+    """MIDIOutput.send_note_on/off verso una porta di loopback: microsecondi per messaggio"""
+    if not MIDI_AVAILABLE:
+        raise BenchmarkSkipped("mido non installato")
+    output = MIDIOutput()
+    output.initialized = True
+    output.output_port = LoopbackPort()
+    notes = range(36, 100)
+
+    def operation():
+        for note in notes:
+            output.send_note_on(note, 100)
+        for note in notes:
+            output.send_note_off(note)
+
+    result = time_operation("midi_output.send", operation, number=10, repeat=repeat)
+    result.samples = [sample / (2 * len(notes)) for sample in result.samples]
+    result.extra['messages_per_second'] = round(1_000_000 / result.value)
+    return [result]
+
+
+@benchmark("pygame_synthesis")
+def bench_pygame_synthesis(repeat: int) -> List[BenchmarkResult]:
+    """Sintesi di una nota da 0.3 s in _play_single_note_pygame (mixer con driver di sistema o dummy)"""
+    if not chord_generator.PYGAME_AVAILABLE:
+        raise BenchmarkSkipped("pygame non installato")
+    import pygame
+    try:
+        pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
+    except pygame.error as e:
+        raise BenchmarkSkipped(f"mixer audio non disponibile: {e}") from None
+    engine = PatternEngine(MIDIScaleGenerator())
+
+    def operation():
+        # Canali del mixer sempre liberi: play() non deve interrompere le note precedenti
+        pygame.mixer.stop()
+        engine._play_single_note_pygame(60, 0.3, 0.5)
+
+    try:
+        return [time_operation("pygame_synthesis.note", operation, number=20, repeat=repeat,
+                               calibrate=False, tolerance=100.0)]
+    finally:
+        pygame.mixer.stop()
+
+
+@benchmark("tree_render")
+def bench_tree_render(repeat: int) -> List[BenchmarkResult]:
+    """Costruzione della vista della Color Tree in ColorTreeDisplayApp (richiede un display)"""
+    try:
+        app = chord_generator.ColorTreeDisplayApp()
+    except chord_generator.tk.TclError as e:
+        raise BenchmarkSkipped(f"nessun display: {e}") from None
+    app.root.withdraw()
+
+    def operation():
+        # Impostazioni diverse da quelle in cache: la vista viene ricostruita da zero
+        app._tree_view_settings = None
+        app.generate_color_tree()
+        app.root.update_idletasks()
+
+    try:
+        return [time_operation("tree_render.view", operation, number=1, repeat=repeat)]
+    finally:
+        app.on_closing()
+
+
+@benchmark("loop_jitter")
+def bench_loop_jitter(repeat: int) -> List[BenchmarkResult]:
+    """Riproduzione reale di 28 note da 10 ms: ritardo p99 dei Note On e jitter degli intervalli"""
+    cell = _cell()
+    lateness, jitter = [], []
+    for _ in range(repeat):
+        output = RecordingOutput()
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        engine.play_pattern(cell, PatternType.UP, base_duration=0.01, duration_octaves=4)
+        deadline = time.monotonic() + 10
+        while engine.is_playing and time.monotonic() < deadline:
+            time.sleep(0.005)
+        engine.stop_pattern()
+        lateness.append(engine.metrics.lateness.percentile(99))
+        intervals = [b - a for a, b in zip(output.note_on_times, output.note_on_times[1:])]
+        jitter.append(statistics.pstdev(intervals) * 1_000_000 if len(intervals) > 1 else 0.0)
+    # Misure di temporizzazione reale: il margine (circa metà della baseline) assorbe il rumore dello
+    # scheduler del sistema, ma un ritardo doppio resta una regressione
+    return [BenchmarkResult("loop_jitter.lateness_p99", lateness, statistic="median", tolerance=250.0),
+            BenchmarkResult("loop_jitter.interval_stdev", jitter, statistic="median", tolerance=50.0)]
+
+
+# ---- Esecuzione, baseline e confronto ----
+
+def run_benchmarks(names: Optional[Sequence[str]] = None, repeat: int = DEFAULT_REPEAT,
+                   verbose: bool = False) -> Tuple[List[BenchmarkResult], Dict[str, str]]:
+    """Esegue i benchmark richiesti (tutti di default); restituisce i risultati e i saltati con il motivo"""
+    results, skipped = [], {}
+    for name, function in BENCHMARKS.items():
+        if names and not any(name.startswith(wanted) or wanted.startswith(name) for wanted in names):
+            continue
+        if verbose:
+            print(f"{name}...", flush=True)
+        try:
+            produced = function(repeat)
+        except BenchmarkSkipped as e:
+            skipped[name] = str(e)
+            continue
+        results.extend(result for result in produced
+                       if not names or any(name.startswith(wanted) or result.name.startswith(wanted)
+                                           for wanted in names))
+    return results, skipped
+
+
+def machine_info() -> dict:
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+
+
+def save_baseline(results: Sequence[BenchmarkResult], path: str = BASELINE_FILE):
+    """Scrive la baseline; i risultati già presenti e non rimisurati vengono mantenuti"""
+    existing = load_baseline(path) or {}
+    entries = existing.get('results', {}) if existing.get('version') == BASELINE_VERSION else {}
+    entries.update({result.name: result.as_dict() for result in results})
+    write_json({'version': BASELINE_VERSION, 'machine': machine_info(),
+                'results': dict(sorted(entries.items()))}, path)
+
+
+def load_baseline(path: str = BASELINE_FILE) -> Optional[dict]:
+    """Baseline salvata (None se assente o illeggibile)"""
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Errore nella lettura della baseline {path}: {e}")
+        return None
+
+
+@dataclass
+class Comparison:
+    """Confronto di un risultato con la baseline"""
+    name: str
+    value: float
+    baseline: Optional[float]
+    limit: Optional[float]
+
+    @property
+    def ratio(self) -> Optional[float]:
+        return self.value / self.baseline if self.baseline else None
+
+    @property
+    def regression(self) -> bool:
+        return self.limit is not None and self.value > self.limit
+
+
+def compare(results: Sequence[BenchmarkResult], baseline: Optional[dict],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Comparison]:
+    """Confronta i risultati con la baseline: regressione oltre baseline * threshold + tolleranza"""
+    entries = (baseline or {}).get('results', {})
+    comparisons = []
+    for result in results:
+        entry = entries.get(result.name)
+        if entry is None or entry.get('unit') != result.unit:
+            comparisons.append(Comparison(result.name, result.value, None, None))
+            continue
+        limit = entry['value'] * threshold + max(result.tolerance, entry.get('tolerance', 0.0))
+        comparisons.append(Comparison(result.name, result.value, entry['value'], limit))
+    return comparisons
+
+
+def confirm_regressions(results: Sequence[BenchmarkResult], baseline: Optional[dict],
+                        threshold: float = DEFAULT_THRESHOLD, attempts: int = DEFAULT_CONFIRM,
+                        repeat: int = DEFAULT_REPEAT) -> List[BenchmarkResult]:
+    """Riesegue i benchmark oltre la soglia tenendo il risultato migliore: restano le regressioni stabili"""
+    best = {result.name: result for result in results}
+    for _ in range(attempts):
+        regressed = [comparison.name for comparison in compare(list(best.values()), baseline, threshold)
+                     if comparison.regression]
+        if not regressed:
+            break
+        # Il carico della macchina cambia a finestre: meglio misurare di nuovo poco dopo
+        time.sleep(CONFIRM_PAUSE)
+        rerun, _ = run_benchmarks(regressed, repeat)
+        for result in rerun:
+            if result.name in best and result.value < best[result.name].value:
+                best[result.name] = result
+    return [best[result.name] for result in results]
+
+
+def format_report(comparisons: Sequence[Comparison], results: Sequence[BenchmarkResult],
+                  skipped: Dict[str, str]) -> str:
+    units = {result.name: result.unit for result in results}
+    lines = [f"{'benchmark':<40} {'valore':>12} {'baseline':>12} {'rapporto':>9}"]
+    for comparison in comparisons:
+        baseline = f"{comparison.baseline:.2f}" if comparison.baseline is not None else "-"
+        ratio = f"{comparison.ratio:.2f}x" if comparison.ratio is not None else "nuovo"
+        flag = "  REGRESSIONE" if comparison.regression else ""
+        lines.append(f"{comparison.name:<40} {comparison.value:>10.2f}{units[comparison.name]:>2} "
+                     f"{baseline:>12} {ratio:>9}{flag}")
+    for name, reason in skipped.items():
+        lines.append(f"{name:<40} saltato: {reason}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Esegue la suite; codice di uscita 1 se qualche benchmark supera la soglia"""
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi critici del Color Tree")
+    parser.add_argument("--filter", nargs="*", default=None,
+                        help=f"Benchmark da eseguire (prefissi): {', '.join(BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Campioni per benchmark")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fattore oltre cui un risultato è una regressione")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="File della baseline")
+    parser.add_argument("--confirm", type=int, default=DEFAULT_CONFIRM,
+                        help="Riesecuzioni dei benchmark oltre la soglia (0 = nessuna)")
+    parser.add_argument("--save", action="store_true", help="Aggiorna la baseline con i risultati")
+    parser.add_argument("--json", dest="json_path", default=None, help="Salva i risultati in JSON")
+    args = parser.parse_args(argv)
+    if args.repeat < 1 or args.threshold <= 0 or args.confirm < 0:
+        parser.error("--repeat e --threshold devono essere positivi, --confirm non negativo")
+
+    results, skipped = run_benchmarks(args.filter, args.repeat, verbose=True)
+    baseline = load_baseline(args.baseline)
+    if baseline and baseline.get('machine') != machine_info():
+        print("Attenzione: la baseline è stata registrata su un'altra macchina o versione di Python")
+    if baseline and not args.save:
+        results = confirm_regressions(results, baseline, args.threshold, args.confirm, args.repeat)
+    comparisons = compare(results, baseline, args.threshold)
+    print(format_report(comparisons, results, skipped))
+
+    try:
+        if args.json_path:
+            write_json({'machine': machine_info(), 'skipped': skipped,
+                        'results': {result.name: result.as_dict() for result in results}}, args.json_path)
+        if args.save:
+            save_baseline(results, args.baseline)
+            print(f"Baseline aggiornata: {args.baseline}")
+            return 0
+    except OSError as e:
+        print(f"Errore nel salvataggio dei risultati: {e}")
+        return 1
+
+    regressions = [comparison for comparison in comparisons if comparison.regression]
+    if regressions:
+        print(f"{len(regressions)} regressioni oltre la soglia di {args.threshold}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
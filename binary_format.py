@@ -0,0 +1,369 @@
+"""
+Archivio binario della Color Tree mappabile in memoria
+Contenitore versionato con record a larghezza fissa: celle (maschera, root, livello, posizione,
+quinte, luminosità, note), voicing precalcolati e pattern compilati come modelli indipendenti
+dalle note. Il file si apre con mmap e le sezioni si leggono senza copie con np.frombuffer:
+processi diversi condividono la stessa copia nella page cache invece di ricostruire le SoundCell.
+
+Struttura: intestazione, indice delle sezioni (nome, offset, numero di record, dimensione del
+record) e sezioni allineate a SECTION_ALIGNMENT byte.
+
+Lo stesso layout serve per i flussi di record delle celle (es. cli_example --format binary): magic
+RECORDS_MAGIC e un'unica sezione che prosegue fino alla fine del file, scritta a blocchi.
+"""
+
+import mmap
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from cell_index import all_cells
+from chord_generator import MIDIScaleGenerator, Note, SoundCell
+from config import CACHE_CONFIG
+from midi_effects import EventBuffer
+from pattern_engine import PatternEngine, PatternType, RANDOM_PATTERNS
+from voicing import VOICING_TYPES, Voicing, VoicingEngine
+
+
+# Versione del formato: va incrementata se cambia un record o il contenuto delle sezioni
+ARCHIVE_VERSION = 1
+ARCHIVE_MAGIC = b"CTREEARC"
+RECORDS_MAGIC = b"CTREEREC"
+SECTION_ALIGNMENT = 64
+
+# Note massime di una cella (e quindi di un voicing o di un modello di pattern)
+MAX_NOTES = 12
+
+# Note MIDI di riferimento con cui vengono compilati i modelli (classi tutte diverse)
+TEMPLATE_BASE_NOTE = 60
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('section_count', '<u4'),
+                         ('octave', '<u4'), ('reserved', '<u4')])
+SECTION_DTYPE = np.dtype([('name', 'S16'), ('offset', '<u8'), ('count', '<u8'),
+                          ('itemsize', '<u4'), ('reserved', '<u4')])
+
+CELL_DTYPE = np.dtype([
+    ('mask', '<u2'), ('root', 'u1'), ('level', 'u1'), ('position', 'u1'),
+    ('fifths_below', 'u1'), ('fifths_above', 'u1'), ('note_count', 'u1'),
+    ('brightness', '<f4'),
+    ('voicing_start', '<u4'), ('voicing_count', '<u2'), ('reserved', '<u2'),
+    ('notes', 'u1', (MAX_NOTES,))  # classi di altezza nell'ordine della cella
+])
+VOICING_DTYPE = np.dtype([
+    ('cell', '<u2'), ('voicing', 'u1'), ('inversion', 'u1'), ('note_count', 'u1'),
+    ('reserved', 'u1', (3,)), ('notes', 'u1', (MAX_NOTES,))  # note MIDI
+])
+NAME_DTYPE = np.dtype([('name', 'S16')])
+TEMPLATE_DTYPE = np.dtype([
+    ('pattern', 'u1'), ('note_count', 'u1'), ('reserved', '<u2'),
+    ('event_start', '<u4'), ('event_count', '<u4'), ('total_steps', '<u4'),
+    ('length', '<f8')  # durata del loop in multipli di base_duration
+])
+EVENT_DTYPE = np.dtype([
+    ('onset', '<f8'), ('gate', '<f8'),  # in multipli di base_duration
+    ('tone', 'u1'), ('octave', 'i1'), ('velocity', 'u1'), ('reserved', 'u1'),
+    ('step', '<u4')
+])
+
+# Record di una cella con le metriche della classe di altezze (flussi esportati con --metrics)
+CELL_METRICS_DTYPE = np.dtype(CELL_DTYPE.descr + [('metric_brightness', '<f4'), ('tension', '<f4'),
+                                                  ('roughness', '<f4')])
+RECORD_DTYPES = {'cells': CELL_DTYPE, 'cell_metrics': CELL_METRICS_DTYPE}
+
+SECTION_DTYPES = {
+    'cells': CELL_DTYPE,
+    'voicing_types': NAME_DTYPE,
+    'voicings': VOICING_DTYPE,
+    'pattern_names': NAME_DTYPE,
+    'templates': TEMPLATE_DTYPE,
+    'events': EVENT_DTYPE,
+}
+
+
+def cell_records(cells: Sequence[SoundCell], dtype: np.dtype = CELL_DTYPE) -> np.ndarray:
+    """Record delle celle (senza voicing: voicing_start e voicing_count restano a zero)"""
+    records = np.zeros(len(cells), dtype=dtype)
+    for record, cell in zip(records, cells):
+        record['mask'] = cell.to_bitmask()
+        record['root'] = cell.root.value
+        record['level'] = cell.level
+        record['position'] = cell.position
+        record['fifths_below'] = cell.fifths_below
+        record['fifths_above'] = cell.fifths_above
+        record['note_count'] = len(cell.notes)
+        record['brightness'] = cell.brightness
+        record['notes'][:len(cell.notes)] = [note.value for note in cell.notes]
+    return records
+
+
+def records_header(dtype: np.dtype = CELL_DTYPE) -> bytes:
+    """Intestazione di un flusso di record: i record seguono subito, fino alla fine del file"""
+    name = next(name for name, known in RECORD_DTYPES.items() if known == dtype)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (RECORDS_MAGIC, ARCHIVE_VERSION, 1, 0, 0)
+    directory = np.zeros(1, dtype=SECTION_DTYPE)
+    # count 0: il numero di record non è noto in anticipo e si ricava dalla lunghezza
+    directory[0] = (name.encode(), HEADER_DTYPE.itemsize + SECTION_DTYPE.itemsize, 0, dtype.itemsize, 0)
+    return header.tobytes() + directory.tobytes()
+
+
+def read_cell_records(data) -> np.ndarray:
+    """Record di un flusso scritto con records_header (vista senza copie sui byte)"""
+    size = HEADER_DTYPE.itemsize + SECTION_DTYPE.itemsize
+    if len(data) < size:
+        raise ValueError("Flusso di record troppo corto")
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != RECORDS_MAGIC:
+        raise ValueError("Non è un flusso di record della Color Tree")
+    if header['version'] != ARCHIVE_VERSION:
+        raise ValueError(f"Versione del flusso non supportata: {int(header['version'])}")
+    entry = np.frombuffer(data, dtype=SECTION_DTYPE, count=1, offset=HEADER_DTYPE.itemsize)[0]
+    dtype = RECORD_DTYPES.get(entry['name'].decode())
+    if dtype is None or entry['itemsize'] != dtype.itemsize:
+        raise ValueError(f"Record sconosciuti nel flusso: {entry['name'].decode()}")
+    offset = int(entry['offset'])
+    if (len(data) - offset) % dtype.itemsize:
+        raise ValueError("Flusso di record troncato")
+    return np.frombuffer(data, dtype=dtype, offset=offset)
+
+
+def _build_cells_and_voicings(octave: int) -> Tuple[np.ndarray, np.ndarray]:
+    cells = all_cells()
+    engine = VoicingEngine()
+    records = cell_records(cells)
+    voicing_rows = []
+    for index, cell in enumerate(cells):
+        record = records[index]
+        record['voicing_start'] = len(voicing_rows)
+        for kind, voicing_type in enumerate(VOICING_TYPES):
+            for inversion, voicing in enumerate(engine.voicings(cell, voicing_type, octave)):
+                voicing_rows.append((index, kind, inversion, voicing))
+        record['voicing_count'] = len(voicing_rows) - record['voicing_start']
+
+    voicings = np.zeros(len(voicing_rows), dtype=VOICING_DTYPE)
+    for row, (index, kind, inversion, voicing) in enumerate(voicing_rows):
+        voicings[row]['cell'] = index
+        voicings[row]['voicing'] = kind
+        voicings[row]['inversion'] = inversion
+        voicings[row]['note_count'] = len(voicing)
+        voicings[row]['notes'][:len(voicing)] = voicing
+    return records, voicings
+
+
+def _build_templates() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pattern deterministici compilati per ogni numero di note, con durata base 1"""
+    engine = PatternEngine(MIDIScaleGenerator())
+    sound_cell = all_cells()[0]  # usata solo come chiave: le note arrivano dal voicing
+    patterns = list(PatternType)
+    templates, events = [], []
+    start = 0
+    for pattern_index, pattern_type in enumerate(patterns):
+        if pattern_type in RANDOM_PATTERNS:
+            continue
+        for note_count in range(1, MAX_NOTES + 1):
+            reference = tuple(TEMPLATE_BASE_NOTE + tone for tone in range(note_count))
+            buffer = engine.compile_pattern(sound_cell, pattern_type, base_duration=1.0, voicing=reference)
+            offsets = buffer.notes.astype(np.int32) - TEMPLATE_BASE_NOTE
+            block = np.zeros(len(buffer), dtype=EVENT_DTYPE)
+            block['onset'] = buffer.onsets
+            block['gate'] = buffer.durations
+            block['tone'] = offsets % 12
+            block['octave'] = offsets // 12
+            block['velocity'] = buffer.velocities
+            block['step'] = buffer.steps
+            events.append(block)
+            templates.append((pattern_index, note_count, 0, start, len(block), buffer.total_steps, buffer.length))
+            start += len(block)
+    names = np.array([(pattern_type.value.encode(),) for pattern_type in patterns], dtype=NAME_DTYPE)
+    return names, np.array(templates, dtype=TEMPLATE_DTYPE), np.concatenate(events)
+
+
+def build_sections(octave: int = 4) -> Dict[str, np.ndarray]:
+    """Tutte le sezioni dell'archivio come array strutturati"""
+    cells, voicings = _build_cells_and_voicings(octave)
+    names, templates, events = _build_templates()
+    return {
+        'cells': cells,
+        'voicing_types': np.array([(name.encode(),) for name in VOICING_TYPES], dtype=NAME_DTYPE),
+        'voicings': voicings,
+        'pattern_names': names,
+        'templates': templates,
+        'events': events,
+    }
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def write_archive(path: str, sections: Optional[Dict[str, np.ndarray]] = None, octave: int = 4) -> str:
+    """Scrive l'archivio in modo atomico (un lettore concorrente non vede mai un file a metà)"""
+    sections = sections if sections is not None else build_sections(octave)
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (ARCHIVE_MAGIC, ARCHIVE_VERSION, len(sections), octave, 0)
+    directory = np.zeros(len(sections), dtype=SECTION_DTYPE)
+    offset = _aligned(HEADER_DTYPE.itemsize + SECTION_DTYPE.itemsize * len(sections))
+    for entry, (name, array) in zip(directory, sections.items()):
+        entry['name'] = name.encode()
+        entry['offset'] = offset
+        entry['count'] = len(array)
+        entry['itemsize'] = array.dtype.itemsize
+        offset = _aligned(offset + array.nbytes)
+
+    directory_name = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory_name, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as handle:
+        handle.write(header.tobytes())
+        handle.write(directory.tobytes())
+        for entry, array in zip(directory, sections.values()):
+            handle.seek(int(entry['offset']))
+            handle.write(np.ascontiguousarray(array).tobytes())
+        handle.truncate(offset)
+    os.replace(temporary, path)
+    return path
+
+
+class ColorTreeArchive:
+    """Archivio aperto in sola lettura: le sezioni sono viste NumPy sul file mappato"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except ValueError:
+            self.close()
+            raise
+
+    def _parse(self):
+        if len(self._mmap) < HEADER_DTYPE.itemsize:
+            raise ValueError(f"Archivio troppo corto: {self.path}")
+        header = np.frombuffer(self._mmap, dtype=HEADER_DTYPE, count=1)[0]
+        if header['magic'] != ARCHIVE_MAGIC:
+            raise ValueError(f"Non è un archivio della Color Tree: {self.path}")
+        if header['version'] != ARCHIVE_VERSION:
+            raise ValueError(f"Versione dell'archivio non supportata: {int(header['version'])}")
+        self.octave = int(header['octave'])
+        directory = np.frombuffer(self._mmap, dtype=SECTION_DTYPE, count=int(header['section_count']),
+                                  offset=HEADER_DTYPE.itemsize)
+        self.sections: Dict[str, np.ndarray] = {}
+        for entry in directory:
+            name = entry['name'].decode()
+            dtype = SECTION_DTYPES.get(name)
+            if dtype is None:
+                continue  # sezioni sconosciute di versioni compatibili vengono ignorate
+            if entry['itemsize'] != dtype.itemsize:
+                raise ValueError(f"Record della sezione {name} di dimensione inattesa")
+            end = int(entry['offset']) + int(entry['count']) * dtype.itemsize
+            if end > len(self._mmap):
+                raise ValueError(f"Sezione {name} oltre la fine del file")
+            self.sections[name] = np.frombuffer(self._mmap, dtype=dtype, count=int(entry['count']),
+                                                offset=int(entry['offset']))
+        missing = set(SECTION_DTYPES) - set(self.sections)
+        if missing:
+            raise ValueError(f"Sezioni mancanti nell'archivio: {', '.join(sorted(missing))}")
+
+        self.cells = self.sections['cells']
+        self.voicings = self.sections['voicings']
+        self.templates = self.sections['templates']
+        self.events = self.sections['events']
+        self.voicing_types = [entry.decode() for entry in self.sections['voicing_types']['name']]
+        pattern_names = [entry.decode() for entry in self.sections['pattern_names']['name']]
+        # Indice (pattern, numero di note) -> modello: piccolo, costruito all'apertura
+        self._templates = {(pattern_names[pattern], int(count)): row for row, (pattern, count) in
+                           enumerate(zip(self.templates['pattern'], self.templates['note_count']))}
+
+    def close(self):
+        """Rilascia le viste e chiude la mappatura"""
+        self.sections = {}
+        self.cells = self.voicings = self.templates = self.events = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Qualche vista è ancora in uso: la mappatura resta finché non viene rilasciata
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def find_cell(self, root: Note, level: int, position: int) -> int:
+        """Indice della cella (stesso ordine di cell_index.all_cells)"""
+        matches = np.flatnonzero((self.cells['root'] == root.value) & (self.cells['level'] == level)
+                                 & (self.cells['position'] == position))
+        if not len(matches):
+            raise ValueError(f"Cella non presente nell'archivio: {root.name} {level} {position}")
+        return int(matches[0])
+
+    def sound_cell(self, index: int) -> SoundCell:
+        """Ricostruisce la SoundCell di un record (solo quando serve davvero l'oggetto)"""
+        record = self.cells[index]
+        notes = [Note(int(value)) for value in record['notes'][:record['note_count']]]
+        return SoundCell(notes=notes, root=Note(int(record['root'])), level=int(record['level']),
+                         position=int(record['position']), fifths_below=int(record['fifths_below']),
+                         fifths_above=int(record['fifths_above']), brightness=float(record['brightness']))
+
+    def cell_voicings(self, index: int, voicing: str = "close") -> List[Voicing]:
+        """Voicing precalcolati della cella (fondamentale e rivolti) per il tipo indicato"""
+        record = self.cells[index]
+        start = int(record['voicing_start'])
+        rows = self.voicings[start:start + int(record['voicing_count'])]
+        rows = rows[rows['voicing'] == self.voicing_types.index(voicing)]
+        return [tuple(int(note) for note in row['notes'][:row['note_count']]) for row in rows]
+
+    def pattern_buffer(self, pattern_type: PatternType, voicing: Voicing, base_duration: float = 0.3,
+                       playback_speed: float = 1.0, duration_octaves: int = 1) -> Optional[EventBuffer]:
+        """Istanzia un modello sulle note del voicing, come compile_pattern senza reverse né block
+
+        Restituisce None per i pattern casuali, che non hanno un modello.
+        """
+        row = self._templates.get((pattern_type.value, len(voicing)))
+        if row is None:
+            return None
+        template = self.templates[row]
+        start = int(template['event_start'])
+        events = self.events[start:start + int(template['event_count'])]
+        scale = base_duration / (playback_speed if playback_speed > 0 else 1.0)
+        length = float(template['length']) * scale
+        tones = np.asarray(voicing, dtype=np.int32)[events['tone']] + 12 * events['octave'].astype(np.int32)
+        # Le ottave successive ripetono il loop spostato di 12 semitoni (come compile_pattern)
+        octaves = np.repeat(np.arange(duration_octaves), len(events))
+        notes = np.minimum(np.tile(tones, duration_octaves) + 12 * octaves, 127)
+        return EventBuffer(
+            onsets=np.tile(events['onset'], duration_octaves) * scale + octaves * length,
+            durations=np.tile(events['gate'], duration_octaves) * scale,
+            notes=np.clip(notes, 0, 127).astype(np.int16),
+            velocities=np.tile(events['velocity'], duration_octaves).astype(np.int16),
+            steps=(np.tile(events['step'], duration_octaves)
+                   + octaves * int(template['total_steps'])).astype(np.int32),
+            length=length * duration_octaves,
+            total_steps=int(template['total_steps']) * duration_octaves
+        )
+
+
+def archive_path(cache_dir: Optional[str] = None) -> str:
+    cache_dir = cache_dir or CACHE_CONFIG['cache_dir']
+    return os.path.join(cache_dir, f"color_tree_v{ARCHIVE_VERSION}.ctree")
+
+
+def open_archive(cache_dir: Optional[str] = None) -> ColorTreeArchive:
+    """Apre l'archivio dalla cache su disco; lo costruisce e salva se manca o non è valido"""
+    path = archive_path(cache_dir)
+    if os.path.exists(path):
+        try:
+            return ColorTreeArchive(path)
+        except (OSError, ValueError) as e:
+            print(f"Errore nella lettura dell'archivio della Color Tree: {e}")
+    try:
+        write_archive(path)
+    except OSError as e:
+        print(f"Errore nel salvataggio dell'archivio della Color Tree: {e}")
+        path = write_archive(os.path.join(tempfile.gettempdir(), os.path.basename(path)))
+    return ColorTreeArchive(path)
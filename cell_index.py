@@ -0,0 +1,64 @@
+"""
+Indice di tutte le sound cells della Color Tree
+Enumerazione stabile delle celle di tutte le 12 root, condivisa dalle matrici precalcolate
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import numpy as np
+from chord_generator import ChordGenerator, Note, SoundCell
+
+
+CellKey = Tuple[int, int, int]  # (root, livello, posizione)
+
+
+@lru_cache(maxsize=1)
+def all_cells() -> Tuple[SoundCell, ...]:
+    """Tutte le celle, ordinate per root, livello e posizione"""
+    generator = ChordGenerator()
+    cells = []
+    for root in Note:
+        for level in generator.generate_color_tree(root):
+            cells.extend(level)
+    return tuple(cells)
+
+
+def cell_key(sound_cell: SoundCell) -> CellKey:
+    """Chiave (root, livello, posizione) di una cella"""
+    return (sound_cell.root.value, sound_cell.level, sound_cell.position)
+
+
+@lru_cache(maxsize=1)
+def _index_by_key() -> Dict[CellKey, int]:
+    return {cell_key(cell): index for index, cell in enumerate(all_cells())}
+
+
+def cell_id(sound_cell: SoundCell) -> int:
+    """Indice della cella nell'enumerazione globale"""
+    try:
+        return _index_by_key()[cell_key(sound_cell)]
+    except KeyError:
+        raise ValueError(f"Cella non presente nella Color Tree: {sound_cell}") from None
+
+
+def cell_count() -> int:
+    """Numero totale di celle (67 per root: livelli 1-11 più la scala cromatica)"""
+    return len(all_cells())
+
+
+@lru_cache(maxsize=1)
+def cell_masks() -> np.ndarray:
+    """Maschere a 12 bit delle classi di altezza di ogni cella (uint16)"""
+    masks = np.array([cell.to_bitmask() for cell in all_cells()], dtype=np.uint16)
+    masks.setflags(write=False)
+    return masks
+
+
+def masks_to_matrix(masks: np.ndarray) -> np.ndarray:
+    """Converte le maschere in una matrice booleana (celle x 12 classi di altezza)"""
+    return ((masks[:, None].astype(np.int32) >> np.arange(12)) & 1).astype(bool)
+
+
+def cells_by_level(level: int) -> List[int]:
+    """Indici delle celle di un livello, per tutte le root"""
+    return [index for index, cell in enumerate(all_cells()) if cell.level == level]
@@ -10,6 +10,8 @@ from dataclasses import dataclass
 from enum import Enum
 import threading
 import time
+from metrics import RateMeter
+from tracing import traced
 
 try:
     import pygame
@@ -167,6 +169,13 @@ class SoundCell:
         }
         return " - ".join(note_names[note] for note in self.notes)
     
+    def to_bitmask(self) -> int:
+        """Insieme delle classi di altezza come maschera a 12 bit (bit 0 = C)"""
+        mask = 0
+        for note in self.notes:
+            mask |= 1 << note.value
+        return mask
+    
     def get_intervals(self) -> List[str]:
         """Calcola gli intervalli della sound cell rispetto alla nota radice"""
         intervals = []
@@ -559,6 +568,12 @@ class MIDIOutput:
         # Tracciamento note attive (solo per debug, non per controllo)
         self.active_notes = set()
         
+        # Metriche: messaggi inviati, errori e istante di accensione delle note attive
+        self.messages_sent = 0
+        self.send_errors = 0
+        self.message_rate = RateMeter()
+        self.note_started = {}
+        
         if MIDI_AVAILABLE:
             try:
                 self._refresh_ports()
@@ -574,7 +589,7 @@ class MIDIOutput:
         
         try:
             self.available_ports = mido.get_output_names()
-        except (OSError, RuntimeError, AttributeError) as e:
+        except (OSError, RuntimeError, AttributeError, ImportError) as e:
             print(f"Errore nel refresh delle porte MIDI: {e}")
             self.available_ports = []
     
@@ -607,6 +622,7 @@ class MIDIOutput:
             print(f"Errore nell'apertura della porta MIDI {port_name}: {e}")
             return False
     
+    @traced(category="midi")
     def send_note_on(self, note, velocity=64, channel=0):
         """Invia un messaggio Note On"""
         if not self.initialized or not self.output_port:
@@ -616,11 +632,15 @@ class MIDIOutput:
             msg = mido.Message('note_on', channel=channel, note=note, velocity=velocity)
             self.output_port.send(msg)
             self.active_notes.add((note, channel))
+            self.note_started[(note, channel)] = time.perf_counter()
+            self._count_message()
             return True
         except (OSError, RuntimeError, AttributeError) as e:
+            self.send_errors += 1
             print(f"Errore nell'invio Note On: {e}")
             return False
     
+    @traced(category="midi")
     def send_note_off(self, note, channel=0):
         """Invia un messaggio Note Off"""
         if not self.initialized or not self.output_port:
@@ -630,11 +650,15 @@ class MIDIOutput:
             msg = mido.Message('note_off', channel=channel, note=note, velocity=0)
             self.output_port.send(msg)
             self.active_notes.discard((note, channel))
+            self.note_started.pop((note, channel), None)
+            self._count_message()
             return True
         except (OSError, RuntimeError, AttributeError) as e:
+            self.send_errors += 1
             print(f"Errore nell'invio Note Off: {e}")
             return False
     
+    @traced(category="midi")
     def stop_all_notes(self):
         """Ferma TUTTE le note su TUTTI i canali - metodo robusto"""
         if not self.initialized or not self.output_port:
@@ -660,10 +684,56 @@ class MIDIOutput:
             
             # Pulisce il tracking
             self.active_notes.clear()
+            self.note_started.clear()
             
         except (OSError, RuntimeError, AttributeError) as e:
             print(f"Errore nel fermare le note: {e}")
     
+    @traced(category="midi")
+    def _send_realtime(self, message_type):
+        """Invia un messaggio MIDI real-time (clock, start, stop, continue)"""
+        if not self.initialized or not self.output_port:
+            return False
+        
+        try:
+            self.output_port.send(mido.Message(message_type))
+            self._count_message()
+            return True
+        except (OSError, RuntimeError, AttributeError) as e:
+            self.send_errors += 1
+            print(f"Errore nell'invio del messaggio {message_type}: {e}")
+            return False
+    
+    def _count_message(self):
+        self.messages_sent += 1
+        self.message_rate.record()
+    
+    def stuck_notes(self, max_age: float) -> int:
+        """Note accese da più di max_age secondi senza il relativo Note Off"""
+        now = time.perf_counter()
+        return sum(1 for started in list(self.note_started.values()) if now - started > max_age)
+    
+    def metrics(self) -> dict:
+        """Contatori dei messaggi inviati"""
+        return {'messages_sent': self.messages_sent, 'messages_per_second': round(self.message_rate.rate(), 2),
+                'send_errors': self.send_errors, 'active_notes': len(self.active_notes)}
+    
+    def send_clock(self):
+        """Invia un impulso di MIDI Timing Clock (24 per semiminima)"""
+        return self._send_realtime('clock')
+    
+    def send_start(self):
+        """Invia MIDI Start"""
+        return self._send_realtime('start')
+    
+    def send_stop(self):
+        """Invia MIDI Stop"""
+        return self._send_realtime('stop')
+    
+    def send_continue(self):
+        """Invia MIDI Continue"""
+        return self._send_realtime('continue')
+    
     def send_chord(self, midi_notes, duration=0.5, channel=0, velocity=64):
         """Invia un accordo MIDI - VERSIONE COMPLETAMENTE SINCRONA"""
         if not self.initialized or not self.output_port:
@@ -755,6 +825,10 @@ class MIDIOutput:
             pass
 
 
+# Colorazione predefinita delle celle (gradazione per posizione nel livello)
+POSITION_COLORING = "posizione"
+
+
 class ColorTreeDisplayApp:
     """Interfaccia grafica per visualizzare la Color Tree"""
     
@@ -795,6 +869,27 @@ class ColorTreeDisplayApp:
         # Inizializza il dropdown personalizzato MIDI
         self._custom_dropdown = None
         
+        # Input MIDI da tastiera: widget delle celle per l'evidenziazione dell'accordo tenuto
+        self.midi_input = None
+        self.midi_input_var = None
+        self.midi_input_combo = None
+        self.cell_widgets = {}
+        self.highlighted_cells = []
+        self.held_chord = None
+        self._input_poll_id = None
+        
+        # Riconoscimento della tonalità dall'input MIDI per scegliere la root automaticamente
+        self.key_detector = None
+        self.auto_root_var = None
+        
+        # Metrica usata per colorare le celle (tabelle di pcset_metrics)
+        self.color_metric_var = None
+        
+        # Viste della Color Tree già costruite, per root (valide per modalità, zoom e colori correnti)
+        self.tree_views = {}
+        self.current_tree_view = None
+        self._tree_view_settings = None
+        
         self.setup_ui()
         self.generate_color_tree()
     
@@ -814,14 +909,27 @@ class ColorTreeDisplayApp:
         self.root_combo = ttk.Combobox(controls_frame, textvariable=self.root_note_var,
                                  values=[note.name.replace('_', '#') for note in Note],
                                  state="readonly", width=8)
-        self.root_combo.grid(row=0, column=1, padx=(0, 20))
+        self.root_combo.grid(row=0, column=1, padx=(0, 5))
         self.root_combo.bind('<<ComboboxSelected>>', self.on_root_note_change)
         
+        # Root automatica dalla tonalità suonata sulla tastiera MIDI
+        self.auto_root_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(controls_frame, text="Auto", variable=self.auto_root_var).grid(row=0, column=2, padx=(0, 20))
+        
         # Switch per modalità visualizzazione
-        self.create_display_mode_switch(controls_frame, 0, 2)
+        self.create_display_mode_switch(controls_frame, 0, 3)
         
         # Selettore zoom
-        self.create_zoom_selector(controls_frame, 0, 3)
+        self.create_zoom_selector(controls_frame, 0, 4)
+        
+        # Colore delle celle: posizione o una metrica dell'insieme di note
+        ttk.Label(controls_frame, text="Colore:", font=('Arial', 10)).grid(row=0, column=5, padx=(20, 5))
+        self.color_metric_var = tk.StringVar(value=POSITION_COLORING)
+        self.color_metric_combo = ttk.Combobox(controls_frame, textvariable=self.color_metric_var,
+                                               values=[POSITION_COLORING, "brightness", "tension", "roughness"],
+                                               state="readonly", width=10)
+        self.color_metric_combo.grid(row=0, column=6)
+        self.color_metric_combo.bind('<<ComboboxSelected>>', lambda e: self.generate_color_tree())
         
         # Frame per la visualizzazione della Color Tree - layout orizzontale
         self.tree_frame = ttk.Frame(main_frame)
@@ -945,6 +1053,15 @@ class ColorTreeDisplayApp:
                                command=self._refresh_midi_ports_with_dropdown_close)
         refresh_btn.pack(side='left', padx=(2, 0))
         
+        # Combobox per la porta MIDI di ingresso (tastiera)
+        tk.Label(midi_container, text="In:", font=('Arial', 10, 'bold'),
+                 bg='#f0f0f0').pack(side='left', padx=(10, 5))
+        self.midi_input_var = tk.StringVar(value="Nessuna porta")
+        self.midi_input_combo = ttk.Combobox(midi_container, textvariable=self.midi_input_var,
+                                             state="readonly", width=16)
+        self.midi_input_combo.pack(side='left')
+        self.midi_input_combo.bind('<<ComboboxSelected>>', self.on_midi_input_change)
+        
         # Inizializza le porte MIDI
         self.refresh_midi_ports()
     
@@ -1113,6 +1230,8 @@ class ColorTreeDisplayApp:
         if not MIDI_AVAILABLE:
             self.midi_combo['values'] = ["MIDI non disponibile"]
             self.midi_combo.set("MIDI non disponibile")
+            self.midi_input_combo['values'] = ["MIDI non disponibile"]
+            self.midi_input_combo.set("MIDI non disponibile")
             return
         
         ports = self.midi_output.get_available_ports()
@@ -1123,6 +1242,15 @@ class ColorTreeDisplayApp:
             port_list = ["Nessuna porta"] + ports
             self.midi_combo['values'] = port_list
             self.midi_combo.set("Nessuna porta")
+        
+        try:
+            input_ports = mido.get_input_names()
+        except (OSError, RuntimeError, AttributeError) as e:
+            print(f"Errore nel refresh delle porte MIDI in ingresso: {e}")
+            input_ports = []
+        self.midi_input_combo['values'] = ["Nessuna porta"] + input_ports
+        if self.midi_input_var.get() not in input_ports:
+            self.midi_input_combo.set("Nessuna porta")
     
     def on_midi_port_change(self, event=None):
         """Gestisce il cambio della porta MIDI"""
@@ -1136,6 +1264,64 @@ class ColorTreeDisplayApp:
             if not success:
                 messagebox.showerror("Errore MIDI", f"Impossibile connettersi alla porta: {selected_port}")
     
+    def on_midi_input_change(self, event=None):
+        """Apre la porta MIDI di ingresso e avvia l'evidenziazione dell'accordo tenuto"""
+        del event  # Ignora il parametro event non utilizzato
+        # Import dinamico per evitare import circolare
+        from key_detection import KeyDetector
+        from midi_input import MIDIInput
+        if self.midi_input is None:
+            self.midi_input = MIDIInput()
+            self.key_detector = KeyDetector()
+            self.midi_input.message_listeners.append(self.key_detector.handle_message)
+        
+        selected_port = self.midi_input_var.get()
+        if selected_port in ("Nessuna porta", "MIDI non disponibile"):
+            self.midi_input.set_input_port(None)
+        elif not self.midi_input.set_input_port(selected_port):
+            messagebox.showerror("Errore MIDI", f"Impossibile connettersi alla porta: {selected_port}")
+        
+        if self._input_poll_id is None:
+            self.poll_midi_input()
+    
+    def poll_midi_input(self):
+        """Svuota la coda dell'input MIDI: al massimo un aggiornamento grafico per polling"""
+        from midi_input import INPUT_POLL_MS
+        key = self.key_detector.drain_updates()
+        if key is not None and self.auto_root_var.get():
+            # Passa alla vista (in cache) della root della tonalità riconosciuta
+            self.root_note_var.set(key.tonic.name.replace('_', '#'))
+            self.generate_color_tree()
+        update = self.midi_input.drain_updates()
+        if update is not None:
+            self.held_chord = update
+            self.highlight_held_chord()
+        if self.midi_input.input_port is not None:
+            self._input_poll_id = self.root.after(INPUT_POLL_MS, self.poll_midi_input)
+        else:
+            self._input_poll_id = None
+    
+    def highlight_held_chord(self):
+        """Evidenzia le celle della root visualizzata che corrispondono all'accordo tenuto"""
+        for widget in self.highlighted_cells:
+            try:
+                widget.config(highlightthickness=0)
+            except tk.TclError:
+                pass
+        self.highlighted_cells = []
+        if self.held_chord is None or not self.held_chord.mask:
+            return
+        
+        recognition = self.held_chord.recognition
+        # Arancione per le celle identiche, giallo per le più vicine
+        cells, color = (recognition.exact, '#FF9800') if recognition.matched else (recognition.nearest, '#FFEB3B')
+        displayed_root = self.color_tree_levels[0][0].root
+        for sound_cell in cells:
+            widget = self.cell_widgets.get((sound_cell.level, sound_cell.position))
+            if sound_cell.root == displayed_root and widget is not None:
+                widget.config(highlightbackground=color, highlightcolor=color, highlightthickness=3)
+                self.highlighted_cells.append(widget)
+    
     def set_intervals_mode(self):
         """Imposta la modalità intervalli"""
         self.display_mode = "intervals"
@@ -1309,30 +1495,45 @@ class ColorTreeDisplayApp:
             messagebox.showerror("Error", f"Failed to open creative window: {str(e)}")
     
     def generate_color_tree(self):
-        """Genera e visualizza la Color Tree"""
-        # Pulisce il frame
-        for widget in self.main_tree_frame.winfo_children():
-            widget.destroy()
-        
-        # Ottiene la nota radice selezionata
-        root_note_name = self.root_note_var.get().replace('#', '_SHARP')
+        """Genera e visualizza la Color Tree (le viste già costruite vengono riusate)"""
+        # Ottiene la nota radice selezionata (i valori del combobox sono del tipo "C#SHARP")
+        root_note_name = self.root_note_var.get().replace('#', '_')
         try:
             root_note = Note[root_note_name]
         except KeyError:
             root_note = Note.C
         
-        # Genera la Color Tree
-        self.color_tree_levels = self.generator.generate_color_tree(root_note)
-        
-        # Visualizza la Color Tree
-        self.display_color_tree()
-    
-    def display_color_tree(self):
+        # Le viste in cache valgono solo per la modalità, lo zoom e i colori con cui sono state costruite
+        settings = (self.display_mode, self.zoom_level, self.color_metric_var.get())
+        if settings != self._tree_view_settings:
+            for view, _, _ in self.tree_views.values():
+                view.destroy()
+            self.tree_views = {}
+            self.current_tree_view = None
+            self._tree_view_settings = settings
+        
+        if self.current_tree_view is not None:
+            self.current_tree_view.grid_remove()
+        if root_note not in self.tree_views:
+            # Genera e visualizza la Color Tree in una nuova vista
+            view = ttk.Frame(self.main_tree_frame)
+            self.color_tree_levels = self.generator.generate_color_tree(root_note)
+            self.cell_widgets = {}
+            self.display_color_tree(view)
+            self.tree_views[root_note] = (view, self.color_tree_levels, self.cell_widgets)
+        
+        view, self.color_tree_levels, self.cell_widgets = self.tree_views[root_note]
+        view.grid(row=0, column=0, sticky='')
+        self.current_tree_view = view
+        self.highlight_held_chord()
+    
+    def display_color_tree(self, parent=None):
         """Visualizza la Color Tree in formato piramidale - triangolo equilatero centrato"""
+        parent = parent or self.main_tree_frame
         # Inverte l'ordine per mostrare il primo livello in basso
         for level, sound_cells in enumerate(reversed(self.color_tree_levels)):
             # Frame per ogni livello - centrato per triangolo equilatero
-            level_frame = ttk.Frame(self.main_tree_frame)
+            level_frame = ttk.Frame(parent)
             level_frame.grid(row=level, column=0, sticky='', 
                            pady=0, padx=0)
             
@@ -1366,7 +1567,10 @@ class ColorTreeDisplayApp:
         # Calcola il colore basato sulla posizione (da scuro a sinistra a chiaro a destra)
         # Per il livello 12, usa 12 come numero totale, altrimenti usa il livello
         total_cells = 12 if sound_cell.level == 12 else sound_cell.level
-        bg_color = self._get_position_color(sound_cell.level, position, total_cells)
+        if self.color_metric_var.get() == POSITION_COLORING:
+            bg_color = self._get_position_color(sound_cell.level, position, total_cells)
+        else:
+            bg_color = self._get_metric_color(sound_cell, self.color_metric_var.get())
         
         # Calcola la larghezza in base al livello e al zoom
         if sound_cell.level == 12:
@@ -1380,6 +1584,7 @@ class ColorTreeDisplayApp:
         main_cell = tk.Frame(parent, bg=bg_color, relief='raised', bd=1, width=cell_width, height=cell_height)
         main_cell.grid(row=0, column=position, padx=0, pady=1, sticky='')
         main_cell.pack_propagate(False)  # Mantiene le dimensioni fisse
+        self.cell_widgets[(sound_cell.level, sound_cell.position)] = main_cell
         
         # Aggiunge il click handler per la riproduzione MIDI
         main_cell.bind("<Button-1>", lambda e: self.on_sound_cell_click(sound_cell))
@@ -1484,7 +1689,16 @@ class ColorTreeDisplayApp:
         
         # Calcola il rapporto di posizione (0.0 = sinistra, 1.0 = destra)
         position_ratio = position / (total_cells - 1) if total_cells > 1 else 0.5
-        
+        return self._get_gradient_color(position_ratio)
+    
+    def _get_metric_color(self, sound_cell: SoundCell, metric: str) -> str:
+        """Colore dal valore normalizzato di una metrica (tabelle precalcolate)"""
+        from pcset_metrics import get_metrics  # import qui per evitare l'import circolare
+        ratio = float(get_metrics().normalized(metric, [sound_cell])[0])
+        return self._get_gradient_color(ratio)
+    
+    def _get_gradient_color(self, position_ratio: float) -> str:
+        """Colore della gradazione blu per un rapporto tra 0 e 1"""
         # Usa una gradazione blu semplice
         hue_start, hue_end = 217, 200  # Tonalità blu
         sat_start, sat_end = 100, 30   # Saturazione
@@ -1544,6 +1758,8 @@ class ColorTreeDisplayApp:
         # Chiude la connessione MIDI
         if hasattr(self, 'midi_output'):
             self.midi_output.close()
+        if self.midi_input is not None:
+            self.midi_input.close()
         # Chiude l'applicazione
         self.root.destroy()
 
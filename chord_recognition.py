@@ -0,0 +1,107 @@
+"""
+Riconoscimento degli accordi da insiemi arbitrari di note
+Tabella precalcolata su tutti i 4096 insiemi di classi di altezza: ogni insieme punta alle celle
+della Color Tree con le stesse note (tutte le root) e, se non ce ne sono, alle celle più vicine
+per distanza di Hamming
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional, Union
+import numpy as np
+from cell_index import all_cells, cell_masks
+from chord_generator import Note, SoundCell
+
+
+# Numero di insiemi di classi di altezza (maschere a 12 bit)
+MASK_COUNT = 1 << 12
+
+# Numero di note di ogni maschera
+POPCOUNT = np.array([bin(mask).count("1") for mask in range(MASK_COUNT)], dtype=np.uint8)
+
+
+def notes_to_mask(notes: Iterable[Union[Note, int]]) -> int:
+    """Maschera a 12 bit (bit 0 = C) da note o numeri di nota MIDI"""
+    mask = 0
+    for note in notes:
+        mask |= 1 << ((note.value if isinstance(note, Note) else int(note)) % 12)
+    return mask
+
+
+@dataclass
+class Recognition:
+    """Risultato del riconoscimento: celle identiche o, in mancanza, le più vicine"""
+    mask: int
+    exact: List[SoundCell]
+    nearest: List[SoundCell]
+    distance: int  # note da aggiungere o togliere per arrivare alle celle più vicine
+
+    @property
+    def matched(self) -> bool:
+        return bool(self.exact)
+
+
+def _grouped(keys: np.ndarray, values: np.ndarray):
+    """Liste (offsets, valori) indicizzate per maschera, in formato CSR"""
+    order = np.lexsort((values, keys))
+    offsets = np.searchsorted(keys[order], np.arange(MASK_COUNT + 1)).astype(np.int32)
+    return offsets, values[order].astype(np.int32)
+
+
+class ChordRecognizer:
+    """Indice di riconoscimento costruito una volta, interrogazioni in tempo costante"""
+
+    def __init__(self):
+        self.cells = all_cells()
+        self.masks = cell_masks()
+
+        # Celle con esattamente le stesse note
+        self.exact_offsets, self.exact_cells = _grouped(self.masks.astype(np.int32),
+                                                        np.arange(len(self.masks)))
+
+        # Distanza di Hamming di ogni maschera da ogni insieme di note della Color Tree
+        unique = np.unique(self.masks).astype(np.int32)
+        distances = POPCOUNT[np.arange(MASK_COUNT)[:, None] ^ unique[None, :]]
+        self.distance = distances.min(axis=1).astype(np.uint8)
+        query, closest = np.nonzero(distances == self.distance[:, None])
+        # Ogni maschera vicina porta con sé tutte le celle con quelle note
+        counts = np.diff(self.exact_offsets)[unique[closest]]
+        starts = self.exact_offsets[unique[closest]]
+        cells = np.concatenate([self.exact_cells[start:start + count] for start, count in zip(starts, counts)])
+        self.nearest_offsets, self.nearest_cells = _grouped(np.repeat(query, counts), cells)
+
+        for table in (self.distance, self.exact_offsets, self.exact_cells,
+                      self.nearest_offsets, self.nearest_cells):
+            table.setflags(write=False)
+
+    def exact(self, mask: int) -> List[SoundCell]:
+        """Celle con esattamente le note della maschera"""
+        start, end = self.exact_offsets[mask], self.exact_offsets[mask + 1]
+        return [self.cells[i] for i in self.exact_cells[start:end]]
+
+    def nearest(self, mask: int) -> List[SoundCell]:
+        """Celle alla distanza di Hamming minima dalla maschera (le identiche se ci sono)"""
+        start, end = self.nearest_offsets[mask], self.nearest_offsets[mask + 1]
+        return [self.cells[i] for i in self.nearest_cells[start:end]]
+
+    def recognize_mask(self, mask: int) -> Recognition:
+        if not 0 <= mask < MASK_COUNT:
+            raise ValueError(f"Maschera non valida: {mask}")
+        return Recognition(mask, self.exact(mask), self.nearest(mask), int(self.distance[mask]))
+
+    def recognize(self, notes: Iterable[Union[Note, int]]) -> Recognition:
+        """Riconosce un insieme di note (Note o numeri di nota MIDI, ottave ignorate)"""
+        return self.recognize_mask(notes_to_mask(notes))
+
+    def containing(self, notes: Iterable[Union[Note, int]], root: Optional[Note] = None) -> List[SoundCell]:
+        """Celle che contengono tutte le note indicate, opzionalmente di una sola root"""
+        mask = notes_to_mask(notes)
+        selected = (self.masks & mask) == mask
+        cells = [self.cells[i] for i in np.flatnonzero(selected)]
+        return [cell for cell in cells if root is None or cell.root == root]
+
+
+@lru_cache(maxsize=1)
+def get_recognizer() -> ChordRecognizer:
+    """Indice condiviso, costruito alla prima richiesta"""
+    return ChordRecognizer()
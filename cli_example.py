@@ -1,49 +1,251 @@
 #!/usr/bin/env python3
 """
-Esempio di utilizzo da riga di comando per Chord Generator
+Esportazione da riga di comando delle Color Tree
+Genera una root alla volta con generate_color_tree e scrive i record a blocchi (testo, JSON,
+JSON Lines, CSV o binario compatto) su stdout o su file: la memoria usata non dipende dal
+numero di root e di livelli esportati
 """
 
 import argparse
+import csv
+import io
+import json
+import os
 import sys
-from chord_generator import ChordGenerator, Note
+from typing import Iterable, Iterator, List, Optional, Sequence
 
-def main():
+# pygame stampa un messaggio all'import: non deve finire nell'output esportato su stdout
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from binary_format import CELL_DTYPE, CELL_METRICS_DTYPE, cell_records, records_header
+from chord_generator import ChordGenerator, Note, SoundCell
+from pcset_metrics import METRICS, get_metrics
+
+# Byte accumulati prima di ogni scrittura sull'output
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = ('text', 'json', 'jsonl', 'csv', 'binary')
+
+CSV_COLUMNS = ["root", "level", "position", "chord", "notes", "intervals"]
+METRIC_COLUMNS = ["brightness", "tension", "roughness", "prime_form"]
+
+
+def note_name(note: Note) -> str:
+    return note.name.replace('_SHARP', '#')
+
+
+def parse_root(name: str) -> Note:
+    """Nota da un nome come C#, c_sharp o F"""
+    try:
+        return Note[name.upper().replace('#', '_SHARP')]
+    except KeyError:
+        raise ValueError(f"Nota radice non valida: {name}") from None
+
+
+def parse_roots(names: Sequence[str]) -> List[Note]:
+    """Root richieste; "all" indica tutte le 12 note"""
+    if any(name.lower() == 'all' for name in names):
+        return list(Note)
+    return [parse_root(name) for name in names]
+
+
+def parse_levels(spec: str) -> List[int]:
+    """Livelli da una specifica: "5" = livelli 1-5, "3,4,7-9" = elenco e intervalli"""
+    try:
+        if spec.isdigit():
+            levels = list(range(1, int(spec) + 1))
+        else:
+            levels = []
+            for part in spec.split(','):
+                first, _, last = part.partition('-')
+                levels.extend(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise ValueError(f"Livelli non validi: {spec}") from None
+    if not levels or min(levels) < 1 or max(levels) > 12:
+        raise ValueError(f"Livelli non validi: {spec} (da 1 a 12)")
+    return sorted(set(levels))
+
+
+def apply_metrics(levels, sort_by=None, filters=()):
+    """Filtra e ordina gli accordi di ogni livello per metrica"""
+    metrics = get_metrics()
+    result = []
+    for level in levels:
+        for metric, minimum, maximum in filters:
+            if metric not in METRICS:
+                raise ValueError(f"Metrica sconosciuta: {metric}")
+            level = metrics.filter_cells(metric, float(minimum), float(maximum), level)
+        if sort_by:
+            level = metrics.sort_cells(sort_by, level)
+        result.append(level)
+    return result
+
+
+def iter_levels(roots: Iterable[Note], levels: Sequence[int], sort_by=None,
+                filters=()) -> Iterator[List[SoundCell]]:
+    """Livelli richiesti, una root alla volta (solo una Color Tree in memoria)"""
+    generator = ChordGenerator()
+    for root in roots:
+        tree = generator.generate_color_tree(root)
+        yield from apply_metrics([tree[level - 1] for level in levels], sort_by, filters)
+
+
+def chord_text(sound_cell: SoundCell, display_mode: str) -> str:
+    return sound_cell.to_intervals_string() if display_mode == "intervals" else str(sound_cell)
+
+
+def cell_record(sound_cell: SoundCell, display_mode: str, with_metrics: bool) -> dict:
+    """Record di una cella per JSON e JSON Lines"""
+    record = {
+        "root": note_name(sound_cell.root),
+        "level": sound_cell.level,
+        "position": sound_cell.position,
+        "chord": chord_text(sound_cell, display_mode),
+        "notes": [note_name(note) for note in sound_cell.notes],
+        "intervals": sound_cell.get_intervals()
+    }
+    if with_metrics:
+        metrics = get_metrics().for_cell(sound_cell)
+        record.update(brightness=metrics.brightness, tension=metrics.tension,
+                      roughness=metrics.roughness, prime_form=list(metrics.prime_form))
+    return record
+
+
+def iter_text(levels: Iterable[List[SoundCell]], display_mode: str, with_metrics: bool) -> Iterator[str]:
+    root = None
+    for level in levels:
+        if not level:
+            continue
+        if level[0].root != root:
+            root = level[0].root
+            yield f"=== Root {note_name(root)} ===\n"
+        yield f"Livello {level[0].level}:\n"
+        for number, sound_cell in enumerate(level, 1):
+            line = f"  {number}. {chord_text(sound_cell, display_mode)}"
+            if with_metrics:
+                metrics = get_metrics().for_cell(sound_cell)
+                line += (f"  (luminosità {metrics.brightness:.2f}, tensione {metrics.tension:.2f},"
+                         f" ruvidità {metrics.roughness:.2f}, forma primaria {metrics.prime_form})")
+            yield line + "\n"
+        yield "\n"
+
+
+def iter_jsonl(levels: Iterable[List[SoundCell]], display_mode: str, with_metrics: bool) -> Iterator[str]:
+    for level in levels:
+        for sound_cell in level:
+            yield json.dumps(cell_record(sound_cell, display_mode, with_metrics), ensure_ascii=False) + "\n"
+
+
+def iter_json(levels: Iterable[List[SoundCell]], display_mode: str, with_metrics: bool) -> Iterator[str]:
+    """Array JSON di record, scritto un elemento alla volta"""
+    separator = "[\n  "
+    for level in levels:
+        for sound_cell in level:
+            yield separator + json.dumps(cell_record(sound_cell, display_mode, with_metrics), ensure_ascii=False)
+            separator = ",\n  "
+    yield "[]\n" if separator.startswith("[") else "\n]\n"
+
+
+def iter_csv(levels: Iterable[List[SoundCell]], display_mode: str, with_metrics: bool) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS + (METRIC_COLUMNS if with_metrics else []))
+    for level in levels:
+        for sound_cell in level:
+            row = [note_name(sound_cell.root), sound_cell.level, sound_cell.position,
+                   chord_text(sound_cell, display_mode),
+                   " - ".join(note_name(note) for note in sound_cell.notes),
+                   sound_cell.to_intervals_string()]
+            if with_metrics:
+                metrics = get_metrics().for_cell(sound_cell)
+                row += [f"{metrics.brightness:.4f}", f"{metrics.tension:.4f}", f"{metrics.roughness:.4f}",
+                        " ".join(str(pc) for pc in metrics.prime_form)]
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_binary(levels: Iterable[List[SoundCell]], display_mode: str, with_metrics: bool) -> Iterator[bytes]:
+    """Flusso di record di binary_format, un livello per blocco (la modalità di visualizzazione non conta)"""
+    del display_mode  # il binario contiene la maschera: note e intervalli si ricavano da essa
+    dtype = CELL_METRICS_DTYPE if with_metrics else CELL_DTYPE
+    yield records_header(dtype)
+    for level in levels:
+        records = cell_records(level, dtype)
+        if with_metrics:
+            for record, sound_cell in zip(records, level):
+                metrics = get_metrics().for_cell(sound_cell)
+                record['metric_brightness'] = metrics.brightness
+                record['tension'] = metrics.tension
+                record['roughness'] = metrics.roughness
+        yield records.tobytes()
+
+
+WRITERS = {'text': iter_text, 'json': iter_json, 'jsonl': iter_jsonl, 'csv': iter_csv, 'binary': iter_binary}
+
+
+def write_chunks(pieces: Iterable, stream, chunk_size: int = CHUNK_SIZE) -> int:
+    """Scrive i pezzi a blocchi di circa chunk_size byte; restituisce i byte (o caratteri) scritti"""
+    chunk, size, total = [], 0, 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            stream.write(piece[:0].join(chunk))
+            total += size
+            chunk, size = [], 0
+    if chunk:
+        stream.write(chunk[0][:0].join(chunk))
+        total += size
+    return total
+
+
+def export(stream, roots: Iterable[Note], levels: Sequence[int], format_type: str = 'text',
+           display_mode: str = 'notes', with_metrics: bool = False, sort_by=None, filters=(),
+           chunk_size: int = CHUNK_SIZE) -> int:
+    """Esporta le Color Tree richieste sullo stream (binario per il formato 'binary')"""
+    pieces = WRITERS[format_type](iter_levels(roots, levels, sort_by, filters), display_mode, with_metrics)
+    return write_chunks(pieces, stream, chunk_size)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
     """Funzione principale per CLI"""
     parser = argparse.ArgumentParser(
-        description="Generatore di accordi basato sul circolo delle quinte",
+        description="Esportazione delle Color Tree basate sul circolo delle quinte",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Esempi di utilizzo:
   python cli_example.py --root C --levels 5
-  python cli_example.py --root G --levels 3 --format json
-  python cli_example.py --root F --export chords.txt
+  python cli_example.py --root G D --levels 3,4 --format json
+  python cli_example.py --root all --format jsonl --metrics --export trees.jsonl
+  python cli_example.py --root all --format binary --export trees.bin
         """
     )
-    
+
     parser.add_argument(
         '--root', '-r',
-        type=str,
-        default='C',
-        choices=[note.name.replace('_', '#') for note in Note],
-        help='Nota radice per la generazione degli accordi (default: C)'
+        nargs='+',
+        default=['C'],
+        help='Note radice (es. C F#; "all" per tutte, default: C)'
     )
-    
+
     parser.add_argument(
         '--levels', '-l',
-        type=int,
-        default=12,
-        choices=range(1, 13),
-        help='Numero di livelli da generare (1-12, default: 12)'
+        type=str,
+        default='12',
+        help='Livelli: N per i livelli 1-N, oppure elenco come 3,4,7-9 (default: 12)'
     )
-    
+
     parser.add_argument(
         '--format', '-f',
         type=str,
-        choices=['text', 'json', 'csv'],
+        choices=FORMATS,
         default='text',
         help='Formato di output (default: text)'
     )
-    
+
     parser.add_argument(
         '--display', '-d',
         type=str,
@@ -51,146 +253,65 @@ Esempi di utilizzo:
         default='notes',
         help='Tipo di visualizzazione: notes o intervals (default: notes)'
     )
-    
+
+    parser.add_argument(
+        '--metrics', '-m',
+        action='store_true',
+        help='Aggiunge luminosità, tensione, ruvidità e forma primaria'
+    )
+
+    parser.add_argument(
+        '--sort-by', '-s',
+        type=str,
+        choices=METRICS,
+        help='Ordina gli accordi di ogni livello per una metrica'
+    )
+
+    parser.add_argument(
+        '--filter',
+        nargs=3,
+        action='append',
+        default=[],
+        metavar=('METRICA', 'MIN', 'MAX'),
+        help='Mantiene solo gli accordi con la metrica nell\'intervallo (ripetibile)'
+    )
+
     parser.add_argument(
         '--export', '-e',
         type=str,
-        help='File di esportazione (opzionale)'
+        help='File di esportazione (default: stdout)'
     )
-    
+
     parser.add_argument(
         '--verbose', '-v',
         action='store_true',
-        help='Output verboso con informazioni aggiuntive'
+        help='Come --metrics (compatibilità)'
     )
-    
-    args = parser.parse_args()
-    
+
+    args = parser.parse_args(argv)
+
     try:
-        # Converte la nota radice
-        root_note_name = args.root.replace('#', '_SHARP')
-        root_note = Note[root_note_name]
-        
-        # Genera gli accordi
-        generator = ChordGenerator()
-        levels = generator.generate_triangular_chords(root_note)
-        
-        # Limita i livelli se richiesto
-        if args.levels < 12:
-            levels = levels[:args.levels]
-        
-        # Genera l'output
-        output = generate_output(levels, args.format, args.verbose, args.display)
-        
-        # Esporta o stampa
+        roots = parse_roots(args.root)
+        levels = parse_levels(args.levels)
+        for metric, _, _ in args.filter:
+            if metric not in METRICS:
+                raise ValueError(f"Metrica sconosciuta: {metric}")
+        options = dict(format_type=args.format, display_mode=args.display,
+                       with_metrics=args.metrics or args.verbose, sort_by=args.sort_by, filters=args.filter)
+
         if args.export:
-            with open(args.export, 'w', encoding='utf-8') as f:
-                f.write(output)
-            print(f"Accordi esportati in {args.export}")
+            mode, encoding = ('wb', None) if args.format == 'binary' else ('w', 'utf-8')
+            with open(args.export, mode, encoding=encoding, newline='' if encoding else None) as f:
+                export(f, roots, levels, **options)
+            print(f"Accordi esportati in {args.export}", file=sys.stderr)
         else:
-            print(output)
-            
-    except Exception as e:
+            stream = sys.stdout.buffer if args.format == 'binary' else sys.stdout
+            export(stream, roots, levels, **options)
+            stream.flush()
+    except (ValueError, OSError) as e:
         print(f"Errore: {e}", file=sys.stderr)
-        sys.exit(1)
-
-def generate_output(levels, format_type, verbose, display_mode):
-    """Genera l'output nel formato richiesto"""
-    
-    if format_type == 'json':
-        return generate_json_output(levels, verbose, display_mode)
-    elif format_type == 'csv':
-        return generate_csv_output(levels, verbose, display_mode)
-    else:
-        return generate_text_output(levels, verbose, display_mode)
-
-def generate_text_output(levels, verbose, display_mode):
-    """Genera output in formato testo"""
-    output = []
-    
-    if verbose:
-        output.append("=== Generatore di Accordi - Circolo delle Quinte ===")
-        output.append(f"Livelli generati: {len(levels)}")
-        output.append(f"Totale accordi: {sum(len(level) for level in levels)}")
-        output.append(f"Modalità visualizzazione: {display_mode}")
-        output.append("")
-    
-    for i, level in enumerate(levels):
-        output.append(f"Livello {i + 1}:")
-        for j, chord in enumerate(level):
-            if display_mode == "intervals":
-                chord_text = chord.to_intervals_string()
-            else:
-                chord_text = str(chord)
-            output.append(f"  {j + 1}. {chord_text}")
-        output.append("")
-    
-    return "\n".join(output)
-
-def generate_json_output(levels, verbose, display_mode):
-    """Genera output in formato JSON"""
-    import json
-    
-    data = {
-        "levels": []
-    }
-    
-    if verbose:
-        data["metadata"] = {
-            "total_levels": len(levels),
-            "total_chords": sum(len(level) for level in levels),
-            "display_mode": display_mode
-        }
-    
-    for i, level in enumerate(levels):
-        level_data = {
-            "level": i + 1,
-            "chords": []
-        }
-        
-        for j, chord in enumerate(level):
-            chord_data = {
-                "position": j + 1,
-                "notes": [note.name.replace('_', '#') for note in chord.notes],
-                "root": chord.root.name.replace('_', '#'),
-                "representation": str(chord),
-                "intervals": chord.get_intervals(),
-                "intervals_string": chord.to_intervals_string()
-            }
-            level_data["chords"].append(chord_data)
-        
-        data["levels"].append(level_data)
-    
-    return json.dumps(data, indent=2, ensure_ascii=False)
-
-def generate_csv_output(levels, verbose, display_mode):
-    """Genera output in formato CSV"""
-    import csv
-    import io
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    if verbose:
-        writer.writerow(["Livello", "Posizione", "Note", "Radice", "Rappresentazione", "Intervalli"])
-    else:
-        writer.writerow(["Livello", "Posizione", "Accordo"])
-    
-    for i, level in enumerate(levels):
-        for j, chord in enumerate(level):
-            if verbose:
-                notes_str = " - ".join(note.name.replace('_', '#') for note in chord.notes)
-                root_str = chord.root.name.replace('_', '#')
-                intervals_str = chord.to_intervals_string()
-                writer.writerow([i + 1, j + 1, notes_str, root_str, str(chord), intervals_str])
-            else:
-                if display_mode == "intervals":
-                    chord_text = chord.to_intervals_string()
-                else:
-                    chord_text = str(chord)
-                writer.writerow([i + 1, j + 1, chord_text])
-    
-    return output.getvalue()
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -2,6 +2,8 @@
 Configurazione per l'applicazione Chord Generator
 """
 
+import os
+
 # Configurazione dell'interfaccia grafica
 UI_CONFIG = {
     'window_title': 'Generatore di Accordi - Circolo delle Quinte',
@@ -67,3 +69,15 @@ INTERVAL_CONFIG = {
     'show_interval_names': False,  # Mostra nomi completi degli intervalli
     'interval_separator': ' - '
 }
+
+# Configurazione della cache su disco (matrici precalcolate)
+CACHE_CONFIG = {
+    'cache_dir': os.environ.get('COLOR_TREE_CACHE_DIR',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'color_tree'))
+}
+
+# Configurazione del tracing (timeline Chrome Trace / Perfetto); attivo se trace_file è impostato
+TRACE_CONFIG = {
+    'trace_file': os.environ.get('COLOR_TREE_TRACE'),
+    'capacity': int(os.environ.get('COLOR_TREE_TRACE_EVENTS', 65536))
+}
@@ -4,10 +4,28 @@ Finestra per la riproduzione creativa di accordi con pattern
 
 import tkinter as tk
 from tkinter import ttk
-from pattern_engine import PatternEngine, PatternType
+from pattern_engine import PatternEngine, PatternType, CHORD_QUANTIZE
+from scheduler import QUANTIZE_MODES
+from osc_control import OSCServer, OSC_PORT
+from tracing import get_tracer, install_tk_tracing
 from chord_generator import SoundCell, MIDIScaleGenerator, MusicalFigure, musical_figure_to_seconds
 
 
+# Parametri del Pattern Engine ricevuti via OSC -> variabile Tk che li mostra
+REMOTE_VARIABLES = {
+    'octave': 'start_octave_var', 'duration_octaves': 'duration_octaves_var',
+    'playback_speed': 'playback_speed_var', 'bpm': 'bpm_var', 'reverse': 'reverse_var',
+    'delay_enabled': 'delay_enabled_var', 'delay_feedback': 'delay_feedback_var', 'delay_mix': 'delay_mix_var',
+    'delay_type': 'delay_type_var', 'delay_repeats': 'delay_repeats_var',
+    'velocity_curve': 'velocity_curve_var', 'velocity_intensity': 'velocity_intensity_var',
+    'accent_enabled': 'accent_enabled_var', 'accent_strength': 'accent_strength_var',
+    'accent_pattern': 'accent_pattern_var', 'repeater_enabled': 'repeater_enabled_var',
+    'repeat_count': 'repeat_count_var', 'repeat_timing': 'repeat_timing_var',
+    'chord_gen_enabled': 'chord_gen_enabled_var', 'chord_variation': 'chord_variation_var',
+    'voicing': 'voicing_var', 'chord_play_mode': 'chord_play_mode_var',
+}
+# Durate in secondi che non corrispondono a una figura della finestra
+REMOTE_DURATIONS = ('base_duration', 'delay_time')
 
 
 class CreativeChordWindow:
@@ -20,6 +38,10 @@ class CreativeChordWindow:
         self.midi_output = midi_output  # Aggiunto supporto MIDI
         self.pattern_engine = PatternEngine(midi_generator, midi_output)  # Passa MIDI al pattern engine
         
+        # Con il tracing attivo anche i callback Tk compaiono nella timeline
+        if get_tracer() is not None:
+            install_tk_tracing()
+        
         # Crea la finestra
         self.window = tk.Toplevel(parent)
         self.window.title("Creative Chord Patterns")
@@ -59,6 +81,14 @@ class CreativeChordWindow:
         self.chord_gen_enabled_var = tk.BooleanVar(value=False)
         self.chord_variation_var = tk.StringVar(value="inversion")
         self.voicing_var = tk.StringVar(value="close")
+        self.chord_play_mode_var = tk.StringVar(value="arpeggio")  # Arpeggio o accordi block
+        self.quantize_var = tk.StringVar(value="beat")  # Confine di applicazione dei cambi
+        self.chord_quantize_var = tk.StringVar(value="bar")  # Confine dei cambi di accordo
+        self.clock_sync_var = tk.StringVar(value="internal")  # Internal, clock out o external
+        self.osc_var = tk.BooleanVar(value=False)  # Controllo remoto via OSC
+        self.osc_server = None
+        # Durate ricevute via OSC, valide finché non si sceglie un'altra figura nella finestra
+        self.remote_durations = {}
         
         # Stato dei controlli
         self.is_playing = False
@@ -486,6 +516,42 @@ class CreativeChordWindow:
                             activebackground='#8e44ad',
                             activeforeground='white')
         speed_up.pack(side='left', padx=(2, 0))
+        
+        # Quantizzazione dei cambi durante la riproduzione
+        quantize_frame = tk.Frame(button_frame, bg='#f8f9fa')
+        quantize_frame.pack(side='left', padx=(10, 0))
+        
+        quantize_label = tk.Label(quantize_frame, text="Quantize", 
+                                 font=('Segoe UI', 8, 'bold'), 
+                                 bg='#f8f9fa', fg='#2c3e50')
+        quantize_label.pack(side='left', padx=(0, 2))
+        
+        quantize_dropdown = ttk.Combobox(quantize_frame, 
+                                        textvariable=self.quantize_var,
+                                        values=list(QUANTIZE_MODES),
+                                        state="readonly", width=9, font=('Segoe UI', 8))
+        quantize_dropdown.pack(side='left')
+        
+        chord_quantize_label = tk.Label(quantize_frame, text="Chord", 
+                                       font=('Segoe UI', 8, 'bold'), 
+                                       bg='#f8f9fa', fg='#2c3e50')
+        chord_quantize_label.pack(side='left', padx=(8, 2))
+        
+        chord_quantize_dropdown = ttk.Combobox(quantize_frame, 
+                                              textvariable=self.chord_quantize_var,
+                                              values=list(CHORD_QUANTIZE),
+                                              state="readonly", width=6, font=('Segoe UI', 8))
+        chord_quantize_dropdown.pack(side='left')
+        
+        osc_check = tk.Checkbutton(quantize_frame, text="OSC", variable=self.osc_var,
+                                   command=self.on_osc_toggle,
+                                   font=('Segoe UI', 8, 'bold'),
+                                   bg='#f8f9fa', fg='#2c3e50')
+        osc_check.pack(side='left', padx=(8, 0))
+        self.quantize_var.trace_add('write', lambda *_: self.sync_osc_quantize())
+        self.chord_quantize_var.trace_add('write', lambda *_: self.sync_osc_quantize())
+        self.note_duration_var.trace_add('write', lambda *_: self.remote_durations.pop('base_duration', None))
+        self.delay_figure_var.trace_add('write', lambda *_: self.remote_durations.pop('delay_time', None))
     
     def create_parameter_controls(self, parent):
         """Crea i controlli per i parametri compatti"""
@@ -646,6 +712,14 @@ class CreativeChordWindow:
                           activeforeground='white')
         bpm_up.pack(side='left', padx=(2, 0))
         
+        # Sincronizzazione MIDI Clock
+        clock_sync_dropdown = ttk.Combobox(bpm_frame, 
+                                          textvariable=self.clock_sync_var,
+                                          values=["internal", "clock out", "external"],
+                                          state="readonly", width=9, font=('Segoe UI', 8))
+        clock_sync_dropdown.pack(fill='x', pady=(2, 0))
+        clock_sync_dropdown.bind('<<ComboboxSelected>>', self.on_clock_sync_change)
+        
         # Aggiorna i valori quando cambiano
         def update_start_octave_value(*_):
             self.start_octave_label.config(text=str(int(self.start_octave_var.get())))
@@ -1259,6 +1333,21 @@ class CreativeChordWindow:
                                       state="readonly", width=8, font=('Segoe UI', 7))
         voicing_dropdown.pack(fill='x')
         voicing_dropdown.bind('<<ComboboxSelected>>', self.on_effect_change)
+        
+        # Modalità di riproduzione del voicing
+        play_mode_frame = tk.Frame(chord_gen_controls, bg='#f3e5f5')
+        play_mode_frame.pack(side='left', fill='x', expand=True, padx=(3, 0))
+        
+        play_mode_label = tk.Label(play_mode_frame, text="Play", font=('Segoe UI', 7), 
+                                 bg='#f3e5f5', fg='#7f8c8d')
+        play_mode_label.pack(anchor='center')
+        
+        play_mode_dropdown = ttk.Combobox(play_mode_frame, 
+                                        textvariable=self.chord_play_mode_var,
+                                        values=["arpeggio", "block"],
+                                        state="readonly", width=8, font=('Segoe UI', 7))
+        play_mode_dropdown.pack(fill='x')
+        play_mode_dropdown.bind('<<ComboboxSelected>>', self.on_effect_change)
     
     def create_pattern_controls_compact(self, parent):
         """Crea i controlli pattern in formato compatto con tooltip"""
@@ -1523,6 +1612,85 @@ class CreativeChordWindow:
             self.update_bpm_display()
             self.update_parameters_realtime()
     
+    def on_clock_sync_change(self, event=None):
+        """Imposta la sincronizzazione: clock interno, MIDI Clock in uscita o clock esterno"""
+        del event  # Ignora il parametro event non utilizzato
+        mode = self.clock_sync_var.get()
+        self.pattern_engine.set_clock_output(mode == "clock out")
+        if mode == "external":
+            if self.pattern_engine.follow_external_clock():
+                self.log_message(f"Following external clock: {self.pattern_engine.external_clock.port_name}")
+                self.poll_external_bpm()
+            else:
+                self.log_message("No MIDI input port available for external clock")
+                self.clock_sync_var.set("internal")
+        else:
+            self.pattern_engine.stop_following_clock()
+            self.update_bpm_display()
+    
+    def on_osc_toggle(self):
+        """Avvia o ferma il server OSC che controlla i parametri del Pattern Engine"""
+        if not self.osc_var.get():
+            self.stop_osc()
+            self.log_message("OSC control stopped")
+            return
+        # Play e stop restano alla finestra, che ne tiene lo stato
+        self.osc_server = OSCServer(self.pattern_engine, port=OSC_PORT, transport=False)
+        self.osc_server.on_parameters = self.on_osc_parameters
+        self.sync_osc_quantize()
+        try:
+            port = self.osc_server.start()
+        except OSError as e:
+            print(f"Errore nell'avvio del server OSC: {e}")
+            self.osc_server = None
+            self.osc_var.set(False)
+            return
+        self.log_message(f"OSC control on udp port {port}")
+    
+    def on_osc_parameters(self, changes):
+        """Dal thread OSC: i controlli vengono aggiornati sul thread di Tk"""
+        try:
+            self.window.after(0, self.apply_remote_parameters, changes)
+        except (tk.TclError, RuntimeError):
+            pass  # finestra già chiusa
+    
+    def apply_remote_parameters(self, changes):
+        """Riporta nei controlli i parametri cambiati via OSC
+        
+        Così il prossimo cambio dalla finestra, o Play, non riporta il motore ai valori vecchi.
+        """
+        for name, value in changes.items():
+            if name in REMOTE_VARIABLES:
+                getattr(self, REMOTE_VARIABLES[name]).set(value)
+            elif name == 'pattern_type':
+                self.selected_pattern.set(value.value)
+            elif name == 'octave_add':
+                # La finestra somma tre controlli: il valore remoto va sul primo
+                self.octave_add_var.set(value - self.octave_shift_1_var.get() - self.octave_shift_2_var.get())
+            elif name in REMOTE_DURATIONS:
+                self.remote_durations[name] = value
+    
+    def sync_osc_quantize(self):
+        """Allinea i confini dei cambi OSC a quelli scelti nella finestra"""
+        if self.osc_server is not None:
+            self.osc_server.quantize = self.quantize_var.get()
+            self.osc_server.chord_quantize = self.chord_quantize_var.get()
+    
+    def stop_osc(self):
+        """Ferma il server OSC, se attivo"""
+        if self.osc_server is not None:
+            self.osc_server.stop()
+            self.osc_server = None
+    
+    def poll_external_bpm(self):
+        """Mostra il tempo stimato del clock esterno finché è agganciato"""
+        follower = self.pattern_engine.external_clock
+        if follower is None:
+            return
+        if follower.pll.locked:
+            self.bpm_label.config(text=f"{follower.bpm:.0f}")
+        self.window.after(500, self.poll_external_bpm)
+    
     def update_bpm_display(self):
         """Aggiorna la visualizzazione del BPM"""
         bpm = self.bpm_var.get()
@@ -1860,9 +2028,10 @@ class CreativeChordWindow:
                 # Converte il pattern selezionato in PatternType
                 pattern_type = PatternType(self.selected_pattern.get())
                 
-                # Aggiorna i parametri nel pattern engine
-                self.pattern_engine.update_parameters(
-                    sound_cell=self.sound_cell,
+                # I cambi vengono applicati dal pattern engine al prossimo confine di quantizzazione
+                # L'accordo passa dalla coda degli accordi (vedi change_chord)
+                self.pattern_engine.schedule_parameters(
+                    quantize=self.quantize_var.get(),
                     pattern_type=pattern_type,
                     octave=self.start_octave_var.get(),
                     base_duration=self.get_note_duration_seconds(),
@@ -1890,7 +2059,8 @@ class CreativeChordWindow:
                     repeat_timing=self.repeat_timing_var.get(),
                     chord_gen_enabled=self.chord_gen_enabled_var.get(),
                     chord_variation=self.chord_variation_var.get(),
-                    voicing=self.voicing_var.get()
+                    voicing=self.voicing_var.get(),
+                    chord_play_mode=self.chord_play_mode_var.get()
                 )
                 
                 self.log_message("Parameters updated in real-time")
@@ -1904,11 +2074,13 @@ class CreativeChordWindow:
         # Aggiorna le informazioni dell'accordo nell'interfaccia
         self.update_chord_info()
         
-        # Se sta riproducendo, aggiorna i parametri in tempo reale
+        # Se sta riproducendo, il nuovo accordo entra sul prossimo confine scelto
         if self.is_playing:
-            # Il MIDI viene ora inviato automaticamente dal pattern engine per ogni nota dell'arpeggio
-            self.update_parameters_realtime()
-            self.log_message(f"Chord changed to: {new_sound_cell.__str__()}")
+            try:
+                self.pattern_engine.queue_chord_change(new_sound_cell, self.chord_quantize_var.get())
+                self.log_message(f"Chord queued ({self.chord_quantize_var.get()}): {new_sound_cell.__str__()}")
+            except (ValueError, RuntimeError) as e:
+                self.log_message(f"Error changing chord: {str(e)}")
     
     def update_chord_info(self):
         """Aggiorna le informazioni dell'accordo nell'interfaccia"""
@@ -1948,6 +2120,8 @@ class CreativeChordWindow:
         }
         
         # Durata base per il tipo di nota selezionato
+        if 'base_duration' in self.remote_durations:
+            return self.remote_durations['base_duration']
         base_duration = duration_map.get(self.note_duration_var.get(), 0.5)
         
         # Applica il BPM (120 BPM è il riferimento)
@@ -1985,6 +2159,8 @@ class CreativeChordWindow:
             "Triplet Eighth": MusicalFigure.TRIPLET_EIGHTH
         }
         
+        if 'delay_time' in self.remote_durations:
+            return self.remote_durations['delay_time']
         figure_name = self.delay_figure_var.get()
         if figure_name in figure_map:
             figure = figure_map[figure_name]
@@ -2053,7 +2229,8 @@ class CreativeChordWindow:
                 repeat_timing=self.repeat_timing_var.get(),
                 chord_gen_enabled=self.chord_gen_enabled_var.get(),
                 chord_variation=self.chord_variation_var.get(),
-                voicing=self.voicing_var.get()
+                voicing=self.voicing_var.get(),
+                chord_play_mode=self.chord_play_mode_var.get()
             )
             
         except (ValueError, RuntimeError, OSError) as e:
@@ -2146,6 +2323,8 @@ class CreativeChordWindow:
         """Gestisce la chiusura della finestra"""
         if self.is_playing:
             self.stop_pattern()
+        self.pattern_engine.stop_following_clock()
+        self.stop_osc()
         self.window.destroy()
     
     def show(self):
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Flusso WebSocket degli eventi di riproduzione
+Endpoint asyncio opzionale che trasmette ai client (visualizzatori nel browser, monitor remoti)
+le note programmate dal PatternEngine o da una sessione multitraccia: un messaggio per ogni
+riempimento della finestra di lookahead, con nota, velocity, onset, durata e traccia.
+
+Il thread di riproduzione non aspetta mai i client: il listener dello scheduler passa il batch
+al loop asyncio e ogni client ha una coda limitata con una politica per quando è pieno
+(scarta i batch più vecchi, scarta i nuovi o li fonde scartando le note già finite).
+
+Messaggi (JSON):
+  {"type": "hello", "policy": ..., "queue_size": ...}
+  {"type": "events", "window": [inizio, fine], "dropped": N,
+   "events": [{"note": 60, "velocity": 100, "onset": 1.25, "duration": 0.24, "track": ""}, ...]}
+Tempi in secondi dall'inizio della riproduzione; dropped conta le note perse dall'ultimo messaggio.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Set, Tuple
+
+from binary_format import open_archive
+from chord_generator import MIDIScaleGenerator
+from cli_example import parse_root
+from http_service import parse_request_head
+from pattern_engine import NOTE_ON, PatternEngine, PatternType
+from scheduler import LookaheadScheduler
+
+
+DEFAULT_PORT = 8765
+EVENTS_PATH = "/events"
+# Batch in coda per client prima di applicare la politica
+DEFAULT_QUEUE_SIZE = 32
+QUEUE_POLICIES = ("drop_oldest", "drop_newest", "coalesce")
+HANDSHAKE_TIMEOUT = 5.0
+# Un client che non riceve un messaggio entro questo tempo viene disconnesso
+SEND_TIMEOUT = 10.0
+# Dimensione massima dei frame inviati dai client (servono solo ping e chiusura)
+MAX_CLIENT_FRAME = 64 * 1024
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+@dataclass
+class EventBatch:
+    """Note programmate in una finestra di lookahead: (onset, durata, nota, velocity, traccia)"""
+    start: float
+    end: float
+    events: List[Tuple[float, float, int, int, str]]
+    _events_json: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def message(self, dropped: int = 0) -> bytes:
+        """Messaggio JSON; la lista di eventi è serializzata una volta sola per tutti i client"""
+        if self._events_json is None:
+            self._events_json = json.dumps([
+                {"note": note, "velocity": velocity, "onset": round(onset, 6),
+                 "duration": round(duration, 6), "track": track}
+                for onset, duration, note, velocity, track in self.events])
+        return (f'{{"type": "events", "window": [{self.start:.6f}, {self.end:.6f}], '
+                f'"dropped": {dropped}, "events": {self._events_json}}}').encode("utf-8")
+
+
+def coalesce(batches: Sequence[EventBatch]) -> Tuple[EventBatch, int]:
+    """Fonde i batch in uno solo, scartando le note già finite all'inizio dell'ultimo"""
+    newest = batches[-1].start
+    events = [event for batch in batches for event in batch.events if event[0] + event[1] >= newest]
+    total = sum(len(batch.events) for batch in batches)
+    return EventBatch(batches[0].start, batches[-1].end, events), total - len(events)
+
+
+class ClientQueue:
+    """Coda limitata dei batch di un client: put non blocca mai"""
+
+    def __init__(self, maxsize: int = DEFAULT_QUEUE_SIZE, policy: str = "drop_oldest"):
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.batches: "deque[EventBatch]" = deque()
+        self.dropped = 0  # note perse dall'ultimo get
+        self.total_dropped = 0
+        self.ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def _drop(self, count: int):
+        self.dropped += count
+        self.total_dropped += count
+
+    def put(self, batch: EventBatch):
+        if len(self.batches) >= self.maxsize:
+            if self.policy == "drop_newest":
+                self._drop(len(batch.events))
+                return
+            if self.policy == "coalesce":
+                merged, dropped = coalesce(list(self.batches) + [batch])
+                self._drop(dropped)
+                self.batches.clear()
+                batch = merged
+            else:
+                self._drop(len(self.batches.popleft().events))
+        self.batches.append(batch)
+        self.ready.set()
+
+    async def get(self) -> Tuple[EventBatch, int]:
+        """Prossimo batch e note perse prima di esso"""
+        while not self.batches:
+            self.ready.clear()
+            await self.ready.wait()
+        dropped, self.dropped = self.dropped, 0
+        return self.batches.popleft(), dropped
+
+
+def encode_frame(payload: bytes, opcode: int = OP_TEXT) -> bytes:
+    """Frame WebSocket non mascherato (dal server)"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Legge un frame (mascherato, dal client): codice operativo e dati"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_CLIENT_FRAME:
+        raise ValueError(f"Frame troppo grande: {length} byte")
+    mask = await reader.readexactly(4) if second & 0x80 else b""
+    data = await reader.readexactly(length)
+    if mask:
+        data = bytes(byte ^ mask[i % 4] for i, byte in enumerate(data))
+    return first & 0x0F, data
+
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+class EventStreamServer:
+    """Server WebSocket che trasmette i batch di eventi di uno o più player"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, policy: str = "drop_oldest"):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Politica sconosciuta: {policy} (ammesse: {', '.join(QUEUE_POLICIES)})")
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.policy = policy
+        self.clients: Set[ClientQueue] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.batches_published = 0
+        self._connections: Set[asyncio.Task] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Lato riproduzione ---
+
+    def attach(self, player):
+        """Trasmette gli eventi di un PatternEngine o di una MultiTrackSession"""
+        if self.listener not in player.event_listeners:
+            player.event_listeners.append(self.listener)
+
+    def detach(self, player):
+        if self.listener in player.event_listeners:
+            player.event_listeners.remove(self.listener)
+
+    def listener(self, scheduler: LookaheadScheduler, start: float, end: float, batch: list):
+        """Listener dello scheduler (thread di riproduzione): passa il batch al loop senza attese"""
+        loop = self.loop
+        if loop is None or not self.clients:
+            return
+        origin = scheduler.origin or 0.0
+        events = [(due - origin, payload[2], payload[0], payload[1], source.track)
+                  for due, kind, source, payload in batch if kind == NOTE_ON]
+        if not events:
+            return
+        try:
+            loop.call_soon_threadsafe(self._publish, EventBatch(start - origin, end - origin, events))
+        except RuntimeError:
+            pass  # loop già chiuso
+
+    def _publish(self, batch: EventBatch):
+        self.batches_published += 1
+        for client in self.clients:
+            client.put(batch)
+
+    # --- Lato asyncio ---
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+        self.loop = None
+
+    def start_in_thread(self) -> int:
+        """Avvia il server in un thread con un proprio loop (per la GUI tkinter o uno script)"""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        errors: List[Exception] = []
+
+        def run():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self.port
+
+    def stop_thread(self):
+        if self._thread is None:
+            return
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        client = None
+        sender = None
+        try:
+            if not await self._handshake(reader, writer):
+                return
+            client = ClientQueue(self.queue_size, self.policy)
+            self.clients.add(client)
+            hello = {"type": "hello", "policy": self.policy, "queue_size": client.maxsize}
+            writer.write(encode_frame(json.dumps(hello).encode("utf-8")))
+            sender = asyncio.ensure_future(self._send_loop(client, writer))
+            while True:
+                opcode, data = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(data[:2], OP_CLOSE))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(data, OP_PONG))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            writer.write(encode_frame(struct.pack("!H", 1001), OP_CLOSE))
+        finally:
+            self.clients.discard(client)
+            if sender is not None:
+                sender.cancel()
+            writer.close()
+            self._connections.discard(task)
+
+    async def _handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Upgrade HTTP → WebSocket; risponde con un errore HTTP se la richiesta non è valida"""
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HANDSHAKE_TIMEOUT)
+        method, target, _, headers = parse_request_head(head)
+        status = None
+        if method != "GET":
+            status = "405 Method Not Allowed"
+        elif target.split("?")[0] != EVENTS_PATH:
+            status = "404 Not Found"
+        elif (headers.get("upgrade", "").lower() != "websocket" or "sec-websocket-key" not in headers
+              or headers.get("sec-websocket-version") != "13"):
+            status = "426 Upgrade Required"
+        if status:
+            writer.write(f"HTTP/1.1 {status}\r\nSec-WebSocket-Version: 13\r\n"
+                         f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            return False
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept_key(headers['sec-websocket-key'])}\r\n\r\n").encode("latin-1"))
+        return True
+
+    async def _send_loop(self, client: ClientQueue, writer: asyncio.StreamWriter):
+        """Invia i batch di un client; un client lento rallenta solo questo task"""
+        try:
+            while True:
+                batch, dropped = await client.get()
+                writer.write(encode_frame(batch.message(dropped)))
+                await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.clients.discard(client)
+            writer.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Suona in loop una cella della Color Tree e ne trasmette gli eventi"""
+    parser = argparse.ArgumentParser(description="Flusso WebSocket degli eventi del Pattern Engine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--policy", choices=QUEUE_POLICIES, default="drop_oldest")
+    parser.add_argument("--cell", default="C:4:1", help="Cella da suonare come ROOT:LIVELLO:POSIZIONE")
+    parser.add_argument("--pattern", default=PatternType.UP_DOWN.value,
+                        choices=[pattern.value for pattern in PatternType])
+    parser.add_argument("--bpm", type=int, default=120)
+    args = parser.parse_args(argv)
+
+    try:
+        root_name, level, position = args.cell.split(":")
+        with open_archive() as archive:
+            sound_cell = archive.sound_cell(archive.find_cell(parse_root(root_name), int(level), int(position)))
+    except ValueError as e:
+        print(f"Errore nella scelta della cella: {e}")
+        return 1
+
+    server = EventStreamServer(args.host, args.port, args.queue_size, args.policy)
+    try:
+        port = server.start_in_thread()
+    except OSError as e:
+        print(f"Errore nell'avvio del flusso di eventi: {e}")
+        return 1
+    engine = PatternEngine(MIDIScaleGenerator())
+    server.attach(engine)
+    engine.play_pattern(sound_cell, PatternType(args.pattern), loop=True, bpm=args.bpm)
+    print(f"Eventi su ws://{args.host}:{port}{EVENTS_PATH} (Ctrl+C per uscire)")
+    try:
+        while engine.is_pattern_playing():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop_pattern()
+        server.stop_thread()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+Servizio HTTP per le Color Tree e i clip renderizzati
+Server asyncio (solo libreria standard) che espone la Color Tree di ogni root, la ricerca e il
+riconoscimento delle celle e il rendering su richiesta di clip MIDI o WAV di una
+(cella, pattern, parametri). Le risposte deterministiche sono servite da una cache LRU con ETag;
+i rendering usano la CPU e girano in un pool di processi che condividono l'archivio binario
+mappato in memoria, così il loop degli eventi non resta mai bloccato.
+
+Endpoint (solo GET):
+  /health
+  /tree/{root}?levels=1-12&display=notes|intervals&metrics=1
+  /cell/{root}/{level}/{position}
+  /recognize?notes=60,62,67        (numeri di nota MIDI o nomi di nota)
+  /render?cell=C:3:0&pattern=up&format=midi|wav&bpm=100&...   (parametri in RENDER_RANGES,
+                                                              RENDER_CHOICES e RENDER_FLAGS)
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+# pygame stampa un messaggio all'import: non serve nei log del servizio
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+from binary_format import ARCHIVE_VERSION, ColorTreeArchive, open_archive
+from chord_generator import MIDIScaleGenerator, Note
+from chord_recognition import get_recognizer, notes_to_mask
+from cli_example import cell_record, iter_levels, note_name, parse_levels, parse_root
+from midi_effects import EventBuffer, REPEAT_TIMING_FACTORS, build_stages
+from pattern_engine import PatternEngine, PatternType, RANDOM_PATTERNS
+from progression import MIDI_AVAILABLE, build_midi_file
+from voicing import CHORD_VARIATIONS, VOICING_TYPES
+
+
+# Versione delle risposte: entra negli ETag insieme alla versione dell'archivio
+SERVICE_VERSION = 1
+
+DEFAULT_PORT = 8000
+# Byte massimi delle risposte tenute nella cache LRU
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Secondi di attesa per l'intestazione di una richiesta (anche tra richieste keep-alive)
+READ_TIMEOUT = 15.0
+# Durata massima di un clip renderizzato
+MAX_RENDER_SECONDS = 60.0
+
+# Sintesi WAV: stessi valori dell'anteprima pygame del Pattern Engine
+SAMPLE_RATE = 22050
+FADE_SECONDS = 0.01
+
+# Formato di rendering: (Content-Type, estensione del file)
+RENDER_FORMATS = {'midi': ("audio/midi", "mid"), 'wav': ("audio/wav", "wav")}
+
+# Parametri del Pattern Engine accettati da /render: tipo e limiti
+RENDER_RANGES = {
+    'octave': (int, 1, 7),
+    'base_duration': (float, 0.02, 4.0),
+    'duration_octaves': (int, 1, 4),
+    'playback_speed': (float, 0.1, 8.0),
+    'bpm': (int, 20, 300),
+    'octave_add': (int, -3, 3),
+    'velocity_intensity': (float, 0.0, 4.0),
+    'accent_strength': (float, 0.0, 1.0),
+    'delay_time': (float, 0.01, 2.0),
+    'delay_feedback': (float, 0.0, 0.95),
+    'delay_mix': (float, 0.0, 1.0),
+    'delay_repeats': (int, 1, 16),
+    'repeat_count': (int, 1, 8),
+    'humanize_timing': (float, 0.0, 0.1),
+    'humanize_velocity': (int, 0, 64),
+}
+# Parametri a scelta: valori ammessi
+RENDER_CHOICES = {
+    'velocity_curve': ("linear", "exponential", "logarithmic", "sine", "random"),
+    'accent_pattern': ("every_beat", "every_other", "crescendo", "diminuendo", "random"),
+    'delay_type': ("Standard", "Dotted", "Triplet", "Ping-Pong", "Reverse"),
+    'repeat_timing': tuple(REPEAT_TIMING_FACTORS),
+    'voicing': VOICING_TYPES,
+    'chord_variation': CHORD_VARIATIONS,
+    'chord_play_mode': ("arpeggio", "block"),
+}
+RENDER_FLAGS = ('reverse', 'delay_enabled', 'accent_enabled', 'repeater_enabled', 'chord_gen_enabled')
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def parse_flag(name: str, value: str) -> bool:
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f"Valore non valido per {name}: {value}")
+
+
+def parse_render_parameters(query: Dict[str, str]) -> Tuple[Tuple[str, object], ...]:
+    """Parametri di rendering validati, in forma canonica (ordinati per nome)"""
+    parameters = {}
+    for name, value in query.items():
+        if name in RENDER_RANGES:
+            kind, minimum, maximum = RENDER_RANGES[name]
+            try:
+                parsed = kind(value)
+            except ValueError:
+                raise ValueError(f"Valore non valido per {name}: {value}") from None
+            if not minimum <= parsed <= maximum:
+                raise ValueError(f"{name} fuori dall'intervallo {minimum}-{maximum}: {value}")
+        elif name in RENDER_CHOICES:
+            if value not in RENDER_CHOICES[name]:
+                raise ValueError(f"Valore non valido per {name}: {value} "
+                                 f"(ammessi: {', '.join(RENDER_CHOICES[name])})")
+            parsed = value
+        elif name in RENDER_FLAGS:
+            parsed = parse_flag(name, value)
+        else:
+            raise ValueError(f"Parametro sconosciuto: {name}")
+        parameters[name] = parsed
+    return tuple(sorted(parameters.items()))
+
+
+def parse_note_list(spec: str) -> List[int]:
+    """Note da "60,64,67" o "C,E,G" (anche mescolati)"""
+    notes = []
+    for token in filter(None, (part.strip() for part in spec.split(','))):
+        notes.append(int(token) if token.isdigit() else parse_root(token).value)
+    if not notes:
+        raise ValueError("Nessuna nota indicata")
+    return notes
+
+
+@dataclass(frozen=True)
+class RenderRequest:
+    """Richiesta di rendering di un clip: viaggia verso i processi del pool"""
+    root: int
+    level: int
+    position: int
+    pattern: str
+    format: str = 'midi'
+    parameters: Tuple[Tuple[str, object], ...] = ()
+
+    @property
+    def key(self) -> str:
+        return f"render/{self.root}/{self.level}/{self.position}/{self.pattern}/{self.format}/{self.parameters!r}"
+
+    @property
+    def deterministic(self) -> bool:
+        """Vero se lo stesso rendering produce sempre gli stessi byte (cacheabile)"""
+        if PatternType(self.pattern) in RANDOM_PATTERNS:
+            return False
+        return all(stage.deterministic for stage in build_stages(dict(self.parameters)))
+
+    @property
+    def filename(self) -> str:
+        root = note_name(Note(self.root)).replace('#', 's')
+        return f"{root}_{self.level}_{self.position}_{self.pattern}.{RENDER_FORMATS[self.format][1]}"
+
+
+def clip_duration(events: EventBuffer) -> float:
+    """Durata del clip: il loop o l'ultima nota che suona oltre (delay, repeater)"""
+    if not len(events):
+        return float(events.length)
+    return max(float(events.length), float(np.max(events.onsets + events.durations)))
+
+
+def synthesize(events: EventBuffer, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Onde sinusoidali con inviluppo, come l'anteprima pygame; mono, in [-1, 1]"""
+    mix = np.zeros(int(np.ceil(clip_duration(events) * sample_rate)) + 1)
+    fade = int(FADE_SECONDS * sample_rate)
+    for onset, duration, note, velocity, _ in events.iter_events():
+        frames = int(duration * sample_rate)
+        if frames <= 0:
+            continue
+        t = np.arange(frames) / sample_rate
+        frequency = 440.0 * (2 ** ((note - 69) / 12.0))
+        tone = np.sin(2 * np.pi * frequency * t) * np.exp(-t * 2) * (velocity / 127)
+        if frames > 2 * fade:
+            tone[:fade] *= np.linspace(0, 1, fade)
+            tone[-fade:] *= np.linspace(1, 0, fade)
+        start = int(round(onset * sample_rate))
+        segment = mix[start:start + frames]
+        segment += tone[:len(segment)]
+    peak = float(np.max(np.abs(mix)))
+    return mix / peak if peak > 1.0 else mix
+
+
+def wav_bytes(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """File WAV mono a 16 bit"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((samples * 32767 * 0.9).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def midi_bytes(events: EventBuffer, bpm: float) -> bytes:
+    buffer = io.BytesIO()
+    build_midi_file(events, bpm).save(file=buffer)
+    return buffer.getvalue()
+
+
+# Stato di ogni processo del pool: archivio mappato e Pattern Engine (con le sue cache)
+_worker_archive: Optional[ColorTreeArchive] = None
+_worker_engine: Optional[PatternEngine] = None
+
+
+def _init_worker(cache_dir: Optional[str] = None):
+    global _worker_archive
+    # I processi del pool non suonano: nessun dispositivo audio per il mixer di pygame
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    _worker_archive = open_archive(cache_dir)
+
+
+def render_clip(request: RenderRequest) -> bytes:
+    """Renderizza il clip richiesto (gira in un processo del pool)"""
+    global _worker_archive, _worker_engine
+    if _worker_archive is None:
+        _init_worker()
+    if _worker_engine is None:
+        _worker_engine = PatternEngine(MIDIScaleGenerator())
+    index = _worker_archive.find_cell(Note(request.root), request.level, request.position)
+    params = dict(request.parameters)
+    events = _worker_engine.render_pattern_events(sound_cell=_worker_archive.sound_cell(index),
+                                                  pattern_type=PatternType(request.pattern), **params)
+    if clip_duration(events) > MAX_RENDER_SECONDS:
+        raise ValueError(f"Clip troppo lungo: {clip_duration(events):.1f} s (massimo {MAX_RENDER_SECONDS:.0f} s)")
+    if request.format == 'wav':
+        return wav_bytes(synthesize(events))
+    settings = _worker_engine.get_current_parameters()
+    settings.update(params)
+    speed = settings['playback_speed'] if settings['playback_speed'] > 0 else 1.0
+    return midi_bytes(events, settings['bpm'] * speed)
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes = b""
+    content_type: str = "application/json"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+def json_response(data, status: int = 200) -> Response:
+    return Response(status, json.dumps(data, ensure_ascii=False).encode("utf-8"),
+                    "application/json; charset=utf-8")
+
+
+def error_response(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    response = json_response({"error": message}, status)
+    response.headers.update(headers or {})
+    return response
+
+
+def make_etag(key: str) -> str:
+    digest = hashlib.sha1(f"{SERVICE_VERSION}/{ARCHIVE_VERSION}/{key}".encode("utf-8")).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def parse_request_head(head: bytes) -> Tuple[str, str, str, Dict[str, str]]:
+    """Metodo, destinazione, versione e intestazioni (nomi minuscoli) di una richiesta"""
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+        raise ValueError(f"Richiesta non valida: {lines[0][:80]}")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(":")
+        if not separator:
+            raise ValueError(f"Intestazione non valida: {line[:80]}")
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], parts[2], headers
+
+
+class RenderError(ValueError):
+    """Richiesta valida che non si può renderizzare (es. clip troppo lungo)"""
+
+
+# Risorsa risolta da una richiesta: chiave canonica, cacheabilità e funzione che produce la risposta
+Resource = Tuple[str, bool, Callable[[], Awaitable[Response]]]
+
+
+class ColorTreeService:
+    """Servizio HTTP: routing, cache LRU con ETag, richieste in corso condivise e pool di rendering"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, workers: Optional[int] = None,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES, cache_dir: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self.cache_dir = cache_dir
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.archive: Optional[ColorTreeArchive] = None
+
+        self._cache: "OrderedDict[str, Response]" = OrderedDict()
+        self._cached_bytes = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.renders = 0
+
+    async def start(self):
+        """Apre l'archivio, prepara il riconoscitore e avvia pool e socket in ascolto"""
+        loop = asyncio.get_running_loop()
+        self.archive = await loop.run_in_executor(None, open_archive, self.cache_dir)
+        await loop.run_in_executor(None, get_recognizer)
+        # spawn: il processo principale ha già dei thread attivi (loop ed executor)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker, initargs=(self.cache_dir,))
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for pending in list(self._in_flight.values()):
+            pending.cancel()
+        if self.pool:
+            if sys.version_info >= (3, 9):
+                self.pool.shutdown(wait=False, cancel_futures=True)
+            else:
+                # cancel_futures esiste solo da Python 3.9: i rendering in attesa finiscono comunque
+                self.pool.shutdown(wait=False)
+            self.pool = None
+        if self.archive:
+            self.archive.close()
+            self.archive = None
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Servizio Color Tree in ascolto su http://{self.host}:{self.port}")
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    # --- HTTP ---
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve le richieste di una connessione finché il client la tiene aperta"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), READ_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, error_response(431, "Intestazioni troppo grandi"), False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                try:
+                    method, target, version, headers = parse_request_head(head)
+                except ValueError as e:
+                    await self._send(writer, error_response(400, str(e)), False)
+                    break
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" and (version != "HTTP/1.0" or connection == "keep-alive")
+                # Un eventuale corpo non viene letto: la connessione si chiude dopo la risposta
+                if "content-length" in headers or "transfer-encoding" in headers:
+                    keep_alive = False
+                response = await self.handle_request(method, target, headers)
+                await self._send(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _send(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        status = HTTPStatus(response.status)
+        headers = {"Connection": "keep-alive" if keep_alive else "close"}
+        if status != HTTPStatus.NOT_MODIFIED:
+            headers["Content-Type"] = response.content_type
+            headers["Content-Length"] = str(response.size)
+        headers.update(response.headers)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        writer.write(head if status == HTTPStatus.NOT_MODIFIED else head + response.body)
+        await writer.drain()
+
+    async def handle_request(self, method: str, target: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """Risposta a una richiesta (senza socket: usata anche direttamente dai test)"""
+        headers = headers or {}
+        if method != "GET":
+            return error_response(405, f"Metodo non supportato: {method}", {"Allow": "GET"})
+        url = urlsplit(target)
+        path = [unquote(part) for part in url.path.split("/") if part]
+        query = dict(parse_qsl(url.query))
+        try:
+            key, deterministic, produce = self._route(path, query)
+        except LookupError as e:
+            return error_response(404, str(e))
+        except ValueError as e:
+            return error_response(400, str(e))
+        # Da qui la risorsa esiste: un KeyError del rendering è un errore interno, non un 404
+        try:
+            if not deterministic:
+                response = await produce()
+                response.headers["Cache-Control"] = "no-store"
+                return response
+            return await self._cached(key, produce, headers.get("if-none-match", ""))
+        except RenderError as e:
+            return error_response(422, str(e))
+        except ValueError as e:
+            return error_response(400, str(e))
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            print(f"Errore nel servizio Color Tree ({target}): {e}")
+            return error_response(500, "Errore interno del servizio")
+        except Exception as e:  # un errore imprevisto non deve chiudere la connessione senza risposta
+            print(f"Errore imprevisto nel servizio Color Tree ({target}): {type(e).__name__}: {e}")
+            return error_response(500, "Errore interno del servizio")
+
+    async def _cached(self, key: str, produce: Callable[[], Awaitable[Response]], if_none_match: str) -> Response:
+        """Risposta deterministica dalla cache LRU; richieste identiche in corso ne attendono una sola"""
+        etag = make_etag(key)
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(304, headers={"ETag": etag})
+        response = self._cache.get(key)
+        if response is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            pending = self._in_flight.get(key)
+            if pending is None:
+                pending = asyncio.ensure_future(produce())
+                self._in_flight[key] = pending
+                pending.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            response = await asyncio.shield(pending)
+            if response.status == 200:
+                self._store(key, response)
+        headers = dict(response.headers)
+        if response.status == 200:
+            headers.update({"ETag": etag, "Cache-Control": "public, max-age=86400"})
+        else:
+            # Gli errori (es. 503 senza mido) non vanno memorizzati da client e proxy
+            headers["Cache-Control"] = "no-store"
+        return Response(response.status, response.body, response.content_type, headers)
+
+    def _store(self, key: str, response: Response):
+        if key in self._cache or response.size > self.cache_bytes:
+            return
+        self._cache[key] = response
+        self._cached_bytes += response.size
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.size
+
+    # --- Endpoint ---
+
+    def _route(self, path: List[str], query: Dict[str, str]) -> Resource:
+        routes = {"health": (0, self._health), "tree": (1, self._tree), "cell": (3, self._cell),
+                  "recognize": (0, self._recognize), "render": (0, self._render)}
+        if not path or path[0] not in routes or len(path) != routes[path[0]][0] + 1:
+            raise LookupError(f"Risorsa non trovata: /{'/'.join(path)}")
+        return routes[path[0]][1](*path[1:], query=query)
+
+    def _health(self, query: Dict[str, str]) -> Resource:
+        async def produce():
+            return json_response({"status": "ok", "version": SERVICE_VERSION, "archive_version": ARCHIVE_VERSION,
+                                  "cells": len(self.archive), "renders": self.renders,
+                                  "cache": {"entries": len(self._cache), "bytes": self._cached_bytes,
+                                            "hits": self.cache_hits, "misses": self.cache_misses}})
+        return "health", False, produce
+
+    def _tree(self, root_name: str, query: Dict[str, str]) -> Resource:
+        root = parse_root(root_name)
+        levels = parse_levels(query.get("levels", "12"))
+        display = query.get("display", "notes")
+        if display not in ("notes", "intervals"):
+            raise ValueError(f"Modalità di visualizzazione non valida: {display}")
+        with_metrics = parse_flag("metrics", query.get("metrics", "0"))
+
+        async def produce():
+            return json_response([cell_record(cell, display, with_metrics)
+                                  for level in iter_levels([root], levels) for cell in level])
+        return f"tree/{root.value}/{levels}/{display}/{with_metrics}", True, produce
+
+    def _find_cell(self, root: Note, level: int, position: int) -> int:
+        try:
+            return self.archive.find_cell(root, level, position)
+        except ValueError as e:
+            raise LookupError(str(e)) from None
+
+    def _cell(self, root_name: str, level: str, position: str, query: Dict[str, str]) -> Resource:
+        root = parse_root(root_name)
+        try:
+            index = self._find_cell(root, int(level), int(position))
+        except ValueError:
+            raise ValueError(f"Livello o posizione non validi: {level}/{position}") from None
+
+        async def produce():
+            record = cell_record(self.archive.sound_cell(index), "notes", True)
+            record["voicings"] = {voicing: [list(notes) for notes in self.archive.cell_voicings(index, voicing)]
+                                  for voicing in VOICING_TYPES}
+            return json_response(record)
+        return f"cell/{index}", True, produce
+
+    def _recognize(self, query: Dict[str, str]) -> Resource:
+        mask = notes_to_mask(parse_note_list(query.get("notes", "")))
+
+        async def produce():
+            recognition = get_recognizer().recognize_mask(mask)
+            return json_response({"mask": mask, "matched": recognition.matched, "distance": recognition.distance,
+                                  "exact": [cell_record(cell, "notes", False) for cell in recognition.exact],
+                                  "nearest": [cell_record(cell, "notes", False) for cell in recognition.nearest]})
+        # La risposta dipende solo dalla maschera: "C,E,G" e "60,64,67" condividono la cache
+        return f"recognize/{mask}", True, produce
+
+    def _render(self, query: Dict[str, str]) -> Resource:
+        query = dict(query)
+        root_name, _, rest = query.pop("cell", "").partition(":")
+        level, _, position = rest.partition(":")
+        if not root_name or not level.isdigit() or not position.isdigit():
+            raise ValueError("Cella non valida: usare cell=ROOT:LIVELLO:POSIZIONE (es. C:3:0)")
+        root = parse_root(root_name)
+        self._find_cell(root, int(level), int(position))
+        pattern = query.pop("pattern", PatternType.UP.value)
+        try:
+            PatternType(pattern)
+        except ValueError:
+            raise ValueError(f"Pattern sconosciuto: {pattern}") from None
+        format_type = query.pop("format", "midi")
+        if format_type not in RENDER_FORMATS:
+            raise ValueError(f"Formato non valido: {format_type} (ammessi: {', '.join(RENDER_FORMATS)})")
+        request = RenderRequest(root.value, int(level), int(position), pattern, format_type,
+                                parse_render_parameters(query))
+
+        async def produce():
+            if format_type == 'midi' and not MIDI_AVAILABLE:
+                return error_response(503, "mido non disponibile: impossibile generare file MIDI")
+            try:
+                body = await asyncio.get_running_loop().run_in_executor(self.pool, render_clip, request)
+            except ValueError as e:
+                raise RenderError(str(e)) from None
+            self.renders += 1
+            return Response(200, body, RENDER_FORMATS[format_type][0],
+                            {"Content-Disposition": f'attachment; filename="{request.filename}"'})
+        return request.key, request.deterministic, produce
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Servizio HTTP per le Color Tree e i clip MIDI/WAV")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"), help="Indirizzo di ascolto")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", DEFAULT_PORT)),
+                        help="Porta di ascolto (default: variabile PORT o 8000)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processi per i rendering (default: numero di CPU)")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="Dimensione massima della cache delle risposte in MB")
+    args = parser.parse_args(argv)
+
+    service = ColorTreeService(args.host, args.port, args.workers, args.cache_mb * 1024 * 1024)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Errore nell'avvio del servizio: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,7 +3,8 @@ Esempio di integrazione del Chord Generator in altri progetti
 Mostra come usare le classi principali per creare funzionalità personalizzate
 """
 
-from chord_generator import ChordGenerator, Note, Chord
+from chord_generator import ChordGenerator, Note, Chord, SoundCell
+from chord_recognition import get_recognizer
 from typing import List, Dict
 
 class CustomChordAnalyzer:
@@ -21,17 +22,9 @@ class CustomChordAnalyzer:
             'interval_count': len(chord.get_intervals())
         }
     
-    def find_chord_by_notes(self, target_notes: List[Note], root: Note = Note.C) -> List[Chord]:
-        """Trova accordi che contengono le note specificate"""
-        levels = self.generator.generate_triangular_chords(root)
-        matching_chords = []
-        
-        for level in levels:
-            for chord in level:
-                if all(note in chord.notes for note in target_notes):
-                    matching_chords.append(chord)
-        
-        return matching_chords
+    def find_chord_by_notes(self, target_notes: List[Note], root: Note = Note.C) -> List[SoundCell]:
+        """Trova le sound cells che contengono le note specificate"""
+        return get_recognizer().containing(target_notes, root)
     
     def generate_chord_progression(self, root: Note, level: int) -> List[Chord]:
         """Genera una progressione di accordi per un livello specifico"""
@@ -0,0 +1,145 @@
+"""
+Riconoscimento in streaming della tonalità dall'input MIDI
+Istogramma delle classi di altezza con decadimento esponenziale, correlato con le 24 rotazioni
+dei profili di Krumhansl-Kessler con un solo prodotto matrice-vettore per messaggio; il cambio
+di tonalità viene confermato solo dopo un tempo minimo (debounce)
+"""
+
+import math
+import queue
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, List, Optional
+import numpy as np
+from chord_generator import Note
+
+
+# Profili di Krumhansl-Kessler (Do maggiore e Do minore)
+MAJOR_PROFILE = (6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88)
+MINOR_PROFILE = (6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17)
+MODES = ("major", "minor")
+
+# Tempo di dimezzamento del peso delle note (secondi)
+DEFAULT_HALF_LIFE = 4.0
+
+# Tempo per cui una nuova tonalità deve restare la migliore prima di essere adottata (secondi)
+DEFAULT_DEBOUNCE = 0.75
+
+# Vantaggio minimo di correlazione sulla tonalità corrente per cambiarla
+DEFAULT_MARGIN = 0.05
+
+
+def _profile_matrix() -> np.ndarray:
+    """Le 24 rotazioni dei profili, centrate e normalizzate (righe: maggiori poi minori)"""
+    rows = [np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)]
+    matrix = np.array(rows, dtype=np.float64)
+    matrix -= matrix.mean(axis=1, keepdims=True)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+PROFILES = _profile_matrix()
+
+
+@dataclass
+class KeyEstimate:
+    """Tonalità stimata con la sua correlazione"""
+    tonic: Note
+    mode: str
+    score: float
+    timestamp: float
+
+    @property
+    def name(self) -> str:
+        return f"{self.tonic.name.replace('_SHARP', '#')} {self.mode}"
+
+
+class KeyDetector:
+    """Stima della tonalità aggiornata a ogni NOTE ON (thread di input)"""
+
+    def __init__(self, half_life: float = DEFAULT_HALF_LIFE, debounce: float = DEFAULT_DEBOUNCE,
+                 margin: float = DEFAULT_MARGIN, clock: Callable[[], float] = time.perf_counter):
+        self.half_life = half_life
+        self.debounce = debounce
+        self.margin = margin
+        self.clock = clock
+        self.histogram = np.zeros(12)
+        self.scores = np.zeros(len(PROFILES))
+        self.key: Optional[KeyEstimate] = None
+        self._last_time: Optional[float] = None
+        self._candidate: Optional[int] = None
+        self._candidate_since = 0.0
+        self.lock = threading.Lock()
+
+        # Coda verso la GUI e listener chiamati sul thread di input ai cambi di tonalità
+        self.updates: "queue.SimpleQueue[KeyEstimate]" = queue.SimpleQueue()
+        self.listeners: List[Callable[[KeyEstimate], None]] = []
+
+    def reset(self):
+        with self.lock:
+            self.histogram[:] = 0.0
+            self.scores[:] = 0.0
+            self.key = None
+            self._last_time = None
+            self._candidate = None
+
+    def handle_message(self, message, timestamp: Optional[float] = None):
+        """Listener dei messaggi MIDI: ogni NOTE ON pesa in base alla velocity"""
+        if message.type == 'note_on' and message.velocity > 0:
+            self.add_note(message.note, message.velocity / 127.0, timestamp)
+
+    def add_note(self, note: int, weight: float = 1.0, timestamp: Optional[float] = None):
+        """Aggiunge una nota all'istogramma e aggiorna la stima"""
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self.lock:
+            if self._last_time is not None and timestamp > self._last_time:
+                self.histogram *= math.pow(0.5, (timestamp - self._last_time) / self.half_life)
+            self._last_time = timestamp
+            self.histogram[note % 12] += weight
+            changed = self._update(timestamp)
+        if changed is not None:
+            self.updates.put(changed)
+            for listener in list(self.listeners):
+                try:
+                    listener(changed)
+                except (RuntimeError, ValueError, AttributeError) as e:
+                    print(f"Errore nel listener della tonalità: {e}")
+
+    def _update(self, timestamp: float) -> Optional[KeyEstimate]:
+        """Correlazione con i 24 profili; restituisce la nuova tonalità se viene adottata"""
+        centered = self.histogram - self.histogram.mean()
+        norm = math.sqrt(float(centered @ centered))
+        if norm == 0.0:
+            return None
+        # Correlazione di Pearson con tutte le tonalità in un solo prodotto
+        np.dot(PROFILES, centered, out=self.scores)
+        self.scores /= norm
+        best = int(self.scores.argmax())
+
+        current = None if self.key is None else MODES.index(self.key.mode) * 12 + self.key.tonic.value
+        if best == current:
+            self._candidate = None
+            # La stima già passata ai listener e alla coda non va modificata: se ne crea una nuova
+            self.key = replace(self.key, score=float(self.scores[best]))
+            return None
+        if best != self._candidate:
+            self._candidate = best
+            self._candidate_since = timestamp
+        if timestamp - self._candidate_since < self.debounce:
+            return None
+        if current is not None and self.scores[best] - self.scores[current] < self.margin:
+            return None
+
+        self._candidate = None
+        self.key = KeyEstimate(Note(best % 12), MODES[best // 12], float(self.scores[best]), timestamp)
+        return self.key
+
+    def drain_updates(self) -> Optional[KeyEstimate]:
+        """Svuota la coda e restituisce solo l'ultima tonalità adottata"""
+        latest = None
+        while True:
+            try:
+                latest = self.updates.get_nowait()
+            except queue.Empty:
+                return latest
@@ -0,0 +1,174 @@
+"""
+Arpeggiatore guidato da una tastiera MIDI
+Le note tenute sulla porta di ingresso diventano l'accordo attivo del PatternEngine: il pattern
+e la catena di effetti correnti le arpeggiano dal vivo. I cambi di note entrano nel loop in
+corso al passo successivo, senza riavviarlo; con il latch l'accordo resta dopo il rilascio.
+"""
+
+import threading
+from collections import deque
+from typing import Optional, Tuple
+import numpy as np
+from midi_input import HeldChord, MIDIInput
+from pattern_engine import PatternEngine, PatternLoopSource, PatternType, PendingChange, NOTE_ON
+from scheduler import GRID_EPSILON, LookaheadScheduler
+
+
+# Latenze conservate per il report
+LATENCY_HISTORY = 256
+
+# Finestra di anticipo dello scheduler suonando dalla tastiera: i cambi di note entrano al primo
+# passo non ancora programmato, quindi la latenza massima è questa finestra più un passo
+KEYBOARD_LOOKAHEAD = 0.02
+
+
+class LatencyMonitor:
+    """Latenze tra l'arrivo di un messaggio MIDI e la prima nota suonata con il nuovo accordo"""
+
+    def __init__(self, size: int = LATENCY_HISTORY):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self.lock:
+            self.samples.append(latency)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def report(self) -> dict:
+        """Statistiche in millisecondi sulle ultime latenze misurate"""
+        with self.lock:
+            samples = np.array(self.samples) * 1000.0
+        if not len(samples):
+            return {'count': 0}
+        return {
+            'count': len(samples),
+            'last_ms': float(samples[-1]),
+            'mean_ms': float(samples.mean()),
+            'p95_ms': float(np.percentile(samples, 95)),
+            'max_ms': float(samples.max())
+        }
+
+
+class KeyboardLoopSource(PatternLoopSource):
+    """Loop del PatternEngine che segnala le note suonate all'arpeggiatore"""
+
+    def __init__(self, engine: PatternEngine, arpeggiator: 'KeyboardArpeggiator'):
+        super().__init__(engine, loop=True)
+        self.arpeggiator = arpeggiator
+
+    def dispatch(self, scheduler: LookaheadScheduler, due: float, kind: int, payload: tuple):
+        super().dispatch(scheduler, due, kind, payload)
+        if kind == NOTE_ON:
+            self.arpeggiator.note_played(due)
+
+
+class KeyboardArpeggiator:
+    """Modalità in cui le note tenute su una porta MIDI sono l'accordo da arpeggiare"""
+
+    def __init__(self, engine: PatternEngine, midi_input: MIDIInput, latch: bool = False,
+                 lookahead: float = KEYBOARD_LOOKAHEAD):
+        self.engine = engine
+        self.midi_input = midi_input
+        self.latch = latch
+        self.lookahead = lookahead
+        self.enabled = False
+        self.chord: Tuple[int, ...] = ()
+        self.latency = LatencyMonitor()
+        self._keys_down = False
+        # Istante di input e cambio in attesa di cui misurare la latenza
+        self._pending_input: Optional[Tuple[float, Optional[PendingChange]]] = None
+        self.lock = threading.Lock()
+
+    def enable(self):
+        """Attiva la modalità: la prossima nota premuta avvia l'arpeggio"""
+        if self.enabled:
+            return
+        if self.engine.current_pattern_type is None:
+            self.engine.update_parameters(pattern_type=PatternType.UP)
+        self.enabled = True
+        self.midi_input.listeners.append(self.handle_update)
+
+    def disable(self):
+        """Disattiva la modalità, ferma l'arpeggio e torna alle note della sound cell"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.handle_update in self.midi_input.listeners:
+            self.midi_input.listeners.remove(self.handle_update)
+        with self.lock:
+            self.chord = ()
+            self._keys_down = False
+            self._pending_input = None
+        self.engine.stop_pattern()
+        self.engine.update_parameters(input_notes=())
+
+    def set_latch(self, latch: bool):
+        """Con il latch l'accordo resta attivo dopo il rilascio di tutti i tasti"""
+        self.latch = latch
+        if not latch and not self.midi_input.held_notes:
+            self._set_chord((), self.midi_input.clock())
+
+    def handle_update(self, update: HeldChord):
+        """Listener dell'input MIDI (thread di input)"""
+        if not self.enabled:
+            return
+        notes = update.notes
+        if notes:
+            # Con il latch le note aggiunte mentre si tiene l'accordo si sommano
+            if self.latch and self._keys_down:
+                notes = tuple(sorted(set(self.chord) | set(notes)))
+            self._keys_down = True
+        else:
+            self._keys_down = False
+            if self.latch:
+                return
+        self._set_chord(notes, update.timestamp)
+
+    def _set_chord(self, notes: Tuple[int, ...], timestamp: float):
+        with self.lock:
+            if notes == self.chord:
+                return
+            self.chord = notes
+            self._pending_input = None
+        if not notes:
+            # Fuori dal lock: lo stop attende il thread di riproduzione, che chiama note_played
+            self.engine.stop_pattern()
+            return
+
+        # La cella riconosciuta dà nome all'accordo; le note suonate sono quelle tenute
+        recognition = self.midi_input.recognizer.recognize(notes)
+        sound_cell = (recognition.exact or recognition.nearest)[0]
+        if self.engine.is_playing:
+            change = self.engine.schedule_parameters(quantize="step", sound_cell=sound_cell,
+                                                     input_notes=notes)
+            with self.lock:
+                self._pending_input = (timestamp, change)
+        else:
+            self.engine.update_parameters(sound_cell=sound_cell, input_notes=notes)
+            self.engine.reset_playback_state(loop=True)
+            with self.lock:
+                self._pending_input = (timestamp, None)
+            lookahead, self.engine.lookahead = self.engine.lookahead, self.lookahead
+            try:
+                self.engine.play_source(KeyboardLoopSource(self.engine, self))
+            finally:
+                self.engine.lookahead = lookahead
+
+    def note_played(self, due: float):
+        """Chiamato dalla sorgente per ogni NOTE ON: chiude la misura di latenza in corso"""
+        now = self.midi_input.clock()
+        with self.lock:
+            if self._pending_input is None:
+                return
+            timestamp, change = self._pending_input
+            if change is not None and (change.due is None or due < change.due - GRID_EPSILON):
+                return
+            self._pending_input = None
+        self.latency.add(max(0.0, now - timestamp))
+
+    def latency_report(self) -> dict:
+        """Report delle latenze input -> output in millisecondi"""
+        return self.latency.report()
@@ -0,0 +1,241 @@
+"""
+Metriche di riproduzione a basso costo
+Istogrammi di ritardo in stile HDR (bucket log-lineari a precisione costante), contatori di
+frequenza su finestra scorrevole ed esposizione in JSON, anche su un endpoint HTTP locale.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+
+# Valore massimo registrato dagli istogrammi (microsecondi); oltre viene limitato
+MAX_LATENCY_US = 60_000_000
+# Bit di sotto-bucket per ottava: 5 = 32 bucket, errore relativo sotto il 3%
+SUB_BUCKET_BITS = 5
+# Finestra dei contatori di frequenza (secondi)
+RATE_WINDOW = 10
+# Porta di default dell'endpoint delle metriche
+METRICS_PORT = 9100
+METRICS_PATH = "/metrics"
+# Percentili riportati negli snapshot
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """Istogramma a bucket log-lineari: registrazione O(1) in una lista preallocata
+
+    I valori sotto 2 * 2^SUB_BUCKET_BITS hanno bucket esatti; sopra, ogni ottava è divisa in
+    2^SUB_BUCKET_BITS bucket, quindi la precisione relativa è costante su tutto l'intervallo.
+    """
+
+    def __init__(self, max_value: int = MAX_LATENCY_US, sub_bucket_bits: int = SUB_BUCKET_BITS):
+        self.max_value = max_value
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.counts: List[int] = [0] * (self.bucket_index(max_value) + 1)
+        self.reset()
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def bucket_index(self, value: int) -> int:
+        """Bucket di un valore intero non negativo"""
+        if value < 2 * self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        return shift * self.sub_buckets + (value >> shift)
+
+    def bucket_range(self, index: int) -> tuple:
+        """Valori minimo e massimo rappresentati da un bucket"""
+        if index < 2 * self.sub_buckets:
+            return index, index
+        shift = index // self.sub_buckets - 1
+        lower = (index - shift * self.sub_buckets) << shift
+        return lower, lower + (1 << shift) - 1
+
+    def record(self, value: int):
+        """Registra un valore (negativi contati come 0, oltre il massimo limitati)"""
+        value = min(max(int(value), 0), self.max_value)
+        self.counts[self.bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """Somma un altro istogramma con la stessa configurazione"""
+        if (other.max_value, other.sub_bucket_bits) != (self.max_value, self.sub_bucket_bits):
+            raise ValueError("Istogrammi con configurazioni diverse")
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> int:
+        """Valore sotto cui cade la percentuale indicata dei campioni (estremo superiore del bucket)"""
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_range(index)[1], self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self) -> dict:
+        """Riepilogo: conteggio, minimo, media, massimo e percentili"""
+        summary = {'count': self.count, 'min': self.min or 0, 'mean': round(self.mean, 1), 'max': self.max}
+        for percentile in PERCENTILES:
+            summary[f"p{percentile:g}"] = self.percentile(percentile)
+        return summary
+
+
+class RateMeter:
+    """Eventi al secondo su una finestra scorrevole di bucket da un secondo"""
+
+    def __init__(self, window: int = RATE_WINDOW, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.total = 0
+        self._counts = [0] * window
+        self._seconds = [-1] * window
+        self._started: Optional[float] = None
+
+    def record(self, count: int = 1):
+        now = self.clock()
+        if self._started is None:
+            self._started = now
+        second = int(now)
+        slot = second % self.window
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._counts[slot] = 0
+        self._counts[slot] += count
+        self.total += count
+
+    def rate(self) -> float:
+        """Frequenza media nella finestra (o dal primo evento, se più recente)"""
+        if self._started is None:
+            return 0.0
+        now = self.clock()
+        oldest = int(now) - self.window
+        recent = sum(count for count, second in zip(self._counts, self._seconds) if second > oldest)
+        elapsed = min(float(self.window), now - self._started)
+        return recent / elapsed if elapsed > 0 else float(recent)
+
+
+class PlaybackMetrics:
+    """Ritardo di invio e frequenza degli eventi registrati dallo scheduler durante la riproduzione"""
+
+    def __init__(self):
+        self.lateness = LatencyHistogram()
+        self.events = RateMeter()
+
+    def record_dispatch(self, lateness: float):
+        """Evento inviato con lateness secondi di ritardo rispetto all'istante programmato"""
+        self.lateness.record(lateness * 1_000_000)
+        self.events.record()
+
+    def reset(self):
+        self.lateness.reset()
+        self.events = RateMeter()
+
+    def as_dict(self) -> dict:
+        return {'lateness_us': self.lateness.as_dict(),
+                'events': {'dispatched': self.events.total, 'per_second': round(self.events.rate(), 2)}}
+
+
+def cache_stats(hits: int, misses: int, size: Optional[int] = None) -> dict:
+    """Riepilogo di una cache con il tasso di successo"""
+    lookups = hits + misses
+    stats = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / lookups, 4) if lookups else 0.0}
+    if size is not None:
+        stats['size'] = size
+    return stats
+
+
+def write_json(snapshot: dict, path: str):
+    """Scrive uno snapshot delle metriche in JSON (scrittura atomica)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file, indent=2)
+        os.replace(temporary, path)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class MetricsServer:
+    """Endpoint HTTP locale che restituisce in JSON lo snapshot fornito da source()"""
+
+    def __init__(self, source: Callable[[], dict], host: str = "127.0.0.1", port: int = METRICS_PORT):
+        self.source = source
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _handler(self):
+        source = self.source
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != METRICS_PATH:
+                    self._reply(404, {'error': f"Risorsa non trovata: {self.path}"})
+                    return
+                self._reply(200, source())
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # nessun log per ogni richiesta
+
+        return Handler
+
+    def start(self) -> int:
+        """Avvia il server in un thread; restituisce la porta effettiva"""
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
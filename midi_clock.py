@@ -0,0 +1,240 @@
+"""
+Sincronizzazione MIDI Clock
+Emissione del Timing Clock (24 PPQN) con Start/Stop/Continue e inseguimento di un clock
+esterno tramite un estimatore ad aggancio di fase (PLL)
+"""
+
+import threading
+import time
+from typing import Callable, Optional
+from scheduler import EventSource, LookaheadScheduler
+
+try:
+    import mido
+    MIDI_AVAILABLE = True
+except ImportError:
+    MIDI_AVAILABLE = False
+
+
+# Impulsi di clock per semiminima previsti dallo standard MIDI
+PPQN = 24
+
+# Tipi di evento del clock nella timeline (precedono le note allo stesso istante)
+CLOCK_TICK = 0
+CLOCK_START = -1
+
+# Guadagni di default del PLL: correzione di fase e di periodo per ogni impulso
+DEFAULT_PHASE_GAIN = 0.1
+DEFAULT_PERIOD_GAIN = 0.01
+
+
+def tick_interval(bpm: float, ppqn: int = PPQN) -> float:
+    """Intervallo tra due impulsi di clock in secondi"""
+    return 60.0 / (max(bpm, 1) * ppqn)
+
+
+class MidiClockSource(EventSource):
+    """Emette il MIDI Timing Clock sulla timeline dello scheduler"""
+
+    # Il clock accompagna le altre sorgenti ma non tiene in vita lo scheduler
+    keeps_alive = False
+
+    def __init__(self, midi_output, bpm: Callable[[], float], start_message: str = "start"):
+        self.midi_output = midi_output
+        self.bpm = bpm
+        self.start_message = start_message  # "start" o "continue"
+        self.next_tick: Optional[float] = None
+        self.ticks_sent = 0
+
+    def fill(self, scheduler: LookaheadScheduler, horizon: float) -> bool:
+        if self.next_tick is None:
+            self.next_tick = scheduler.origin
+            scheduler.push(self.next_tick, CLOCK_START, self)
+        # L'intervallo segue il BPM corrente, senza salti di fase ai cambi di tempo
+        while self.next_tick <= horizon:
+            scheduler.push(self.next_tick, CLOCK_TICK, self)
+            self.next_tick += tick_interval(self.bpm())
+        return False
+
+    def rewind(self):
+        # Nuovo Start alla nuova origine
+        self.next_tick = None
+        self.start_message = "start"
+
+    def dispatch(self, scheduler: LookaheadScheduler, due: float, kind: int, payload: tuple):
+        if kind == CLOCK_START:
+            if self.start_message == "continue":
+                self.midi_output.send_continue()
+            else:
+                self.midi_output.send_start()
+        else:
+            self.midi_output.send_clock()
+            self.ticks_sent += 1
+
+
+class ClockPLL:
+    """Estimatore ad aggancio di fase per un clock MIDI esterno
+
+    Ogni impulso corregge la fase prevista di una frazione dell'errore e il periodo di una
+    frazione più piccola, così il jitter di arrivo viene filtrato e la deriva inseguita.
+    """
+
+    def __init__(self, ppqn: int = PPQN, phase_gain: float = DEFAULT_PHASE_GAIN,
+                 period_gain: float = DEFAULT_PERIOD_GAIN, initial_bpm: float = 120):
+        self.ppqn = ppqn
+        self.phase_gain = phase_gain
+        self.period_gain = period_gain
+        self.initial_bpm = initial_bpm
+        self.reset()
+
+    def reset(self, initial_bpm: Optional[float] = None):
+        """Azzera lo stato (nuovo Start)"""
+        if initial_bpm is not None:
+            self.initial_bpm = initial_bpm
+        self.period = tick_interval(self.initial_bpm, self.ppqn)
+        self.count = -1  # indice dell'ultimo impulso ricevuto
+        self.predicted: Optional[float] = None  # istante stimato dell'ultimo impulso
+        self._first_tick: Optional[float] = None
+        self.paused = False
+
+    def pause(self):
+        """Stop: la posizione resta ferma all'ultimo impulso e la fase va riagganciata"""
+        self.paused = True
+
+    @property
+    def locked(self) -> bool:
+        """True dopo il primo impulso ricevuto"""
+        return self.predicted is not None
+
+    @property
+    def bpm(self) -> float:
+        """Tempo stimato"""
+        return 60.0 / (self.period * self.ppqn)
+
+    def tick(self, timestamp: float) -> float:
+        """Registra un impulso ricevuto all'istante indicato; restituisce l'errore di fase"""
+        self.count += 1
+        if self.predicted is None:
+            self.predicted = self._first_tick = timestamp
+            return 0.0
+        if self.paused:
+            # Primo impulso dopo un Continue: nuova fase, il periodo stimato resta valido
+            self.paused = False
+            self.predicted = timestamp
+            return 0.0
+        if self.count == 1:
+            # Il secondo impulso dà la prima stima del periodo
+            self.period = max(timestamp - self._first_tick, 1e-4)
+            self.predicted = timestamp
+            return 0.0
+        expected = self.predicted + self.period
+        error = timestamp - expected
+        # Limita la correzione a mezzo periodo: un impulso perso non sposta la stima di colpo
+        limit = self.period / 2
+        correction = min(max(error, -limit), limit)
+        self.period = max(self.period + self.period_gain * correction, 1e-4)
+        self.predicted = expected + self.phase_gain * correction
+        return error
+
+    def ticks_at(self, timestamp: float) -> float:
+        """Posizione in impulsi (frazionaria) all'istante indicato"""
+        if self.predicted is None:
+            return 0.0
+        if self.paused:
+            return float(self.count)
+        return self.count + (timestamp - self.predicted) / self.period
+
+    def time_of(self, ticks: float) -> float:
+        """Istante stimato della posizione in impulsi indicata"""
+        if self.predicted is None or self.paused:
+            return float('inf')
+        return self.predicted + (ticks - self.count) * self.period
+
+
+class ExternalClockFollower:
+    """Segue il clock di una porta MIDI in ingresso e fa da timebase per lo scheduler
+
+    La timeline dello scheduler è espressa in secondi al BPM nominale del pattern: una
+    semiminima nominale corrisponde sempre a 24 impulsi del clock esterno.
+    """
+
+    def __init__(self, nominal_bpm: Callable[[], float], ppqn: int = PPQN,
+                 phase_gain: float = DEFAULT_PHASE_GAIN, period_gain: float = DEFAULT_PERIOD_GAIN,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.nominal_bpm = nominal_bpm
+        self.clock = clock
+        self.pll = ClockPLL(ppqn, phase_gain, period_gain, nominal_bpm())
+        self.running = False
+        self.input_port = None
+        self.port_name: Optional[str] = None
+        self.lock = threading.Lock()
+        self.on_start: Optional[Callable[[], None]] = None
+        self.on_stop: Optional[Callable[[], None]] = None
+
+    def open(self, port_name: Optional[str] = None) -> bool:
+        """Apre la porta di ingresso (di default la prima disponibile)"""
+        if not MIDI_AVAILABLE:
+            return False
+        try:
+            names = mido.get_input_names()
+            if port_name is None and names:
+                port_name = names[0]
+            if port_name not in names:
+                return False
+            self.close()
+            self.input_port = mido.open_input(port_name, callback=self.handle_message)
+            self.port_name = port_name
+            return True
+        except (OSError, RuntimeError, AttributeError) as e:
+            print(f"Errore nell'apertura della porta MIDI in ingresso {port_name}: {e}")
+            return False
+
+    def close(self):
+        """Chiude la porta di ingresso"""
+        if self.input_port:
+            try:
+                self.input_port.close()
+            except (OSError, RuntimeError, AttributeError):
+                pass
+        self.input_port = None
+        self.port_name = None
+
+    def handle_message(self, message, timestamp: Optional[float] = None):
+        """Gestisce clock, start, stop e continue in arrivo"""
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self.lock:
+            if message.type == 'clock':
+                if self.running:
+                    self.pll.tick(timestamp)
+            elif message.type == 'start':
+                self.pll.reset(self.nominal_bpm())
+                self.running = True
+            elif message.type == 'continue':
+                self.running = True
+            elif message.type == 'stop':
+                self.running = False
+                self.pll.pause()
+        if message.type == 'start' and self.on_start:
+            self.on_start()
+        elif message.type == 'stop' and self.on_stop:
+            self.on_stop()
+
+    @property
+    def bpm(self) -> float:
+        """Tempo esterno stimato"""
+        return self.pll.bpm
+
+    def _seconds_per_tick(self) -> float:
+        return tick_interval(self.nominal_bpm(), self.pll.ppqn)
+
+    def position(self, wall_time: float) -> float:
+        """Posizione sulla timeline dello scheduler all'istante indicato"""
+        with self.lock:
+            return self.pll.ticks_at(wall_time) * self._seconds_per_tick()
+
+    def wall_time(self, position: float) -> float:
+        """Istante previsto per una posizione della timeline (inf se il clock è fermo)"""
+        with self.lock:
+            if not self.running or not self.pll.locked:
+                return float('inf')
+            return self.pll.time_of(position / self._seconds_per_tick())
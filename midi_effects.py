@@ -0,0 +1,507 @@
+"""
+Catena di effetti MIDI per il Pattern Engine
+Ogni stadio trasforma un intero buffer di eventi compilato in un'unica operazione
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from tracing import trace_span, traced
+
+
+@dataclass
+class EventBuffer:
+    """Buffer di eventi compilato: array paralleli con un elemento per nota"""
+    onsets: np.ndarray      # inizio della nota in secondi dall'inizio del loop
+    durations: np.ndarray   # durata del gate in secondi
+    notes: np.ndarray       # numeri di nota MIDI (0-127)
+    velocities: np.ndarray  # velocity MIDI (1-127)
+    steps: np.ndarray       # indice del passo del pattern che ha generato l'evento
+    length: float = 0.0     # durata del loop in secondi
+    total_steps: int = 0    # numero di passi del pattern compilato
+    key: Optional[tuple] = None  # chiave di cache, None se il contenuto è casuale
+
+    @classmethod
+    def from_events(cls, onsets: Sequence[float], durations: Sequence[float],
+                    notes: Sequence[int], velocities: Sequence[int],
+                    length: float, key: Optional[tuple] = None,
+                    steps: Optional[Sequence[int]] = None,
+                    total_steps: Optional[int] = None) -> 'EventBuffer':
+        """Crea un buffer da sequenze Python; senza steps ogni evento è un passo a sé"""
+        count = len(notes)
+        if steps is None:
+            steps = range(count)
+        return cls(
+            onsets=np.asarray(onsets, dtype=np.float64),
+            durations=np.asarray(durations, dtype=np.float64),
+            notes=np.clip(np.asarray(notes, dtype=np.int16), 0, 127),
+            velocities=np.clip(np.asarray(velocities, dtype=np.int16), 1, 127),
+            steps=np.asarray(steps, dtype=np.int32),
+            length=float(length),
+            total_steps=count if total_steps is None else total_steps,
+            key=key
+        )
+
+    @classmethod
+    def empty(cls) -> 'EventBuffer':
+        """Restituisce un buffer vuoto"""
+        return cls.from_events([], [], [], [], 0.0)
+
+    def __len__(self) -> int:
+        return int(self.notes.shape[0])
+
+    def take(self, indices: np.ndarray) -> 'EventBuffer':
+        """Restituisce un nuovo buffer con gli eventi agli indici indicati"""
+        return replace(self,
+                       onsets=self.onsets[indices],
+                       durations=self.durations[indices],
+                       notes=self.notes[indices],
+                       velocities=self.velocities[indices],
+                       steps=self.steps[indices])
+
+    def sorted(self) -> 'EventBuffer':
+        """Ordina gli eventi per onset (ordinamento stabile)"""
+        return self.take(np.argsort(self.onsets, kind='stable'))
+
+    def iter_events(self) -> Iterable[tuple]:
+        """Itera sugli eventi come tuple (onset, durata, nota, velocity, passo)"""
+        return zip(self.onsets.tolist(), self.durations.tolist(), self.notes.tolist(),
+                   self.velocities.tolist(), self.steps.tolist())
+
+
+class EffectStage:
+    """Stadio base della catena: trasforma un buffer intero"""
+    name = "stage"
+
+    @property
+    def deterministic(self) -> bool:
+        """True se lo stesso input produce sempre lo stesso output (cacheabile)"""
+        return True
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        raise NotImplementedError
+
+
+def _normalized_positions(total_steps: int) -> np.ndarray:
+    """Posizioni normalizzate (0-1) dei passi di un pattern"""
+    if total_steps <= 1:
+        return np.zeros(max(1, total_steps), dtype=np.float64)
+    return np.arange(total_steps, dtype=np.float64) / (total_steps - 1)
+
+
+def _clip_velocities(values: np.ndarray) -> np.ndarray:
+    return np.clip(values.astype(np.int64), 1, 127).astype(np.int16)
+
+
+# Alias dei nomi di curva usati dall'interfaccia grafica
+VELOCITY_CURVE_ALIASES = {"exp": "exponential", "log": "logarithmic"}
+
+
+def _curve_factors(curve: str, intensity: float, normalized: np.ndarray) -> np.ndarray:
+    """Fattore di curva (0-1) per ogni posizione normalizzata (curve deterministiche)"""
+    curve = VELOCITY_CURVE_ALIASES.get(curve, curve)
+    intensity = max(intensity, 1e-6)
+    if curve == "exponential":
+        return normalized ** (1 / intensity)
+    elif curve == "logarithmic":
+        return normalized ** intensity
+    elif curve == "sine":
+        return (np.sin(normalized * np.pi) + 1) / 2
+    return normalized
+
+
+def _accent_factors(pattern: str, strength: float, steps: np.ndarray,
+                    normalized: np.ndarray) -> np.ndarray:
+    """Moltiplicatore di accento per ogni passo (pattern deterministici)"""
+    if pattern == "every_beat":
+        return np.full(steps.shape, 1.0 + strength)
+    elif pattern == "every_other":
+        return 1.0 + strength * (steps % 2 == 0)
+    elif pattern == "crescendo":
+        return 1.0 + strength * normalized
+    elif pattern == "diminuendo":
+        return 1.0 + strength * (1 - normalized)
+    return np.ones(steps.shape)
+
+
+class VelocityTableCache:
+    """Cache di tabelle di velocity: per ogni passo, 128 velocity di uscita
+
+    Una tabella (passi x 128) trasforma la velocity di ingresso di ogni evento con
+    un semplice gather, senza ricalcolare curve o accenti durante la riproduzione.
+    """
+
+    def __init__(self, max_tables: int = 128):
+        self.max_tables = max_tables
+        self._tables: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _build(factors: np.ndarray) -> np.ndarray:
+        """Costruisce la tabella moltiplicando ogni velocity (0-127) per il fattore del passo"""
+        values = np.arange(128, dtype=np.float64)[np.newaxis, :] * factors[:, np.newaxis]
+        return np.clip(values.astype(np.int64), 1, 127).astype(np.uint8)
+
+    def _get(self, key: tuple, builder: Callable[[], np.ndarray]) -> np.ndarray:
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+        table = builder()
+        with self._lock:
+            self._tables[key] = table
+            if len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
+
+    def curve_table(self, curve: str, intensity: float, total_steps: int) -> np.ndarray:
+        """Tabella per (tipo di curva, intensità, numero di passi)"""
+        def builder():
+            normalized = _normalized_positions(total_steps)
+            return self._build(_curve_factors(curve, intensity, normalized) * intensity)
+        return self._get(('curve', curve, intensity, total_steps), builder)
+
+    def accent_table(self, pattern: str, strength: float, total_steps: int) -> np.ndarray:
+        """Tabella per (pattern di accento, forza, numero di passi)"""
+        def builder():
+            steps = np.arange(max(1, total_steps))
+            factors = _accent_factors(pattern, strength, steps, _normalized_positions(total_steps))
+            return self._build(factors)
+        return self._get(('accent', pattern, strength, total_steps), builder)
+
+    def prefetch(self, curve: Optional[tuple] = None, accent: Optional[tuple] = None) -> list:
+        """Costruisce le tabelle in un thread di servizio, fuori dal thread di riproduzione
+
+        curve e accent sono tuple (tipo, intensità/forza, numero di passi).
+        Restituisce i future delle tabelle in costruzione.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="velocity-tables")
+        futures = []
+        if curve is not None and curve[0] not in ("linear", "random"):
+            futures.append(self._executor.submit(self.curve_table, *curve))
+        if accent is not None and accent[0] != "random":
+            futures.append(self._executor.submit(self.accent_table, *accent))
+        return futures
+
+
+# Cache condivisa da tutti gli stadi e da tutti i motori
+VELOCITY_TABLES = VelocityTableCache()
+
+
+@dataclass(frozen=True)
+class TransposeStage(EffectStage):
+    """Trasposizione in semitoni (octave add = 12 * ottave)"""
+    semitones: int = 0
+    name = "transpose"
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        if self.semitones == 0:
+            return buffer
+        notes = np.clip(buffer.notes.astype(np.int32) + self.semitones, 0, 127).astype(np.int16)
+        return replace(buffer, notes=notes)
+
+
+@dataclass(frozen=True)
+class VelocityCurveStage(EffectStage):
+    """Curva di velocità applicata lungo il pattern"""
+    curve: str = "linear"
+    intensity: float = 1.0
+    seed: Optional[int] = None
+    name = "velocity_curve"
+
+    @property
+    def deterministic(self) -> bool:
+        return self.curve != "random" or self.seed is not None
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        if self.curve == "linear" or len(buffer) == 0:
+            return buffer
+        if self.curve == "random":
+            factors = np.random.default_rng(self.seed).random(len(buffer))
+            values = buffer.velocities * factors * self.intensity
+            return replace(buffer, velocities=_clip_velocities(values))
+        table = VELOCITY_TABLES.curve_table(self.curve, self.intensity, buffer.total_steps)
+        return replace(buffer, velocities=table[buffer.steps, buffer.velocities].astype(np.int16))
+
+
+@dataclass(frozen=True)
+class AccentStage(EffectStage):
+    """Pattern di accento: moltiplica la velocity secondo la posizione"""
+    pattern: str = "every_beat"
+    strength: float = 0.5
+    seed: Optional[int] = None
+    name = "accent"
+
+    @property
+    def deterministic(self) -> bool:
+        return self.pattern != "random" or self.seed is not None
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        if len(buffer) == 0:
+            return buffer
+        if self.pattern == "random":
+            hits = np.random.default_rng(self.seed).random(len(buffer)) < 0.3
+            values = buffer.velocities * (1.0 + self.strength * hits)
+            return replace(buffer, velocities=_clip_velocities(values))
+        table = VELOCITY_TABLES.accent_table(self.pattern, self.strength, buffer.total_steps)
+        return replace(buffer, velocities=table[buffer.steps, buffer.velocities].astype(np.int16))
+
+
+# Fattori di durata per ogni modalità del repeater (rispetto al gate originale)
+REPEAT_TIMING_FACTORS = {
+    "immediate": (0.3, 0.3),
+    "staccato": (0.2, 0.2),
+    "legato": (0.8, 0.8),
+    "swing": (0.3, 0.7),
+}
+
+
+@dataclass(frozen=True)
+class RepeaterStage(EffectStage):
+    """Note repeater: ogni evento diventa una raffica di ripetizioni consecutive"""
+    count: int = 2
+    timing: str = "immediate"
+    name = "repeater"
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        count = max(1, int(self.count))
+        if len(buffer) == 0:
+            return buffer
+        even, odd = REPEAT_TIMING_FACTORS.get(self.timing, (0.5, 0.5))
+        factors = np.where(np.arange(count) % 2 == 0, even, odd)
+        # Onset di ogni ripetizione = somma delle durate delle ripetizioni precedenti
+        offsets = np.concatenate(([0.0], np.cumsum(factors)[:-1]))
+
+        repeated = buffer.take(np.repeat(np.arange(len(buffer)), count))
+        gates = np.repeat(buffer.durations, count)
+        tiled_factors = np.tile(factors, len(buffer))
+        tiled_offsets = np.tile(offsets, len(buffer))
+        return replace(repeated,
+                       onsets=repeated.onsets + gates * tiled_offsets,
+                       durations=gates * tiled_factors)
+
+
+@dataclass(frozen=True)
+class DelayStage(EffectStage):
+    """MIDI delay: aggiunge gli echi come eventi espliciti nel buffer"""
+    delay_time: float = 0.25
+    feedback: float = 0.3
+    mix: float = 0.5
+    delay_type: str = "Standard"
+    repeats: int = 3
+    playback_speed: float = 1.0
+    name = "delay"
+
+    def echo_interval(self) -> float:
+        """Intervallo tra gli echi in secondi, secondo il tipo e la velocità"""
+        interval = self.delay_time
+        if self.delay_type == "Dotted":
+            interval *= 1.5
+        elif self.delay_type == "Triplet":
+            interval *= 0.67
+        return interval / self.playback_speed if self.playback_speed > 0 else interval
+
+    def echo_offset(self, index: int) -> int:
+        """Offset in semitoni dell'eco (Ping-Pong alterna le ottave, Reverse scende)"""
+        if self.delay_type == "Ping-Pong":
+            return 12 if index % 2 == 0 else -12
+        elif self.delay_type == "Reverse":
+            return -12
+        return 0
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        if len(buffer) == 0 or self.mix <= 0:
+            return buffer
+
+        velocities = buffer.velocities.astype(np.float64)
+        dry = (velocities * (1.0 - self.mix)).astype(np.int64)
+        wet = (velocities * self.mix).astype(np.int64)
+
+        parts: List[EventBuffer] = []
+        keep = np.nonzero(dry > 0)[0]
+        if keep.size:
+            parts.append(replace(buffer.take(keep), velocities=_clip_velocities(dry[keep])))
+
+        interval = self.echo_interval()
+        for i in range(max(0, int(self.repeats))):
+            echo_velocities = (wet * (self.feedback ** (i + 1))).astype(np.int64)
+            audible = np.nonzero(echo_velocities >= 2)[0]
+            if audible.size == 0:
+                break
+            echoes = buffer.take(audible)
+            parts.append(replace(
+                echoes,
+                onsets=echoes.onsets + interval * (i + 1),
+                durations=echoes.durations * (0.8 ** (i + 1)),
+                notes=np.clip(echoes.notes.astype(np.int32) + self.echo_offset(i), 0, 127).astype(np.int16),
+                velocities=_clip_velocities(echo_velocities[audible])
+            ))
+
+        if not parts:
+            return buffer.take(np.array([], dtype=np.int64))
+        merged = replace(parts[0],
+                         onsets=np.concatenate([p.onsets for p in parts]),
+                         durations=np.concatenate([p.durations for p in parts]),
+                         notes=np.concatenate([p.notes for p in parts]),
+                         velocities=np.concatenate([p.velocities for p in parts]),
+                         steps=np.concatenate([p.steps for p in parts]))
+        return merged.sorted()
+
+
+@dataclass(frozen=True)
+class HumanizeStage(EffectStage):
+    """Piccole variazioni casuali di timing (secondi) e velocity"""
+    timing: float = 0.0
+    velocity: int = 0
+    seed: Optional[int] = None
+    name = "humanize"
+
+    @property
+    def deterministic(self) -> bool:
+        return self.seed is not None
+
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        if len(buffer) == 0 or (self.timing <= 0 and self.velocity <= 0):
+            return buffer
+        rng = np.random.default_rng(self.seed)
+        onsets = buffer.onsets
+        velocities = buffer.velocities
+        if self.timing > 0:
+            onsets = np.maximum(0.0, onsets + rng.uniform(-self.timing, self.timing, len(buffer)))
+        if self.velocity > 0:
+            jitter = rng.integers(-self.velocity, self.velocity + 1, len(buffer))
+            velocities = _clip_velocities(velocities + jitter)
+        return replace(buffer, onsets=onsets, velocities=velocities).sorted()
+
+
+class EffectChain:
+    """Catena ordinata di stadi di effetto con cache per snapshot dei parametri"""
+
+    DEFAULT_ORDER = ("transpose", "velocity_curve", "accent", "delay", "repeater", "humanize")
+    TIME_EFFECTS = ("delay", "repeater")
+
+    def __init__(self, stages: Optional[List[EffectStage]] = None,
+                 order: Optional[Sequence[str]] = None, cache_size: int = 64):
+        self.order: List[str] = list(order or self.DEFAULT_ORDER)
+        self.stages: List[EffectStage] = []
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, EventBuffer]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.set_stages(stages or [])
+
+    def set_stages(self, stages: List[EffectStage]):
+        """Sostituisce gli stadi, disponendoli secondo l'ordine corrente"""
+        rank = {name: i for i, name in enumerate(self.order)}
+        self.stages = sorted(stages, key=lambda stage: rank.get(stage.name, len(rank)))
+
+    def set_order(self, order: Sequence[str]):
+        """Riordina la catena; i nomi mancanti vengono accodati nell'ordine di default"""
+        unknown = [name for name in order if name not in self.DEFAULT_ORDER]
+        if unknown:
+            raise ValueError(f"Stadi di effetto sconosciuti: {unknown}")
+        self.order = list(order) + [name for name in self.DEFAULT_ORDER if name not in order]
+        self.set_stages(self.stages)
+
+    def move_stage(self, name: str, index: int):
+        """Sposta uno stadio in una nuova posizione dell'ordine"""
+        if name not in self.order:
+            raise ValueError(f"Stadio di effetto sconosciuto: {name}")
+        order = [stage for stage in self.order if stage != name]
+        order.insert(max(0, min(index, len(order))), name)
+        self.set_order(order)
+
+    def get_stage(self, name: str) -> Optional[EffectStage]:
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def snapshot(self) -> tuple:
+        """Snapshot immutabile (e hashable) della configurazione della catena"""
+        return tuple(self.stages)
+
+    def update_from_parameters(self, params: Dict, include_time_effects: bool = True):
+        """Ricostruisce gli stadi attivi da un dizionario di parametri del Pattern Engine"""
+        self.set_stages(build_stages(params, include_time_effects))
+
+    @traced("EffectChain.process", "effects")
+    def process(self, buffer: EventBuffer) -> EventBuffer:
+        """Applica tutti gli stadi al buffer, usando la cache se possibile"""
+        cacheable = buffer.key is not None and all(stage.deterministic for stage in self.stages)
+        if cacheable:
+            cache_key = (buffer.key, self.snapshot())
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+
+        result = buffer
+        for stage in self.stages:
+            with trace_span(stage.name, "effects"):
+                result = stage.process(result)
+
+        if cacheable:
+            self._cache[cache_key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    @classmethod
+    def from_parameters(cls, params: Dict, order: Optional[Sequence[str]] = None,
+                        include_time_effects: bool = True) -> 'EffectChain':
+        """Crea una catena dai parametri correnti (es. per un rendering offline)"""
+        chain = cls(order=order)
+        chain.update_from_parameters(params, include_time_effects)
+        return chain
+
+
+def build_stages(params: Dict, include_time_effects: bool = True) -> List[EffectStage]:
+    """Costruisce la lista degli stadi attivi a partire dai parametri"""
+    stages: List[EffectStage] = []
+
+    if params.get('octave_add', 0):
+        stages.append(TransposeStage(int(params['octave_add']) * 12))
+    if params.get('velocity_curve', "linear") != "linear":
+        stages.append(VelocityCurveStage(params['velocity_curve'],
+                                         float(params.get('velocity_intensity', 1.0))))
+    if params.get('accent_enabled'):
+        stages.append(AccentStage(params.get('accent_pattern', "every_beat"),
+                                  float(params.get('accent_strength', 0.5))))
+
+    if include_time_effects:
+        if params.get('delay_enabled') and params.get('delay_mix', 0) > 0:
+            try:
+                repeats = int(params.get('delay_repeats', 3))
+            except (ValueError, TypeError):
+                repeats = 3
+            stages.append(DelayStage(float(params.get('delay_time', 0.25)),
+                                     float(params.get('delay_feedback', 0.3)),
+                                     float(params.get('delay_mix', 0.5)),
+                                     params.get('delay_type', "Standard"),
+                                     repeats,
+                                     float(params.get('playback_speed', 1.0))))
+        if params.get('repeater_enabled'):
+            try:
+                count = int(params.get('repeat_count', 2))
+            except (ValueError, TypeError):
+                count = 2
+            stages.append(RepeaterStage(count, params.get('repeat_timing', "immediate")))
+
+    if params.get('humanize_timing', 0) > 0 or params.get('humanize_velocity', 0) > 0:
+        stages.append(HumanizeStage(float(params.get('humanize_timing', 0.0)),
+                                    int(params.get('humanize_velocity', 0))))
+    return stages
@@ -0,0 +1,198 @@
+"""
+Input MIDI da tastiere esterne
+Tiene l'insieme delle note premute come maschera di classi di altezza e lo riconosce contro
+tutte le celle della Color Tree direttamente nel callback della porta. Gli aggiornamenti
+arrivano alla GUI tramite una coda thread-safe svuotata con after().
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+from chord_recognition import ChordRecognizer, Recognition, get_recognizer
+
+try:
+    import mido
+    MIDI_AVAILABLE = True
+except ImportError:
+    MIDI_AVAILABLE = False
+
+
+# Intervallo di polling della coda dalla GUI (ms): latenza massima aggiunta dalla GUI
+INPUT_POLL_MS = 5
+
+# Controller del pedale di risonanza e di All Notes Off
+SUSTAIN_CONTROL = 64
+ALL_NOTES_OFF_CONTROL = 123
+
+
+@dataclass
+class HeldChord:
+    """Stato delle note premute dopo un cambio"""
+    mask: int
+    notes: Tuple[int, ...]
+    recognition: Recognition
+    timestamp: float  # istante di arrivo del messaggio che ha cambiato lo stato
+
+
+class MIDIInput:
+    """Gestisce l'input MIDI da una porta di ingresso (callback sul thread di mido)"""
+
+    def __init__(self, recognizer: Optional[ChordRecognizer] = None,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.recognizer = recognizer or get_recognizer()
+        self.clock = clock
+        self.input_port = None
+        self.port_name: Optional[str] = None
+        self.available_ports: List[str] = []
+
+        # Conteggio delle pressioni per nota MIDI e per classe di altezza (più canali o ottave)
+        self._note_counts = [0] * 128
+        self._pitch_class_counts = [0] * 12
+        self._sustained: List[int] = []  # rilasci rinviati dal pedale di risonanza
+        self.sustain = False
+        self.held_mask = 0
+        self.lock = threading.Lock()
+
+        # Coda verso la GUI e listener chiamati sul thread di input
+        self.updates: "queue.SimpleQueue[HeldChord]" = queue.SimpleQueue()
+        self.listeners: List[Callable[[HeldChord], None]] = []
+        # Listener di ogni messaggio in arrivo, con il suo istante (es. riconoscimento della tonalità)
+        self.message_listeners: List[Callable[[object, float], None]] = []
+
+    def get_available_ports(self) -> List[str]:
+        """Restituisce la lista delle porte MIDI di ingresso disponibili"""
+        if not MIDI_AVAILABLE:
+            return []
+        try:
+            self.available_ports = mido.get_input_names()
+        except (OSError, RuntimeError, AttributeError) as e:
+            print(f"Errore nel refresh delle porte MIDI in ingresso: {e}")
+            self.available_ports = []
+        return self.available_ports
+
+    def set_input_port(self, port_name: Optional[str]) -> bool:
+        """Apre la porta di ingresso indicata (None chiude la porta corrente)"""
+        self.close()
+        if not MIDI_AVAILABLE or not port_name:
+            return False
+        try:
+            self.input_port = mido.open_input(port_name, callback=self.handle_message)
+            self.port_name = port_name
+            return True
+        except (OSError, RuntimeError, AttributeError) as e:
+            print(f"Errore nell'apertura della porta MIDI in ingresso {port_name}: {e}")
+            return False
+
+    def close(self):
+        """Chiude la porta di ingresso e rilascia tutte le note"""
+        if self.input_port:
+            try:
+                self.input_port.close()
+            except (OSError, RuntimeError, AttributeError):
+                pass
+        self.input_port = None
+        self.port_name = None
+        self.reset()
+
+    def reset(self):
+        """Rilascia tutte le note tenute"""
+        with self.lock:
+            changed = self._clear()
+            self.sustain = False
+        if changed:
+            self._publish(self.clock(), True)
+
+    def _clear(self) -> bool:
+        changed = any(self._note_counts)
+        self._note_counts = [0] * 128
+        self._pitch_class_counts = [0] * 12
+        self._sustained.clear()
+        self.held_mask = 0
+        return changed
+
+    @property
+    def held_notes(self) -> Tuple[int, ...]:
+        """Note MIDI tenute, in ordine crescente"""
+        return tuple(note for note, count in enumerate(self._note_counts) if count)
+
+    def _press(self, note: int) -> bool:
+        """Preme una nota; True se cambia l'insieme delle note tenute"""
+        self._note_counts[note] += 1
+        pitch_class = note % 12
+        self._pitch_class_counts[pitch_class] += 1
+        self.held_mask |= 1 << pitch_class
+        return self._note_counts[note] == 1
+
+    def _release(self, note: int) -> bool:
+        """Rilascia una nota; True se cambia l'insieme delle note tenute"""
+        if not self._note_counts[note]:
+            return False
+        if self.sustain:
+            # Con il pedale premuto la nota resta tenuta fino al rilascio del pedale
+            self._sustained.append(note)
+            return False
+        self._note_counts[note] -= 1
+        pitch_class = note % 12
+        self._pitch_class_counts[pitch_class] -= 1
+        if not self._pitch_class_counts[pitch_class]:
+            self.held_mask &= ~(1 << pitch_class)
+        return not self._note_counts[note]
+
+    def handle_message(self, message, timestamp: Optional[float] = None):
+        """Aggiorna le note tenute e pubblica i cambi
+
+        I listener ricevono ogni cambio delle note tenute; la coda della GUI solo i cambi
+        della maschera (un Do aggiunto in un'altra ottava non ridisegna nulla).
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        for listener in list(self.message_listeners):
+            try:
+                listener(message, timestamp)
+            except (RuntimeError, ValueError, AttributeError) as e:
+                print(f"Errore nel listener dei messaggi MIDI: {e}")
+        with self.lock:
+            mask = self.held_mask
+            if message.type == 'note_on' and message.velocity > 0:
+                changed = self._press(message.note)
+            elif message.type in ('note_on', 'note_off'):
+                changed = self._release(message.note)
+            elif message.type == 'control_change' and message.control == SUSTAIN_CONTROL:
+                self.sustain = message.value >= 64
+                changed = False
+                if not self.sustain:
+                    pending, self._sustained = self._sustained, []
+                    for note in pending:
+                        changed |= self._release(note)
+            elif message.type == 'control_change' and message.control == ALL_NOTES_OFF_CONTROL:
+                changed = self._clear()
+            else:
+                return
+            mask_changed = self.held_mask != mask
+        if changed or mask_changed:
+            self._publish(timestamp, mask_changed)
+
+    def _publish(self, timestamp: float, mask_changed: bool):
+        with self.lock:
+            mask, notes = self.held_mask, self.held_notes
+        update = HeldChord(mask, notes, self.recognizer.recognize_mask(mask), timestamp)
+        if mask_changed:
+            self.updates.put(update)
+        for listener in list(self.listeners):
+            try:
+                listener(update)
+            except (RuntimeError, ValueError, AttributeError) as e:
+                print(f"Errore nel listener dell'input MIDI: {e}")
+
+    def drain_updates(self) -> Optional[HeldChord]:
+        """Svuota la coda e restituisce solo l'ultimo stato (None se non ci sono cambi)
+
+        Più cambi arrivati tra due polling della GUI diventano un solo aggiornamento grafico.
+        """
+        latest = None
+        while True:
+            try:
+                latest = self.updates.get_nowait()
+            except queue.Empty:
+                return latest
@@ -0,0 +1,168 @@
+"""
+Sessione multi-traccia
+Più voci PatternEngine (es. basso e lead) suonate da un unico scheduler sullo stesso clock
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from chord_generator import MIDIScaleGenerator
+from metrics import PlaybackMetrics
+from midi_clock import MidiClockSource
+from pattern_engine import PatternEngine, PatternLoopSource
+from scheduler import LookaheadScheduler, DEFAULT_LOOKAHEAD
+from voicing import VoicingEngine
+
+
+@dataclass
+class Track:
+    """Traccia della sessione: un PatternEngine con il proprio canale MIDI"""
+    name: str
+    engine: PatternEngine
+    source: Optional[PatternLoopSource] = None
+
+    @property
+    def channel(self) -> int:
+        return self.engine.midi_channel
+
+    def update(self, **params):
+        """Aggiorna i parametri della traccia (quantizzati se la sessione sta suonando)"""
+        self.engine.schedule_parameters(**params)
+
+
+class MultiTrackSession:
+    """Sessione di N tracce che condividono scheduler, clock e cache di compilazione
+
+    Un solo thread riempie la finestra di lookahead per tutte le tracce; pattern compilati e
+    voicing sono condivisi, così tracce con le stesse celle non ricompilano nulla.
+    """
+
+    def __init__(self, midi_generator: MIDIScaleGenerator, midi_output=None,
+                 lookahead: float = DEFAULT_LOOKAHEAD):
+        self.midi_generator = midi_generator
+        self.midi_output = midi_output
+        self.lookahead = lookahead
+        self.tracks: "OrderedDict[str, Track]" = OrderedDict()
+        self.scheduler: Optional[LookaheadScheduler] = None
+        self.current_thread: Optional[threading.Thread] = None
+        self.is_playing = False
+        self.clock_output_enabled = False
+
+        # Cache condivise tra le tracce
+        self.voicing_engine = VoicingEngine()
+        self._compile_cache = OrderedDict()
+        self._compile_lock = threading.Lock()
+        self.compile_cache_size = 128
+
+        # Listener degli eventi programmati di tutte le tracce (es. flusso WebSocket)
+        self.event_listeners: List[Callable] = []
+        # Ritardo di invio e frequenza degli eventi di tutte le tracce
+        self.metrics = PlaybackMetrics()
+
+    def add_track(self, name: str, channel: int = 0, **params) -> Track:
+        """Aggiunge una traccia con i parametri iniziali (sound_cell, pattern_type, octave, ...)"""
+        if name in self.tracks:
+            raise ValueError(f"Traccia già presente: {name}")
+        engine = PatternEngine(self.midi_generator, self.midi_output)
+        engine.midi_channel = channel
+        engine.voicing_engine = self.voicing_engine
+        engine._compile_cache = self._compile_cache
+        engine._compile_lock = self._compile_lock
+        engine.compile_cache_size = self.compile_cache_size
+        engine.update_parameters(**params)
+        track = Track(name, engine)
+        self.tracks[name] = track
+        if self.is_playing:
+            self._start_track(track, loop=True)
+        return track
+
+    def remove_track(self, name: str):
+        """Rimuove una traccia, fermandola se sta suonando"""
+        track = self.tracks.pop(name)
+        self._stop_track(track)
+
+    def get_track(self, name: str) -> Optional[Track]:
+        return self.tracks.get(name)
+
+    def _start_track(self, track: Track, loop: bool):
+        track.source = track.engine.prepare_playback(loop)
+        track.source.track = track.name
+        self.scheduler.add_source(track.source)
+
+    def _stop_track(self, track: Track):
+        engine = track.engine
+        engine.stop_requested = True
+        engine.is_playing = False
+        engine.is_looping = False
+        if self.scheduler and track.source:
+            self.scheduler.remove_source(track.source)
+            # Spegne le note ancora accese sul canale della traccia
+            if self.midi_output and self.midi_output.initialized and self.midi_output.output_port:
+                for note, channel in list(getattr(self.midi_output, 'active_notes', ())):
+                    if channel == engine.midi_channel:
+                        self.midi_output.send_note_off(note, channel)
+        track.source = None
+
+    def tempo(self) -> float:
+        """Tempo della sessione: quello della prima traccia"""
+        first = next(iter(self.tracks.values()), None)
+        return first.engine.effective_bpm() if first else 120
+
+    def play(self, loop: bool = True, callback: Optional[Callable] = None):
+        """Avvia tutte le tracce sullo stesso scheduler"""
+        if self.is_playing:
+            self.stop()
+        scheduler = LookaheadScheduler(self.lookahead)
+        scheduler.listeners = self.event_listeners
+        scheduler.metrics = self.metrics
+        self.scheduler = scheduler
+        for track in self.tracks.values():
+            self._start_track(track, loop)
+        send_clock = (self.clock_output_enabled and self.midi_output is not None
+                      and self.midi_output.initialized and self.midi_output.output_port)
+        if send_clock:
+            scheduler.add_source(MidiClockSource(self.midi_output, self.tempo))
+        scheduler.start()
+        self.is_playing = True
+
+        def session_worker():
+            try:
+                scheduler.run()
+            except (OSError, RuntimeError, ValueError) as e:
+                print(f"Errore nella riproduzione della sessione: {e}")
+            finally:
+                if send_clock:
+                    self.midi_output.send_stop()
+                for track in self.tracks.values():
+                    track.engine.is_playing = False
+                self.is_playing = False
+                if callback:
+                    callback()
+
+        self.current_thread = threading.Thread(target=session_worker)
+        self.current_thread.daemon = True
+        self.current_thread.start()
+
+    def stop(self):
+        """Ferma la sessione e tutte le tracce"""
+        for track in self.tracks.values():
+            track.engine.stop_requested = True
+            track.engine.is_looping = False
+        if self.scheduler:
+            self.scheduler.stop()
+        if self.midi_output and self.midi_output.initialized and self.midi_output.output_port:
+            self.midi_output.stop_all_notes()
+        if self.current_thread and self.current_thread.is_alive():
+            self.current_thread.join(timeout=0.2)
+        for track in self.tracks.values():
+            track.source = None
+        self.is_playing = False
+
+    def channels(self) -> List[int]:
+        """Canali MIDI usati dalle tracce"""
+        return [track.channel for track in self.tracks.values()]
+
+    def parameters(self) -> Dict[str, dict]:
+        """Parametri correnti di ogni traccia"""
+        return {name: track.engine.get_current_parameters() for name, track in self.tracks.items()}
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Superficie di controllo OSC (UDP) per i parametri del Pattern Engine
+Un thread riceve i messaggi OSC da controller o altri software e li applica direttamente ai
+parametri del PatternEngine (con la quantizzazione dei cambi), senza passare dai widget Tk.
+
+Indirizzi:
+  /bpm, /playback/speed, /octave, /delay/feedback, /voicing, ...
+      un parametro del Pattern Engine (nome con "/" al posto di "_", senza "_enabled");
+      i numeri fuori intervallo vengono limitati, le scelte accettano il nome o l'indice
+  /delay, /accent, /repeater, /chord/gen, /reverse
+      attivano (1, T o nessun argomento) o spengono (0, F) un effetto
+  /pattern s|i            pattern per nome o indice
+  /root s|i               root delle celle richieste con /cell
+  /cell/{livello}/{pos}   cambio di accordo (anche /cell i i)
+  /play, /stop            trasporto (se abilitato)
+  /stats                  risponde al mittente con /stats e i contatori
+
+La ricezione usa un unico buffer preallocato: gli argomenti sono letti sul posto con Struct
+precompilati in una lista riusata e gli indirizzi sono risolti con una tabella costruita
+all'avvio. I bundle vengono applicati subito, senza attendere il loro timetag.
+"""
+
+import argparse
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from cell_index import all_cells, cell_key
+from chord_generator import MIDIScaleGenerator, Note
+from cli_example import parse_root
+from http_service import RENDER_CHOICES, RENDER_FLAGS, RENDER_RANGES
+from metrics import MetricsServer
+from pattern_engine import PatternEngine, PatternType
+
+
+OSC_PORT = 9000
+# Dimensione massima di un datagramma UDP
+MAX_PACKET = 65536
+# Intervallo con cui il thread di ricezione controlla la richiesta di stop (secondi)
+RECEIVE_TIMEOUT = 0.1
+
+BUNDLE_TAG = b"#bundle\0"
+INT32 = struct.Struct(">i")
+INT64 = struct.Struct(">q")
+FLOAT32 = struct.Struct(">f")
+FLOAT64 = struct.Struct(">d")
+
+# Motivi per cui un messaggio viene scartato
+DROP_REASONS = ("malformed", "unknown_address", "invalid_arguments")
+
+PATTERNS = tuple(PatternType)
+
+
+def parameter_address(name: str) -> bytes:
+    """Indirizzo OSC di un parametro: delay_feedback -> /delay/feedback, delay_enabled -> /delay"""
+    if name.endswith("_enabled"):
+        name = name[:-len("_enabled")]
+    return ("/" + name.replace("_", "/")).encode("ascii")
+
+
+def build_routes() -> Dict[bytes, tuple]:
+    """Tabella indirizzo -> azione, costruita una volta sola"""
+    routes = {}
+    for name, (kind, minimum, maximum) in RENDER_RANGES.items():
+        routes[parameter_address(name)] = ("range", name, kind, minimum, maximum)
+    for name, choices in RENDER_CHOICES.items():
+        routes[parameter_address(name)] = ("choice", name, choices)
+    for name in RENDER_FLAGS:
+        routes[parameter_address(name)] = ("flag", name)
+    routes[b"/chord"] = routes[parameter_address("chord_gen_enabled")]
+    routes[b"/pattern"] = ("pattern",)
+    routes[b"/root"] = ("root",)
+    routes[b"/cell"] = ("cell", None, None)
+    # Livelli e posizioni sono gli stessi per tutte le root
+    for cell in all_cells():
+        if cell.root == Note.C:
+            routes[f"/cell/{cell.level}/{cell.position}".encode("ascii")] = ("cell", cell.level, cell.position)
+    routes[b"/play"] = ("play",)
+    routes[b"/stop"] = ("stop",)
+    routes[b"/stats"] = ("stats",)
+    return routes
+
+
+def _string_end(data, start: int, end: int) -> Tuple[int, int]:
+    """Terminatore di una stringa OSC e inizio del campo successivo (allineato a 4 byte)"""
+    null = data.find(0, start, end)
+    if null < 0:
+        raise ValueError("Stringa OSC non terminata")
+    return null, start + ((null - start) // 4 + 1) * 4
+
+
+def parse_message(data, start: int, end: int, args: list) -> bytes:
+    """Indirizzo di un messaggio OSC in data[start:end]; gli argomenti finiscono in args (riusata)"""
+    null, index = _string_end(data, start, end)
+    address = bytes(data[start:null])
+    args.clear()
+    if index >= end:
+        return address  # messaggio senza type tag
+    if data[index] != 0x2C:  # ','
+        raise ValueError("Type tag OSC mancante")
+    tags_start = index + 1
+    tags_end, index = _string_end(data, index, end)
+    for position in range(tags_start, tags_end):
+        tag = data[position]
+        if tag == 0x69:  # i
+            args.append(INT32.unpack_from(data, index)[0])
+            index += 4
+        elif tag == 0x66:  # f
+            args.append(FLOAT32.unpack_from(data, index)[0])
+            index += 4
+        elif tag == 0x73:  # s
+            string_end, following = _string_end(data, index, end)
+            args.append(data[index:string_end].decode("utf-8"))
+            index = following
+        elif tag == 0x68:  # h
+            args.append(INT64.unpack_from(data, index)[0])
+            index += 8
+        elif tag == 0x64:  # d
+            args.append(FLOAT64.unpack_from(data, index)[0])
+            index += 8
+        elif tag == 0x54:  # T
+            args.append(True)
+        elif tag == 0x46:  # F
+            args.append(False)
+        elif tag == 0x4E:  # N
+            args.append(None)
+        else:
+            raise ValueError(f"Tipo di argomento OSC non supportato: {chr(tag)}")
+        if index > end:
+            raise ValueError("Argomenti OSC troncati")
+    return address
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (4 - len(data) % 4)
+
+
+def encode_message(address: str, *args) -> bytes:
+    """Messaggio OSC con argomenti int, float, str o bool"""
+    tags = ","
+    payload = b""
+    for arg in args:
+        if isinstance(arg, bool):
+            tags += "T" if arg else "F"
+        elif isinstance(arg, int):
+            tags += "i"
+            payload += INT32.pack(arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            payload += FLOAT32.pack(arg)
+        elif isinstance(arg, str):
+            tags += "s"
+            payload += _pad(arg.encode("utf-8"))
+        else:
+            raise TypeError(f"Argomento OSC non supportato: {arg!r}")
+    return _pad(address.encode("ascii")) + _pad(tags.encode("ascii")) + payload
+
+
+def encode_bundle(*messages: bytes, timetag: int = 1) -> bytes:
+    """Bundle OSC (timetag 1 = immediato)"""
+    return BUNDLE_TAG + INT64.pack(timetag) + b"".join(INT32.pack(len(message)) + message
+                                                       for message in messages)
+
+
+@dataclass
+class OSCStats:
+    """Contatori del server OSC; la latenza va dalla ricezione del pacchetto al cambio applicato"""
+    packets: int = 0
+    messages: int = 0
+    applied: int = 0
+    dropped: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(DROP_REASONS, 0))
+    latency_total_ns: int = 0
+    latency_max_ns: int = 0
+    latency_last_ns: int = 0
+
+    @property
+    def total_dropped(self) -> int:
+        return sum(self.dropped.values())
+
+    def record_latency(self, latency_ns: int):
+        self.applied += 1
+        self.latency_total_ns += latency_ns
+        self.latency_last_ns = latency_ns
+        if latency_ns > self.latency_max_ns:
+            self.latency_max_ns = latency_ns
+
+    def as_dict(self) -> dict:
+        """Contatori con le latenze in microsecondi"""
+        mean = self.latency_total_ns / self.applied if self.applied else 0.0
+        return {'packets': self.packets, 'messages': self.messages, 'applied': self.applied,
+                'dropped': dict(self.dropped),
+                'latency_us': {'mean': round(mean / 1000, 1), 'max': round(self.latency_max_ns / 1000, 1),
+                               'last': round(self.latency_last_ns / 1000, 1)}}
+
+
+class OSCServer:
+    """Server OSC su UDP che applica i messaggi a un PatternEngine da un thread dedicato"""
+
+    def __init__(self, engine: PatternEngine, host: str = "127.0.0.1", port: int = OSC_PORT,
+                 quantize: Optional[str] = None, chord_quantize: Optional[str] = None,
+                 transport: bool = True):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        # Confini dei cambi (None = quelli correnti del motore); letti a ogni messaggio
+        self.quantize = quantize
+        self.chord_quantize = chord_quantize
+        # /play e /stop sono ignorati quando il trasporto è gestito da altri (es. la GUI)
+        self.transport = transport
+        # Richiamata dal thread di ricezione con i parametri applicati (es. per aggiornare la GUI)
+        self.on_parameters: Optional[Callable[[Dict[str, object]], None]] = None
+        self.root = engine.current_sound_cell.root if engine.current_sound_cell else Note.C
+        self.stats = OSCStats()
+        self.routes = build_routes()
+        self.cells = {cell_key(cell): cell for cell in all_cells()}
+        self._buffer = bytearray(MAX_PACKET)
+        self._args = []
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---- Thread di ricezione ----
+
+    def start(self) -> int:
+        """Apre il socket e avvia il thread; restituisce la porta effettiva"""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.host, self.port))
+        self._sock.settimeout(RECEIVE_TIMEOUT)
+        self.port = self._sock.getsockname()[1]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._receive_loop, name="osc-control", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        """Ferma il thread e chiude il socket"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def _receive_loop(self):
+        buffer = self._buffer
+        while not self._stop.is_set():
+            try:
+                size, sender = self._sock.recvfrom_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self._stop.is_set():
+                    print(f"Errore nella ricezione OSC: {e}")
+                break
+            self.handle_packet(buffer, size, time.perf_counter_ns(), sender)
+
+    def feed(self, packet: bytes, sender=None):
+        """Elabora un pacchetto senza passare dal socket"""
+        self.handle_packet(packet, len(packet), time.perf_counter_ns(), sender)
+
+    # ---- Decodifica e applicazione ----
+
+    def handle_packet(self, data, size: int, received_ns: int, sender=None):
+        """Decodifica un pacchetto (messaggio o bundle) e applica i messaggi che contiene"""
+        self.stats.packets += 1
+        try:
+            self._handle_element(data, 0, size, received_ns, sender)
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            self.stats.messages += 1
+            self.stats.dropped['malformed'] += 1
+            print(f"Errore nel messaggio OSC: {e}")
+
+    def _handle_element(self, data, start: int, end: int, received_ns: int, sender):
+        if data[start:start + 8] == BUNDLE_TAG:
+            # Timetag ignorato: i cambi seguono comunque la quantizzazione del motore
+            index = start + 16
+            while index < end:
+                length = INT32.unpack_from(data, index)[0]
+                index += 4
+                if length <= 0 or index + length > end:
+                    raise ValueError("Elemento del bundle OSC troncato")
+                self._handle_element(data, index, index + length, received_ns, sender)
+                index += length
+            return
+        args = self._args
+        address = parse_message(data, start, end, args)
+        self.stats.messages += 1
+        route = self.routes.get(address)
+        if route is None:
+            self.stats.dropped['unknown_address'] += 1
+            return
+        try:
+            self._apply(route, args, sender)
+        except (ValueError, TypeError, IndexError, KeyError) as e:
+            self.stats.dropped['invalid_arguments'] += 1
+            print(f"Errore nel messaggio OSC {address.decode('ascii', 'replace')}: {e}")
+            return
+        self.stats.record_latency(time.perf_counter_ns() - received_ns)
+
+    def _schedule(self, changes: Dict[str, object]):
+        self.engine.schedule_parameters(self.quantize, **changes)
+        if self.on_parameters:
+            self.on_parameters(changes)
+
+    def _apply(self, route: tuple, args: list, sender):
+        action = route[0]
+        if action == "range":
+            _, name, kind, minimum, maximum = route
+            value = min(max(_number(args[0]), minimum), maximum)
+            self._schedule({name: round(value) if kind is int else value})
+        elif action == "choice":
+            _, name, choices = route
+            self._schedule({name: _choice(args[0], choices)})
+        elif action == "flag":
+            enabled = bool(args[0]) if args else True
+            self._schedule({route[1]: enabled})
+        elif action == "pattern":
+            pattern = args[0]
+            pattern = PATTERNS[pattern] if isinstance(pattern, int) else PatternType(pattern)
+            self._schedule({'pattern_type': pattern})
+        elif action == "root":
+            self.root = Note(args[0] % 12) if isinstance(args[0], int) else parse_root(args[0])
+        elif action == "cell":
+            _, level, position = route
+            if level is None:
+                level, position = int(args[0]), int(args[1])
+            cell = self.cells.get((self.root.value, level, position))
+            if cell is None:
+                raise ValueError(f"Cella inesistente: livello {level}, posizione {position}")
+            self.engine.queue_chord_change(cell, self.chord_quantize)
+        elif action == "play":
+            if self.transport and not self.engine.is_playing:
+                if self.engine.current_sound_cell is None or self.engine.current_pattern_type is None:
+                    raise ValueError("Nessuna cella o pattern da suonare")
+                self.engine.play_source(self.engine.prepare_playback(loop=True))
+        elif action == "stop":
+            if self.transport:
+                self.engine.stop_pattern()
+        elif action == "stats":
+            self._reply_stats(sender)
+
+    def _reply_stats(self, sender):
+        if sender is None or self._sock is None:
+            return
+        stats = self.stats
+        mean = stats.latency_total_ns / stats.applied / 1000 if stats.applied else 0.0
+        reply = encode_message("/stats", stats.packets, stats.messages, stats.applied, stats.total_dropped,
+                               float(mean), stats.latency_max_ns / 1000)
+        try:
+            self._sock.sendto(reply, sender)
+        except OSError as e:
+            print(f"Errore nell'invio delle statistiche OSC: {e}")
+
+
+def _number(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"Valore numerico atteso: {value!r}")
+    # NaN supererebbe il limite dell'intervallo (min/max non lo scartano)
+    if not math.isfinite(value):
+        raise ValueError(f"Valore numerico non finito: {value!r}")
+    return value
+
+
+def _choice(value, choices: Sequence[str]) -> str:
+    """Scelta per nome o per indice"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return choices[value]
+    if value not in choices:
+        raise ValueError(f"Valore non valido: {value} (validi: {', '.join(choices)})")
+    return value
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Suona in loop una cella e la lascia controllare via OSC"""
+    parser = argparse.ArgumentParser(description="Controllo OSC del Pattern Engine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=OSC_PORT)
+    parser.add_argument("--cell", default="C:4:1", help="Cella iniziale come ROOT:LIVELLO:POSIZIONE")
+    parser.add_argument("--pattern", default=PatternType.UP_DOWN.value,
+                        choices=[pattern.value for pattern in PatternType])
+    parser.add_argument("--quantize", default=None, help="Confine dei cambi di parametri (step/beat/bar/loop)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Espone le metriche di riproduzione su http://HOST:PORTA/metrics")
+    args = parser.parse_args(argv)
+
+    try:
+        root_name, level, position = args.cell.split(":")
+        key = (parse_root(root_name).value, int(level), int(position))
+        sound_cell = next(cell for cell in all_cells() if cell_key(cell) == key)
+    except (ValueError, StopIteration) as e:
+        print(f"Errore nella scelta della cella: {args.cell} {e}")
+        return 1
+
+    engine = PatternEngine(MIDIScaleGenerator())
+    server = OSCServer(engine, args.host, args.port, quantize=args.quantize)
+    server.root = sound_cell.root
+    try:
+        port = server.start()
+    except OSError as e:
+        print(f"Errore nell'avvio del server OSC: {e}")
+        return 1
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(engine.metrics_snapshot, args.host, args.metrics_port)
+        try:
+            print(f"Metriche su http://{args.host}:{metrics_server.start()}/metrics")
+        except OSError as e:
+            print(f"Errore nell'avvio dell'endpoint delle metriche: {e}")
+            metrics_server = None
+    engine.play_pattern(sound_cell, PatternType(args.pattern), loop=True)
+    print(f"Controllo OSC su udp://{args.host}:{port} (Ctrl+C per uscire)")
+    try:
+        while True:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop_pattern()
+        server.stop()
+        if metrics_server:
+            metrics_server.stop()
+        print(server.stats.as_dict())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,13 +3,47 @@ Pattern Engine per la riproduzione creativa di accordi
 Gestisce tutti i pattern di riproduzione richiesti
 """
 
+import math
 import random
 import time
 import threading
-from typing import List, Callable, Optional
-from dataclasses import dataclass
+from collections import OrderedDict
+from typing import List, Callable, Optional, Sequence
+from dataclasses import dataclass, field
 from enum import Enum
+import numpy as np
 from chord_generator import Note, SoundCell, MIDIScaleGenerator, MusicalFigure, musical_figure_to_seconds
+from midi_clock import ExternalClockFollower, MidiClockSource
+from metrics import PlaybackMetrics, cache_stats
+from midi_effects import EventBuffer, EffectChain, VELOCITY_TABLES
+from scheduler import (LookaheadScheduler, EventSource, DEFAULT_LOOKAHEAD, QUANTIZE_MODES,
+                       GRID_EPSILON)
+from tracing import trace_instant, traced
+from voicing import VoicingEngine, Voicing
+
+
+# Frazione della durata del passo in cui la nota resta accesa (gate)
+GATE_RATIO = 0.8
+
+# Tipi di evento nella timeline: a parità di tempo i NOTE OFF precedono i NOTE ON
+NOTE_OFF = 0
+NOTE_ON = 1
+LOOP_END = 2
+
+# Confini per i cambi di accordo e corrispondente quantizzazione dello scheduler
+CHORD_QUANTIZE = {"note": "step", "beat": "beat", "bar": "bar", "loop": "loop"}
+
+# Distanza minima tra due accordi in coda (secondi): ognuno occupa il proprio confine
+CHORD_QUEUE_SPACING = 1e-6
+
+# Età oltre cui una nota ancora accesa è considerata bloccata: durante la riproduzione
+# (più lunga di qualsiasi gate realistico) e a riproduzione ferma
+STUCK_NOTE_SECONDS = 10.0
+STOPPED_NOTE_GRACE = 0.5
+
+# Parametri che richiedono nuove tabelle di velocity
+VELOCITY_PARAMETERS = ('velocity_curve', 'velocity_intensity', 'accent_enabled', 'accent_strength',
+                       'accent_pattern')
 
 
 class PatternType(Enum):
@@ -61,18 +95,221 @@ class NoteEvent:
     delay: float = 0.0
 
 
+# Pattern che producono un risultato diverso ad ogni generazione (non cacheabili)
+RANDOM_PATTERNS = frozenset({
+    PatternType.SKIP,
+    PatternType.RANDOM_CHAOS,
+    PatternType.RANDOM_RHYTHM,
+    PatternType.RANDOM_VOLUME,
+    PatternType.RANDOM_CHANGING,
+})
+
+
+def sound_cell_key(sound_cell: SoundCell) -> tuple:
+    """Chiave hashable che identifica una sound cell"""
+    return (sound_cell.root.value, sound_cell.level, sound_cell.position,
+            tuple(note.value for note in sound_cell.notes))
+
+
+@dataclass
+class PendingChange:
+    """Cambio di parametri in attesa del confine di quantizzazione"""
+    changes: dict = field(default_factory=dict)
+    quantize: str = "beat"
+    due: Optional[float] = None  # istante assoluto, risolto dallo scheduler
+    chord: bool = False  # cambio di accordo dalla coda degli accordi
+
+
+class PatternLoopSource(EventSource):
+    """Loop di un PatternEngine come sorgente di eventi per il LookaheadScheduler"""
+
+    def __init__(self, engine: 'PatternEngine', loop: bool = False):
+        self.engine = engine
+        self.loop = loop
+        self.buffer: Optional[EventBuffer] = None
+        self.params: dict = {}
+        self.anchor = 0.0  # inizio del loop corrente sul clock assoluto
+        self.cursor = 0  # prossimo evento del buffer da programmare
+        self.filled_until: Optional[float] = None
+        self.finished = False
+
+    @traced("load_loop", "pattern")
+    def _load(self, at: Optional[float] = None) -> bool:
+        """Compila il loop con i parametri correnti; con at riprende dalla stessa fase"""
+        engine = self.engine
+        params = engine.get_current_parameters()
+        if not params['sound_cell'] or not params['pattern_type']:
+            return False
+        
+        # Con il chord generator attivo sceglie il voicing più vicino all'accordo precedente
+        voicing = engine.resolve_voicing(params, engine._previous_voicing)
+        if voicing is not None:
+            engine._previous_voicing = voicing
+        
+        # Delay e repeater diventano eventi espliciti del buffer
+        buffer = engine.compile_from_parameters(params, voicing)
+        engine._last_total_steps = buffer.total_steps
+        with engine.param_lock:
+            engine.effect_chain.update_from_parameters(params)
+            buffer = engine.effect_chain.process(buffer)
+        if buffer.length <= 0:
+            return False
+        if len(buffer) > 1 and np.any(np.diff(buffer.onsets) < 0):
+            buffer = buffer.sorted()
+        
+        self.buffer = buffer
+        self.params = params
+        self.cursor = 0
+        if at is not None:
+            # Il nuovo buffer prosegue dalla fase corrente del loop, senza riallineare il clock
+            phase = at - self.anchor
+            if phase >= buffer.length:
+                self.anchor = at
+            else:
+                self.cursor = int(np.searchsorted(buffer.onsets, phase - GRID_EPSILON, side='left'))
+        return True
+
+    def rewind(self):
+        # Il loop viene ricompilato alla nuova origine; i NOTE OFF in coda sono stati scartati
+        self.buffer = None
+        self.cursor = 0
+        self.filled_until = None
+        self.finished = False
+        if self.engine._midi_ready():
+            self.engine.midi_output.stop_all_notes()
+
+    def next_step_time(self, after: float) -> float:
+        if self.buffer is None:
+            return after
+        index = int(np.searchsorted(self.buffer.onsets, after - self.anchor - GRID_EPSILON, side='left'))
+        if index < len(self.buffer):
+            return self.anchor + float(self.buffer.onsets[index])
+        return self.next_loop_time(after)
+
+    def next_loop_time(self, after: float) -> float:
+        if self.buffer is None:
+            return after
+        return max(after, self.anchor + self.buffer.length + self.params.get('pause_duration', 0.0))
+
+    def _resolve_changes(self, scheduler: LookaheadScheduler, after: float) -> Optional[float]:
+        """Assegna un istante ai cambi in attesa; restituisce il primo in scadenza"""
+        engine = self.engine
+        with engine.param_lock:
+            pending = list(engine._pending_changes)
+        last_chord = None
+        for change in pending:
+            if change.due is None:
+                # Gli accordi in coda suonano uno per confine, nell'ordine di arrivo
+                start = after
+                if change.chord and last_chord is not None:
+                    start = max(after, last_chord + CHORD_QUEUE_SPACING)
+                change.due = scheduler.next_boundary(start, change.quantize,
+                                                     self.params.get('bpm', 120),
+                                                     self.params.get('playback_speed', 1.0), self)
+            if change.chord:
+                last_chord = change.due
+        return min((change.due for change in pending), default=None)
+
+    def _apply_changes(self, until: float) -> bool:
+        """Applica i cambi in attesa con scadenza entro until"""
+        engine = self.engine
+        with engine.param_lock:
+            due = [change for change in engine._pending_changes
+                   if change.due is not None and change.due <= until]
+            engine._pending_changes = [change for change in engine._pending_changes
+                                       if change.due is None or change.due > until]
+        for change in due:
+            trace_instant("chord_change" if change.chord else "parameter_change", "pattern")
+            engine.update_parameters(**change.changes)
+        return bool(due)
+
+    def fill(self, scheduler: LookaheadScheduler, horizon: float) -> bool:
+        if self.finished:
+            return False
+        if self.buffer is None:
+            self.anchor = scheduler.origin
+            if not self._load():
+                self.finished = True
+                return False
+        
+        while True:
+            # Gli eventi fino a filled_until sono già in coda: i cambi partono da lì
+            after = self.filled_until if self.filled_until is not None else self.anchor
+            change_time = self._resolve_changes(scheduler, after)
+            buffer = self.buffer
+            loop_end = self.anchor + buffer.length
+            if self.cursor < len(buffer):
+                next_time = self.anchor + float(buffer.onsets[self.cursor])
+            else:
+                next_time = loop_end
+            
+            if change_time is not None and change_time <= horizon and change_time <= next_time:
+                self._apply_changes(change_time)
+                if not self._load(at=change_time):
+                    self.finished = True
+                    break
+                continue
+            
+            if next_time > horizon:
+                break
+            
+            if self.cursor < len(buffer):
+                scheduler.push(next_time, NOTE_ON, self,
+                               (int(buffer.notes[self.cursor]), int(buffer.velocities[self.cursor]),
+                                float(buffer.durations[self.cursor])))
+                self.cursor += 1
+                continue
+            
+            # Fine del loop: senza loop la sorgente termina quando l'ultima nota è finita
+            if not self.loop or not self.engine.is_looping:
+                scheduler.push(loop_end, LOOP_END, self)
+                self._apply_changes(float('inf'))
+                self.finished = True
+                break
+            
+            # Il loop successivo parte dopo la pausa, sullo stesso clock assoluto
+            self.anchor = loop_end + self.params['pause_duration']
+            self._apply_changes(self.anchor)
+            if not self._load():
+                self.finished = True
+                break
+        
+        self.filled_until = horizon
+        return not self.finished
+
+    def dispatch(self, scheduler: LookaheadScheduler, due: float, kind: int, payload: tuple):
+        if kind == NOTE_ON:
+            midi_note, velocity, gate_duration = payload
+            if self.engine._play_single_note(midi_note, gate_duration, velocity):
+                scheduler.push(due + gate_duration, NOTE_OFF, self, (midi_note, self.engine.midi_channel))
+        elif kind == NOTE_OFF:
+            self.engine.midi_output.send_note_off(*payload)
+
+
 class PatternEngine:
     """Motore per la generazione e riproduzione di pattern creativi"""
     
     def __init__(self, midi_generator: MIDIScaleGenerator, midi_output=None):
         self.midi_generator = midi_generator
         self.midi_output = midi_output  # Aggiunto supporto MIDI
+        self.midi_channel = 0
         self.is_playing = False
         self.is_looping = False
         self.stop_requested = False
         self.current_thread: Optional[threading.Thread] = None
         self.playback_id = 0
         
+        # Scheduler a lookahead e cambi di parametri quantizzati in attesa
+        self.scheduler: Optional[LookaheadScheduler] = None
+        self.lookahead = DEFAULT_LOOKAHEAD
+        self.quantize = "beat"  # "immediate", "step", "beat", "bar" o "loop"
+        self.chord_quantize = "bar"  # "note", "beat", "bar" o "loop"
+        self._pending_changes: List[PendingChange] = []
+        
+        # Sincronizzazione: MIDI clock in uscita oppure clock esterno da seguire
+        self.clock_output_enabled = False
+        self.external_clock: Optional[ExternalClockFollower] = None
+        
         # Parametri dinamici per aggiornamento in tempo reale
         self.current_sound_cell = None
         self.current_pattern_type = None
@@ -105,6 +342,32 @@ class PatternEngine:
         self.current_chord_gen_enabled = False
         self.current_chord_variation = "inversion"
         self.current_voicing = "close"
+        self.current_chord_play_mode = "arpeggio"  # "arpeggio" o "block"
+        self.current_humanize_timing = 0.0
+        self.current_humanize_velocity = 0
+        
+        # Note tenute su una tastiera MIDI: se presenti sostituiscono le note della sound cell
+        self.current_input_notes: Voicing = ()
+        
+        # Voicing engine per il chord generator (voicing precalcolati per cella)
+        self.voicing_engine = VoicingEngine()
+        self._previous_voicing: Optional[Voicing] = None
+        
+        # Catena di effetti applicata ai buffer compilati e cache dei pattern compilati
+        self.effect_chain = EffectChain()
+        self._compile_cache: "OrderedDict[tuple, EventBuffer]" = OrderedDict()
+        # La cache è letta dal thread della GUI e dallo scheduler: ogni accesso passa dal lock
+        self._compile_lock = threading.Lock()
+        self.compile_cache_size = 32
+        self.compile_cache_hits = 0
+        self.compile_cache_misses = 0
+        self._last_total_steps = 0  # passi dell'ultimo loop compilato (per le tabelle di velocity)
+        
+        # Listener degli eventi programmati, passati a ogni scheduler (es. flusso WebSocket)
+        self.event_listeners: List[Callable] = []
+        
+        # Ritardo di invio e frequenza degli eventi, registrati dallo scheduler
+        self.metrics = PlaybackMetrics()
     
     def update_parameters(self, sound_cell: SoundCell = None, pattern_type: PatternType = None,
                          octave: int = None, base_duration: float = None,
@@ -116,8 +379,14 @@ class PatternEngine:
                          octave_add: int = None, velocity_curve: str = None, velocity_intensity: float = None,
                          accent_enabled: bool = None, accent_strength: float = None, accent_pattern: str = None,
                          repeater_enabled: bool = None, repeat_count: int = None, repeat_timing: str = None,
-                         chord_gen_enabled: bool = None, chord_variation: str = None, voicing: str = None):
+                         chord_gen_enabled: bool = None, chord_variation: str = None, voicing: str = None,
+                         humanize_timing: float = None, humanize_velocity: int = None,
+                         chord_play_mode: str = None, input_notes: Sequence[int] = None):
         """Aggiorna i parametri in tempo reale durante la riproduzione"""
+        if sound_cell is not None:
+            # I voicing della nuova cella sono pronti prima che il loop li richieda
+            self.voicing_engine.precompute([sound_cell], self.current_octave if octave is None else octave)
+        
         with self.param_lock:
             if sound_cell is not None:
                 self.current_sound_cell = sound_cell
@@ -177,6 +446,100 @@ class PatternEngine:
                 self.current_chord_variation = chord_variation
             if voicing is not None:
                 self.current_voicing = voicing
+            if humanize_timing is not None:
+                self.current_humanize_timing = humanize_timing
+            if humanize_velocity is not None:
+                self.current_humanize_velocity = humanize_velocity
+            if chord_play_mode is not None:
+                self.current_chord_play_mode = chord_play_mode
+            if input_notes is not None:
+                self.current_input_notes = tuple(sorted(input_notes))
+        
+        # Prepara in background le tabelle di velocity per i nuovi valori di curva/accento
+        if any(value is not None for value in (velocity_curve, velocity_intensity, accent_enabled,
+                                               accent_strength, accent_pattern)):
+            self._prefetch_velocity_tables()
+    
+    def _prefetch_velocity_tables(self, changes: Optional[dict] = None) -> list:
+        """Costruisce le tabelle di velocity fuori dal thread di riproduzione
+
+        changes sono i parametri di un cambio in attesa: hanno la precedenza su quelli correnti.
+        """
+        total_steps = self._last_total_steps
+        if total_steps <= 0:
+            return []
+        changes = changes or {}
+        with self.param_lock:
+            def value(name):
+                return changes[name] if changes.get(name) is not None else getattr(self, f"current_{name}")
+            curve = (value('velocity_curve'), value('velocity_intensity'), total_steps)
+            accent = None
+            if value('accent_enabled'):
+                accent = (value('accent_pattern'), value('accent_strength'), total_steps)
+        return VELOCITY_TABLES.prefetch(curve=curve, accent=accent)
+    
+    def schedule_parameters(self, quantize: Optional[str] = None, **changes) -> Optional[PendingChange]:
+        """Applica i cambi di parametri al prossimo confine di quantizzazione
+
+        Durante la riproduzione i cambi vengono messi in attesa e applicati dallo scheduler
+        sul primo step, beat, bar o loop non ancora programmato; da fermo sono immediati.
+        Restituisce il cambio in attesa (None se applicato subito).
+        """
+        quantize = quantize or self.quantize
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Quantizzazione non valida: {quantize}")
+        if not self.is_playing:
+            self.update_parameters(**changes)
+            return None
+        if changes.get('sound_cell') is not None:
+            # I voicing della nuova cella sono pronti prima del confine
+            octave = changes.get('octave') or self.current_octave
+            self.voicing_engine.precompute([changes['sound_cell']], octave)
+        if any(changes.get(name) is not None for name in VELOCITY_PARAMETERS):
+            # Le tabelle sono pronte prima del confine, non costruite dallo scheduler
+            self._prefetch_velocity_tables(changes)
+        change = PendingChange(changes, quantize)
+        with self.param_lock:
+            self._pending_changes.append(change)
+        return change
+    
+    def queue_chord_change(self, sound_cell: SoundCell, quantize: Optional[str] = None) -> bool:
+        """Mette in coda un cambio di accordo sul prossimo confine (note, beat, bar o loop)
+
+        Gli eventi del nuovo accordo vengono compilati subito, così al confine lo scheduler
+        li trova già pronti. Da fermo il cambio è immediato; restituisce True se è in coda.
+        """
+        quantize = quantize or self.chord_quantize
+        if quantize not in CHORD_QUANTIZE:
+            raise ValueError(f"Confine di cambio accordo non valido: {quantize}")
+        if not self.is_playing:
+            self.update_parameters(sound_cell=sound_cell)
+            return False
+        self.prepare_chord(sound_cell)
+        with self.param_lock:
+            self._pending_changes.append(PendingChange({'sound_cell': sound_cell},
+                                                       CHORD_QUANTIZE[quantize], chord=True))
+        return True
+    
+    def prepare_chord(self, sound_cell: SoundCell) -> Optional[EventBuffer]:
+        """Compila in anticipo il pattern corrente sul nuovo accordo (resta nella cache)"""
+        params = self.get_current_parameters()
+        params['sound_cell'] = sound_cell
+        if not params['pattern_type']:
+            return None
+        self.voicing_engine.precompute([sound_cell], params['octave'])
+        voicing = self.resolve_voicing(params, self._previous_voicing)
+        return self.compile_from_parameters(params, voicing)
+    
+    def pending_chords(self) -> List[SoundCell]:
+        """Accordi in coda, nell'ordine in cui verranno suonati"""
+        with self.param_lock:
+            return [change.changes['sound_cell'] for change in self._pending_changes if change.chord]
+    
+    def clear_chord_queue(self):
+        """Scarta gli accordi in coda non ancora suonati"""
+        with self.param_lock:
+            self._pending_changes = [change for change in self._pending_changes if not change.chord]
     
     def update_parameters_safe(self, sound_cell: SoundCell = None, pattern_type: PatternType = None,
                               octave: int = None, base_duration: float = None,
@@ -236,9 +599,152 @@ class PatternEngine:
                 'repeat_timing': self.current_repeat_timing,
                 'chord_gen_enabled': self.current_chord_gen_enabled,
                 'chord_variation': self.current_chord_variation,
-                'voicing': self.current_voicing
+                'voicing': self.current_voicing,
+                'chord_play_mode': self.current_chord_play_mode,
+                'humanize_timing': self.current_humanize_timing,
+                'humanize_velocity': self.current_humanize_velocity,
+                'input_notes': self.current_input_notes
             }
+    
+    def effective_bpm(self) -> float:
+        """Tempo effettivo della riproduzione (BPM per velocità di riproduzione)"""
+        speed = self.current_playback_speed if self.current_playback_speed > 0 else 1.0
+        return self.current_bpm * speed
+    
+    def _midi_ready(self) -> bool:
+        return bool(self.midi_output and self.midi_output.initialized and self.midi_output.output_port)
+    
+    def set_clock_output(self, enabled: bool):
+        """Abilita l'invio di MIDI Clock e Start/Stop durante la riproduzione"""
+        self.clock_output_enabled = enabled
+    
+    def follow_external_clock(self, port_name: Optional[str] = None) -> bool:
+        """Aggancia la riproduzione al clock di una porta MIDI in ingresso"""
+        follower = ExternalClockFollower(self.effective_bpm)
+        if not follower.open(port_name):
+            return False
+        self.use_external_clock(follower)
+        return True
+    
+    def use_external_clock(self, follower: ExternalClockFollower):
+        """Usa un follower già configurato come timebase: Start riparte da capo, Stop mette in pausa"""
+        self.stop_following_clock()
+        follower.on_start = self._on_external_start
+        follower.on_stop = self._on_external_stop
+        self.external_clock = follower
+    
+    def _on_external_start(self):
+        # Il PLL riparte da zero: lo scheduler si riallinea con una nuova origine (thread di input MIDI)
+        scheduler = self.scheduler
+        if self.is_playing and scheduler is not None and scheduler.timebase is self.external_clock:
+            scheduler.restart()
+    
+    def _on_external_stop(self):
+        # Lo scheduler resta in attesa finché il clock è fermo; le note accese vengono spente
+        if self.is_playing and self._midi_ready():
+            self.midi_output.stop_all_notes()
+    
+    def stop_following_clock(self):
+        """Torna al clock interno"""
+        if self.external_clock:
+            self.external_clock.close()
+        self.external_clock = None
+    
+    def set_effect_order(self, order: Sequence[str]):
+        """Imposta l'ordine degli stadi della catena di effetti (es. delay prima dell'accento)"""
+        with self.param_lock:
+            self.effect_chain.set_order(order)
+    
+    @traced(category="pattern")
+    def compile_pattern(self, sound_cell: SoundCell, pattern_type: PatternType,
+                        octave: int = 4, base_duration: float = 0.3, duration_octaves: int = 1,
+                        reverse: bool = False, playback_speed: float = 1.0,
+                        voicing: Optional[Voicing] = None, block: bool = False) -> EventBuffer:
+        """Compila il pattern in un buffer di eventi con onset relativi all'inizio del loop
+
+        Con un voicing (note MIDI) il pattern arpeggia il voicing invece delle note della cella;
+        con block=True ogni passo del pattern suona l'intero voicing come accordo.
+        """
+        key = None
+        if pattern_type not in RANDOM_PATTERNS:
+            key = (sound_cell_key(sound_cell), pattern_type, octave, base_duration,
+                   duration_octaves, reverse, playback_speed, voicing, block)
+            with self._compile_lock:
+                cached = self._compile_cache.get(key)
+                if cached is not None:
+                    self._compile_cache.move_to_end(key)
+                    self.compile_cache_hits += 1
+                    return cached
+                self.compile_cache_misses += 1
         
+        # Genera le note per tutte le ottave specificate, come coppie (evento, accordo block)
+        pattern_notes = []
+        for octave_offset in range(duration_octaves):
+            if voicing:
+                shifted = tuple(min(127, midi_note + 12 * octave_offset) for midi_note in voicing)
+                events = self.generate_voiced_pattern_notes(shifted, pattern_type, base_duration)
+                pattern_notes.extend((event, shifted if block else None) for event in events)
+            else:
+                events = self.generate_pattern_notes(sound_cell, pattern_type, octave + octave_offset, base_duration)
+                pattern_notes.extend((event, None) for event in events)
+        if reverse:
+            pattern_notes.reverse()
+        
+        # Converte ritardi e durate in onset assoluti (applica la velocità di riproduzione)
+        speed = playback_speed if playback_speed > 0 else 1.0
+        onsets, gates, midi_notes, velocities, steps = [], [], [], [], []
+        clock = 0.0
+        for step, (note_event, block_chord) in enumerate(pattern_notes):
+            clock += note_event.delay / speed
+            step_duration = note_event.duration / speed
+            # In modalità block ogni passo suona l'intero voicing con il ritmo del pattern
+            chord = block_chord or (self.midi_generator.note_to_midi_number(note_event.note, note_event.octave),)
+            for midi_note in chord:
+                onsets.append(clock)
+                gates.append(step_duration * GATE_RATIO)
+                midi_notes.append(midi_note)
+                velocities.append(int(note_event.volume * 127))
+                steps.append(step)
+            clock += step_duration
+        
+        buffer = EventBuffer.from_events(onsets, gates, midi_notes, velocities, clock, key,
+                                         steps=steps, total_steps=len(pattern_notes))
+        if key is not None:
+            with self._compile_lock:
+                self._compile_cache[key] = buffer
+                while len(self._compile_cache) > self.compile_cache_size:
+                    self._compile_cache.popitem(last=False)
+        return buffer
+    
+    def resolve_voicing(self, params: dict, previous: Optional[Voicing] = None) -> Optional[Voicing]:
+        """Voicing da suonare per i parametri indicati (None se il chord generator è spento)
+
+        Le note tenute su una tastiera MIDI sono già un voicing e hanno la precedenza.
+        """
+        if params.get('input_notes'):
+            return tuple(params['input_notes'])
+        if not params.get('chord_gen_enabled') or not params.get('sound_cell'):
+            return None
+        return self.voicing_engine.voice(params['sound_cell'], params['voicing'],
+                                         params['chord_variation'], params['octave'], previous)
+    
+    def compile_from_parameters(self, params: dict, voicing: Optional[Voicing] = None) -> EventBuffer:
+        """Compila il loop descritto da uno snapshot dei parametri"""
+        return self.compile_pattern(params['sound_cell'], params['pattern_type'], params['octave'],
+                                    params['base_duration'], params['duration_octaves'],
+                                    params['reverse'], params['playback_speed'], voicing,
+                                    voicing is not None and params.get('chord_play_mode') == "block")
+    
+    def render_pattern_events(self, **overrides) -> EventBuffer:
+        """Compila il pattern corrente con l'intera catena di effetti (per rendering offline)"""
+        params = self.get_current_parameters()
+        params.update(overrides)
+        if not params['sound_cell'] or not params['pattern_type']:
+            return EventBuffer.empty()
+        buffer = self.compile_from_parameters(params, self.resolve_voicing(params))
+        chain = EffectChain.from_parameters(params, order=self.effect_chain.order)
+        return chain.process(buffer)
+    
     def generate_pattern_notes(self, sound_cell: SoundCell, pattern_type: PatternType, 
                              octave: int = 4, base_duration: float = 0.3) -> List[NoteEvent]:
         """Genera una sequenza di note basata sul pattern selezionato"""
@@ -248,7 +754,21 @@ class PatternEngine:
         
         # Genera le note base per l'ottava specificata
         base_notes = self._generate_base_notes(notes, octave, base_duration)
-        
+        return self._arrange_pattern(base_notes, pattern_type, base_duration)
+    
+    def generate_voiced_pattern_notes(self, midi_notes: Sequence[int], pattern_type: PatternType,
+                                      base_duration: float = 0.3) -> List[NoteEvent]:
+        """Genera il pattern a partire da un voicing (note MIDI) invece che dalla sound cell"""
+        base_notes = [NoteEvent(note=Note(midi_note % 12), octave=midi_note // 12 - 1,
+                                duration=base_duration, volume=0.7)
+                      for midi_note in midi_notes]
+        if not base_notes:
+            return []
+        return self._arrange_pattern(base_notes, pattern_type, base_duration)
+    
+    def _arrange_pattern(self, base_notes: List[NoteEvent], pattern_type: PatternType,
+                         base_duration: float) -> List[NoteEvent]:
+        """Dispone le note base secondo il pattern selezionato"""
         if pattern_type == PatternType.UP:
             return self._pattern_up(base_notes, base_duration)
         elif pattern_type == PatternType.DOWN:
@@ -868,7 +1388,8 @@ class PatternEngine:
                     octave_add: int = 0, velocity_curve: str = "linear", velocity_intensity: float = 1.0,
                     accent_enabled: bool = False, accent_strength: float = 0.5, accent_pattern: str = "every_beat",
                     repeater_enabled: bool = False, repeat_count: int = 2, repeat_timing: str = "immediate",
-                    chord_gen_enabled: bool = False, chord_variation: str = "inversion", voicing: str = "close"):
+                    chord_gen_enabled: bool = False, chord_variation: str = "inversion", voicing: str = "close",
+                    chord_play_mode: str = "arpeggio"):
         """Riproduce un pattern con le note specificate"""
         if self.is_playing:
             self.stop_pattern()
@@ -877,97 +1398,36 @@ class PatternEngine:
         self.update_parameters(sound_cell, pattern_type, octave, base_duration, loop, reverse, duration_octaves, playback_speed, bpm, pause_duration,
                               delay_enabled, delay_time, delay_feedback, delay_mix, delay_type, delay_repeats,
                               octave_add, velocity_curve, velocity_intensity, accent_enabled, accent_strength, accent_pattern, 
-                              repeater_enabled, repeat_count, repeat_timing, chord_gen_enabled, chord_variation, voicing)
+                              repeater_enabled, repeat_count, repeat_timing, chord_gen_enabled, chord_variation, voicing,
+                              chord_play_mode=chord_play_mode)
         
-        self.is_playing = True
-        self.is_looping = loop
-        self.stop_requested = False
-        self.playback_id += 1
+        self.play_source(self.prepare_playback(loop), callback)
+    
+    def play_source(self, source: EventSource, callback: Optional[Callable] = None):
+        """Avvia lo scheduler a lookahead su una sorgente già preparata (loop o progressione)"""
+        scheduler = LookaheadScheduler(self.lookahead)
+        scheduler.listeners = self.event_listeners
+        scheduler.metrics = self.metrics
+        scheduler.add_source(source)
+        # Con un clock esterno la timeline segue i suoi impulsi, altrimenti può emettere il clock
+        send_clock = False
+        if self.external_clock is not None:
+            scheduler.timebase = self.external_clock
+        elif self.clock_output_enabled and self._midi_ready():
+            scheduler.add_source(MidiClockSource(self.midi_output, self.effective_bpm))
+            send_clock = True
+        scheduler.start()
+        self.scheduler = scheduler
         
         def play_worker():
             try:
-                iteration_count = 0
-                while not self.stop_requested and (not loop or self.is_looping):
-                    # Ottieni i parametri correnti (potrebbero essere cambiati durante la riproduzione)
-                    params = self.get_current_parameters()
-                    current_sound_cell = params['sound_cell']
-                    current_pattern_type = params['pattern_type']
-                    current_octave = params['octave']
-                    current_base_duration = params['base_duration']
-                    current_reverse = params['reverse']
-                    current_duration_octaves = params['duration_octaves']
-                    current_playback_speed = params['playback_speed']
-                    current_pause_duration = params['pause_duration']
-                    
-                    if not current_sound_cell or not current_pattern_type:
-                        break
-                    
-                    # Genera le note del pattern per ogni ottava di durata
-                    all_pattern_notes = []
-                    
-                    # Genera le note per tutte le ottave specificate (sia per MIDI che pygame)
-                    for octave_offset in range(current_duration_octaves):
-                        octave_to_use = current_octave + octave_offset
-                        pattern_notes = self.generate_pattern_notes(current_sound_cell, current_pattern_type, octave_to_use, current_base_duration)
-                        all_pattern_notes.extend(pattern_notes)
-                    
-                    # Debug info (commentato per ridurre output)
-                    # if self.midi_output and self.midi_output.initialized and self.midi_output.output_port:
-                    #     print(f"MIDI mode: Generated {len(all_pattern_notes)} notes for {current_duration_octaves} octaves")
-                    # else:
-                    #     print(f"Pygame mode: Generated {len(all_pattern_notes)} notes for {current_duration_octaves} octaves")
-                    
-                    # Applica reverse se richiesto
-                    if current_reverse:
-                        all_pattern_notes = list(reversed(all_pattern_notes))
-                    
-                    # Riproduce le note con timing corretto
-                    for i, note_event in enumerate(all_pattern_notes):
-                        if self.stop_requested:
-                            break
-
-                        # Calcola il numero MIDI
-                        midi_note = self.midi_generator.note_to_midi_number(note_event.note, note_event.octave)
-
-                        # Applica il ritardo se specificato (applica la velocità di riproduzione)
-                        if note_event.delay > 0:
-                            time.sleep(note_event.delay / current_playback_speed)
-
-                        if self.stop_requested:
-                            break
-
-                        # La durata regola il tempo tra le note
-                        adjusted_duration = note_event.duration / current_playback_speed
-                        
-                        # Riproduce la nota (ora non bloccante)
-                        self._play_single_note(midi_note, adjusted_duration, note_event.volume, i, len(all_pattern_notes))
-                        
-                        # Il thread principale ora funge da metronomo, attendendo la durata della nota
-                        # prima di passare alla successiva.
-                        time.sleep(adjusted_duration)
-                    
-                    # Se non è in loop, esce dopo una volta
-                    if not loop:
-                        break
-                    
-                    # Non limitare le iterazioni per MIDI - permette loop completo
-                    # Il controllo del loop è gestito dalla variabile loop e is_looping
-                    
-                    # Incrementa il contatore delle iterazioni per debug
-                    iteration_count += 1
-                    
-                    # Aggiunge pausa tra le ripetizioni del pattern se specificata
-                    if current_pause_duration > 0:
-                        # Controlla se dobbiamo fermarci durante la pausa
-                        pause_chunks = int(current_pause_duration / 0.01) + 1
-                        for _ in range(pause_chunks):
-                            if self.stop_requested:
-                                break
-                            time.sleep(0.01)
-                
+                # Lo scheduler programma gli eventi con una finestra di anticipo sul clock assoluto
+                scheduler.run()
             except (OSError, RuntimeError, ValueError) as e:
                 print(f"Errore nella riproduzione del pattern: {e}")
             finally:
+                if send_clock:
+                    self.midi_output.send_stop()
                 self.is_playing = False
                 if callback:
                     callback()
@@ -976,321 +1436,43 @@ class PatternEngine:
         self.current_thread.daemon = True
         self.current_thread.start()
     
-    def _play_single_note(self, midi_note: int, step_duration: float, volume: float, note_index: int = 0, total_notes: int = 1):
-        """Riproduce una singola nota in modo non bloccante con controlli di stop"""
+    def prepare_playback(self, loop: bool = False) -> PatternLoopSource:
+        """Prepara lo stato di riproduzione e restituisce la sorgente del loop per uno scheduler"""
+        self.reset_playback_state(loop)
+        return PatternLoopSource(self, loop)
+    
+    def reset_playback_state(self, loop: bool = False):
+        """Azzera lo stato di riproduzione prima di avviare una nuova sorgente"""
+        self._previous_voicing = None
+        self.is_playing = True
+        self.is_looping = loop
+        self.stop_requested = False
+        self.playback_id += 1
+        with self.param_lock:
+            self._pending_changes = []
+    
+    def _play_single_note(self, midi_note: int, gate_duration: float, velocity: int) -> bool:
+        """Avvia una singola nota; True se la nota richiede un NOTE OFF esplicito (MIDI)"""
         try:
             if self.stop_requested:
-                return
+                return False
             
-            # Se MIDI è configurato, invia via MIDI
+            # Se MIDI è configurato, invia via MIDI (il NOTE OFF è un evento della timeline)
             if self.midi_output and self.midi_output.initialized and self.midi_output.output_port:
-                if not isinstance(midi_note, int):
-                    print(f"WARNING: midi_note in _play_single_note is not int: {type(midi_note)} = {midi_note}")
-                    midi_note = int(midi_note) if isinstance(midi_note, (int, float)) else 60
-                self._play_single_note_midi(midi_note, step_duration, volume, note_index, total_notes)
-                return
+                return self.midi_output.send_note_on(midi_note, velocity, self.midi_channel)
                 
             # Altrimenti usa pygame
-            self._play_single_note_pygame(midi_note, step_duration, volume)
+            self._play_single_note_pygame(midi_note, gate_duration, velocity / 127)
         except (OSError, RuntimeError, ValueError) as e:
             print(f"Errore nella riproduzione della nota: {e}")
+        return False
     
-    def _apply_midi_effects(self, midi_note: int, velocity: int, note_index: int = 0, total_notes: int = 1):
-        """Applica gli effetti MIDI a una nota"""
-        # Ottieni i parametri correnti
-        params = self.get_current_parameters()
-        
-        # Ottava addition
-        if params['octave_add'] != 0:
-            midi_note += params['octave_add'] * 12
-            midi_note = max(0, min(127, midi_note))  # Clamp to valid MIDI range
-        
-        # Velocity curve
-        if params['velocity_curve'] != "linear":
-            velocity = self._apply_velocity_curve(velocity, note_index, total_notes, params['velocity_curve'], params['velocity_intensity'])
-        
-        # Accent patterns
-        if params['accent_enabled']:
-            velocity = self._apply_accent_pattern(velocity, note_index, total_notes, params['accent_pattern'], params['accent_strength'])
-        
-        return midi_note, velocity
-    
-    def _apply_delay_effect(self, midi_note: int, velocity: int, duration: float):
-        """Applica l'effetto delay (MIDI echo) con controlli avanzati"""
-        params = self.get_current_parameters()
-        
-        if not params['delay_enabled']:
-            return [(midi_note, velocity, duration)]
-        
-        # Parametri del delay
-        feedback = params['delay_feedback']
-        mix = params['delay_mix']
-        delay_type = params['delay_type']
-        try:
-            max_repeats = int(params['delay_repeats'])  # Assicura che sia un intero
-        except (ValueError, TypeError):
-            max_repeats = 3  # Valore di default
-        
-        # Crea gli echi
-        echoes = []
-        
-        # Nota originale (dry signal)
-        if mix < 1.0:  # Se mix non è 100% wet
-            echoes.append((midi_note, velocity, duration))
-        
-        # Genera gli echi
-        current_velocity = velocity
-        current_duration = duration
-        
-        for i in range(max_repeats):
-            # Calcola la velocità dell'eco
-            current_velocity = int(velocity * (feedback ** (i + 1)))
-            if current_velocity < 10:  # Soglia minima
-                break
-            
-            # Calcola la durata dell'eco
-            current_duration = duration * (0.8 ** (i + 1))
-            
-            # Applica il tipo di delay
-            if delay_type == "Ping-Pong":
-                # Alterna canali (simulato con ottave diverse)
-                channel_offset = 12 if i % 2 == 0 else -12
-                echo_note = max(0, min(127, midi_note + channel_offset))
-            elif delay_type == "Dotted":
-                # Delay puntato (1.5x tempo)
-                current_duration *= 1.5
-                echo_note = midi_note
-            elif delay_type == "Triplet":
-                # Delay in terzine (0.67x tempo)
-                current_duration *= 0.67
-                echo_note = midi_note
-            elif delay_type == "Reverse":
-                # Echi al contrario (ottava più bassa)
-                echo_note = max(0, min(127, midi_note - 12))
-            elif delay_type == "Stutter":
-                # Ripetizioni rapide con durata ridotta
-                current_duration *= 0.3
-                echo_note = midi_note
-            else:  # Standard
-                echo_note = midi_note
-            
-            # Aggiungi l'eco
-            echoes.append((echo_note, current_velocity, current_duration))
-        
-        return echoes
-    
-    def _apply_repeater_effect(self, midi_note: int, velocity: int, duration: float):
-        """Applica l'effetto note repeater"""
-        params = self.get_current_parameters()
-        
-        if not params['repeater_enabled']:
-            return [(midi_note, velocity, duration)]
-        
-        try:
-            repeat_count = int(params['repeat_count'])  # Assicura che sia un intero
-        except (ValueError, TypeError):
-            repeat_count = 2  # Valore di default
-        timing = params['repeat_timing']
-        
-        repeats = []
-        
-        for i in range(repeat_count):
-            if timing == "immediate":
-                # Ripetizione immediata
-                repeat_duration = duration * 0.3
-            elif timing == "staccato":
-                # Staccato - note corte e separate
-                repeat_duration = duration * 0.2
-            elif timing == "legato":
-                # Legato - note che si sovrappongono
-                repeat_duration = duration * 0.8
-            elif timing == "swing":
-                # Swing - durata variabile
-                repeat_duration = duration * (0.3 if i % 2 == 0 else 0.7)
-            else:
-                repeat_duration = duration * 0.5
-            
-            repeats.append((midi_note, velocity, repeat_duration))
-        
-        return repeats
-    
-    def _apply_velocity_curve(self, velocity: int, note_index: int, total_notes: int, curve_type: str, intensity: float):
-        """Applica una curva di velocità alle note"""
-        if curve_type == "linear":
-            return velocity
-        
-        # Normalizza l'indice della nota (0-1)
-        normalized_index = note_index / max(1, total_notes - 1) if total_notes > 1 else 0
-        
-        if curve_type == "exponential":
-            # Curva esponenziale crescente
-            curve_value = normalized_index ** (1 / intensity)
-        elif curve_type == "logarithmic":
-            # Curva logaritmica crescente
-            curve_value = (normalized_index ** intensity) if intensity > 0 else normalized_index
-        elif curve_type == "sine":
-            # Curva sinusoidale
-            import math
-            curve_value = (math.sin(normalized_index * math.pi) + 1) / 2
-        elif curve_type == "random":
-            # Velocità casuale
-            curve_value = random.random()
-        else:
-            curve_value = normalized_index
-        
-        # Applica la curva alla velocità
-        new_velocity = int(velocity * curve_value * intensity)
-        return max(1, min(127, new_velocity))
-    
-    def _apply_accent_pattern(self, velocity: int, note_index: int, total_notes: int, pattern: str, strength: float):
-        """Applica pattern di accento alle note"""
-        if pattern == "every_beat":
-            # Accentua ogni nota
-            accent_multiplier = 1.0 + strength
-        elif pattern == "every_other":
-            # Accentua ogni altra nota
-            accent_multiplier = 1.0 + (strength if note_index % 2 == 0 else 0)
-        elif pattern == "random":
-            # Accentua casualmente
-            accent_multiplier = 1.0 + (strength if random.random() < 0.3 else 0)
-        elif pattern == "crescendo":
-            # Crescendo - accentua di più verso la fine
-            normalized_index = note_index / max(1, total_notes - 1) if total_notes > 1 else 0
-            accent_multiplier = 1.0 + (strength * normalized_index)
-        elif pattern == "diminuendo":
-            # Diminuendo - accentua di più all'inizio
-            normalized_index = note_index / max(1, total_notes - 1) if total_notes > 1 else 0
-            accent_multiplier = 1.0 + (strength * (1 - normalized_index))
-        else:
-            accent_multiplier = 1.0
-        
-        new_velocity = int(velocity * accent_multiplier)
-        return max(1, min(127, new_velocity))
-    
-    def _play_single_note_midi(self, midi_note: int, step_duration: float, volume: float, note_index: int = 0, total_notes: int = 1):
-        """Invia messaggi MIDI NOTE ON e schedula NOTE OFF e delay in background."""
-        try:
-            if self.stop_requested:
-                return
-
-            params = self.get_current_parameters()
-            velocity = int(volume * 127)
-            
-            # Calcola la durata del gate (es. 80% della durata del passo)
-            gate_duration = step_duration * 0.8 
-
-            # Applica effetti che modificano la nota base (non-temporali)
-            midi_note, velocity = self._apply_midi_effects(midi_note, velocity, note_index, total_notes)
-
-            # Gestione del segnale WET (delay) in background
-            if params['delay_enabled'] and params['delay_mix'] > 0:
-                echo_base_velocity = int(velocity * params['delay_mix'])
-                self._play_delay_echoes_async(midi_note, echo_base_velocity, gate_duration, params) # Passa gate_duration
-
-            # Gestione del segnale DRY (nota originale)
-            dry_velocity = int(velocity * (1.0 - params['delay_mix']))
-            
-            if dry_velocity > 0:
-                if params['repeater_enabled']:
-                    self._play_repeater_async(midi_note, dry_velocity, gate_duration, params) # Passa gate_duration
-                else:
-                    self.midi_output.send_note_on(midi_note, dry_velocity)
-                    
-                    def note_off_worker(note, delay):
-                        time.sleep(delay)
-                        if not self.stop_requested:
-                            self.midi_output.send_note_off(note)
-                    
-                    t = threading.Thread(target=note_off_worker, args=(midi_note, gate_duration)) # Usa gate_duration
-                    t.daemon = True
-                    t.start()
-            # La funzione non attende (non è bloccante), il timing è gestito dal chiamante (play_worker)
-
-        except (OSError, RuntimeError, AttributeError) as e:
-            print(f"Errore nell'invio MIDI: {e}")
-
-    def _play_delay_echoes_async(self, midi_note: int, velocity: int, duration: float, params: dict):
-        """Genera e riproduce gli echi del delay in un thread separato, in modo sincrono all'interno del thread."""
-        def delay_worker():
-            delay_time = params['delay_time']
-            feedback = params['delay_feedback']
-            max_repeats = params['delay_repeats']
-            delay_type = params['delay_type']
-            playback_speed = params.get('playback_speed', 1.0)  # Get playback_speed safely
-
-            # Calcola il tempo di delay effettivo in base al tipo prima del loop
-            actual_delay_time = delay_time
-            if delay_type == "Dotted":
-                actual_delay_time *= 1.5
-            elif delay_type == "Triplet":
-                actual_delay_time *= 0.67
-
-            # Applica la velocità di riproduzione al tempo di delay
-            adjusted_delay_time = actual_delay_time / playback_speed if playback_speed > 0 else actual_delay_time
-
-            for i in range(max_repeats):
-                # Usa il tempo di delay calcolato e costante per ogni eco
-                time.sleep(adjusted_delay_time)
-                if self.stop_requested: return
-
-                echo_velocity = int(velocity * (feedback ** (i + 1)))
-                # Abbassa la soglia per permettere più ripetizioni a basso volume
-                if echo_velocity < 2: break
-
-                echo_duration = duration * (0.8 ** (i + 1))
-                echo_note = self._get_echo_note(midi_note, i, delay_type)
-
-                if params['repeater_enabled']:
-                    repeated_echoes = self._apply_repeater_effect(echo_note, echo_velocity, echo_duration)
-                    for r_note, r_vel, r_dur in repeated_echoes:
-                        if self.stop_requested: break
-                        self.midi_output.send_note_on(r_note, r_vel)
-                        time.sleep(r_dur)
-                        if not self.stop_requested:
-                            self.midi_output.send_note_off(r_note)
-                else:
-                    self.midi_output.send_note_on(echo_note, echo_velocity)
-                    time.sleep(echo_duration)
-                    if not self.stop_requested:
-                        self.midi_output.send_note_off(echo_note)
-
-        t = threading.Thread(target=delay_worker)
-        t.daemon = True
-        t.start()
-
-    def _play_repeater_async(self, midi_note: int, velocity: int, duration: float, params: dict):
-        """Esegue l'effetto repeater in un thread separato."""
-        def repeater_worker():
-            repeated_notes = self._apply_repeater_effect(midi_note, velocity, duration)
-            for r_note, r_vel, r_dur in repeated_notes:
-                if self.stop_requested: break
-                self.midi_output.send_note_on(r_note, r_vel)
-                time.sleep(r_dur)
-                if not self.stop_requested:
-                    self.midi_output.send_note_off(r_note)
-
-        t = threading.Thread(target=repeater_worker)
-        t.daemon = True
-        t.start()
-
-    def _get_echo_note(self, base_note: int, echo_index: int, delay_type: str) -> int:
-        """Calcola la nota MIDI per un eco in base al tipo di delay."""
-        if delay_type == "Ping-Pong":
-            offset = 12 if echo_index % 2 == 0 else -12
-            return max(0, min(127, base_note + offset))
-        elif delay_type == "Reverse":
-            return max(0, min(127, base_note - 12))
-        return base_note
-    
-    def _play_single_note_pygame(self, midi_note: int, step_duration: float, volume: float):
+    def _play_single_note_pygame(self, midi_note: int, gate_duration: float, volume: float):
         """Riproduce una singola nota via pygame con gate duration."""
         try:
             if self.stop_requested:
                 return
 
-            # Calcola la durata del gate (es. 80% della durata del passo)
-            gate_duration = step_duration * 0.8 
-            
             # Calcola la frequenza dalla nota MIDI
             frequency = 440.0 * (2 ** ((midi_note - 69) / 12.0))
             
@@ -1322,28 +1504,19 @@ class PatternEngine:
                 # Crea array stereo
                 stereo_wave = np.column_stack((wave, wave))
                 
-                # Riproduce il suono in un thread separato per non bloccare il metronomo
+                # Il mixer ferma il suono dopo la gate_duration, senza thread dedicati
                 import pygame
                 sound = pygame.sndarray.make_sound(stereo_wave)
-                
-                def pygame_note_worker(s, d):
-                    s.play()
-                    time.sleep(d) # Attende la gate_duration
-                    s.stop() # Ferma il suono dopo la gate_duration
-                
-                t = threading.Thread(target=pygame_note_worker, args=(sound, gate_duration))
-                t.daemon = True
-                t.start()
+                sound.play(maxtime=int(gate_duration * 1000))
                 
             except ImportError:
                 # Fallback senza numpy
-                import math
                 import pygame
                 arr = []
                 for j in range(frames):
                     time_val = j / sample_rate
                     # Genera onda sinusoidale semplice
-                    wave_val = math.sin(2 * np.pi * frequency * time_val)
+                    wave_val = math.sin(2 * math.pi * frequency * time_val)
                     
                     # Aggiunge fade-in e fade-out
                     fade_samples = int(0.01 * sample_rate)
@@ -1360,15 +1533,7 @@ class PatternEngine:
                     arr.append([wave_val, wave_val])
                 
                 sound = pygame.sndarray.make_sound(arr)
-                
-                def pygame_note_worker(s, d):
-                    s.play()
-                    time.sleep(d) # Attende la gate_duration
-                    s.stop() # Ferma il suono dopo la gate_duration
-                
-                t = threading.Thread(target=pygame_note_worker, args=(sound, gate_duration))
-                t.daemon = True
-                t.start()
+                sound.play(maxtime=int(gate_duration * 1000))
                 
         except (OSError, RuntimeError, ValueError) as e:
             print(f"Errore nella riproduzione della nota: {e}")
@@ -1378,6 +1543,8 @@ class PatternEngine:
         self.stop_requested = True
         self.is_playing = False
         self.is_looping = False
+        if self.scheduler:
+            self.scheduler.stop()
         
         # Ferma TUTTE le note MIDI immediatamente
         if self.midi_output and self.midi_output.initialized and self.midi_output.output_port:
@@ -1394,6 +1561,42 @@ class PatternEngine:
         except (OSError, RuntimeError, AttributeError):
             pass
     
+    def stuck_notes(self) -> int:
+        """Note MIDI accese oltre ogni gate plausibile (o ancora accese a riproduzione ferma)"""
+        if not hasattr(self.midi_output, 'stuck_notes'):
+            return 0
+        return self.midi_output.stuck_notes(STUCK_NOTE_SECONDS if self.is_playing else STOPPED_NOTE_GRACE)
+    
+    def metrics_snapshot(self) -> dict:
+        """Metriche di riproduzione serializzabili in JSON
+
+        Ritardo di invio (µs) rispetto all'istante programmato, eventi al secondo, thread attivi,
+        profondità delle code, note bloccate, contatori dell'uscita MIDI e cache.
+        """
+        scheduler = self.scheduler
+        with self.param_lock:
+            pending_changes = len(self._pending_changes)
+        snapshot = self.metrics.as_dict()
+        snapshot.update({
+            'playing': self.is_playing,
+            'threads': threading.active_count(),
+            'queues': {'scheduled_events': scheduler.pending() if scheduler else 0,
+                       'pending_changes': pending_changes},
+            'stuck_notes': self.stuck_notes(),
+            'caches': {
+                'compile': cache_stats(self.compile_cache_hits, self.compile_cache_misses, len(self._compile_cache)),
+                'effect_chain': cache_stats(self.effect_chain.cache_hits, self.effect_chain.cache_misses,
+                                            len(self.effect_chain._cache)),
+                'velocity_tables': cache_stats(VELOCITY_TABLES.hits, VELOCITY_TABLES.misses,
+                                               len(VELOCITY_TABLES._tables)),
+                'voicing': cache_stats(self.voicing_engine.hits, self.voicing_engine.misses,
+                                       len(self.voicing_engine._cache)),
+            },
+        })
+        if hasattr(self.midi_output, 'metrics'):
+            snapshot['midi_output'] = self.midi_output.metrics()
+        return snapshot
+    
     def is_pattern_playing(self) -> bool:
         """Controlla se un pattern è attualmente in riproduzione"""
         return self.is_playing
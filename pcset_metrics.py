@@ -0,0 +1,212 @@
+"""
+Metriche precalcolate per tutti i 4096 insiemi di classi di altezza
+Luminosità continua (bilancio delle quinte), vettore intervallare, forma primaria e classe
+dell'insieme, tensione e ruvidità psicoacustica (modello di Plomp-Levelt sugli armonici).
+Le tabelle sono indicizzate dalla maschera relativa alla root (bit 0 = root): una cella si
+legge con una sola lettura, e GUI, CLI e ricerca ordinano, filtrano e colorano senza ricalcoli.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from cell_index import all_cells, masks_to_matrix
+from chord_generator import SoundCell
+from chord_recognition import MASK_COUNT, POPCOUNT
+
+
+# Metriche scalari disponibili per ordinare, filtrare e colorare
+METRICS = ("brightness", "tension", "roughness", "cardinality", "set_class")
+
+# Frequenza della root per il calcolo della ruvidità (Do centrale)
+REFERENCE_FREQUENCY = 261.63
+
+# Armonici per nota e loro decadimento di ampiezza
+PARTIALS = 6
+PARTIAL_DECAY = 0.88
+
+# Classi di intervallo considerate dissonanti per la tensione (seconde e tritono)
+DISSONANT_CLASSES = (1, 2, 6)
+
+_ALL_MASKS = np.arange(MASK_COUNT, dtype=np.int32)
+_FULL = MASK_COUNT - 1
+
+
+def rotate_masks(masks, steps: int):
+    """Trasposizione di una o più maschere di `steps` semitoni"""
+    steps %= 12
+    return ((masks << steps) | (masks >> (12 - steps))) & _FULL
+
+
+def relative_mask(sound_cell: SoundCell) -> int:
+    """Maschera della cella trasposta in modo che la root sia il bit 0"""
+    return int(rotate_masks(sound_cell.to_bitmask(), -sound_cell.root.value))
+
+
+def mask_to_pitch_classes(mask: int) -> Tuple[int, ...]:
+    """Classi di altezza (0-11) presenti nella maschera"""
+    return tuple(pc for pc in range(12) if mask >> pc & 1)
+
+
+@dataclass
+class SetMetrics:
+    """Metriche di un insieme di classi di altezza (relativo alla root)"""
+    mask: int
+    cardinality: int
+    brightness: float  # 0 (tutte quinte sotto) - 1 (tutte quinte sopra)
+    tension: float     # quota di seconde e tritoni tra tutti gli intervalli
+    roughness: float
+    interval_vector: Tuple[int, ...]
+    prime_form: Tuple[int, ...]
+    set_class: int     # indice della classe (forma primaria) in ordine di cardinalità
+
+
+def _brightness(bits: np.ndarray) -> np.ndarray:
+    """Bilancio delle quinte rispetto alla root, lungo l'arco più corto che contiene l'insieme"""
+    # Colonna k = classe a k quinte sopra la root
+    steps = np.arange(12)
+    fifths = bits[:, (steps * 7) % 12]
+    # Taglio j del circolo: le posizioni 0..j sono quinte sopra, le altre quinte sotto
+    signed = np.where(steps[None, :] <= steps[:, None], steps[None, :], steps[None, :] - 12).astype(np.float64)
+    spans = np.stack([(fifths * np.maximum(cut, 0)).max(axis=1) + (fifths * np.maximum(-cut, 0)).max(axis=1)
+                      for cut in signed], axis=1)
+    balance = fifths @ signed.T
+    total = fifths @ np.abs(signed).T
+    values = np.where(total > 0, 0.5 + 0.5 * balance / np.maximum(total, 1.0), 0.5)
+    # Con più archi minimi (insiemi simmetrici) si usa la media
+    best = spans == spans.min(axis=1, keepdims=True)
+    return (values * best).sum(axis=1) / best.sum(axis=1)
+
+
+def _interval_vectors(bits: np.ndarray) -> np.ndarray:
+    """Vettori intervallari (4096 x 6)"""
+    vectors = np.stack([(bits * np.roll(bits, -k, axis=1)).sum(axis=1) for k in range(1, 7)], axis=1)
+    vectors[:, 5] //= 2  # il tritono viene contato due volte
+    return vectors.astype(np.uint8)
+
+
+def _prime_forms() -> np.ndarray:
+    """Forma primaria (Rahn) come maschera: la minima tra trasposizioni e inversioni"""
+    inverted = np.zeros(MASK_COUNT, dtype=np.int32)
+    for pc in range(12):
+        inverted |= ((_ALL_MASKS >> pc) & 1) << ((12 - pc) % 12)
+    candidates = [rotate_masks(masks, steps) for masks in (_ALL_MASKS, inverted) for steps in range(12)]
+    return np.min(candidates, axis=0)
+
+
+def _roughness(bits: np.ndarray) -> np.ndarray:
+    """Ruvidità di Plomp-Levelt (parametri di Sethares) sommata su tutte le coppie di armonici"""
+    frequencies = REFERENCE_FREQUENCY * 2.0 ** (np.arange(12) / 12.0)
+    partials = frequencies[:, None] * np.arange(1, PARTIALS + 1)[None, :]
+    amplitudes = np.broadcast_to(PARTIAL_DECAY ** np.arange(PARTIALS), partials.shape)
+    f1, f2 = partials[:, None, :, None], partials[None, :, None, :]
+    a1, a2 = amplitudes[:, None, :, None], amplitudes[None, :, None, :]
+    scale = 0.24 / (0.0207 * np.minimum(f1, f2) + 18.96)
+    delta = np.abs(f2 - f1)
+    pair = np.minimum(a1, a2) * (np.exp(-3.5 * scale * delta) - np.exp(-5.75 * scale * delta))
+    # Matrice 12 x 12 tra classi di altezza; gli armonici di una stessa nota non contano
+    matrix = pair.sum(axis=(2, 3))
+    np.fill_diagonal(matrix, 0.0)
+    return 0.5 * np.einsum('mi,ij,mj->m', bits, matrix, bits)
+
+
+class PCSetMetrics:
+    """Tabelle delle metriche su tutte le maschere, costruite una volta in forma vettoriale"""
+
+    def __init__(self):
+        bits = masks_to_matrix(_ALL_MASKS).astype(np.float64)
+        self.cardinality = POPCOUNT.astype(np.int32)
+        self.brightness = _brightness(bits)
+        self.interval_vectors = _interval_vectors(bits)
+        pairs = self.cardinality * (self.cardinality - 1) // 2
+        dissonant = self.interval_vectors[:, [k - 1 for k in DISSONANT_CLASSES]].sum(axis=1)
+        self.tension = np.where(pairs > 0, dissonant / np.maximum(pairs, 1), 0.0)
+        self.roughness = _roughness(bits)
+        self.prime_forms = _prime_forms()
+        # Classi ordinate per cardinalità e poi per forma primaria
+        classes = np.unique(self.prime_forms)
+        classes = classes[np.lexsort((classes, POPCOUNT[classes]))]
+        self.set_class_masks = classes
+        lookup = np.empty(MASK_COUNT, dtype=np.int32)
+        lookup[classes] = np.arange(len(classes))
+        self.set_class = lookup[self.prime_forms]
+
+        self._tables: Dict[str, np.ndarray] = {metric: getattr(self, metric) for metric in METRICS}
+        for table in (*self._tables.values(), self.interval_vectors, self.prime_forms, self.set_class_masks):
+            table.setflags(write=False)
+
+        # Maschere relative delle celle della Color Tree e intervallo dei valori per i colori
+        self.cells = all_cells()
+        self.cell_masks = np.array([relative_mask(cell) for cell in self.cells], dtype=np.int32)
+        self._ranges = {metric: (float(table[self.cell_masks].min()), float(table[self.cell_masks].max()))
+                        for metric, table in self._tables.items()}
+
+    def table(self, metric: str) -> np.ndarray:
+        """Tabella (4096 valori) di una metrica scalare"""
+        try:
+            return self._tables[metric]
+        except KeyError:
+            raise ValueError(f"Metrica sconosciuta: {metric} (disponibili: {', '.join(METRICS)})") from None
+
+    def metrics(self, mask: int) -> SetMetrics:
+        """Tutte le metriche di una maschera relativa alla root"""
+        if not 0 <= mask < MASK_COUNT:
+            raise ValueError(f"Maschera fuori intervallo: {mask}")
+        return SetMetrics(
+            mask=mask,
+            cardinality=int(self.cardinality[mask]),
+            brightness=float(self.brightness[mask]),
+            tension=float(self.tension[mask]),
+            roughness=float(self.roughness[mask]),
+            interval_vector=tuple(int(v) for v in self.interval_vectors[mask]),
+            prime_form=mask_to_pitch_classes(int(self.prime_forms[mask])),
+            set_class=int(self.set_class[mask])
+        )
+
+    def for_cell(self, sound_cell: SoundCell) -> SetMetrics:
+        return self.metrics(relative_mask(sound_cell))
+
+    def value(self, metric: str, sound_cell: SoundCell) -> float:
+        return float(self.table(metric)[relative_mask(sound_cell)])
+
+    def values(self, metric: str, cells: Optional[Iterable[SoundCell]] = None) -> np.ndarray:
+        """Valori della metrica per le celle indicate (default: tutte, nell'ordine di all_cells)"""
+        if cells is None:
+            return self.table(metric)[self.cell_masks]
+        masks = np.array([relative_mask(cell) for cell in cells], dtype=np.int32)
+        return self.table(metric)[masks]
+
+    def normalized(self, metric: str, cells: Optional[Iterable[SoundCell]] = None) -> np.ndarray:
+        """Valori tra 0 e 1 rispetto all'intervallo della metrica sulla Color Tree"""
+        values = self.values(metric, cells)
+        low, high = self._ranges[metric]
+        if high <= low:
+            return np.full(len(values), 0.5)
+        return (values - low) / (high - low)
+
+    def sort_cells(self, metric: str, cells: Optional[Iterable[SoundCell]] = None,
+                   reverse: bool = False) -> List[SoundCell]:
+        """Celle ordinate per metrica (ordinamento stabile)"""
+        cells = self.cells if cells is None else list(cells)
+        order = np.argsort(self.values(metric, cells), kind='stable')
+        if reverse:
+            order = order[::-1]
+        return [cells[i] for i in order]
+
+    def filter_cells(self, metric: str, minimum: Optional[float] = None, maximum: Optional[float] = None,
+                     cells: Optional[Iterable[SoundCell]] = None) -> List[SoundCell]:
+        """Celle con la metrica nell'intervallo [minimum, maximum]"""
+        cells = self.cells if cells is None else list(cells)
+        values = self.values(metric, cells)
+        keep = np.ones(len(cells), dtype=bool)
+        if minimum is not None:
+            keep &= values >= minimum
+        if maximum is not None:
+            keep &= values <= maximum
+        return [cells[i] for i in np.nonzero(keep)[0]]
+
+
+@lru_cache(maxsize=1)
+def get_metrics() -> PCSetMetrics:
+    """Tabelle delle metriche condivise (costruite al primo uso)"""
+    return PCSetMetrics()
@@ -0,0 +1,335 @@
+"""
+Sequencer di progressioni di accordi sulla Color Tree
+Una progressione è una lista ordinata di (sound cell, durata in battute, override dei parametri)
+che il PatternEngine suona senza pause tra un accordo e l'altro
+"""
+
+import json
+from dataclasses import dataclass, field, replace
+from typing import Callable, Iterator, List, Optional
+import numpy as np
+from chord_generator import ChordGenerator, Note, SoundCell
+from midi_effects import EventBuffer, EffectChain
+from pattern_engine import PatternEngine, PatternLoopSource, PatternType, LOOP_END, NOTE_ON
+from scheduler import LookaheadScheduler
+from tracing import trace_instant
+
+try:
+    import mido
+    MIDI_AVAILABLE = True
+except ImportError:
+    MIDI_AVAILABLE = False
+
+
+# Versione del formato dei file di progressione
+PROGRESSION_FORMAT_VERSION = 1
+
+# Risoluzione dei file MIDI esportati
+TICKS_PER_BEAT = 480
+
+
+@dataclass
+class ProgressionStep:
+    """Accordo della progressione con durata in battute e parametri specifici"""
+    sound_cell: SoundCell
+    bars: float = 1.0
+    overrides: dict = field(default_factory=dict)
+
+
+@dataclass
+class CompiledStep:
+    """Accordo compilato: eventi dell'intera durata dell'accordo, relativi al suo inizio"""
+    buffer: EventBuffer
+    span: float
+    params: dict
+
+
+def cell_reference(sound_cell: SoundCell) -> list:
+    """Riferimento compatto a una cella della Color Tree: [root, livello, posizione]"""
+    return [sound_cell.root.value, sound_cell.level, sound_cell.position]
+
+
+def resolve_cell(reference: list, generator: Optional[ChordGenerator] = None) -> SoundCell:
+    """Ricostruisce la sound cell da un riferimento [root, livello, posizione]"""
+    root, level, position = reference
+    generator = generator or ChordGenerator()
+    return generator.generate_color_tree(Note(root))[level - 1][position]
+
+
+class ChordProgression:
+    """Lista ordinata di accordi della Color Tree"""
+
+    def __init__(self, steps: Optional[List[ProgressionStep]] = None, beats_per_bar: int = 4):
+        self.steps: List[ProgressionStep] = list(steps or [])
+        self.beats_per_bar = beats_per_bar
+
+    def add(self, sound_cell: SoundCell, bars: float = 1.0, **overrides) -> ProgressionStep:
+        """Aggiunge un accordo in coda alla progressione"""
+        if bars <= 0:
+            raise ValueError(f"Durata in battute non valida: {bars}")
+        step = ProgressionStep(sound_cell, bars, overrides)
+        self.steps.append(step)
+        return step
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __iter__(self) -> Iterator[ProgressionStep]:
+        return iter(self.steps)
+
+    @property
+    def total_bars(self) -> float:
+        return sum(step.bars for step in self.steps)
+
+    def to_dict(self) -> dict:
+        """Rappresentazione compatta: le celle sono riferimenti alla Color Tree"""
+        steps = []
+        for step in self.steps:
+            overrides = {key: value.value if isinstance(value, PatternType) else value
+                         for key, value in step.overrides.items()}
+            entry = cell_reference(step.sound_cell) + [step.bars]
+            if overrides:
+                entry.append(overrides)
+            steps.append(entry)
+        return {'version': PROGRESSION_FORMAT_VERSION, 'beats_per_bar': self.beats_per_bar,
+                'steps': steps}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ChordProgression':
+        """Ricostruisce una progressione da to_dict"""
+        if data.get('version') != PROGRESSION_FORMAT_VERSION:
+            raise ValueError(f"Versione del file di progressione non supportata: {data.get('version')}")
+        generator = ChordGenerator()
+        progression = cls(beats_per_bar=data.get('beats_per_bar', 4))
+        for entry in data['steps']:
+            overrides = dict(entry[4]) if len(entry) > 4 else {}
+            if 'pattern_type' in overrides:
+                overrides['pattern_type'] = PatternType(overrides['pattern_type'])
+            progression.add(resolve_cell(entry[:3], generator), entry[3], **overrides)
+        return progression
+
+    def save(self, path: str):
+        """Salva la progressione in un file JSON compatto"""
+        with open(path, 'w', encoding='utf-8') as handle:
+            json.dump(self.to_dict(), handle, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path: str) -> 'ChordProgression':
+        """Carica una progressione salvata con save"""
+        with open(path, 'r', encoding='utf-8') as handle:
+            return cls.from_dict(json.load(handle))
+
+
+class ProgressionSource(PatternLoopSource):
+    """Sorgente dello scheduler che suona gli accordi compilati uno dopo l'altro
+
+    I cambi di parametri in attesa (schedule_parameters) entrano al confine del prossimo accordo,
+    ricompilando la progressione con recompile; i cambi di accordo in coda vengono scartati,
+    perché gli accordi li decide la progressione.
+    """
+
+    def __init__(self, engine: PatternEngine, compiled: List[CompiledStep], loop: bool = False,
+                 recompile: Optional[Callable[[], List[CompiledStep]]] = None):
+        super().__init__(engine, loop)
+        self.compiled = compiled
+        self.recompile = recompile
+        self.step_index = 0
+        self.step_start: Optional[float] = None
+        self.on_step: Optional[Callable[[int], None]] = None
+
+    def rewind(self):
+        super().rewind()
+        self.step_index = 0
+        self.step_start = None
+
+    def _apply_step_changes(self) -> bool:
+        """Applica i cambi in attesa sul confine tra due accordi"""
+        engine = self.engine
+        with engine.param_lock:
+            pending, engine._pending_changes = engine._pending_changes, []
+        changes = [change for change in pending if not change.chord]
+        for change in changes:
+            trace_instant("parameter_change", "pattern")
+            engine.update_parameters(**change.changes)
+        if changes and self.recompile is not None:
+            self.compiled = self.recompile()
+        return bool(changes)
+
+    def fill(self, scheduler: LookaheadScheduler, horizon: float) -> bool:
+        if self.finished:
+            return False
+        if self.step_start is None:
+            self.step_start = scheduler.origin
+
+        while True:
+            step = self.compiled[self.step_index]
+            buffer = step.buffer
+            if self.cursor < len(buffer):
+                onset = float(buffer.onsets[self.cursor])
+                due = self.step_start + onset
+                # Le code oltre la fine dell'accordo vanno in coda subito: l'accordo successivo
+                # deve essere programmato in tempo
+                if due > horizon and onset < step.span:
+                    break
+                scheduler.push(due, NOTE_ON, self,
+                               (int(buffer.notes[self.cursor]), int(buffer.velocities[self.cursor]),
+                                float(buffer.durations[self.cursor])))
+                self.cursor += 1
+                continue
+
+            # L'accordo successivo parte esattamente alla fine di questo
+            step_end = self.step_start + step.span
+            self.step_index += 1
+            if self.step_index >= len(self.compiled):
+                if not self.loop or not self.engine.is_looping:
+                    scheduler.push(step_end, LOOP_END, self)
+                    self.finished = True
+                    break
+                self.step_index = 0
+            self._apply_step_changes()
+            self.step_start = step_end
+            self.cursor = 0
+            if self.on_step:
+                self.on_step(self.step_index)
+
+        return not self.finished
+
+
+class ProgressionSequencer:
+    """Compila una ChordProgression e la suona o la esporta tramite un PatternEngine"""
+
+    def __init__(self, engine: PatternEngine, progression: ChordProgression):
+        self.engine = engine
+        self.progression = progression
+        self.compiled: List[CompiledStep] = []
+
+    def step_parameters(self, step: ProgressionStep) -> dict:
+        """Parametri correnti del motore con la cella e gli override dell'accordo"""
+        params = self.engine.get_current_parameters()
+        unknown = set(step.overrides) - set(params)
+        if unknown:
+            raise ValueError(f"Parametri sconosciuti nella progressione: {sorted(unknown)}")
+        params.update(step.overrides)
+        params['sound_cell'] = step.sound_cell
+        return params
+
+    def compile(self) -> List[CompiledStep]:
+        """Compila tutti gli accordi prima della riproduzione
+
+        Ogni pattern viene ripetuto (con la pausa tra le ripetizioni) per l'intera durata
+        dell'accordo, così ogni accordo è un unico buffer pronto da suonare.
+        """
+        if not self.progression.steps:
+            raise ValueError("La progressione è vuota")
+        compiled = []
+        previous = None
+        for step in self.progression:
+            params = self.step_parameters(step)
+            if params['pattern_type'] is None:
+                raise ValueError("Nessun pattern impostato per la progressione")
+            beat = LookaheadScheduler.beat_duration(params['bpm'], params['playback_speed'])
+            span = step.bars * self.progression.beats_per_bar * beat
+            voicing = self.engine.resolve_voicing(params, previous)
+            if voicing is not None:
+                previous = voicing
+            pattern = self.engine.compile_from_parameters(params, voicing)
+            chain = EffectChain.from_parameters(params, order=self.engine.effect_chain.order)
+            compiled.append(CompiledStep(self._tile(chain.process(pattern), span, params['pause_duration']),
+                                         span, params))
+        self.compiled = compiled
+        return compiled
+
+    @staticmethod
+    def _tile(buffer: EventBuffer, span: float, pause: float = 0.0) -> EventBuffer:
+        """Ripete il pattern ogni length + pause fino a coprire span, come il loop dal vivo
+
+        Sul confine vengono scartati i passi che partirebbero dopo la fine dell'accordo; gli echi
+        di delay e repeater dei passi suonati proseguono oltre il confine.
+        """
+        if len(buffer) == 0 or buffer.length <= 0:
+            return replace(EventBuffer.empty(), length=span)
+        period = buffer.length + max(pause, 0.0)
+        repeats = int(np.ceil(span / period))
+        # Onset del passo che ha generato ogni evento (la nota originale delle sue code)
+        step_onsets = np.full(int(buffer.steps.max()) + 1, np.inf)
+        np.minimum.at(step_onsets, buffer.steps, buffer.onsets)
+        sources = np.tile(step_onsets[buffer.steps], repeats)
+        offsets = np.repeat(np.arange(repeats) * period, len(buffer))
+        indices = np.tile(np.arange(len(buffer)), repeats)
+        tiled = buffer.take(indices)
+        tiled = replace(tiled, onsets=tiled.onsets + offsets, length=span, key=None)
+        return tiled.take(np.flatnonzero(sources + offsets < span - 1e-9)).sorted()
+
+    def play(self, loop: bool = False, callback: Optional[Callable] = None,
+             on_step: Optional[Callable[[int], None]] = None):
+        """Compila e suona la progressione senza pause tra gli accordi"""
+        compiled = self.compile()
+        if self.engine.is_playing:
+            self.engine.stop_pattern()
+        self.engine.reset_playback_state(loop)
+        source = ProgressionSource(self.engine, compiled, loop, recompile=self.compile)
+        source.on_step = on_step
+        self.engine.play_source(source, callback)
+
+    def stop(self):
+        self.engine.stop_pattern()
+
+    def render(self) -> EventBuffer:
+        """Eventi dell'intera progressione con onset dall'inizio (rendering offline)
+
+        Le code degli echi proseguono sull'accordo successivo; solo quelle oltre la fine della
+        progressione vengono tagliate.
+        """
+        compiled = self.compiled or self.compile()
+        parts, start = [], 0.0
+        for step in compiled:
+            parts.append(replace(step.buffer, onsets=step.buffer.onsets + start))
+            start += step.span
+        events = EventBuffer(
+            onsets=np.concatenate([part.onsets for part in parts]),
+            durations=np.concatenate([part.durations for part in parts]),
+            notes=np.concatenate([part.notes for part in parts]),
+            velocities=np.concatenate([part.velocities for part in parts]),
+            steps=np.concatenate([part.steps for part in parts]),
+            length=start,
+            total_steps=sum(part.total_steps for part in parts)
+        )
+        return events.take(np.flatnonzero(events.onsets < start - 1e-9)).sorted()
+
+    def export_midi(self, path: str, channel: int = 0) -> bool:
+        """Esporta la progressione in un file MIDI standard (una traccia)"""
+        if not MIDI_AVAILABLE:
+            print("mido non disponibile: impossibile esportare il file MIDI")
+            return False
+        midi_file = build_midi_file(self.render(), self.engine.effective_bpm(),
+                                    self.progression.beats_per_bar, channel)
+        midi_file.save(path)
+        return True
+
+
+def build_midi_file(events: EventBuffer, bpm: float, beats_per_bar: int = 4, channel: int = 0) -> 'mido.MidiFile':
+    """File MIDI standard (una traccia) dagli eventi di un buffer con onset in secondi"""
+    tempo = mido.bpm2tempo(bpm)
+
+    # Messaggi assoluti in tick; a parità di tick i NOTE OFF precedono i NOTE ON
+    messages = []
+    for onset, duration, note, velocity, _ in events.iter_events():
+        start = int(round(mido.second2tick(onset, TICKS_PER_BEAT, tempo)))
+        end = max(start + 1, int(round(mido.second2tick(onset + duration, TICKS_PER_BEAT, tempo))))
+        messages.append((start, 1, 'note_on', note, velocity))
+        messages.append((end, 0, 'note_off', note, 0))
+    messages.sort()
+
+    midi_file = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+    track.append(mido.MetaMessage('set_tempo', tempo=tempo, time=0))
+    track.append(mido.MetaMessage('time_signature', numerator=beats_per_bar, denominator=4, time=0))
+    last_tick = 0
+    for tick, _, kind, note, velocity in messages:
+        track.append(mido.Message(kind, channel=channel, note=note, velocity=velocity,
+                                  time=tick - last_tick))
+        last_tick = tick
+    end_tick = int(round(mido.second2tick(events.length, TICKS_PER_BEAT, tempo)))
+    track.append(mido.MetaMessage('end_of_track', time=max(0, end_tick - last_tick)))
+    return midi_file
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Ricerca di progressioni sul grafo della Color Tree
+Trova le progressioni più economiche tra due sound cells, o attraverso un insieme di celle
+obbligatorie, combinando voice leading, cambio di luminosità e cambio di livello
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from cell_index import cell_id
+from chord_generator import ChordGenerator, Note, SoundCell
+from pcset_metrics import get_metrics
+from voice_leading import VoiceLeadingIndex, get_index
+
+
+# Stati mantenuti per ogni espansione / passo della ricerca
+DEFAULT_BEAM_WIDTH = 64
+
+# Lunghezza massima di una progressione senza lunghezza fissa
+MAX_PATH_LENGTH = 64
+
+
+@dataclass(frozen=True)
+class SearchWeights:
+    """Pesi delle componenti del costo di un passaggio tra due accordi"""
+    voice_leading: float = 1.0  # per semitono di movimento
+    brightness: float = 2.0     # per unità di luminosità (0-1)
+    level: float = 1.0          # per livello di differenza
+    metrics: Tuple[Tuple[str, float], ...] = ()  # (metrica, peso) per unità di metrica normalizzata
+
+
+@dataclass
+class SearchResult:
+    """Progressione trovata con il suo costo totale"""
+    cells: List[SoundCell]
+    cost: float
+    expanded: int = 0
+    step_costs: List[float] = field(default_factory=list)
+
+
+def build_edge_costs(index: VoiceLeadingIndex, weights: SearchWeights) -> np.ndarray:
+    """Matrice dei costi dei passaggi (float64); inf tra celle con le stesse note"""
+    brightness = np.array([cell.brightness for cell in index.cells])
+    levels = index.levels.astype(np.float64)
+    costs = (weights.voice_leading * np.asarray(index.matrix, dtype=np.float64)
+             + weights.brightness * np.abs(brightness[:, None] - brightness[None, :])
+             + weights.level * np.abs(levels[:, None] - levels[None, :]))
+    # Metriche aggiuntive lette dalle tabelle precalcolate
+    for metric, weight in weights.metrics:
+        values = get_metrics().normalized(metric, index.cells)
+        costs += weight * np.abs(values[:, None] - values[None, :])
+    # Ripetere lo stesso accordo (o le stesse note sotto un'altra root) non è un passaggio
+    costs[index.masks[:, None] == index.masks[None, :]] = np.inf
+    return costs
+
+
+class ProgressionSearch:
+    """Ricerca A* e beam search con costi dei passaggi precalcolati"""
+
+    def __init__(self, weights: SearchWeights = SearchWeights(),
+                 index: Optional[VoiceLeadingIndex] = None, beam_width: int = DEFAULT_BEAM_WIDTH):
+        self.index = index or get_index()
+        self.weights = weights
+        self.beam_width = beam_width
+        self.costs = build_edge_costs(self.index, weights)
+        self._distances: Dict[int, np.ndarray] = {}
+        self._exact: Dict[int, List[np.ndarray]] = {}
+
+    def distances_to(self, target: int) -> np.ndarray:
+        """Costo minimo (lunghezza libera) da ogni cella al target, memorizzato (Dijkstra denso)"""
+        cached = self._distances.get(target)
+        if cached is not None:
+            return cached
+        count = len(self.costs)
+        distance = np.full(count, np.inf)
+        distance[target] = 0.0
+        done = np.zeros(count, dtype=bool)
+        for _ in range(count):
+            node = int(np.argmin(np.where(done, np.inf, distance)))
+            if done[node] or not np.isfinite(distance[node]):
+                break
+            done[node] = True
+            # I costi sono simmetrici: la distanza verso il target è quella dal target
+            np.minimum(distance, distance[node] + self.costs[node], out=distance)
+        self._distances[target] = distance
+        return distance
+
+    def exact_distances_to(self, target: int, steps: int) -> np.ndarray:
+        """Costo minimo da ogni cella al target in esattamente steps passaggi (min-plus all'indietro)"""
+        table = self._exact.setdefault(target, [])
+        if not table:
+            first = np.full(len(self.costs), np.inf)
+            first[target] = 0.0
+            table.append(first)
+        while len(table) <= steps:
+            table.append((self.costs + table[-1][None, :]).min(axis=1))
+        return table[steps]
+
+    def _result(self, path: Sequence[int], expanded: int) -> SearchResult:
+        step_costs = [float(self.costs[a, b]) for a, b in zip(path, path[1:])]
+        return SearchResult([self.index.cells[i] for i in path], sum(step_costs), expanded, step_costs)
+
+    def find_path(self, start: SoundCell, goal: SoundCell, length: Optional[int] = None) -> Optional[SearchResult]:
+        """Progressione più economica da start a goal (A*)
+
+        Con length la progressione ha esattamente length accordi (estremi compresi).
+        """
+        if length is not None and length < 2:
+            raise ValueError("Una progressione ha almeno 2 accordi")
+        start_id, goal_id = cell_id(start), cell_id(goal)
+        to_goal = None if length is not None else self.distances_to(goal_id)
+        last = (length or MAX_PATH_LENGTH) - 1
+        fixed = length is not None
+
+        def heuristic(remaining: int) -> np.ndarray:
+            # Con lunghezza fissa la stima è esatta: A* segue direttamente il percorso migliore
+            return self.exact_distances_to(goal_id, remaining) if fixed else to_goal
+
+        counter = itertools.count()
+        # A parità di stima vince lo stato più profondo: con la stima esatta non si ramifica
+        frontier = [(float(heuristic(last)[start_id]), 0, 0.0, next(counter), start_id, (start_id,))]
+        best = {(start_id, 0): 0.0}
+        expanded = 0
+        while frontier:
+            _, negative_depth, cost, _, node, path = heapq.heappop(frontier)
+            depth = -negative_depth
+            if node == goal_id and (not fixed or depth == last) and depth > 0:
+                return self._result(path, expanded)
+            if depth >= last or best.get((node, depth if fixed else 0), np.inf) < cost:
+                continue
+            expanded += 1
+
+            next_cost = cost + self.costs[node]
+            remaining = last - depth - 1
+            estimate = next_cost + heuristic(remaining)
+            candidates = np.flatnonzero(np.isfinite(estimate))
+            if len(candidates) > self.beam_width:
+                candidates = candidates[np.argpartition(estimate[candidates], self.beam_width - 1)[:self.beam_width]]
+            for successor in candidates.tolist():
+                key = (successor, depth + 1 if fixed else 0)
+                if next_cost[successor] < best.get(key, np.inf):
+                    best[key] = float(next_cost[successor])
+                    heapq.heappush(frontier, (float(estimate[successor]), -depth - 1, float(next_cost[successor]),
+                                              next(counter), successor, path + (successor,)))
+        return None
+
+    def find_through(self, start: SoundCell, required: Sequence[SoundCell],
+                     goal: Optional[SoundCell] = None, length: Optional[int] = None) -> Optional[SearchResult]:
+        """Progressione più economica che tocca tutte le celle richieste, in qualsiasi ordine (beam search)"""
+        if length is not None and length < 2:
+            raise ValueError("Una progressione ha almeno 2 accordi")
+        start_id = cell_id(start)
+        required_ids = [cell_id(cell) for cell in required if cell_id(cell) != start_id]
+        goal_id = cell_id(goal) if goal is not None else None
+        if not required_ids and goal_id is None and length is None:
+            raise ValueError("Indica una cella di arrivo, le celle da toccare o la lunghezza della progressione")
+        minimum = len(required_ids) + 1 + (1 if goal_id is not None else 0)
+        length = length or minimum
+        if length < minimum:
+            raise ValueError(f"Servono almeno {minimum} accordi per toccare tutte le celle richieste")
+
+        full_mask = (1 << len(required_ids)) - 1
+        required_bits = {node: 1 << bit for bit, node in enumerate(required_ids)}
+        bit_of = np.zeros(len(self.costs), dtype=np.int64)
+        for node, bit in required_bits.items():
+            bit_of[node] |= bit
+        targets = required_ids + ([goal_id] if goal_id is not None else [])
+        target_distances = {node: self.distances_to(node) for node in targets}
+
+        # Stato: (costo, cella, maschera delle celle richieste già toccate, percorso)
+        beam = [(0.0, start_id, 0, (start_id,))]
+        expanded = 0
+        for depth in range(1, length):
+            remaining = length - 1 - depth
+            candidates: Dict[tuple, tuple] = {}
+            for cost, node, mask, path in beam:
+                expanded += 1
+                next_cost = cost + self.costs[node]
+                next_masks = mask | bit_of
+                # Stima ammissibile: la cella obbligatoria (o il goal) più lontana ancora da toccare
+                estimate = next_cost.copy()
+                missing = np.zeros(len(self.costs), dtype=np.int64)
+                for bit, target in enumerate(required_ids):
+                    pending = (next_masks & (1 << bit)) == 0
+                    estimate = np.where(pending, np.maximum(estimate, next_cost + target_distances[target]), estimate)
+                    missing += pending
+                if goal_id is not None:
+                    estimate = np.maximum(estimate, next_cost + target_distances[goal_id])
+                    missing += np.arange(len(self.costs)) != goal_id
+                # Scarta i rami che non possono più toccare tutte le celle nei passi rimasti
+                estimate[missing > remaining] = np.inf
+                options = np.flatnonzero(np.isfinite(estimate))
+                if len(options) > self.beam_width:
+                    options = options[np.argpartition(estimate[options], self.beam_width - 1)[:self.beam_width]]
+                for successor in options.tolist():
+                    key = (successor, int(next_masks[successor]))
+                    entry = (float(estimate[successor]), float(next_cost[successor]), successor,
+                             int(next_masks[successor]), path + (successor,))
+                    if key not in candidates or entry[1] < candidates[key][1]:
+                        candidates[key] = entry
+            best = heapq.nsmallest(self.beam_width, candidates.values(), key=lambda entry: entry[:2])
+            beam = [(cost, node, mask, path) for _, cost, node, mask, path in best]
+            if not beam:
+                return None
+
+        finished = [state for state in beam if state[2] == full_mask
+                    and (goal_id is None or state[1] == goal_id)]
+        if not finished:
+            return None
+        cost, _, _, path = min(finished, key=lambda state: state[0])
+        return self._result(path, expanded)
+
+
+def parse_cell(spec: str, generator: Optional[ChordGenerator] = None) -> SoundCell:
+    """Cella da una specifica ROOT:LIVELLO:POSIZIONE (es. "C#:3:1", posizione da 0)"""
+    try:
+        root_name, level, position = spec.split(':')
+        root = Note[root_name.upper().replace('#', '_SHARP')]
+        level, position = int(level), int(position)
+        if level < 1 or position < 0:
+            raise IndexError(level)
+        generator = generator or ChordGenerator()
+        return generator.generate_color_tree(root)[level - 1][position]
+    except (KeyError, ValueError, IndexError):
+        raise ValueError(f"Cella non valida: {spec} (formato ROOT:LIVELLO:POSIZIONE)") from None
+
+
+def describe_cell(sound_cell: SoundCell) -> str:
+    """Descrizione compatta della cella con la sua specifica"""
+    root = sound_cell.root.name.replace('_SHARP', '#')
+    return f"{sound_cell} [{root}:{sound_cell.level}:{sound_cell.position}]"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Interfaccia da riga di comando"""
+    parser = argparse.ArgumentParser(
+        description="Ricerca di progressioni di accordi sulla Color Tree",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Esempi di utilizzo:
+  python progression_search.py --from C:3:1 --to G:3:1 --length 8
+  python progression_search.py --from C:3:1 --through F:3:1 A:4:2 --to C:3:1
+        """
+    )
+    parser.add_argument('--from', dest='start', required=True, help='Cella di partenza ROOT:LIVELLO:POSIZIONE')
+    parser.add_argument('--to', dest='goal', help='Cella di arrivo')
+    parser.add_argument('--through', nargs='*', default=[], help='Celle da toccare (in qualsiasi ordine)')
+    parser.add_argument('--length', type=int, help='Numero di accordi della progressione')
+    parser.add_argument('--beam', type=int, default=DEFAULT_BEAM_WIDTH, help='Ampiezza del beam')
+    parser.add_argument('--weights', type=float, nargs=3, metavar=('VL', 'BRIGHTNESS', 'LEVEL'),
+                        default=(1.0, 2.0, 1.0), help='Pesi di voice leading, luminosità e livello')
+    parser.add_argument('--metric', nargs=2, action='append', default=[], metavar=('NOME', 'PESO'),
+                        help='Costo aggiuntivo per il cambio di una metrica (brightness, tension, roughness, ...)')
+    parser.add_argument('--format', '-f', choices=['text', 'json'], default='text', help='Formato di output')
+    args = parser.parse_args(argv)
+
+    try:
+        generator = ChordGenerator()
+        start = parse_cell(args.start, generator)
+        goal = parse_cell(args.goal, generator) if args.goal else None
+        required = [parse_cell(spec, generator) for spec in args.through]
+        metrics = tuple((name, float(weight)) for name, weight in args.metric)
+        search = ProgressionSearch(SearchWeights(*args.weights, metrics=metrics), beam_width=args.beam)
+        if required or goal is None:
+            result = search.find_through(start, required, goal, args.length)
+        else:
+            result = search.find_path(start, goal, args.length)
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 1
+
+    if result is None:
+        print("Nessuna progressione trovata", file=sys.stderr)
+        return 1
+    if args.format == 'json':
+        print(json.dumps({
+            'cost': result.cost,
+            'chords': [{'notes': str(cell), 'root': cell.root.name.replace('_SHARP', '#'),
+                        'level': cell.level, 'position': cell.position} for cell in result.cells],
+            'step_costs': result.step_costs
+        }, indent=2, ensure_ascii=False))
+    else:
+        for number, cell in enumerate(result.cells, 1):
+            print(f"{number:2d}. {describe_cell(cell)}")
+        print(f"Costo totale: {result.cost:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
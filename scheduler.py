@@ -0,0 +1,238 @@
+"""
+Scheduler a finestra di lookahead per la riproduzione dei pattern
+Gli eventi vengono programmati con qualche decina di millisecondi di anticipo su un
+clock assoluto, così la temporizzazione non dipende dai ritardi del thread della GUI
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from typing import Callable, List, Optional
+from tracing import trace_span
+
+
+# Finestra di lookahead di default (secondi)
+DEFAULT_LOOKAHEAD = 0.075
+
+# Intervallo massimo di attesa tra due controlli di stop (secondi)
+STOP_POLL_INTERVAL = 0.01
+
+# Confini di quantizzazione per l'applicazione dei cambi di parametri
+QUANTIZE_MODES = ("immediate", "step", "beat", "bar", "loop")
+
+# Tolleranza per considerare un istante già su un confine della griglia
+GRID_EPSILON = 1e-9
+
+
+class EventSource:
+    """Sorgente di eventi interrogata dallo scheduler (es. il loop di un pattern)"""
+
+    # Le sorgenti ausiliarie (es. il MIDI clock) non tengono in vita lo scheduler
+    keeps_alive = True
+    # Nome della traccia a cui appartengono gli eventi (sessioni multitraccia)
+    track = ""
+
+    def fill(self, scheduler: "LookaheadScheduler", horizon: float) -> bool:
+        """Programma gli eventi fino a horizon; False quando la sorgente ha finito"""
+        raise NotImplementedError
+
+    def dispatch(self, scheduler: "LookaheadScheduler", due: float, kind: int, payload: tuple):
+        """Esegue un evento arrivato a scadenza"""
+        raise NotImplementedError
+
+    def next_step_time(self, after: float) -> float:
+        """Primo passo del pattern a partire dall'istante indicato"""
+        return after
+
+    def next_loop_time(self, after: float) -> float:
+        """Primo inizio di loop a partire dall'istante indicato"""
+        return after
+
+    def rewind(self):
+        """Riporta la sorgente all'inizio (es. Start di un clock esterno); eventi in coda già scartati"""
+
+
+class LookaheadScheduler:
+    """Timeline a heap su clock assoluto, riempita dalle sorgenti con una finestra di anticipo"""
+
+    def __init__(self, lookahead: float = DEFAULT_LOOKAHEAD, beats_per_bar: int = 4,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.lookahead = lookahead
+        self.beats_per_bar = beats_per_bar
+        self.clock = clock
+        self.sources: List[EventSource] = []
+        self.origin: Optional[float] = None  # istante del primo beat della griglia musicale
+        # Timebase opzionale (es. clock MIDI esterno) con position(wall) e wall_time(position)
+        self.timebase = None
+        self.stop_requested = False
+        # Riavvio richiesto da un altro thread (Start di un clock esterno), eseguito dal ciclo
+        self._restart_requested = False
+        # La coda è condivisa con i thread che rimuovono sorgenti (GUI, OSC): ogni accesso passa dal lock
+        self._queue: list = []
+        self._queue_lock = threading.Lock()
+        self._sequence = itertools.count()
+        # Listener degli eventi programmati a ogni riempimento della finestra, chiamati nel thread
+        # di riproduzione con (scheduler, inizio, fine, [(due, kind, source, payload), ...])
+        self.listeners: List[Callable[["LookaheadScheduler", float, float, list], None]] = []
+        self._batch: Optional[list] = None
+        self._window_start: Optional[float] = None
+        # Metriche opzionali (es. PlaybackMetrics): ritardo di ogni evento rispetto alla scadenza
+        self.metrics = None
+
+    def add_source(self, source: EventSource):
+        """Aggiunge una sorgente di eventi"""
+        with self._queue_lock:
+            self.sources.append(source)
+
+    def remove_source(self, source: EventSource):
+        """Rimuove una sorgente e i suoi eventi ancora in coda (anche da un altro thread)"""
+        with self._queue_lock:
+            if source in self.sources:
+                self.sources.remove(source)
+            self._queue[:] = [entry for entry in self._queue if entry[3] is not source]
+            heapq.heapify(self._queue)
+
+    def push(self, due: float, kind: int, source: EventSource, payload: tuple = ()):
+        """Inserisce un evento nella timeline; a parità di tempo vince il tipo minore"""
+        with self._queue_lock:
+            heapq.heappush(self._queue, (due, kind, next(self._sequence), source, payload))
+        if self._batch is not None:
+            self._batch.append((due, kind, source, payload))
+
+    def pending(self) -> int:
+        """Numero di eventi in coda"""
+        return len(self._queue)
+
+    def now(self) -> float:
+        """Posizione corrente sulla timeline"""
+        if self.timebase is not None:
+            return self.timebase.position(self.clock())
+        return self.clock()
+
+    def start(self, origin: Optional[float] = None) -> float:
+        """Fissa l'origine della griglia musicale (di default adesso)"""
+        self.origin = self.now() if origin is None else origin
+        self.stop_requested = False
+        return self.origin
+
+    def stop(self):
+        """Interrompe la riproduzione e scarta gli eventi in coda"""
+        self.stop_requested = True
+
+    def restart(self):
+        """Chiede di ripartire da capo: nuova origine, coda vuota e sorgenti riavvolte"""
+        self._restart_requested = True
+
+    def _restart(self):
+        self._restart_requested = False
+        with self._queue_lock:
+            self._queue.clear()
+        self._window_start = None
+        for source in list(self.sources):
+            source.rewind()
+        self.start()
+
+    @staticmethod
+    def beat_duration(bpm: float, playback_speed: float = 1.0) -> float:
+        """Durata di un beat (semiminima) in secondi"""
+        speed = playback_speed if playback_speed > 0 else 1.0
+        return 60.0 / (max(bpm, 1) * speed)
+
+    def next_boundary(self, after: float, quantize: str, bpm: float = 120,
+                      playback_speed: float = 1.0, source: Optional[EventSource] = None) -> float:
+        """Primo confine di quantizzazione a partire dall'istante indicato"""
+        if quantize == "immediate":
+            return after
+        if quantize == "step" and source is not None:
+            return source.next_step_time(after)
+        if quantize == "loop" and source is not None:
+            return source.next_loop_time(after)
+        grid = self.beat_duration(bpm, playback_speed)
+        if quantize == "bar":
+            grid *= self.beats_per_bar
+        origin = self.origin if self.origin is not None else after
+        periods = math.ceil((after - origin) / grid - GRID_EPSILON)
+        return origin + max(periods, 0) * grid
+
+    def wait_until(self, deadline: float) -> bool:
+        """Attende fino all'istante indicato; False se è stato richiesto lo stop o un riavvio"""
+        while not self.stop_requested and not self._restart_requested:
+            if self.timebase is not None:
+                remaining = self.timebase.wall_time(deadline) - self.clock()
+            else:
+                remaining = deadline - self.clock()
+            if remaining <= 0:
+                return True
+            time.sleep(min(remaining, STOP_POLL_INTERVAL))
+        return False
+
+    def fill(self, horizon: float) -> bool:
+        """Chiede a tutte le sorgenti gli eventi fino a horizon; False se nessuna è attiva"""
+        self._batch = [] if self.listeners else None
+        active = False
+        for source in list(self.sources):
+            if source.fill(self, horizon) and source.keeps_alive:
+                active = True
+        batch, self._batch = self._batch, None
+        start = self._window_start if self._window_start is not None else (self.origin or 0.0)
+        self._window_start = horizon
+        if batch:
+            self._notify(start, horizon, batch)
+        return active
+
+    def _notify(self, start: float, end: float, batch: list):
+        """Passa ai listener gli eventi programmati nella finestra (un batch per riempimento)"""
+        for listener in list(self.listeners):
+            try:
+                listener(self, start, end, batch)
+            except (RuntimeError, ValueError, AttributeError) as e:
+                print(f"Errore nel listener dello scheduler: {e}")
+
+    def _record_lateness(self, due: float):
+        """Registra il ritardo tra la scadenza di un evento e la fine del suo invio"""
+        wall_due = self.timebase.wall_time(due) if self.timebase is not None else due
+        self.metrics.record_dispatch(self.clock() - wall_due)
+
+    def _has_live_events(self) -> bool:
+        with self._queue_lock:
+            return any(entry[3].keeps_alive for entry in self._queue)
+
+    def _pop_due(self, wake: float) -> Optional[tuple]:
+        """Estrae il prossimo evento entro wake (None se non ce ne sono)"""
+        with self._queue_lock:
+            if not self._queue or self._queue[0][0] > wake:
+                return None
+            return heapq.heappop(self._queue)
+
+    def run(self):
+        """Ciclo di riproduzione: riempie la finestra e invia gli eventi a scadenza"""
+        if self.origin is None:
+            self.start()
+        while not self.stop_requested:
+            if self._restart_requested:
+                self._restart()
+            now = self.now()
+            with trace_span("fill", "scheduler"):
+                active = self.fill(now + self.lookahead)
+            if not active and not self._has_live_events():
+                break
+            # Invia gli eventi fino a metà finestra, poi torna a riempire
+            wake = now + self.lookahead / 2
+            entry = self._pop_due(wake)
+            while entry is not None:
+                due, kind, _, source, payload = entry
+                if not self.wait_until(due):
+                    break
+                # Una sorgente rimossa durante l'attesa non invia più nulla
+                if source in self.sources:
+                    with trace_span("dispatch", "scheduler"):
+                        source.dispatch(self, due, kind, payload)
+                    if self.metrics is not None:
+                        self._record_lateness(due)
+                entry = self._pop_due(wake)
+            # Dopo uno stop il ciclo termina, dopo un riavvio riparte dalla nuova origine
+            self.wait_until(wake)
+        with self._queue_lock:
+            self._queue.clear()
@@ -0,0 +1,104 @@
+"""
+Test per la suite di benchmark e il confronto con la baseline
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import benchmarks
+from benchmarks import (BenchmarkResult, BenchmarkSkipped, LoopbackPort, compare, confirm_regressions,
+                        load_baseline, run_benchmarks, save_baseline)
+
+
+def _baseline(**values):
+    return {'version': benchmarks.BASELINE_VERSION,
+            'results': {name.replace("_", "."): {'value': value, 'unit': "us"} for name, value in values.items()}}
+
+
+class TestComparison(unittest.TestCase):
+    """Test per la soglia di regressione e la baseline su file"""
+
+    def test_threshold_and_tolerance(self):
+        baseline = _baseline(a_fast=10.0, a_slow=10.0, a_noisy=10.0)
+        results = [BenchmarkResult("a.fast", [12.0, 15.0]), BenchmarkResult("a.slow", [13.0, 14.0]),
+                   BenchmarkResult("a.noisy", [30.0], statistic="median", tolerance=25.0),
+                   BenchmarkResult("a.new", [1.0]), BenchmarkResult("a.fast", [1.0], unit="msg")]
+        comparisons = compare(results, baseline, threshold=1.25)
+        self.assertEqual([comparison.regression for comparison in comparisons], [False, True, False, False, False])
+        self.assertAlmostEqual(comparisons[0].ratio, 1.2)
+        # Risultati senza baseline (o con un'altra unità) sono nuovi, non regressioni
+        self.assertEqual((comparisons[3].baseline, comparisons[4].baseline), (None, None))
+        self.assertEqual(compare(results[:1], None)[0].limit, None)
+
+    def test_save_and_load_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            self.assertIsNone(load_baseline(path))
+            save_baseline([BenchmarkResult("a", [3.0, 1.0, 2.0]), BenchmarkResult("b", [5.0])], path)
+            # Un salvataggio parziale mantiene i benchmark non rimisurati
+            save_baseline([BenchmarkResult("a", [4.0], statistic="median", tolerance=2.0)], path)
+            baseline = load_baseline(path)
+            self.assertEqual(baseline['machine'], benchmarks.machine_info())
+            self.assertEqual(baseline['results']['a'], {'value': 4.0, 'unit': "us", 'statistic': "median",
+                                                        'median': 4.0, 'max': 4.0, 'samples': 1, 'tolerance': 2.0})
+            self.assertEqual(baseline['results']['b']['value'], 5.0)
+
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("{non json")
+            self.assertIsNone(load_baseline(path))
+
+
+class TestRunner(unittest.TestCase):
+    """Test per l'esecuzione dei benchmark"""
+
+    def test_quick_run_of_real_benchmarks(self):
+        results, skipped = run_benchmarks(["pattern_notes.up_down", "effects.delay", "midi_output", "tree_render"],
+                                          repeat=2)
+        names = [result.name for result in results]
+        self.assertEqual(names[:3], ["pattern_notes.up_down", "effects.delay", "midi_output.send"])
+        self.assertTrue(all(result.value > 0 and len(result.samples) == 2 for result in results))
+        self.assertGreater(results[2].extra['messages_per_second'], 0)
+        # Senza display il disegno dell'albero viene saltato con il motivo
+        self.assertEqual("tree_render" in skipped, "tree_render.view" not in names)
+
+        port = LoopbackPort(maxlen=2)
+        for note in (60, 61, 62):
+            port.send(benchmarks.mido.Message('note_on', note=note))
+        self.assertEqual([message[1] for message in port.received], [61, 62])
+
+    def test_confirm_and_exit_code(self):
+        calls = {'flaky': 0}
+
+        def flaky(repeat):
+            calls['flaky'] += 1
+            # Lento solo alla prima esecuzione, come un picco di carico della macchina
+            return [BenchmarkResult("fake.flaky", [100.0 if calls['flaky'] == 1 else 10.0]),
+                    BenchmarkResult("fake.slow", [100.0])]
+
+        def unavailable(repeat):
+            raise BenchmarkSkipped("non disponibile")
+
+        fakes = {'fake': flaky, 'missing': unavailable}
+        baseline = _baseline(fake_flaky=10.0, fake_slow=10.0)
+        with mock.patch.dict(benchmarks.BENCHMARKS, fakes, clear=True), \
+                mock.patch.object(benchmarks, 'CONFIRM_PAUSE', 0):
+            results, skipped = run_benchmarks()
+            self.assertEqual(skipped, {'missing': "non disponibile"})
+            confirmed = confirm_regressions(results, baseline, attempts=2)
+            self.assertEqual([result.value for result in confirmed], [10.0, 100.0])
+            self.assertEqual(calls['flaky'], 3)
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "baseline.json")
+                with open(path, "w", encoding="utf-8") as file:
+                    json.dump(baseline, file)
+                with mock.patch("builtins.print"):
+                    self.assertEqual(benchmarks.main(["--baseline", path]), 1)
+                    self.assertEqual(benchmarks.main(["--baseline", path, "--save"]), 0)
+                    self.assertEqual(benchmarks.main(["--baseline", path, "--threshold", "2"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,136 @@
+"""
+Test per l'archivio binario mappabile in memoria
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from binary_format import (ARCHIVE_MAGIC, CELL_DTYPE, HEADER_DTYPE, ColorTreeArchive, archive_path,
+                           build_sections, cell_records, open_archive, read_cell_records, records_header,
+                           write_archive)
+from cell_index import all_cells
+from chord_generator import MIDIScaleGenerator, Note
+from pattern_engine import PatternEngine, PatternType, RANDOM_PATTERNS
+from voicing import VoicingEngine
+
+
+def _worker_checksum(path):
+    """Legge l'archivio in un altro processo (solo viste sul file mappato)"""
+    with ColorTreeArchive(path) as archive:
+        return int(archive.cells['mask'].astype(np.int64).sum()), archive.cells.flags.owndata
+
+
+class TestColorTreeArchive(unittest.TestCase):
+    """Test per scrittura, lettura senza copie e modelli dei pattern"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = write_archive(os.path.join(cls.directory, "tree.ctree"))
+        cls.archive = ColorTreeArchive(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.archive.close()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def test_cells_match_color_tree(self):
+        cells = all_cells()
+        self.assertEqual(len(self.archive), len(cells))
+        # Le sezioni sono viste in sola lettura sul file mappato
+        self.assertFalse(self.archive.cells.flags.owndata)
+        self.assertFalse(self.archive.cells.flags.writeable)
+        for index in (0, 5, 200, len(cells) - 1):
+            self.assertEqual(self.archive.sound_cell(index), cells[index])
+            self.assertEqual(int(self.archive.cells['mask'][index]), cells[index].to_bitmask())
+        found = self.archive.sound_cell(self.archive.find_cell(Note.A, 4, 2))
+        self.assertEqual((found.root, found.level, found.position), (Note.A, 4, 2))
+        with self.assertRaises(ValueError):
+            self.archive.find_cell(Note.C, 12, 1)
+
+    def test_voicings(self):
+        engine = VoicingEngine()
+        index = self.archive.find_cell(Note.F_SHARP, 5, 2)
+        cell = self.archive.sound_cell(index)
+        for voicing in ("close", "drop2", "spread"):
+            self.assertEqual(self.archive.cell_voicings(index, voicing), list(engine.voicings(cell, voicing)))
+
+    def test_templates_match_compiled_patterns(self):
+        engine = PatternEngine(MIDIScaleGenerator())
+        index = self.archive.find_cell(Note.E, 6, 3)
+        cell = self.archive.sound_cell(index)
+        voicing = self.archive.cell_voicings(index, "open")[2]
+        for pattern_type in PatternType:
+            buffer = self.archive.pattern_buffer(pattern_type, voicing, 0.2, 1.25, 2)
+            if pattern_type in RANDOM_PATTERNS:
+                self.assertIsNone(buffer)
+                continue
+            expected = engine.compile_pattern(cell, pattern_type, base_duration=0.2, playback_speed=1.25,
+                                              duration_octaves=2, voicing=voicing)
+            np.testing.assert_allclose(buffer.onsets, expected.onsets)
+            np.testing.assert_allclose(buffer.durations, expected.durations)
+            np.testing.assert_array_equal(buffer.notes, expected.notes)
+            np.testing.assert_array_equal(buffer.velocities, expected.velocities)
+            np.testing.assert_array_equal(buffer.steps, expected.steps)
+            self.assertAlmostEqual(buffer.length, expected.length)
+            self.assertEqual(buffer.total_steps, expected.total_steps)
+
+    def test_invalid_files(self):
+        corrupt = os.path.join(self.directory, "corrupt.ctree")
+        with open(corrupt, 'wb') as handle:
+            handle.write(b"not an archive" * 10)
+        with self.assertRaises(ValueError):
+            ColorTreeArchive(corrupt)
+
+        # Versione diversa: rifiutata
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header[0] = (ARCHIVE_MAGIC, 999, 0, 4, 0)
+        with open(corrupt, 'wb') as handle:
+            handle.write(header.tobytes())
+        with self.assertRaises(ValueError):
+            ColorTreeArchive(corrupt)
+
+        # Una sezione mancante rende l'archivio non valido
+        sections = build_sections()
+        del sections['events']
+        partial = write_archive(os.path.join(self.directory, "partial.ctree"), sections)
+        with self.assertRaises(ValueError):
+            ColorTreeArchive(partial)
+
+    def test_record_stream(self):
+        cells = all_cells()[:20]
+        data = records_header() + cell_records(cells[:8]).tobytes() + cell_records(cells[8:]).tobytes()
+        records = read_cell_records(data)
+        # Stessi record della sezione cells dell'archivio, senza voicing
+        expected = self.archive.cells[:20].copy()
+        expected['voicing_start'] = expected['voicing_count'] = 0
+        self.assertEqual(records.dtype, CELL_DTYPE)
+        self.assertEqual(records.tobytes(), expected.tobytes())
+
+        with self.assertRaises(ValueError):
+            read_cell_records(data[:-1])
+        # Un archivio non è un flusso di record
+        with open(self.path, 'rb') as handle:
+            with self.assertRaises(ValueError):
+                read_cell_records(handle.read())
+
+    def test_open_archive_builds_once(self):
+        cache_dir = os.path.join(self.directory, "cache")
+        with open_archive(cache_dir) as archive:
+            self.assertEqual(len(archive), len(all_cells()))
+        modified = os.path.getmtime(archive_path(cache_dir))
+        with open_archive(cache_dir):
+            self.assertEqual(os.path.getmtime(archive_path(cache_dir)), modified)
+
+    def test_worker_processes_share_the_file(self):
+        expected = int(self.archive.cells['mask'].astype(np.int64).sum())
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(_worker_checksum, [self.path] * 2))
+        self.assertEqual(results, [(expected, False)] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
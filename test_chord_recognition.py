@@ -0,0 +1,61 @@
+"""
+Test per il riconoscimento degli accordi da insiemi di note
+"""
+
+import unittest
+from chord_generator import ChordGenerator, Note
+from chord_recognition import MASK_COUNT, POPCOUNT, get_recognizer, notes_to_mask
+
+
+class TestChordRecognition(unittest.TestCase):
+    """Test per la tabella di riconoscimento su tutti i 4096 insiemi"""
+
+    def setUp(self):
+        self.recognizer = get_recognizer()
+        self.generator = ChordGenerator()
+
+    def test_notes_to_mask(self):
+        self.assertEqual(notes_to_mask([Note.C, Note.E, Note.G]), 0b10010001)
+        # I numeri di nota MIDI ignorano l'ottava
+        self.assertEqual(notes_to_mask([48, 64, 79]), notes_to_mask([Note.C, Note.E, Note.G]))
+
+    def test_every_cell_is_recognized(self):
+        for cell in self.recognizer.cells:
+            result = self.recognizer.recognize(cell.notes)
+            self.assertTrue(result.matched)
+            self.assertIn(cell, result.exact)
+            self.assertEqual(result.distance, 0)
+
+    def test_exact_matches_across_roots(self):
+        # C - G - D è la cella centrale del livello 3 di G e una cella laterale di C e D
+        result = self.recognizer.recognize([Note.C, Note.G, Note.D])
+        self.assertEqual(sorted(cell.root.name for cell in result.exact), ["C", "D", "G"])
+        self.assertTrue(all(cell.to_bitmask() == result.mask for cell in result.exact))
+
+    def test_nearest_by_hamming_distance(self):
+        # Triade maggiore: non è un segmento di quinte consecutive
+        result = self.recognizer.recognize([60, 64, 67])
+        self.assertFalse(result.matched)
+        self.assertEqual(result.distance, 1)
+        for cell in result.nearest:
+            self.assertEqual(POPCOUNT[cell.to_bitmask() ^ result.mask], 1)
+        # Nessuna cella della Color Tree è più vicina
+        closest = min(POPCOUNT[cell.to_bitmask() ^ result.mask] for cell in self.recognizer.cells)
+        self.assertEqual(closest, result.distance)
+
+    def test_table_covers_all_masks(self):
+        self.assertEqual(len(self.recognizer.distance), MASK_COUNT)
+        self.assertTrue(all(self.recognizer.nearest(mask) for mask in range(MASK_COUNT)))
+        with self.assertRaises(ValueError):
+            self.recognizer.recognize_mask(MASK_COUNT)
+
+    def test_containing(self):
+        cells = self.recognizer.containing([Note.C, Note.G], Note.C)
+        self.assertTrue(cells)
+        self.assertTrue(all(cell.root == Note.C and {Note.C, Note.G} <= set(cell.notes) for cell in cells))
+        chromatic = self.generator.generate_color_tree(Note.C)[11][0]
+        self.assertIn(chromatic, cells)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
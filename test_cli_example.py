@@ -0,0 +1,120 @@
+"""
+Test per l'esportazione a blocchi delle Color Tree da riga di comando
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from binary_format import CELL_METRICS_DTYPE, read_cell_records
+from chord_generator import Note
+from cli_example import export, iter_levels, main, parse_levels, parse_roots, write_chunks
+from pcset_metrics import get_metrics
+
+
+class TestTreeExport(unittest.TestCase):
+    """Test per formati, selezione di root e livelli e scrittura a blocchi"""
+
+    def export_text(self, roots, levels, format_type, **options):
+        stream = io.StringIO()
+        export(stream, roots, levels, format_type, **options)
+        return stream.getvalue()
+
+    def test_parse_roots_and_levels(self):
+        self.assertEqual(parse_roots(["C#", "g"]), [Note.C_SHARP, Note.G])
+        self.assertEqual(len(parse_roots(["all"])), 12)
+        self.assertEqual(parse_levels("3"), [1, 2, 3])
+        self.assertEqual(parse_levels("3,7-9,3"), [3, 7, 8, 9])
+        for spec in ("0", "13", "2-x", ""):
+            with self.assertRaises(ValueError):
+                parse_levels(spec)
+        with self.assertRaises(ValueError):
+            parse_roots(["H"])
+
+    def test_jsonl_and_json(self):
+        lines = self.export_text(list(Note), list(range(1, 13)), 'jsonl').splitlines()
+        # 67 celle per root
+        self.assertEqual(len(lines), 12 * 67)
+        first = json.loads(lines[0])
+        self.assertEqual((first["root"], first["level"], first["chord"]), ("C", 1, "C"))
+        records = json.loads(self.export_text([Note.F_SHARP], [3], 'json', display_mode='intervals',
+                                              with_metrics=True))
+        self.assertEqual([r["chord"] for r in records], ["T.2.5", "T.4.5", "T.4.b7"])
+        self.assertEqual(records[0]["root"], "F#")
+        self.assertIn("roughness", records[0])
+        # Un filtro che esclude tutto produce un array vuoto valido
+        self.assertEqual(json.loads(self.export_text([Note.C], [2], 'json', filters=[("brightness", 2, 3)])), [])
+
+    def test_csv_and_text(self):
+        rows = list(csv.reader(io.StringIO(self.export_text([Note.C, Note.G], [4], 'csv', with_metrics=True))))
+        self.assertEqual(rows[0][:3], ["root", "level", "position"])
+        self.assertEqual(len(rows), 1 + 2 * 4)
+        self.assertEqual(rows[1][3], "C - D - G - A")
+        text = self.export_text([Note.D], [1, 2], 'text')
+        self.assertIn("=== Root D ===", text)
+        self.assertIn("Livello 2:\n  1. D - A\n", text)
+
+    def test_sort_and_filter(self):
+        records = [json.loads(line) for line in self.export_text(
+            [Note.C], [5], 'jsonl', with_metrics=True, sort_by='roughness').splitlines()]
+        roughness = [record["roughness"] for record in records]
+        self.assertEqual(roughness, sorted(roughness))
+
+    def test_binary_records(self):
+        stream = io.BytesIO()
+        export(stream, [Note.C, Note.E], [3, 12], 'binary', with_metrics=True)
+        records = read_cell_records(stream.getvalue())
+        self.assertEqual(records.dtype, CELL_METRICS_DTYPE)
+        self.assertEqual(len(records), 2 * 4)
+        first = records[0]
+        self.assertEqual((first['mask'], first['root'], first['level'], first['position'],
+                          first['fifths_below'], first['fifths_above'], first['brightness']),
+                         ((1 << 0) | (1 << 2) | (1 << 7), 0, 3, 0, 0, 2, 1.0))
+        self.assertEqual(list(first['notes'][:first['note_count']]), [0, 2, 7])
+        self.assertAlmostEqual(float(first['roughness']), get_metrics().roughness[first['mask']], places=4)
+
+    def test_write_chunks(self):
+        class Sink:
+            def __init__(self):
+                self.writes = []
+
+            def write(self, data):
+                self.writes.append(data)
+
+        sink = Sink()
+        total = write_chunks((b"x" * 10 for _ in range(100)), sink, chunk_size=256)
+        self.assertEqual(total, 1000)
+        self.assertEqual(b"".join(sink.writes), b"x" * 1000)
+        self.assertEqual(len(sink.writes), 4)
+
+    def test_streams_one_root_at_a_time(self):
+        levels = iter_levels(list(Note), [1, 2])
+        # Generazione pigra: il primo livello arriva prima che le altre root siano generate
+        self.assertEqual([cell.root for cell in next(levels)], [Note.C])
+
+        class Sink:
+            def __init__(self):
+                self.roots_seen = []
+
+            def write(self, data):
+                self.roots_seen.append(data.count('"root"'))
+
+        sink = Sink()
+        export(sink, list(Note), list(range(1, 13)), 'jsonl', chunk_size=1024)
+        # Molte scritture piccole invece di un unico output costruito in memoria
+        self.assertGreater(len(sink.roots_seen), 12)
+        self.assertEqual(sum(sink.roots_seen), 12 * 67)
+
+    def test_main_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trees.jsonl")
+            self.assertEqual(main(["--root", "all", "--levels", "2", "--format", "jsonl", "--export", path]), 0)
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(sum(1 for _ in f), 12 * 3)
+        self.assertEqual(main(["--root", "H"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,207 @@
+"""
+Test per il flusso WebSocket degli eventi di riproduzione
+"""
+
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import time
+import unittest
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from event_stream import (OP_CLOSE, OP_TEXT, ClientQueue, EventBatch, EventStreamServer, accept_key,
+                          coalesce)
+from multitrack import MultiTrackSession
+from pattern_engine import NOTE_ON, PatternEngine, PatternType
+from scheduler import LookaheadScheduler
+from test_midi_effects import FakeMIDIOutput
+
+
+def make_batch(start, events):
+    return EventBatch(start, start + 0.1, [(onset, duration, 60, 100, "") for onset, duration in events])
+
+
+class WebSocketClient:
+    """Client WebSocket minimo e bloccante per i test"""
+
+    def __init__(self, port, path="/events"):
+        self.key = base64.b64encode(os.urandom(16)).decode("ascii")
+        self.sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        self.sock.sendall((f"GET {path} HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {self.key}\r\n"
+                           "Sec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+        self.head = b""
+        while b"\r\n\r\n" not in self.head:
+            self.head += self.sock.recv(1)
+
+    def _read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connessione chiusa")
+            data += chunk
+        return data
+
+    def receive(self):
+        first, second = self._read(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._read(8))[0]
+        return first & 0x0F, self._read(length)
+
+    def receive_json(self):
+        opcode, data = self.receive()
+        return json.loads(data) if opcode == OP_TEXT else None
+
+    def close(self):
+        mask = os.urandom(4)
+        payload = struct.pack("!H", 1000)
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        self.sock.sendall(bytes([0x80 | OP_CLOSE, 0x80 | len(payload)]) + mask + masked)
+        try:
+            self.receive()
+        finally:
+            self.sock.close()
+
+
+class TestClientQueue(unittest.TestCase):
+    """Test per le code limitate e le politiche per i client lenti"""
+
+    def fill(self, policy):
+        queue = ClientQueue(maxsize=2, policy=policy)
+        for index in range(4):
+            queue.put(make_batch(index / 10, [(index / 10, 0.05), (index / 10 + 0.05, 0.5)]))
+        return queue
+
+    def test_drop_policies(self):
+        oldest = self.fill("drop_oldest")
+        self.assertEqual([batch.start for batch in oldest.batches], [0.2, 0.3])
+        newest = self.fill("drop_newest")
+        self.assertEqual([batch.start for batch in newest.batches], [0.0, 0.1])
+        for queue in (oldest, newest):
+            self.assertEqual(queue.total_dropped, 4)
+            batch, dropped = asyncio.run(queue.get())
+            self.assertEqual(dropped, 4)
+            self.assertEqual(queue.dropped, 0)
+
+    def test_coalesce_drops_finished_notes(self):
+        merged, dropped = coalesce([make_batch(0.0, [(0.0, 0.05), (0.05, 0.5)]),
+                                    make_batch(0.1, [(0.1, 0.05)])])
+        self.assertEqual((merged.start, merged.end), (0.0, 0.2))
+        # La prima nota è finita prima dell'ultima finestra
+        self.assertEqual([event[0] for event in merged.events], [0.05, 0.1])
+        self.assertEqual(dropped, 1)
+        queue = self.fill("coalesce")
+        self.assertLessEqual(len(queue), 2)
+        self.assertGreater(queue.total_dropped, 0)
+
+    def test_message_format(self):
+        batch = EventBatch(0.0, 0.075, [(0.05, 0.24, 64, 90, "lead")])
+        message = json.loads(batch.message(dropped=3))
+        self.assertEqual(message["type"], "events")
+        self.assertEqual(message["window"], [0.0, 0.075])
+        self.assertEqual(message["dropped"], 3)
+        self.assertEqual(message["events"], [{"note": 64, "velocity": 90, "onset": 0.05,
+                                              "duration": 0.24, "track": "lead"}])
+
+
+class TestSchedulerBatches(unittest.TestCase):
+    """Test per i batch passati dallo scheduler a ogni riempimento della finestra"""
+
+    def test_one_batch_per_window(self):
+        engine = PatternEngine(MIDIScaleGenerator(), FakeMIDIOutput())
+        cell = ChordGenerator().generate_color_tree(Note.C)[2][0]
+        engine.update_parameters(sound_cell=cell, pattern_type=PatternType.UP, base_duration=0.1)
+        scheduler = LookaheadScheduler(lookahead=0.1)
+        batches = []
+        scheduler.listeners.append(lambda sched, start, end, batch: batches.append((start, end, batch)))
+        scheduler.add_source(engine.prepare_playback(loop=False))
+        scheduler.start(origin=0.0)
+        for horizon in (0.1, 0.2, 0.3, 0.4):
+            scheduler.fill(horizon)
+        # Un batch per ogni finestra con eventi (la terza è vuota); ogni nota compare una volta sola
+        self.assertEqual([(start, end) for start, end, _ in batches], [(0.0, 0.1), (0.1, 0.2), (0.3, 0.4)])
+        notes = [event for _, _, batch in batches for event in batch if event[1] == NOTE_ON]
+        self.assertEqual([round(event[0], 6) for event in notes], [0.0, 0.1, 0.2])
+        self.assertTrue(all(start <= event[0] <= end for start, end, batch in batches for event in batch))
+
+
+class TestEventStreamServer(unittest.TestCase):
+    """Test end-to-end su un socket locale"""
+
+    def setUp(self):
+        self.server = EventStreamServer(port=0, queue_size=4)
+        self.port = self.server.start_in_thread()
+
+    def tearDown(self):
+        self.server.stop_thread()
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Condizione non raggiunta")
+            time.sleep(0.01)
+
+    def test_handshake_and_rejections(self):
+        client = WebSocketClient(self.port)
+        self.assertIn(b"101 Switching Protocols", client.head)
+        self.assertIn(accept_key(client.key).encode("ascii"), client.head)
+        self.assertEqual(client.receive_json()["policy"], "drop_oldest")
+        client.close()
+        rejected = WebSocketClient(self.port, "/other")
+        self.assertIn(b"404", rejected.head)
+        rejected.sock.close()
+        with socket.create_connection(("127.0.0.1", self.port), timeout=5) as plain:
+            plain.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            self.assertIn(b"426", plain.recv(1024))
+
+    def test_live_playback_is_streamed(self):
+        client = WebSocketClient(self.port)
+        client.receive_json()
+        self.wait_for(lambda: self.server.clients)
+        output = FakeMIDIOutput()
+        session = MultiTrackSession(MIDIScaleGenerator(), output)
+        cell = ChordGenerator().generate_color_tree(Note.G)[3][1]
+        session.add_track("lead", channel=0, sound_cell=cell, pattern_type=PatternType.UP, base_duration=0.03)
+        self.server.attach(session)
+        session.play(loop=False)
+        self.wait_for(lambda: not session.is_playing)
+
+        events = []
+        while len(events) < 4:
+            message = client.receive_json()
+            events.extend(message["events"])
+        played = [m[1] for m in output.messages if m[0] == 'on']
+        self.assertEqual([event["note"] for event in events], played)
+        self.assertEqual({event["track"] for event in events}, {"lead"})
+        self.assertEqual([round(event["onset"], 3) for event in events], [0.0, 0.03, 0.06, 0.09])
+        client.close()
+
+    def test_slow_client_never_blocks_publisher(self):
+        slow = WebSocketClient(self.port)
+        slow.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.wait_for(lambda: self.server.clients)
+        scheduler = LookaheadScheduler()
+        scheduler.start(origin=0.0)
+        events = [(index * 0.001, 0.1, NOTE_ON, None, (60, 100, 0.1)) for index in range(400)]
+        batch = [(due, kind, type("Source", (), {"track": "t"})(), payload) for due, _, kind, _, payload in events]
+        started = time.perf_counter()
+        for window in range(300):
+            self.server.listener(scheduler, window * 0.1, (window + 1) * 0.1, batch)
+        # Il thread di riproduzione consegna solo i batch al loop: nessuna attesa sul client
+        self.assertLess(time.perf_counter() - started, 1.0)
+        client = next(iter(self.server.clients))
+        self.wait_for(lambda: self.server.batches_published == 300)
+        self.assertLessEqual(len(client), 4)
+        self.assertGreater(client.total_dropped, 0)
+        slow.sock.close()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
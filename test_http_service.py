@@ -0,0 +1,184 @@
+"""
+Test per il servizio HTTP delle Color Tree (server locale su una porta libera)
+"""
+
+import asyncio
+import http.client
+import io
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import mido
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from http_service import (ColorTreeService, RenderRequest, error_response, parse_note_list,
+                          parse_render_parameters, render_clip)
+from pattern_engine import PatternEngine, PatternType
+
+
+class TestRenderRequests(unittest.TestCase):
+    """Test per la validazione dei parametri e il rendering nei processi del pool"""
+
+    def test_parameters_are_validated_and_canonical(self):
+        parameters = parse_render_parameters({'reverse': "true", 'bpm': "90", 'voicing': "drop2"})
+        self.assertEqual(parameters, (('bpm', 90), ('reverse', True), ('voicing', "drop2")))
+        for query in ({'bpm': "900"}, {'bpm': "fast"}, {'voicing': "wide"}, {'reverse': "maybe"},
+                      {'sound_cell': "C"}):
+            with self.assertRaises(ValueError):
+                parse_render_parameters(query)
+        self.assertEqual(parse_note_list("60, E,G"), [60, 4, 7])
+
+    def test_determinism(self):
+        self.assertTrue(RenderRequest(0, 3, 0, "up").deterministic)
+        self.assertTrue(RenderRequest(0, 3, 0, "up", parameters=(('accent_enabled', True),)).deterministic)
+        self.assertFalse(RenderRequest(0, 3, 0, "random_chaos").deterministic)
+        self.assertFalse(RenderRequest(0, 3, 0, "up", parameters=(('humanize_velocity', 10),)).deterministic)
+
+    def test_render_clip(self):
+        request = RenderRequest(Note.A.value, 4, 1, "up_down", 'midi', (('bpm', 100), ('duration_octaves', 2)))
+        midi_file = mido.MidiFile(file=io.BytesIO(render_clip(request)))
+        notes = [message.note for message in midi_file if message.type == 'note_on']
+        engine = PatternEngine(MIDIScaleGenerator())
+        cell = next(cell for cell in ChordGenerator().generate_color_tree(Note.A)[3] if cell.position == 1)
+        expected = engine.render_pattern_events(sound_cell=cell, pattern_type=PatternType.UP_DOWN, duration_octaves=2)
+        self.assertEqual(notes, [int(note) for note in expected.notes])
+        # Gli onset sono in secondi: il tempo del file cambia i tick, non la durata
+        self.assertAlmostEqual(midi_file.length, expected.length, places=2)
+        self.assertEqual(render_clip(request), render_clip(request))
+
+        wav = wave.open(io.BytesIO(render_clip(RenderRequest(Note.C.value, 3, 0, "up", 'wav'))))
+        self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (1, 2, 22050))
+        # Tre note da 0.3 s
+        self.assertAlmostEqual(wav.getnframes() / 22050, 0.9, places=2)
+
+        too_long = RenderRequest(Note.C.value, 12, 0, "up", 'midi', (('base_duration', 4.0), ('duration_octaves', 4)))
+        with self.assertRaises(ValueError):
+            render_clip(too_long)
+
+
+class TestColorTreeService(unittest.TestCase):
+    """Test end-to-end: socket reale, cache con ETag, keep-alive ed errori"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.loop = asyncio.new_event_loop()
+        cls.thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.thread.start()
+        cls.service = ColorTreeService(port=0, workers=1, cache_dir=cls.directory)
+        asyncio.run_coroutine_threadsafe(cls.service.start(), cls.loop).result(timeout=60)
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run_coroutine_threadsafe(cls.service.stop(), cls.loop).result(timeout=60)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread.join(timeout=10)
+        cls.loop.close()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def request(self, path, method="GET", headers=None, connection=None):
+        connection = connection or http.client.HTTPConnection("127.0.0.1", self.service.port, timeout=30)
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_tree_cell_and_recognition(self):
+        response, body = self.request("/tree/F%23?levels=3-3&display=intervals")
+        self.assertEqual(response.status, 200)
+        self.assertEqual([record["chord"] for record in json.loads(body)], ["T.2.5", "T.4.5", "T.4.b7"])
+
+        response, body = self.request("/cell/A/4/2")
+        record = json.loads(body)
+        self.assertEqual((record["root"], record["level"], record["position"]), ("A", 4, 2))
+        self.assertEqual(set(record["voicings"]), {"close", "open", "drop2", "drop3", "spread"})
+        self.assertIn("roughness", record)
+
+        response, body = self.request("/recognize?notes=60,62,67")
+        result = json.loads(body)
+        self.assertTrue(result["matched"])
+        self.assertIn(["C", "D", "G"], [cell["notes"] for cell in result["exact"]])
+        # Note diverse, stessa maschera: stessa risorsa e stesso ETag
+        other, _ = self.request("/recognize?notes=C,D,G")
+        self.assertEqual(response.getheader("ETag"), other.getheader("ETag"))
+
+    def test_render_cache_and_etag(self):
+        path = "/render?cell=D:3:1&pattern=zigzag&bpm=132&format=midi"
+        response, body = self.request(path)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "audio/midi")
+        etag = response.getheader("ETag")
+        renders = self.service.renders
+
+        # Stessi parametri in un altro ordine: risposta dalla cache, senza nuovi rendering
+        response, cached = self.request("/render?format=midi&bpm=132&pattern=zigzag&cell=D:3:1")
+        self.assertEqual((cached, response.getheader("ETag")), (body, etag))
+        response, empty = self.request(path, headers={"If-None-Match": etag})
+        self.assertEqual((response.status, empty), (304, b""))
+        self.assertEqual(self.service.renders, renders)
+
+        # I pattern casuali non vengono memorizzati
+        response, _ = self.request("/render?cell=D:3:1&pattern=random_rhythm")
+        self.assertEqual(response.status, 200)
+        self.assertIsNone(response.getheader("ETag"))
+        self.assertEqual(response.getheader("Cache-Control"), "no-store")
+
+    def test_identical_renders_in_flight_are_shared(self):
+        path = "/render?cell=G:5:2&pattern=cascade&format=wav&delay_enabled=1&delay_mix=0.4"
+        renders = self.service.renders
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: self.request(path), range(4)))
+        self.assertTrue(all(response.status == 200 for response, _ in results))
+        self.assertEqual(len({body for _, body in results}), 1)
+        self.assertEqual(self.service.renders, renders + 1)
+
+    def test_keep_alive(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.service.port, timeout=30)
+        first, _ = self.request("/health", connection=connection)
+        second, body = self.request("/tree/C?levels=1", connection=connection)
+        self.assertEqual((first.status, second.status), (200, 200))
+        self.assertEqual(len(json.loads(body)), 1)
+        connection.close()
+
+    def test_errors(self):
+        cases = {"/missing": 404, "/cell/C/3/9": 404, "/tree/H": 400, "/tree/C?levels=13": 400,
+                 "/render?cell=C:3:0&pattern=sideways": 400, "/render?cell=C:3:0&tempo=1": 400,
+                 "/render?cell=C:12:0&base_duration=4&duration_octaves=4": 422}
+        for path, status in cases.items():
+            response, body = self.request(path)
+            self.assertEqual(response.status, status, path)
+            self.assertIn("error", json.loads(body))
+        response, _ = self.request("/tree/C", method="POST")
+        self.assertEqual((response.status, response.getheader("Allow")), (405, "GET"))
+
+    def test_errors_are_not_cached(self):
+        async def unavailable():
+            return error_response(503, "mido non disponibile")
+
+        async def missing_key():
+            raise KeyError("velocity")
+
+        async def broken():
+            raise TypeError("unsupported operand")
+
+        resources = {"/unavailable": ("unavailable", True, unavailable), "/missing_key": ("key", True, missing_key),
+                     "/broken": ("broken", False, broken)}
+        with mock.patch.object(self.service, "_route", lambda path, query: resources["/" + path[0]]), \
+                mock.patch("builtins.print"):
+            response, _ = self.request("/unavailable")
+            self.assertEqual(response.status, 503)
+            self.assertIsNone(response.getheader("ETag"))
+            self.assertEqual(response.getheader("Cache-Control"), "no-store")
+
+            # Un'eccezione imprevista del rendering diventa un 500, non un 404 o una connessione chiusa
+            for path in ("/missing_key", "/broken"):
+                response, body = self.request(path)
+                self.assertEqual(response.status, 500, path)
+                self.assertIn("error", json.loads(body))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
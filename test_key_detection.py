@@ -0,0 +1,95 @@
+"""
+Test per il riconoscimento della tonalità in streaming
+"""
+
+import time
+import unittest
+import mido
+import numpy as np
+from chord_generator import Note
+from key_detection import PROFILES, KeyDetector
+from midi_input import MIDIInput
+
+
+# Scale con tonica e dominante ripetute, come in una frase musicale
+C_MAJOR_PHRASE = [60, 62, 64, 65, 67, 69, 71, 72, 67, 64, 60]
+A_MINOR_PHRASE = [57, 59, 60, 62, 64, 65, 68, 69, 64, 60, 57]
+
+
+class TestKeyDetector(unittest.TestCase):
+    """Test per istogramma, correlazione e debounce"""
+
+    def play(self, detector, phrase, start, spacing=0.1, repeats=3):
+        at = start
+        for _ in range(repeats):
+            for note in phrase:
+                detector.add_note(note, 1.0, at)
+                at += spacing
+        return at
+
+    def test_profiles_are_normalized(self):
+        self.assertEqual(PROFILES.shape, (24, 12))
+        np.testing.assert_allclose(np.linalg.norm(PROFILES, axis=1), 1.0)
+        np.testing.assert_allclose(PROFILES.sum(axis=1), 0.0, atol=1e-12)
+
+    def test_detects_major_and_minor(self):
+        detector = KeyDetector(debounce=0.2)
+        self.play(detector, C_MAJOR_PHRASE, 0.0)
+        self.assertEqual((detector.key.tonic, detector.key.mode), (Note.C, "major"))
+
+        detector = KeyDetector(debounce=0.2)
+        self.play(detector, A_MINOR_PHRASE, 0.0)
+        self.assertEqual(detector.key.name, "A minor")
+
+    def test_follows_modulation_with_decay(self):
+        detector = KeyDetector(half_life=1.0, debounce=0.3)
+        at = self.play(detector, C_MAJOR_PHRASE, 0.0)
+        self.assertEqual(detector.key.tonic, Note.C)
+        self.play(detector, [note + 2 for note in C_MAJOR_PHRASE], at, repeats=4)
+        self.assertEqual(detector.key.name, "D major")
+
+    def test_debounce(self):
+        detector = KeyDetector(debounce=10.0)
+        self.play(detector, C_MAJOR_PHRASE, 0.0)
+        # La tonalità migliore non è ancora rimasta tale abbastanza a lungo
+        self.assertIsNone(detector.key)
+        self.assertEqual(int(detector.scores.argmax()), Note.C.value)
+        self.assertIsNone(detector.drain_updates())
+
+    def test_updates_and_listeners(self):
+        detector = KeyDetector(debounce=0.2)
+        received = []
+        detector.listeners.append(received.append)
+        self.play(detector, C_MAJOR_PHRASE, 0.0)
+        self.assertEqual([key.name for key in received], ["C major"])
+        # Le note successive aggiornano la correlazione senza toccare la stima già consegnata
+        adopted_score = received[0].score
+        self.play(detector, C_MAJOR_PHRASE, 10.0, repeats=1)
+        self.assertEqual(received[0].score, adopted_score)
+        self.assertIsNot(detector.key, received[0])
+        self.assertEqual(detector.drain_updates().name, "C major")
+        detector.reset()
+        self.assertIsNone(detector.key)
+        self.assertFalse(detector.histogram.any())
+
+    def test_midi_input_messages(self):
+        midi_input = MIDIInput()
+        detector = KeyDetector(debounce=0.0)
+        midi_input.message_listeners.append(detector.handle_message)
+        for index, note in enumerate(C_MAJOR_PHRASE * 2):
+            midi_input.handle_message(mido.Message('note_on', note=note, velocity=100), index * 0.1)
+            midi_input.handle_message(mido.Message('note_off', note=note), index * 0.1 + 0.05)
+        self.assertEqual(detector.key.name, "C major")
+
+    def test_update_cost(self):
+        detector = KeyDetector()
+        start = time.perf_counter()
+        for index in range(2000):
+            detector.add_note(60 + index % 12, 1.0, index * 0.01)
+        per_note = (time.perf_counter() - start) / 2000
+        # Microsecondi per messaggio (margine ampio per macchine lente)
+        self.assertLess(per_note, 0.0005)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,127 @@
+"""
+Test per l'arpeggiatore guidato dalla tastiera MIDI
+"""
+
+import time
+import unittest
+import mido
+from chord_generator import MIDIScaleGenerator
+from keyboard_arpeggiator import KeyboardArpeggiator, LatencyMonitor
+from midi_input import MIDIInput
+from pattern_engine import PatternEngine, PatternType
+from test_midi_effects import FakeMIDIOutput
+
+
+def note_on(note):
+    return mido.Message('note_on', note=note, velocity=100)
+
+
+def note_off(note):
+    return mido.Message('note_off', note=note)
+
+
+class TestKeyboardArpeggiator(unittest.TestCase):
+    """Test per l'accordo attivo preso dalle note tenute"""
+
+    def setUp(self):
+        self.output = FakeMIDIOutput()
+        self.engine = PatternEngine(MIDIScaleGenerator(), self.output)
+        self.engine.update_parameters(pattern_type=PatternType.UP, base_duration=0.05)
+        self.input = MIDIInput()
+        self.arpeggiator = KeyboardArpeggiator(self.engine, self.input)
+        self.arpeggiator.enable()
+
+    def tearDown(self):
+        self.arpeggiator.disable()
+
+    def play(self, *messages):
+        for message in messages:
+            self.input.handle_message(message)
+
+    def note_ons(self):
+        return [(m[1], m[3]) for m in self.output.messages if m[0] == 'on']
+
+    def test_held_notes_are_arpeggiated(self):
+        self.play(note_on(48), note_on(52), note_on(55))
+        time.sleep(0.2)
+        notes = [note for note, _ in self.note_ons()]
+        # Le note suonate sono quelle tenute, nelle loro ottave
+        self.assertTrue(notes)
+        self.assertEqual(set(notes), {48, 52, 55})
+        self.assertEqual(self.engine.current_input_notes, (48, 52, 55))
+
+    def test_changes_merge_without_restart(self):
+        self.play(note_on(60), note_on(64))
+        time.sleep(0.12)
+        origin = self.engine.scheduler.origin
+        self.play(note_on(67))
+        time.sleep(0.25)
+        self.play(note_off(60), note_off(64), note_off(67))
+
+        self.assertEqual(self.engine.scheduler.origin, origin)
+        onsets = [at - origin for _, at in self.note_ons()]
+        # Tutte le note restano sulla griglia dei passi da 0.05 s: il loop non è ripartito
+        for onset in onsets:
+            self.assertAlmostEqual(onset / 0.05, round(onset / 0.05), delta=0.3)
+        self.assertIn(67, [note for note, _ in self.note_ons()])
+
+    def test_release_stops_without_latch(self):
+        self.play(note_on(60), note_on(64))
+        time.sleep(0.08)
+        self.play(note_off(60), note_off(64))
+        self.assertFalse(self.engine.is_playing)
+        count = len(self.note_ons())
+        time.sleep(0.1)
+        self.assertEqual(len(self.note_ons()), count)
+
+    def test_latch_holds_and_replaces(self):
+        self.arpeggiator.set_latch(True)
+        self.play(note_on(60), note_on(64), note_off(60), note_on(67))
+        # Con il latch le note aggiunte mentre si tiene l'accordo si sommano
+        self.assertEqual(self.arpeggiator.chord, (60, 64, 67))
+        self.play(note_off(64), note_off(67))
+        time.sleep(0.1)
+        self.assertTrue(self.engine.is_playing)
+        self.assertEqual(self.arpeggiator.chord, (60, 64, 67))
+        # Un nuovo accordo dopo il rilascio sostituisce quello latchato
+        self.play(note_on(62))
+        self.assertEqual(self.arpeggiator.chord, (62,))
+        self.arpeggiator.set_latch(False)
+        self.play(note_off(62))
+        self.assertFalse(self.engine.is_playing)
+
+    def test_latency_is_reported(self):
+        self.play(note_on(60))
+        time.sleep(0.1)
+        self.play(note_on(64))
+        time.sleep(0.15)
+        report = self.arpeggiator.latency_report()
+        self.assertEqual(report['count'], 2)
+        # La prima nota parte subito; il cambio entra dopo la finestra di anticipo e un passo
+        self.assertLess(report['max_ms'], 20 + 50 + 20)
+
+    def test_disable_restores_sound_cell_notes(self):
+        self.play(note_on(60))
+        self.arpeggiator.disable()
+        self.assertFalse(self.engine.is_playing)
+        self.assertEqual(self.engine.current_input_notes, ())
+        self.assertNotIn(self.arpeggiator.handle_update, self.input.listeners)
+
+
+class TestLatencyMonitor(unittest.TestCase):
+    """Test per le statistiche di latenza"""
+
+    def test_report(self):
+        monitor = LatencyMonitor(size=3)
+        self.assertEqual(monitor.report(), {'count': 0})
+        for latency in (0.001, 0.002, 0.003, 0.004):
+            monitor.add(latency)
+        report = monitor.report()
+        self.assertEqual(report['count'], 3)
+        self.assertAlmostEqual(report['last_ms'], 4.0)
+        self.assertAlmostEqual(report['mean_ms'], 3.0)
+        self.assertAlmostEqual(report['max_ms'], 4.0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
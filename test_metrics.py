@@ -0,0 +1,165 @@
+"""
+Test per le metriche di riproduzione
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+import chord_generator
+from chord_generator import ChordGenerator, MIDIOutput, MIDIScaleGenerator, Note
+from metrics import LatencyHistogram, MetricsServer, RateMeter, cache_stats, write_json
+from pattern_engine import PatternEngine, PatternType
+from test_midi_effects import FakeMIDIOutput
+
+
+class FakePort:
+    """Porta MIDI che memorizza i messaggi inviati"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """Test per i bucket log-lineari e i percentili"""
+
+    def test_buckets_are_contiguous(self):
+        histogram = LatencyHistogram(max_value=1_000_000)
+        previous = -1
+        for index in range(len(histogram.counts)):
+            lower, upper = histogram.bucket_range(index)
+            self.assertEqual(lower, previous + 1)
+            self.assertEqual(histogram.bucket_index(lower), index)
+            self.assertEqual(histogram.bucket_index(upper), index)
+            # Precisione relativa sotto il 3% anche per i valori grandi
+            self.assertLessEqual(upper - lower, max(1, lower * 0.032))
+            previous = upper
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 1001):
+            histogram.record(value)
+        histogram.record(-5)
+        histogram.record(10 ** 12)
+        summary = histogram.as_dict()
+        self.assertEqual((summary['count'], summary['min'], summary['max']), (1002, 0, histogram.max_value))
+        self.assertAlmostEqual(histogram.percentile(50), 500, delta=500 * 0.032)
+        self.assertAlmostEqual(histogram.percentile(99), 990, delta=990 * 0.032)
+        self.assertEqual(histogram.percentile(100), histogram.max_value)
+
+        other = LatencyHistogram()
+        other.record(7)
+        histogram.merge(other)
+        self.assertEqual(histogram.count, 1003)
+        with self.assertRaises(ValueError):
+            histogram.merge(LatencyHistogram(sub_bucket_bits=3))
+        histogram.reset()
+        self.assertEqual((histogram.count, histogram.percentile(99), sum(histogram.counts)), (0, 0, 0))
+
+
+class TestRateMeter(unittest.TestCase):
+    """Test per la frequenza su finestra scorrevole"""
+
+    def test_rate(self):
+        now = [100.0]
+        meter = RateMeter(window=4, clock=lambda: now[0])
+        self.assertEqual(meter.rate(), 0.0)
+        for _ in range(40):
+            meter.record()
+            now[0] += 0.05
+        # 40 eventi in 2 secondi
+        self.assertAlmostEqual(meter.rate(), 20.0)
+        now[0] += 10
+        self.assertEqual(meter.rate(), 0.0)
+        self.assertEqual(meter.total, 40)
+
+
+class TestPlaybackMetrics(unittest.TestCase):
+    """Test per le metriche del Pattern Engine e dell'uscita MIDI"""
+
+    def test_engine_snapshot(self):
+        output = FakeMIDIOutput()
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        cell = ChordGenerator().generate_color_tree(Note.D)[3][0]
+        engine.play_pattern(cell, PatternType.UP, base_duration=0.02)
+        deadline = time.monotonic() + 5
+        while engine.is_playing and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        snapshot = json.loads(json.dumps(engine.metrics_snapshot()))
+        notes = len([message for message in output.messages if message[0] == 'on'])
+        offs = len([message for message in output.messages if message[0] == 'off'])
+        # NOTE ON, NOTE OFF e fine del loop passano tutti dallo scheduler
+        self.assertEqual(snapshot['lateness_us']['count'], notes + offs + 1)
+        self.assertEqual(snapshot['events']['dispatched'], notes + offs + 1)
+        self.assertLess(snapshot['lateness_us']['p50'], 50_000)
+        self.assertGreaterEqual(snapshot['threads'], 1)
+        self.assertEqual(snapshot['queues']['scheduled_events'], 0)
+        self.assertEqual(snapshot['caches']['compile']['misses'], 1)
+
+        # Lo stesso pattern una seconda volta viene dalla cache di compilazione
+        engine.play_pattern(cell, PatternType.UP, base_duration=0.02)
+        engine.stop_pattern()
+        self.assertEqual(engine.metrics_snapshot()['caches']['compile']['hit_rate'], 0.5)
+        self.assertEqual(cache_stats(0, 0), {'hits': 0, 'misses': 0, 'hit_rate': 0.0})
+
+    def test_midi_output_counters_and_stuck_notes(self):
+        # Nessuna scansione delle porte: basta una porta che accetti i messaggi
+        with mock.patch.object(chord_generator, 'MIDI_AVAILABLE', False):
+            output = MIDIOutput()
+        output.initialized = True
+        output.output_port = FakePort()
+        output.send_note_on(60, 100)
+        output.send_note_on(64, 100)
+        output.send_note_off(64)
+        output.send_clock()
+        self.assertEqual(output.metrics()['messages_sent'], 4)
+        self.assertEqual(output.metrics()['active_notes'], 1)
+        self.assertEqual(output.stuck_notes(60.0), 0)
+        output.note_started[(60, 0)] -= 120
+        self.assertEqual(output.stuck_notes(60.0), 1)
+
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        self.assertEqual(engine.metrics_snapshot()['stuck_notes'], 1)
+        output.stop_all_notes()
+        self.assertEqual(engine.stuck_notes(), 0)
+
+
+class TestMetricsExport(unittest.TestCase):
+    """Test per l'esportazione JSON e l'endpoint HTTP"""
+
+    def test_write_json_and_http_endpoint(self):
+        engine = PatternEngine(MIDIScaleGenerator(), FakeMIDIOutput())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "metrics.json")
+            write_json(engine.metrics_snapshot(), path)
+            with open(path, encoding="utf-8") as file:
+                self.assertIn('lateness_us', json.load(file))
+            self.assertEqual(os.listdir(directory), ["metrics.json"])
+
+        server = MetricsServer(engine.metrics_snapshot, port=0)
+        port = server.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+                self.assertEqual(response.headers["Content-Type"], "application/json")
+                self.assertIn('caches', json.loads(response.read()))
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/other", timeout=5)
+            self.assertEqual(context.exception.code, 404)
+            context.exception.close()
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,160 @@
+"""
+Test per la sincronizzazione MIDI Clock
+Verifica l'estimatore PLL, il timebase esterno e l'emissione del clock dal pattern engine
+"""
+
+import random
+import time
+import unittest
+import mido
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from midi_clock import ClockPLL, ExternalClockFollower, tick_interval
+from pattern_engine import PatternEngine, PatternType
+from test_midi_effects import FakeMIDIOutput
+
+
+class FakeClockOutput(FakeMIDIOutput):
+    """Output MIDI finto che registra anche i messaggi real-time"""
+
+    def send_clock(self):
+        self.messages.append(('clock', None, 0, time.perf_counter()))
+
+    def send_start(self):
+        self.messages.append(('start', None, 0, time.perf_counter()))
+
+    def send_stop(self):
+        self.messages.append(('stop', None, 0, time.perf_counter()))
+
+    def send_continue(self):
+        self.messages.append(('continue', None, 0, time.perf_counter()))
+
+
+class TestClockPLL(unittest.TestCase):
+    """Test per l'estimatore ad aggancio di fase"""
+
+    def test_locks_to_jittery_clock(self):
+        rng = random.Random(3)
+        period = tick_interval(128)
+        pll = ClockPLL(initial_bpm=120)
+        errors = []
+        for index in range(600):
+            true_time = index * period
+            pll.tick(true_time + rng.uniform(-0.001, 0.001))
+            if index > 300:
+                errors.append(abs(pll.time_of(index) - true_time))
+        self.assertAlmostEqual(pll.bpm, 128, delta=0.5)
+        # Il jitter stimato resta sotto quello in ingresso (±1 ms)
+        self.assertLess(max(errors), 0.001)
+
+    def test_follows_tempo_change(self):
+        pll = ClockPLL(initial_bpm=120)
+        clock = 0.0
+        for _ in range(200):
+            pll.tick(clock)
+            clock += tick_interval(120)
+        for _ in range(800):
+            pll.tick(clock)
+            clock += tick_interval(100)
+        self.assertAlmostEqual(pll.bpm, 100, delta=0.5)
+
+
+class TestExternalClockFollower(unittest.TestCase):
+    """Test per il timebase che segue un clock esterno"""
+
+    def test_timeline_maps_to_external_beats(self):
+        follower = ExternalClockFollower(lambda: 120)
+        self.assertEqual(follower.wall_time(0.0), float('inf'))
+        follower.handle_message(mido.Message('start'), timestamp=5.0)
+        period = tick_interval(60)
+        for index in range(48):
+            follower.handle_message(mido.Message('clock'), timestamp=5.0 + index * period)
+        # Una semiminima nominale (0.5 s a 120 BPM) dura un beat esterno (1 s a 60 BPM)
+        self.assertAlmostEqual(follower.wall_time(0.5), 6.0, delta=0.02)
+        self.assertAlmostEqual(follower.position(6.0), 0.5, delta=0.01)
+
+        follower.handle_message(mido.Message('stop'), timestamp=7.0)
+        self.assertEqual(follower.wall_time(1.0), float('inf'))
+
+    def test_continue_resumes_phase_and_tempo(self):
+        follower = ExternalClockFollower(lambda: 120)
+        period = tick_interval(120)
+        follower.handle_message(mido.Message('start'), timestamp=0.0)
+        for index in range(192):
+            follower.handle_message(mido.Message('clock'), timestamp=index * period)
+        follower.handle_message(mido.Message('stop'), timestamp=4.0)
+        stopped = follower.position(4.0)
+        # Da fermo la posizione non avanza
+        self.assertEqual(follower.position(5.5), stopped)
+        self.assertAlmostEqual(stopped, 191 * period, places=6)
+
+        follower.handle_message(mido.Message('continue'), timestamp=6.0)
+        for index in range(384):
+            follower.handle_message(mido.Message('clock'), timestamp=6.0 + index * period)
+        # La pausa di 2 s non è un errore di fase: tempo e posizione proseguono dall'ultimo impulso
+        self.assertAlmostEqual(follower.bpm, 120, delta=0.5)
+        end = 6.0 + 383 * period
+        self.assertAlmostEqual(follower.position(end), 575 * period, delta=0.01)
+        self.assertAlmostEqual(follower.wall_time(576 * period), end + period, delta=0.01)
+
+
+class TestExternalStartStop(unittest.TestCase):
+    """Test per Start/Stop del clock esterno durante la riproduzione"""
+
+    def send_clock(self, follower, seconds):
+        """Invia impulsi a 120 BPM in tempo reale per la durata indicata"""
+        period = tick_interval(120)
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            follower.handle_message(mido.Message('clock'))
+            time.sleep(period)
+
+    def test_start_stop_start_restarts_timeline(self):
+        output = FakeMIDIOutput()
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        follower = ExternalClockFollower(engine.effective_bpm)
+        engine.use_external_clock(follower)
+        cell = ChordGenerator().generate_color_tree(Note.C)[3][0]
+        engine.play_pattern(cell, PatternType.UP, base_duration=0.05, loop=True, bpm=120)
+        try:
+            follower.handle_message(mido.Message('start'))
+            self.send_clock(follower, 0.6)
+            follower.handle_message(mido.Message('stop'))
+            self.assertEqual(output.messages[-1][0], 'all_off')
+            paused_notes = len([m for m in output.messages if m[0] == 'on'])
+            self.assertGreater(paused_notes, 5)
+            time.sleep(0.3)
+            # Durante lo Stop non parte nessuna nota
+            self.assertEqual(len([m for m in output.messages if m[0] == 'on']), paused_notes)
+
+            restart = time.perf_counter()
+            follower.handle_message(mido.Message('start'))
+            self.send_clock(follower, 0.3)
+            resumed = [m for m in output.messages if m[0] == 'on' and m[3] > restart]
+            # La timeline riparte dal primo passo subito, non dopo i 0.6 s già suonati
+            self.assertGreater(len(resumed), 2)
+            self.assertLess(resumed[0][3] - restart, 0.1)
+            self.assertEqual(resumed[0][1], [m for m in output.messages if m[0] == 'on'][0][1])
+        finally:
+            engine.stop_pattern()
+
+
+class TestClockOutput(unittest.TestCase):
+    """Test per l'invio del MIDI Clock durante la riproduzione"""
+
+    def test_start_ticks_and_stop(self):
+        output = FakeClockOutput()
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        engine.set_clock_output(True)
+        cell = ChordGenerator().generate_color_tree(Note.C)[0][0]
+        # 150 BPM: 24 impulsi in 0.4 s
+        engine.play_pattern(cell, PatternType.UP, base_duration=0.4, bpm=150)
+        engine.current_thread.join(timeout=2)
+
+        kinds = [m[0] for m in output.messages]
+        self.assertEqual(kinds[0], 'start')
+        self.assertEqual(kinds[-1], 'stop')
+        self.assertAlmostEqual(kinds.count('clock'), 24, delta=2)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
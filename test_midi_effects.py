@@ -0,0 +1,239 @@
+"""
+Test per la catena di effetti MIDI
+Verifica gli stadi sui buffer compilati, l'ordinamento e la cache
+"""
+
+import threading
+import time
+import unittest
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from pattern_engine import PatternEngine, PatternType
+from midi_effects import (EventBuffer, EffectChain, TransposeStage, VelocityCurveStage,
+                          AccentStage, RepeaterStage, DelayStage, HumanizeStage,
+                          VelocityTableCache)
+
+
+def make_buffer(count=4, velocity=80, key=("test",)):
+    """Crea un buffer di test con note a distanza di 0.5 secondi"""
+    return EventBuffer.from_events(
+        onsets=[i * 0.5 for i in range(count)],
+        durations=[0.4] * count,
+        notes=[60 + i for i in range(count)],
+        velocities=[velocity] * count,
+        length=count * 0.5,
+        key=key
+    )
+
+
+class TestEffectStages(unittest.TestCase):
+    """Test per i singoli stadi"""
+
+    def test_transpose_clamps_to_midi_range(self):
+        buffer = TransposeStage(72).process(make_buffer())
+        self.assertEqual(buffer.notes.tolist(), [127, 127, 127, 127])
+
+    def test_velocity_curve_exponential(self):
+        buffer = VelocityCurveStage("exp", 1.0).process(make_buffer(velocity=90))
+        # La prima nota ha curva 0 e viene limitata a velocity 1, l'ultima resta piena
+        self.assertEqual(buffer.velocities[0], 1)
+        self.assertEqual(buffer.velocities[-1], 90)
+
+    def test_accent_every_other(self):
+        buffer = AccentStage("every_other", 0.5).process(make_buffer(velocity=80))
+        self.assertEqual(buffer.velocities.tolist(), [120, 80, 120, 80])
+
+    def test_repeater_expands_events(self):
+        buffer = RepeaterStage(3, "staccato").process(make_buffer(count=2))
+        self.assertEqual(len(buffer), 6)
+        self.assertAlmostEqual(buffer.onsets[1], 0.4 * 0.2)
+        self.assertAlmostEqual(buffer.durations[0], 0.4 * 0.2)
+
+    def test_delay_adds_echoes(self):
+        stage = DelayStage(delay_time=0.25, feedback=0.5, mix=0.5, delay_type="Ping-Pong", repeats=2)
+        buffer = stage.process(make_buffer(count=1, velocity=100))
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.notes.tolist(), [60, 72, 48])
+        self.assertEqual(buffer.velocities.tolist(), [50, 25, 12])
+        self.assertAlmostEqual(buffer.onsets[2], 0.5)
+
+    def test_humanize_with_seed_is_deterministic(self):
+        stage = HumanizeStage(timing=0.01, velocity=5, seed=7)
+        first = stage.process(make_buffer())
+        second = stage.process(make_buffer())
+        self.assertEqual(first.velocities.tolist(), second.velocities.tolist())
+        self.assertTrue(stage.deterministic)
+
+
+class TestVelocityTables(unittest.TestCase):
+    """Test per le tabelle di velocity precalcolate"""
+
+    def test_curve_table_matches_formula(self):
+        table = VelocityTableCache().curve_table("sine", 1.0, 5)
+        self.assertEqual(table.shape, (5, 128))
+        # sin(0.5 * pi) = 1 -> fattore 1 al centro del pattern
+        self.assertEqual(table[2, 100], 100)
+        self.assertEqual(table[0, 100], 50)
+
+    def test_accent_table_and_cache_hits(self):
+        cache = VelocityTableCache()
+        first = cache.accent_table("every_other", 0.5, 4)
+        second = cache.accent_table("every_other", 0.5, 4)
+        self.assertIs(first, second)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(first[:, 80].tolist(), [120, 80, 120, 80])
+
+    def test_prefetch_builds_off_thread(self):
+        cache = VelocityTableCache()
+        futures = cache.prefetch(curve=("exp", 1.5, 8), accent=("crescendo", 0.3, 8))
+        for future in futures:
+            future.result(timeout=2)
+        self.assertEqual(cache.misses, 2)
+        cache.curve_table("exp", 1.5, 8)
+        self.assertEqual(cache.hits, 1)
+
+
+class TestEffectChain(unittest.TestCase):
+    """Test per la catena di effetti"""
+
+    def test_from_parameters_builds_active_stages(self):
+        params = {'octave_add': 1, 'velocity_curve': "sine", 'velocity_intensity': 1.0,
+                  'accent_enabled': True, 'accent_pattern': "every_beat", 'accent_strength': 0.2,
+                  'delay_enabled': False, 'repeater_enabled': True, 'repeat_count': 2}
+        chain = EffectChain.from_parameters(params)
+        names = [stage.name for stage in chain.stages]
+        self.assertEqual(names, ["transpose", "velocity_curve", "accent", "repeater"])
+
+        chain = EffectChain.from_parameters(params, include_time_effects=False)
+        self.assertIsNone(chain.get_stage("repeater"))
+
+    def test_reorder_stages(self):
+        chain = EffectChain([TransposeStage(12), AccentStage("every_beat", 0.5)])
+        chain.move_stage("accent", 0)
+        self.assertEqual([stage.name for stage in chain.stages], ["accent", "transpose"])
+        with self.assertRaises(ValueError):
+            chain.set_order(["unknown"])
+
+    def test_cache_per_parameter_snapshot(self):
+        chain = EffectChain([AccentStage("every_beat", 0.5)])
+        buffer = make_buffer()
+        first = chain.process(buffer)
+        second = chain.process(buffer)
+        self.assertIs(first, second)
+        self.assertEqual(chain.cache_hits, 1)
+
+        chain.set_stages([AccentStage("every_beat", 0.2)])
+        third = chain.process(buffer)
+        self.assertIsNot(first, third)
+
+    def test_random_stages_are_not_cached(self):
+        chain = EffectChain([AccentStage("random", 0.5)])
+        chain.process(make_buffer())
+        chain.process(make_buffer())
+        self.assertEqual(chain.cache_hits + chain.cache_misses, 0)
+
+
+class TestPatternCompilation(unittest.TestCase):
+    """Test per la compilazione dei pattern in buffer di eventi"""
+
+    def setUp(self):
+        self.engine = PatternEngine(MIDIScaleGenerator())
+        self.cell = ChordGenerator().generate_color_tree(Note.C)[2][1]
+
+    def test_compile_up_pattern(self):
+        buffer = self.engine.compile_pattern(self.cell, PatternType.UP, octave=4, base_duration=0.5)
+        self.assertEqual(len(buffer), len(self.cell.notes))
+        self.assertEqual(buffer.onsets.tolist(), [0.0, 0.5, 1.0])
+        self.assertAlmostEqual(buffer.length, 1.5)
+        self.assertAlmostEqual(buffer.durations[0], 0.4)
+
+    def test_compile_cache(self):
+        first = self.engine.compile_pattern(self.cell, PatternType.UP_DOWN)
+        second = self.engine.compile_pattern(self.cell, PatternType.UP_DOWN)
+        self.assertIs(first, second)
+        random_first = self.engine.compile_pattern(self.cell, PatternType.RANDOM_CHAOS)
+        self.assertIsNone(random_first.key)
+
+    def test_compile_cache_from_two_threads(self):
+        # GUI e scheduler compilano insieme con una cache piccola: le espulsioni non devono fallire
+        self.engine.compile_cache_size = 4
+        errors = []
+
+        def compile_many(octave):
+            try:
+                for index in range(300):
+                    self.engine.compile_pattern(self.cell, PatternType.UP, octave=octave,
+                                                base_duration=0.1 + (index % 20) * 0.01)
+            except (KeyError, RuntimeError) as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=compile_many, args=(octave,)) for octave in (3, 4, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(self.engine._compile_cache), 4)
+
+    def test_render_pattern_events_applies_chain(self):
+        self.engine.update_parameters(sound_cell=self.cell, pattern_type=PatternType.UP,
+                                      octave_add=1, repeater_enabled=True, repeat_count=2)
+        buffer = self.engine.render_pattern_events()
+        self.assertEqual(len(buffer), 2 * len(self.cell.notes))
+        self.assertEqual(int(buffer.notes.min()), 72)
+
+
+class FakeMIDIOutput:
+    """Output MIDI finto che registra i messaggi inviati con il loro istante"""
+
+    def __init__(self):
+        self.initialized = True
+        self.output_port = object()
+        self.messages = []
+
+    def send_note_on(self, note, velocity=64, channel=0):
+        self.messages.append(('on', note, velocity, time.perf_counter()))
+        return True
+
+    def send_note_off(self, note, channel=0):
+        self.messages.append(('off', note, 0, time.perf_counter()))
+        return True
+
+    def stop_all_notes(self):
+        self.messages.append(('all_off', None, 0, time.perf_counter()))
+
+
+class TestTimelinePlayback(unittest.TestCase):
+    """Test per la riproduzione della timeline con delay e repeater espansi"""
+
+    def setUp(self):
+        self.output = FakeMIDIOutput()
+        self.engine = PatternEngine(MIDIScaleGenerator(), self.output)
+        self.cell = ChordGenerator().generate_color_tree(Note.C)[0][0]
+
+    def test_delay_echoes_without_extra_threads(self):
+        threads_before = threading.active_count()
+        self.engine.play_pattern(self.cell, PatternType.UP, base_duration=0.05,
+                                 delay_enabled=True, delay_time=0.03, delay_feedback=0.5,
+                                 delay_mix=0.5, delay_type="Standard", delay_repeats=2)
+        self.assertLessEqual(threading.active_count(), threads_before + 1)
+        self.engine.current_thread.join(timeout=2)
+
+        note_ons = [m for m in self.output.messages if m[0] == 'on']
+        note_offs = [m for m in self.output.messages if m[0] == 'off']
+        self.assertEqual([m[2] for m in note_ons], [44, 22, 11])
+        self.assertEqual(len(note_offs), 3)
+        self.assertAlmostEqual(note_ons[2][3] - note_ons[0][3], 0.06, delta=0.02)
+
+    def test_stop_cancels_pending_events(self):
+        self.engine.play_pattern(self.cell, PatternType.UP, base_duration=0.05, loop=True,
+                                 repeater_enabled=True, repeat_count=4, repeat_timing="legato")
+        time.sleep(0.03)
+        self.engine.stop_pattern()
+        sent = len(self.output.messages)
+        time.sleep(0.1)
+        self.assertEqual(len(self.output.messages), sent)
+        self.assertFalse(self.engine.current_thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,96 @@
+"""
+Test per l'input MIDI da tastiera e il riconoscimento dell'accordo tenuto
+"""
+
+import time
+import unittest
+import mido
+from chord_generator import Note
+from midi_input import MIDIInput
+
+
+def note_on(note, velocity=100):
+    return mido.Message('note_on', note=note, velocity=velocity)
+
+
+def note_off(note):
+    return mido.Message('note_off', note=note)
+
+
+def sustain(value):
+    return mido.Message('control_change', control=64, value=value)
+
+
+class TestMIDIInput(unittest.TestCase):
+    """Test per la maschera delle note tenute e la coda degli aggiornamenti"""
+
+    def setUp(self):
+        self.input = MIDIInput()
+
+    def play(self, *messages):
+        for message in messages:
+            self.input.handle_message(message)
+
+    def test_held_mask_and_recognition(self):
+        self.play(note_on(48), note_on(55), note_on(62))
+        self.assertEqual(self.input.held_mask, (1 << 0) | (1 << 7) | (1 << 2))
+        update = self.input.drain_updates()
+        self.assertEqual(update.notes, (48, 55, 62))
+        self.assertTrue(update.recognition.matched)
+        self.assertIn(Note.G, [cell.root for cell in update.recognition.exact])
+
+    def test_octaves_share_pitch_class(self):
+        self.play(note_on(60), note_on(72), note_off(60))
+        self.assertEqual(self.input.held_mask, 1)
+        self.assertEqual(self.input.held_notes, (72,))
+        self.play(note_on(64, velocity=0))  # note on a velocità 0 = note off di una nota non tenuta
+        self.play(note_off(72))
+        self.assertEqual(self.input.held_mask, 0)
+
+    def test_updates_only_on_mask_change(self):
+        self.play(note_on(60), note_on(72), note_off(72))
+        updates = []
+        while True:
+            update = self.input.drain_updates()
+            if update is None:
+                break
+            updates.append(update)
+        # Un solo aggiornamento: i due Do hanno la stessa classe di altezza
+        self.assertEqual(len(updates), 1)
+
+    def test_drain_coalesces_to_latest(self):
+        self.play(note_on(60), note_on(64), note_on(67))
+        latest = self.input.drain_updates()
+        self.assertEqual(latest.notes, (60, 64, 67))
+        self.assertIsNone(self.input.drain_updates())
+
+    def test_sustain_pedal(self):
+        self.play(note_on(60), sustain(127), note_off(60))
+        self.assertEqual(self.input.held_mask, 1)
+        self.play(note_on(60), sustain(0))
+        # Il Do ripremuto resta tenuto dopo il rilascio del pedale
+        self.assertEqual(self.input.held_notes, (60,))
+        self.play(note_off(60))
+        self.assertEqual(self.input.held_mask, 0)
+
+    def test_all_notes_off_and_reset(self):
+        self.play(note_on(60), note_on(67), mido.Message('control_change', control=123, value=0))
+        self.assertEqual(self.input.held_mask, 0)
+        self.play(note_on(62))
+        self.input.reset()
+        self.assertEqual(self.input.held_notes, ())
+        self.assertEqual(self.input.drain_updates().mask, 0)
+
+    def test_listener_and_latency(self):
+        received = []
+        self.input.listeners.append(received.append)
+        start = time.perf_counter()
+        self.play(note_on(60), note_on(67))
+        elapsed = time.perf_counter() - start
+        self.assertEqual([update.mask for update in received], [1, 1 | (1 << 7)])
+        # Riconoscimento e pubblicazione ben sotto i 10 ms
+        self.assertLess(elapsed, 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,80 @@
+"""
+Test per la sessione multi-traccia
+Verifica canali separati, clock condiviso e cache di compilazione comuni
+"""
+
+import threading
+import time
+import unittest
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from multitrack import MultiTrackSession
+from pattern_engine import PatternType
+from test_midi_effects import FakeMIDIOutput
+
+
+class FakeChannelOutput(FakeMIDIOutput):
+    """Output MIDI finto che registra anche il canale delle note"""
+
+    def send_note_on(self, note, velocity=64, channel=0):
+        self.messages.append(('on', note, velocity, time.perf_counter(), channel))
+        return True
+
+    def send_note_off(self, note, channel=0):
+        self.messages.append(('off', note, 0, time.perf_counter(), channel))
+        return True
+
+
+class TestMultiTrackSession(unittest.TestCase):
+    """Test per MultiTrackSession"""
+
+    def setUp(self):
+        self.output = FakeChannelOutput()
+        self.session = MultiTrackSession(MIDIScaleGenerator(), self.output)
+        tree = ChordGenerator().generate_color_tree(Note.C)
+        self.session.add_track("bass", channel=0, sound_cell=tree[0][0],
+                               pattern_type=PatternType.UP, octave=2, base_duration=0.05)
+        self.session.add_track("lead", channel=1, sound_cell=tree[2][1],
+                               pattern_type=PatternType.UP, octave=5, base_duration=0.05)
+
+    def tearDown(self):
+        self.session.stop()
+
+    def test_tracks_share_one_clock(self):
+        threads_before = threading.active_count()
+        self.session.play(loop=True)
+        self.assertLessEqual(threading.active_count(), threads_before + 1)
+        time.sleep(0.32)
+        self.session.stop()
+
+        bass = [m[3] for m in self.output.messages if m[0] == 'on' and m[4] == 0]
+        lead = [m[3] for m in self.output.messages if m[0] == 'on' and m[4] == 1]
+        self.assertGreaterEqual(min(len(bass), len(lead)), 5)
+        # Stesso passo su entrambe le tracce: gli onset coincidono, senza deriva
+        for bass_time, lead_time in zip(bass, lead):
+            self.assertAlmostEqual(bass_time, lead_time, delta=0.005)
+
+    def test_notes_use_track_channel(self):
+        self.session.play(loop=False)
+        self.session.current_thread.join(timeout=2)
+        lead_notes = {m[1] for m in self.output.messages if m[0] == 'on' and m[4] == 1}
+        bass_notes = {m[1] for m in self.output.messages if m[0] == 'on' and m[4] == 0}
+        self.assertEqual(bass_notes, {36})
+        self.assertTrue(all(note >= 72 for note in lead_notes))
+        self.assertEqual(self.session.channels(), [0, 1])
+
+    def test_compile_cache_is_shared(self):
+        tree = ChordGenerator().generate_color_tree(Note.C)
+        self.session.add_track("double", channel=2, sound_cell=tree[2][1],
+                               pattern_type=PatternType.UP, octave=5, base_duration=0.05)
+        lead = self.session.get_track("lead").engine
+        double = self.session.get_track("double").engine
+        first = lead.render_pattern_events()
+        self.assertIs(lead.compile_from_parameters(lead.get_current_parameters()),
+                      double.compile_from_parameters(double.get_current_parameters()))
+        self.assertEqual(len(first), 3)
+        with self.assertRaises(ValueError):
+            self.session.add_track("lead")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
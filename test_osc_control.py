@@ -0,0 +1,133 @@
+"""
+Test per la superficie di controllo OSC
+"""
+
+import socket
+import struct
+import time
+import unittest
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from osc_control import (INT32, OSCServer, build_routes, encode_bundle, encode_message, parameter_address,
+                         parse_message)
+from pattern_engine import PatternEngine, PatternType
+from test_midi_effects import FakeMIDIOutput
+
+
+class TestOSCParsing(unittest.TestCase):
+    """Test per la decodifica dei messaggi e la tabella degli indirizzi"""
+
+    def test_parse_message(self):
+        args = [None]
+        packet = encode_message("/delay/feedback", 0.5, 3, "drop2", True)
+        self.assertEqual(len(packet) % 4, 0)
+        self.assertEqual(parse_message(packet, 0, len(packet), args), b"/delay/feedback")
+        self.assertEqual(args, [0.5, 3, "drop2", True])
+        # Offset all'interno di un buffer più grande, senza type tag
+        buffer = bytearray(64)
+        buffer[8:16] = b"/stop\0\0\0"
+        self.assertEqual(parse_message(buffer, 8, 16, args), b"/stop")
+        self.assertEqual(args, [])
+        for broken in (b"/bpm", b"/bpm\0\0\0\0,i\0\0", b"/bpm\0\0\0\0xi\0\0\0\0\0\0"):
+            with self.assertRaises((ValueError, struct.error)):
+                parse_message(broken, 0, len(broken), args)
+
+    def test_routes(self):
+        self.assertEqual(parameter_address("delay_feedback"), b"/delay/feedback")
+        self.assertEqual(parameter_address("delay_enabled"), b"/delay")
+        routes = build_routes()
+        for address in (b"/bpm", b"/pattern", b"/chord/gen", b"/cell/1/0", b"/cell/12/0", b"/stats"):
+            self.assertIn(address, routes)
+        # 67 celle per root
+        self.assertEqual(len([address for address in routes if address.startswith(b"/cell/")]), 67)
+
+
+class TestOSCServer(unittest.TestCase):
+    """Test per l'applicazione dei messaggi al Pattern Engine"""
+
+    def setUp(self):
+        self.engine = PatternEngine(MIDIScaleGenerator(), FakeMIDIOutput())
+        self.server = OSCServer(self.engine, port=0)
+
+    def test_parameters_are_applied(self):
+        self.server.feed(encode_message("/bpm", 999))
+        self.server.feed(encode_message("/delay/feedback", 0.25))
+        self.server.feed(encode_message("/voicing", 2))
+        self.server.feed(encode_message("/delay"))
+        self.server.feed(encode_message("/reverse", 0))
+        self.server.feed(encode_message("/pattern", "zigzag"))
+        self.assertEqual(self.engine.current_bpm, 300)
+        self.assertAlmostEqual(self.engine.current_delay_feedback, 0.25)
+        self.assertEqual(self.engine.current_voicing, "drop2")
+        self.assertTrue(self.engine.current_delay_enabled)
+        self.assertFalse(self.engine.current_reverse)
+        self.assertEqual(self.engine.current_pattern_type, PatternType.ZIGZAG)
+        self.assertEqual(self.server.stats.applied, 6)
+
+    def test_applied_parameters_are_reported(self):
+        received = []
+        self.server.on_parameters = received.append
+        self.server.feed(encode_message("/bpm", 100.4))
+        self.server.feed(encode_message("/pattern", "zigzag"))
+        self.server.feed(encode_message("/delay/feedback", float('nan')))
+        self.server.feed(encode_message("/cell/3/1"))
+        # Solo i parametri applicati, già convertiti come li riceve il motore
+        self.assertEqual(received, [{'bpm': 100}, {'pattern_type': PatternType.ZIGZAG}])
+
+    def test_bundle_and_cells(self):
+        self.server.feed(encode_bundle(encode_message("/root", "A"), encode_message("/cell/4/1")))
+        expected = next(cell for cell in ChordGenerator().generate_color_tree(Note.A)[3] if cell.position == 1)
+        self.assertEqual(self.engine.current_sound_cell.notes, expected.notes)
+        self.server.feed(encode_message("/cell", 3, 0))
+        self.assertEqual((self.engine.current_sound_cell.level, self.engine.current_sound_cell.position), (3, 0))
+        self.assertEqual(self.server.stats.packets, 2)
+        self.assertEqual(self.server.stats.messages, 3)
+
+    def test_queued_during_playback(self):
+        cell = ChordGenerator().generate_color_tree(Note.C)[2][0]
+        self.engine.update_parameters(sound_cell=cell, pattern_type=PatternType.UP, base_duration=0.05)
+        self.engine.is_playing = True  # cambi messi in coda come durante la riproduzione
+        self.server.chord_quantize = "bar"
+        self.server.feed(encode_message("/bpm", 90))
+        self.server.feed(encode_message("/cell/5/0"))
+        self.assertNotEqual(self.engine.current_bpm, 90)
+        self.assertEqual(len(self.engine.pending_chords()), 1)
+        self.engine.is_playing = False
+
+    def test_dropped_messages(self):
+        for packet in (b"garbage", encode_message("/unknown"), encode_message("/bpm", "fast"),
+                       encode_message("/cell/9/9"), encode_message("/cell", 9, 9),
+                       encode_message("/voicing", "wide"), encode_message("/delay/feedback", float('nan')),
+                       encode_message("/bpm", float('inf')),
+                       encode_bundle(encode_message("/bpm", 100)) + INT32.pack(64)):
+            self.server.feed(packet)
+        self.assertEqual(self.server.stats.dropped,
+                         {'malformed': 2, 'unknown_address': 2, 'invalid_arguments': 5})
+        # Il messaggio valido del bundle troncato è comunque applicato
+        self.assertEqual(self.server.stats.applied, 1)
+        self.assertEqual(self.engine.current_delay_feedback, 0.3)
+
+    def test_udp_round_trip(self):
+        port = self.server.start()
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+                client.settimeout(5)
+                client.sendto(encode_message("/octave", 6), ("127.0.0.1", port))
+                deadline = time.monotonic() + 5
+                while self.server.stats.applied < 1 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(self.engine.current_octave, 6)
+                client.sendto(encode_message("/stats"), ("127.0.0.1", port))
+                reply, _ = client.recvfrom(1024)
+                args = []
+                self.assertEqual(parse_message(reply, 0, len(reply), args), b"/stats")
+                self.assertEqual(args[:4], [2, 2, 1, 0])
+                self.assertGreater(args[5], 0)
+        finally:
+            self.server.stop()
+        stats = self.server.stats.as_dict()
+        self.assertEqual(stats['applied'], 2)
+        self.assertGreater(stats['latency_us']['max'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,97 @@
+"""
+Test per le metriche precalcolate degli insiemi di classi di altezza
+"""
+
+import unittest
+import numpy as np
+from chord_generator import ChordGenerator, Note
+from chord_recognition import MASK_COUNT
+from cli_example import apply_metrics
+from pcset_metrics import METRICS, get_metrics, relative_mask, rotate_masks
+from progression_search import ProgressionSearch, SearchWeights
+
+
+MAJOR_TRIAD = 0b10010001  # C E G
+MINOR_TRIAD = 0b10001001  # C Eb G
+
+
+class TestPCSetMetrics(unittest.TestCase):
+    """Test per le tabelle su tutte le 4096 maschere e la lettura per cella"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.metrics = get_metrics()
+        cls.tree = ChordGenerator().generate_color_tree(Note.D)
+
+    def test_tables_cover_all_masks(self):
+        for metric in METRICS:
+            self.assertEqual(self.metrics.table(metric).shape, (MASK_COUNT,))
+        self.assertEqual(self.metrics.interval_vectors.shape, (MASK_COUNT, 6))
+        # 224 classi di insiemi sotto trasposizione e inversione (vuoto e totale compresi)
+        self.assertEqual(len(self.metrics.set_class_masks), 224)
+        with self.assertRaises(ValueError):
+            self.metrics.table("loudness")
+        with self.assertRaises(ValueError):
+            self.metrics.metrics(MASK_COUNT)
+
+    def test_set_theory(self):
+        major = self.metrics.metrics(MAJOR_TRIAD)
+        minor = self.metrics.metrics(MINOR_TRIAD)
+        self.assertEqual(major.interval_vector, (0, 0, 1, 1, 1, 0))
+        self.assertEqual(major.prime_form, (0, 3, 7))
+        self.assertEqual(major.set_class, minor.set_class)
+        self.assertEqual(self.metrics.metrics(0xFFF).interval_vector, (12, 12, 12, 12, 12, 6))
+        # Le metriche di classe non cambiano con la trasposizione
+        for steps in range(12):
+            rotated = int(rotate_masks(MAJOR_TRIAD, steps))
+            self.assertEqual(self.metrics.set_class[rotated], major.set_class)
+            self.assertEqual(self.metrics.tension[rotated], major.tension)
+
+    def test_continuous_brightness_refines_cells(self):
+        for level in self.tree[1:11]:
+            for cell in level:
+                value = self.metrics.value("brightness", cell)
+                # La luminosità discreta della cella resta coerente con quella continua
+                if cell.brightness == 1.0:
+                    self.assertGreaterEqual(value, 0.5)
+                elif cell.brightness == 0.0:
+                    self.assertLessEqual(value, 0.5)
+            values = self.metrics.values("brightness", level)
+            # Più quinte sopra = più brillante, lungo tutto il livello
+            self.assertTrue(np.all(np.diff(values) < 0))
+
+    def test_roughness(self):
+        roughness = self.metrics.table("roughness")
+        self.assertEqual(roughness[1], 0.0)
+        # Un semitono è più ruvido di una quinta; aggiungere note non diminuisce la ruvidità
+        self.assertGreater(roughness[0b11], roughness[0b10000001])
+        self.assertTrue(np.all(roughness[MAJOR_TRIAD | (1 << 11)] >= roughness[MAJOR_TRIAD]))
+
+    def test_lookup_is_relative_to_root(self):
+        d_major = next(cell for cell in self.tree[3] if cell.position == 0)
+        self.assertEqual(relative_mask(d_major), relative_mask(ChordGenerator().generate_color_tree()[3][0]))
+        self.assertEqual(self.metrics.for_cell(d_major).mask, relative_mask(d_major))
+
+    def test_sort_filter_and_normalize(self):
+        level = self.tree[4]
+        ordered = self.metrics.sort_cells("roughness", level)
+        values = self.metrics.values("roughness", ordered)
+        self.assertTrue(np.all(np.diff(values) >= 0))
+        bright = self.metrics.filter_cells("brightness", minimum=0.5, cells=level)
+        self.assertTrue(all(self.metrics.value("brightness", cell) >= 0.5 for cell in bright))
+        normalized = self.metrics.normalized("roughness")
+        self.assertAlmostEqual(normalized.min(), 0.0)
+        self.assertAlmostEqual(normalized.max(), 1.0)
+
+    def test_cli_and_search_use_metrics(self):
+        levels = apply_metrics(self.tree[:5], "tension", [("brightness", "0.5", "1")])
+        for level in levels:
+            self.assertTrue(all(self.metrics.value("brightness", cell) >= 0.5 for cell in level))
+        plain = ProgressionSearch(SearchWeights())
+        rough = ProgressionSearch(SearchWeights(metrics=(("roughness", 5.0),)))
+        self.assertTrue(np.all(rough.costs >= plain.costs))
+        self.assertTrue(np.any(rough.costs > plain.costs))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
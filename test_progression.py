@@ -0,0 +1,125 @@
+"""
+Test per il sequencer di progressioni
+Verifica la compilazione, il salvataggio, l'esportazione MIDI e la riproduzione senza pause
+"""
+
+import os
+import tempfile
+import time
+import unittest
+import mido
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from pattern_engine import PatternEngine, PatternType
+from progression import ChordProgression, ProgressionSequencer, resolve_cell, cell_reference
+from test_midi_effects import FakeMIDIOutput
+
+
+class TestChordProgression(unittest.TestCase):
+    """Test per ChordProgression e ProgressionSequencer"""
+
+    def setUp(self):
+        generator = ChordGenerator()
+        self.c_tree = generator.generate_color_tree(Note.C)
+        self.g_tree = generator.generate_color_tree(Note.G)
+        self.engine = PatternEngine(MIDIScaleGenerator())
+        self.engine.update_parameters(pattern_type=PatternType.UP, base_duration=0.5, bpm=120)
+        self.progression = ChordProgression()
+        self.progression.add(self.c_tree[2][1], bars=1)
+        self.progression.add(self.g_tree[2][1], bars=2, pattern_type=PatternType.DOWN)
+
+    def test_compile_tiles_pattern_over_bars(self):
+        compiled = ProgressionSequencer(self.engine, self.progression).compile()
+        self.assertEqual([step.span for step in compiled], [2.0, 4.0])
+        # Tre note da 0.5 s ripetute su una battuta da 2 s: la quarta apre la ripetizione
+        self.assertEqual(compiled[0].buffer.onsets.tolist(), [0.0, 0.5, 1.0, 1.5])
+        self.assertEqual(compiled[1].params['pattern_type'], PatternType.DOWN)
+        self.assertEqual(len(compiled[1].buffer), 8)
+
+    def test_tiling_keeps_pause_and_echo_tails(self):
+        self.engine.update_parameters(pause_duration=0.5)
+        compiled = ProgressionSequencer(self.engine, self.progression).compile()
+        # Ripetizioni ogni 1.5 s di pattern + 0.5 s di pausa, come nel loop dal vivo
+        self.assertEqual(compiled[0].buffer.onsets.tolist(), [0.0, 0.5, 1.0])
+        self.assertEqual(compiled[1].buffer.onsets.tolist(), [0.0, 0.5, 1.0, 2.0, 2.5, 3.0])
+
+        self.engine.update_parameters(pause_duration=0.0, delay_enabled=True, delay_time=0.25,
+                                      delay_feedback=0.5, delay_mix=0.5, delay_repeats=3)
+        sequencer = ProgressionSequencer(self.engine, self.progression)
+        first = sequencer.compile()[0].buffer
+        # Gli echi del primo passo ripetuto a 1.5 s proseguono oltre la battuta; la nota a 2.0 s non parte
+        tails = first.onsets >= 2.0 - 1e-9
+        self.assertEqual(first.onsets[tails].tolist(), [2.0, 2.25])
+        self.assertEqual(set(first.steps[tails].tolist()), {int(first.steps[0])})
+        # Nel rendering le code cadono sull'accordo successivo e vengono tagliate solo alla fine
+        events = sequencer.render()
+        self.assertIn(2.25, events.onsets.tolist())
+        self.assertLess(events.onsets.max(), 6.0)
+
+    def test_unknown_override_is_rejected(self):
+        self.progression.add(self.c_tree[0][0], tempo=3)
+        with self.assertRaises(ValueError):
+            ProgressionSequencer(self.engine, self.progression).compile()
+
+    def test_save_and_load(self):
+        path = os.path.join(tempfile.mkdtemp(), "progression.json")
+        self.progression.save(path)
+        loaded = ChordProgression.load(path)
+        self.assertEqual([cell_reference(step.sound_cell) for step in loaded],
+                         [cell_reference(step.sound_cell) for step in self.progression])
+        self.assertEqual(loaded.steps[1].overrides, {'pattern_type': PatternType.DOWN})
+        self.assertEqual(resolve_cell([Note.G.value, 3, 1]).notes, self.g_tree[2][1].notes)
+
+    def test_export_midi(self):
+        sequencer = ProgressionSequencer(self.engine, self.progression)
+        path = os.path.join(tempfile.mkdtemp(), "progression.mid")
+        self.assertTrue(sequencer.export_midi(path))
+        midi_file = mido.MidiFile(path)
+        note_ons = [msg for msg in midi_file if msg.type == 'note_on']
+        self.assertEqual(len(note_ons), len(sequencer.render()))
+        self.assertAlmostEqual(midi_file.length, 6.0, places=2)
+
+
+class TestProgressionPlayback(unittest.TestCase):
+    """Test per la riproduzione della progressione"""
+
+    def test_gapless_transitions(self):
+        output = FakeMIDIOutput()
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        # 600 BPM: battuta di 0.4 s, una nota ogni 0.1 s
+        engine.update_parameters(pattern_type=PatternType.UP, base_duration=0.1, bpm=600)
+        generator = ChordGenerator()
+        progression = ChordProgression()
+        progression.add(generator.generate_color_tree(Note.C)[0][0], bars=1)
+        progression.add(generator.generate_color_tree(Note.G)[0][0], bars=1)
+        ProgressionSequencer(engine, progression).play()
+        engine.current_thread.join(timeout=2)
+
+        note_ons = [m for m in output.messages if m[0] == 'on']
+        self.assertEqual([m[1] for m in note_ons], [60] * 4 + [67] * 4)
+        gaps = [b[3] - a[3] for a, b in zip(note_ons, note_ons[1:])]
+        for gap in gaps:
+            self.assertAlmostEqual(gap, 0.1, delta=0.01)
+
+    def test_scheduled_changes_apply_on_chord_boundary(self):
+        output = FakeMIDIOutput()
+        engine = PatternEngine(MIDIScaleGenerator(), output)
+        engine.update_parameters(pattern_type=PatternType.UP, base_duration=0.1, bpm=600)
+        generator = ChordGenerator()
+        progression = ChordProgression()
+        for root in (Note.C, Note.G, Note.C):
+            progression.add(generator.generate_color_tree(root)[0][0], bars=1)
+        ProgressionSequencer(engine, progression).play()
+        time.sleep(0.15)
+        engine.schedule_parameters(quantize="beat", octave=5)
+        engine.queue_chord_change(generator.generate_color_tree(Note.E)[0][0])
+        engine.current_thread.join(timeout=3)
+
+        # Il cambio entra sul secondo accordo; l'accordo in coda non sostituisce la progressione
+        notes = [m[1] for m in output.messages if m[0] == 'on']
+        self.assertEqual(notes, [60] * 4 + [79] * 4 + [72] * 4)
+        self.assertEqual(engine.current_octave, 5)
+        self.assertEqual(engine._pending_changes, [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
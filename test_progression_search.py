@@ -0,0 +1,108 @@
+"""
+Test per la ricerca di progressioni sulla Color Tree
+"""
+
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from cell_index import cell_id
+from chord_generator import ChordGenerator, Note
+from progression_search import ProgressionSearch, SearchWeights, parse_cell, main
+from voice_leading import VoiceLeadingIndex
+
+
+class TestProgressionSearch(unittest.TestCase):
+    """Test per A* e beam search sui costi dei passaggi"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.search = ProgressionSearch(index=VoiceLeadingIndex(cache_dir=cls.cache_dir))
+        generator = ChordGenerator()
+        cls.c_major = generator.generate_color_tree(Note.C)[2][1]
+        cls.g_cell = generator.generate_color_tree(Note.G)[2][1]
+        cls.f_cell = generator.generate_color_tree(Note.F)[2][1]
+        cls.a_cell = generator.generate_color_tree(Note.A)[3][2]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.cache_dir, ignore_errors=True)
+
+    def brute_force(self, start, goal, steps):
+        """Costo minimo esatto con programmazione dinamica in avanti"""
+        costs = self.search.costs
+        current = np.full(len(costs), np.inf)
+        current[start] = 0.0
+        for _ in range(steps):
+            current = (current[:, None] + costs).min(axis=0)
+        return current[goal]
+
+    def test_direct_path(self):
+        result = self.search.find_path(self.c_major, self.g_cell)
+        self.assertEqual(result.cells[0], self.c_major)
+        self.assertEqual(result.cells[-1], self.g_cell)
+        self.assertAlmostEqual(result.cost, sum(result.step_costs))
+
+    def test_fixed_length_is_optimal(self):
+        result = self.search.find_path(self.c_major, self.g_cell, length=6)
+        self.assertEqual(len(result.cells), 6)
+        self.assertEqual(result.cells[-1], self.g_cell)
+        self.assertAlmostEqual(result.cost, self.brute_force(cell_id(self.c_major), cell_id(self.g_cell), 5))
+
+    def test_no_repeated_chords(self):
+        result = self.search.find_path(self.c_major, self.g_cell, length=16)
+        self.assertEqual(len(result.cells), 16)
+        for first, second in zip(result.cells, result.cells[1:]):
+            self.assertNotEqual(first.to_bitmask(), second.to_bitmask())
+        self.assertTrue(all(np.isfinite(result.step_costs)))
+
+    def test_through_required_cells(self):
+        result = self.search.find_through(self.c_major, [self.f_cell, self.a_cell], goal=self.c_major)
+        self.assertEqual(len(result.cells), 4)
+        self.assertEqual(result.cells[0], self.c_major)
+        self.assertEqual(result.cells[-1], self.c_major)
+        self.assertEqual(set(map(str, result.cells[1:3])), {str(self.f_cell), str(self.a_cell)})
+
+    def test_through_with_length(self):
+        result = self.search.find_through(self.c_major, [self.a_cell], length=8)
+        self.assertEqual(len(result.cells), 8)
+        self.assertIn(str(self.a_cell), map(str, result.cells))
+        with self.assertRaises(ValueError):
+            self.search.find_through(self.c_major, [self.f_cell, self.a_cell], goal=self.g_cell, length=3)
+
+    def test_through_requires_a_target_or_length(self):
+        # Senza arrivo, celle richieste o lunghezza la "progressione" sarebbe un solo accordo
+        for required, length in (([], None), ([self.c_major], None), ([self.a_cell], 1)):
+            with self.assertRaises(ValueError):
+                self.search.find_through(self.c_major, required, length=length)
+        self.assertEqual(len(self.search.find_through(self.c_major, [], length=2).cells), 2)
+
+    def test_weights_change_costs(self):
+        levels_only = ProgressionSearch(SearchWeights(0.0, 0.0, 1.0), index=self.search.index)
+        result = levels_only.find_path(self.c_major, self.g_cell)
+        self.assertEqual(result.cost, 0.0)
+
+
+class TestCommandLine(unittest.TestCase):
+    """Test per il parsing delle celle della CLI"""
+
+    def test_parse_cell(self):
+        cell = parse_cell("C#:3:1")
+        self.assertEqual((cell.root, cell.level, cell.position), (Note.C_SHARP, 3, 1))
+        self.assertEqual(parse_cell("c_sharp:3:1").root, Note.C_SHARP)
+        for spec in ("X:1:0", "C:13:0", "C:0:0", "C:1", "C:1:-1"):
+            with self.assertRaises(ValueError):
+                parse_cell(spec)
+
+    def test_invalid_cell_exits_with_error(self):
+        self.assertEqual(main(["--from", "C:3:1", "--to", "H:1:0"]), 1)
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            self.assertEqual(main(["--from", "C:3:1"]), 1)
+        self.assertIn("lunghezza", errors.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,218 @@
+"""
+Test per lo scheduler a lookahead
+Verifica la griglia di quantizzazione e l'applicazione dei cambi di parametri sui confini
+"""
+
+import threading
+import time
+import unittest
+from unittest import mock
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note
+from midi_effects import VelocityTableCache
+from pattern_engine import PatternEngine, PatternType
+from scheduler import EventSource, LookaheadScheduler
+from test_midi_effects import FakeMIDIOutput
+
+
+class TestQuantizeGrid(unittest.TestCase):
+    """Test per il calcolo dei confini di quantizzazione"""
+
+    def setUp(self):
+        self.scheduler = LookaheadScheduler(lookahead=0.05)
+        self.scheduler.start(origin=10.0)
+
+    def test_beat_and_bar_boundaries(self):
+        # 120 BPM: beat di 0.5 s, bar di 2 s
+        self.assertAlmostEqual(self.scheduler.next_boundary(10.2, "beat", 120), 10.5)
+        self.assertAlmostEqual(self.scheduler.next_boundary(10.2, "bar", 120), 12.0)
+        self.assertAlmostEqual(self.scheduler.next_boundary(12.0, "bar", 120), 12.0)
+
+    def test_playback_speed_shortens_grid(self):
+        self.assertAlmostEqual(self.scheduler.next_boundary(10.2, "beat", 120, playback_speed=2.0), 10.25)
+
+    def test_immediate_and_before_origin(self):
+        self.assertEqual(self.scheduler.next_boundary(10.3, "immediate"), 10.3)
+        self.assertAlmostEqual(self.scheduler.next_boundary(9.0, "bar", 120), 10.0)
+
+
+class TickSource(EventSource):
+    """Un evento ogni millisecondo, registrato all'invio"""
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.next_time = None
+
+    def fill(self, scheduler, horizon):
+        if self.next_time is None:
+            self.next_time = scheduler.origin
+        while self.next_time <= horizon:
+            scheduler.push(self.next_time, 0, self)
+            self.next_time += 0.001
+        return True
+
+    def dispatch(self, scheduler, due, kind, payload):
+        self.sent.append((self, time.perf_counter()))
+
+
+class TestSourceRemoval(unittest.TestCase):
+    """Test per l'aggiunta e la rimozione di sorgenti da un altro thread"""
+
+    def test_remove_while_running(self):
+        scheduler = LookaheadScheduler()
+        sent = []
+        keeper = TickSource(sent)
+        scheduler.add_source(keeper)
+        thread = threading.Thread(target=scheduler.run, daemon=True)
+        thread.start()
+        try:
+            removed = []
+            for _ in range(100):
+                source = TickSource(sent)
+                scheduler.add_source(source)
+                time.sleep(0.002)
+                scheduler.remove_source(source)
+                removed.append((source, time.perf_counter()))
+                # Il resto della coda resta un heap valido
+                with scheduler._queue_lock:
+                    queue = list(scheduler._queue)
+                self.assertTrue(all(queue[(index - 1) // 2] <= queue[index] for index in range(1, len(queue))))
+                self.assertFalse(any(entry[3] is source for entry in queue))
+            time.sleep(0.05)
+        finally:
+            scheduler.stop()
+            thread.join(timeout=2)
+        self.assertFalse(thread.is_alive())
+        # Nessun invio di una sorgente dopo la sua rimozione (salvo quello già in corso), e la sorgente
+        # rimasta continua a suonare
+        late = [at for source, at in sent for other, removed_at in removed
+                if source is other and at > removed_at + 0.02]
+        self.assertEqual(late, [])
+        self.assertGreater(len([1 for source, _ in sent if source is keeper]), 100)
+
+
+class TestQuantizedChanges(unittest.TestCase):
+    """Test per i cambi di parametri applicati durante la riproduzione"""
+
+    def setUp(self):
+        self.output = FakeMIDIOutput()
+        self.engine = PatternEngine(MIDIScaleGenerator(), self.output)
+        self.cell = ChordGenerator().generate_color_tree(Note.C)[0][0]
+
+    def tearDown(self):
+        self.engine.stop_pattern()
+
+    def test_change_applies_on_bar(self):
+        # 600 BPM: beat di 0.1 s, bar di 0.4 s; una nota ogni 0.05 s
+        self.engine.play_pattern(self.cell, PatternType.UP, octave=4, base_duration=0.05,
+                                 loop=True, bpm=600)
+        origin = self.engine.scheduler.origin
+        time.sleep(0.15)
+        self.engine.schedule_parameters(quantize="bar", octave=5)
+        self.assertEqual(self.engine.current_octave, 4)
+        time.sleep(0.4)
+        self.engine.stop_pattern()
+
+        note_ons = [(m[1], m[3] - origin) for m in self.output.messages if m[0] == 'on']
+        before = [note for note, at in note_ons if at < 0.39]
+        after = [note for note, at in note_ons if at > 0.41]
+        self.assertTrue(before and after)
+        self.assertEqual(set(before), {60})
+        self.assertEqual(set(after), {72})
+        self.assertEqual(self.engine.current_octave, 5)
+
+    def test_scheduled_velocity_change_is_prefetched(self):
+        cache = VelocityTableCache()
+        futures = []
+        prefetch = cache.prefetch
+        self.engine.is_playing = True
+        self.engine._last_total_steps = 8
+        try:
+            with mock.patch("pattern_engine.VELOCITY_TABLES", cache), \
+                    mock.patch.object(cache, "prefetch", lambda **tables: futures.extend(prefetch(**tables))):
+                self.engine.schedule_parameters(quantize="beat", velocity_curve="exponential",
+                                                velocity_intensity=1.7)
+        finally:
+            self.engine.is_playing = False
+        for future in futures:
+            future.result(timeout=2)
+        # La tabella del cambio in attesa è già pronta, prima che lo scheduler lo applichi
+        self.assertEqual(self.engine.current_velocity_curve, "linear")
+        cache.curve_table("exponential", 1.7, 8)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_schedule_when_stopped_is_immediate(self):
+        self.engine.schedule_parameters(quantize="bar", octave=6)
+        self.assertEqual(self.engine.current_octave, 6)
+        with self.assertRaises(ValueError):
+            self.engine.schedule_parameters(quantize="half_bar", octave=3)
+
+    def test_loop_keeps_absolute_clock(self):
+        self.engine.play_pattern(self.cell, PatternType.UP, base_duration=0.05, loop=True)
+        origin = self.engine.scheduler.origin
+        time.sleep(0.33)
+        self.engine.stop_pattern()
+        onsets = [m[3] - origin for m in self.output.messages if m[0] == 'on']
+        # Ogni nota resta sulla griglia di 0.05 s, senza deriva tra un loop e l'altro
+        for index, onset in enumerate(onsets):
+            self.assertAlmostEqual(onset, index * 0.05, delta=0.015)
+
+
+class TestChordQueue(unittest.TestCase):
+    """Test per la coda dei cambi di accordo"""
+
+    def setUp(self):
+        self.output = FakeMIDIOutput()
+        self.engine = PatternEngine(MIDIScaleGenerator(), self.output)
+        generator = ChordGenerator()
+        self.c_cell = generator.generate_color_tree(Note.C)[0][0]
+        self.e_cell = generator.generate_color_tree(Note.E)[0][0]
+        self.g_cell = generator.generate_color_tree(Note.G)[0][0]
+
+    def tearDown(self):
+        self.engine.stop_pattern()
+
+    def test_chord_lands_on_beat(self):
+        # 600 BPM: beat di 0.1 s; una nota ogni 0.05 s
+        self.engine.play_pattern(self.c_cell, PatternType.UP, base_duration=0.05, loop=True, bpm=600)
+        origin = self.engine.scheduler.origin
+        time.sleep(0.12)
+        self.assertTrue(self.engine.queue_chord_change(self.g_cell, "beat"))
+        self.assertEqual(self.engine.pending_chords(), [self.g_cell])
+        time.sleep(0.3)
+        self.engine.stop_pattern()
+
+        note_ons = [(m[1], m[3] - origin) for m in self.output.messages if m[0] == 'on']
+        first_g = next(at for note, at in note_ons if note == 67)
+        # Il nuovo accordo parte esattamente su un beat, dopo la finestra già programmata
+        self.assertAlmostEqual(first_g, round(first_g, 1), delta=0.01)
+        self.assertTrue(all(note == 60 for note, at in note_ons if at < first_g - 0.01))
+        self.assertTrue(all(note == 67 for note, at in note_ons if at > first_g + 0.01))
+
+    def test_queued_chords_play_in_order(self):
+        self.engine.play_pattern(self.c_cell, PatternType.UP, base_duration=0.05, loop=True)
+        time.sleep(0.06)
+        self.engine.queue_chord_change(self.e_cell, "note")
+        self.engine.queue_chord_change(self.g_cell, "note")
+        time.sleep(0.3)
+        self.engine.stop_pattern()
+
+        notes = [m[1] for m in self.output.messages if m[0] == 'on']
+        changes = [note for index, note in enumerate(notes) if index == 0 or note != notes[index - 1]]
+        # Un accordo per passo: C, poi E per un solo passo, poi G
+        self.assertEqual(changes, [60, 64, 67])
+        self.assertEqual(notes.count(64), 1)
+
+    def test_chord_is_precompiled(self):
+        self.engine.play_pattern(self.c_cell, PatternType.UP, base_duration=0.05, loop=True)
+        self.engine.queue_chord_change(self.g_cell, "bar")
+        params = self.engine.get_current_parameters()
+        params['sound_cell'] = self.g_cell
+        cached_before = len(self.engine._compile_cache)
+        self.engine.compile_from_parameters(params)
+        self.assertEqual(len(self.engine._compile_cache), cached_before)
+        with self.assertRaises(ValueError):
+            self.engine.queue_chord_change(self.g_cell, "half_bar")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
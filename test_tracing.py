@@ -0,0 +1,151 @@
+"""
+Test per il tracing in formato Chrome Trace Event
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import tkinter
+import unittest
+from unittest import mock
+import chord_generator
+from chord_generator import ChordGenerator, MIDIOutput, MIDIScaleGenerator, Note
+from pattern_engine import PatternEngine, PatternType
+from test_metrics import FakePort
+from test_midi_effects import FakeMIDIOutput
+from tracing import (NULL_SPAN, TraceBuffer, disable_tracing, enable_tracing, get_tracer, install_tk_tracing,
+                     trace_instant, trace_span, traced)
+
+
+class TestTraceBuffer(unittest.TestCase):
+    """Test per il ring buffer e il formato JSON"""
+
+    def test_ring_overwrites_oldest(self):
+        buffer = TraceBuffer(capacity=4)
+        for index in range(6):
+            buffer.record("X", f"span{index}", "test", index * 1000, 500)
+        self.assertEqual((len(buffer), buffer.dropped), (4, 2))
+        self.assertEqual([event[1] for event in buffer.events()], ["span2", "span3", "span4", "span5"])
+        buffer.clear()
+        self.assertEqual((len(buffer), list(buffer.events())), (0, []))
+        with self.assertRaises(ValueError):
+            TraceBuffer(capacity=0)
+
+    def test_chrome_trace_format(self):
+        buffer = TraceBuffer(capacity=8)
+        buffer.record("X", "compile", "pattern", buffer.origin + 2000, 1500, {'steps': 8})
+        buffer.instant("chord_change", "pattern")
+        trace = json.loads(json.dumps(buffer.to_chrome_trace()))
+        events = [event for event in trace['traceEvents'] if event['ph'] != "M"]
+        span, instant = events
+        self.assertEqual((span['name'], span['cat'], span['ts'], span['dur']), ("compile", "pattern", 2.0, 1.5))
+        self.assertEqual(span['args'], {'steps': 8})
+        self.assertEqual((instant['ph'], instant['s']), ("i", "t"))
+        names = [event for event in trace['traceEvents'] if event['ph'] == "M"]
+        self.assertEqual(names[0]['args']['name'], threading.current_thread().name)
+        self.assertEqual(trace['otherData']['dropped'], 0)
+
+    def test_concurrent_writers(self):
+        buffer = TraceBuffer(capacity=10000)
+        # I thread restano vivi fino alla fine, così hanno identificativi distinti
+        barrier = threading.Barrier(4)
+
+        def write():
+            barrier.wait()
+            for _ in range(1000):
+                buffer.record("i", "tick", "test", time.perf_counter_ns())
+            barrier.wait()
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(list(buffer.events())), 4000)
+        self.assertEqual(len(buffer.thread_names), 4)
+
+
+class TestTracingPoints(unittest.TestCase):
+    """Test per i punti di tracing del motore"""
+
+    def tearDown(self):
+        disable_tracing()
+
+    def test_disabled_tracing_records_nothing(self):
+        disable_tracing()
+        self.assertIs(trace_span("fill", "scheduler"), NULL_SPAN)
+        trace_instant("tick", "test")
+
+        @traced(category="test")
+        def work(value):
+            return value * 2
+
+        self.assertEqual(work(21), 42)
+        tracer = enable_tracing(capacity=16)
+        self.assertEqual(work(1), 2)
+        with trace_span("outer", "test", {'n': 1}):
+            trace_instant("inside", "test")
+        self.assertEqual([event[1] for event in tracer.events()],
+                         ["TestTracingPoints.test_disabled_tracing_records_nothing.<locals>.work", "inside", "outer"])
+        self.assertIs(disable_tracing(), tracer)
+        self.assertIsNone(get_tracer())
+
+    def test_playback_timeline(self):
+        tracer = enable_tracing()
+        engine = PatternEngine(MIDIScaleGenerator(), FakeMIDIOutput())
+        cell = ChordGenerator().generate_color_tree(Note.E)[3][0]
+        engine.play_pattern(cell, PatternType.UP, base_duration=0.02, delay_enabled=True)
+        deadline = time.monotonic() + 5
+        while engine.is_playing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        spans = {(event[2], event[1]) for event in tracer.events()}
+        for expected in (("scheduler", "fill"), ("scheduler", "dispatch"), ("pattern", "load_loop"),
+                         ("pattern", "PatternEngine.compile_pattern"), ("effects", "delay")):
+            self.assertIn(expected, spans)
+        # Gli eventi dello scheduler vengono dal thread di riproduzione
+        threads = {event[5] for event in tracer.events() if event[2] == "scheduler"}
+        self.assertNotIn(threading.get_ident(), threads)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            tracer.dump(path)
+            with open(path, encoding="utf-8") as file:
+                trace = json.load(file)
+        self.assertTrue(all(event['dur'] >= 0 for event in trace['traceEvents'] if event['ph'] == "X"))
+
+    def test_midi_output_and_tk_callbacks(self):
+        tracer = enable_tracing()
+        with mock.patch.object(chord_generator, 'MIDI_AVAILABLE', False):
+            output = MIDIOutput()
+        output.initialized = True
+        output.output_port = FakePort()
+        output.send_note_on(60)
+        output.send_note_off(60)
+        output.send_clock()
+
+        def on_click():
+            return "clicked"
+
+        install_tk_tracing()
+        self.assertEqual(tkinter.CallWrapper(on_click, None, None)(), "clicked")
+        names = [(event[2], event[1]) for event in tracer.events()]
+        self.assertEqual(names[:3], [("midi", "MIDIOutput.send_note_on"), ("midi", "MIDIOutput.send_note_off"),
+                                     ("midi", "MIDIOutput._send_realtime")])
+        self.assertEqual(names[3][0], "tk")
+        self.assertTrue(names[3][1].endswith("on_click"))
+
+        # after() registra la propria callit: la timeline mostra la funzione avvolta
+        def poll_midi_input():
+            return None
+
+        registered = []
+        widget = mock.Mock(_register=lambda func: registered.append(func) or "callit")
+        tkinter.Misc.after(widget, 10, poll_midi_input)
+        tkinter.CallWrapper(registered[0], None, None)()
+        self.assertTrue(list(tracer.events())[-1][1].endswith("poll_midi_input"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
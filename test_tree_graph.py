@@ -0,0 +1,83 @@
+"""
+Test per il grafo delle adiacenze della Color Tree
+"""
+
+import unittest
+from chord_generator import ChordGenerator, Note
+from tree_graph import MOVES, get_graph
+
+
+class TestTreeGraph(unittest.TestCase):
+    """Test per mosse, BFS e passeggiate casuali"""
+
+    def setUp(self):
+        self.graph = get_graph()
+        generator = ChordGenerator()
+        self.c_tree = generator.generate_color_tree(Note.C)
+        self.g_tree = generator.generate_color_tree(Note.G)
+        self.f_tree = generator.generate_color_tree(Note.F)
+
+    def test_moves_follow_fifths(self):
+        cell = self.c_tree[2][1]  # F - C - G
+        self.assertEqual(self.graph.move(cell, "left"), self.c_tree[2][0])
+        self.assertEqual(self.graph.move(cell, "right"), self.c_tree[2][2])
+        self.assertEqual(self.graph.move(cell, "add_above"), self.c_tree[3][1])
+        self.assertEqual(self.graph.move(cell, "add_below"), self.c_tree[3][2])
+        self.assertEqual(self.graph.move(cell, "remove_above"), self.c_tree[1][1])
+        self.assertEqual(self.graph.move(cell, "remove_below"), self.c_tree[1][0])
+        self.assertEqual(self.graph.move(cell, "fifth_up"), self.g_tree[2][1])
+        self.assertEqual(self.graph.move(cell, "fifth_down"), self.f_tree[2][1])
+
+    def test_moves_keep_fifth_counts(self):
+        for cell in self.graph.cells:
+            if cell.level >= 11:
+                continue
+            above = self.graph.move(cell, "add_above")
+            below = self.graph.move(cell, "add_below")
+            self.assertEqual((above.fifths_below, above.fifths_above), (cell.fifths_below, cell.fifths_above + 1))
+            self.assertEqual((below.fifths_below, below.fifths_above), (cell.fifths_below + 1, cell.fifths_above))
+
+    def test_edges_of_the_tree(self):
+        self.assertIsNone(self.graph.move(self.c_tree[0][0], "left"))
+        self.assertIsNone(self.graph.move(self.c_tree[0][0], "remove_above"))
+        self.assertEqual(self.graph.move(self.c_tree[10][4], "add_above"), self.c_tree[11][0])
+        # La scala cromatica è vicina di tutte le celle del livello 11
+        neighbours = self.graph.neighbours(self.c_tree[11][0])
+        self.assertTrue(all(cell in neighbours for cell in self.c_tree[10]))
+
+    def test_adjacency_is_symmetric(self):
+        for index in range(len(self.graph.cells)):
+            for neighbour in self.graph.neighbour_ids(index):
+                self.assertIn(index, self.graph.neighbour_ids(neighbour))
+        self.assertEqual(self.graph.moves.shape, (len(self.graph.cells), len(MOVES)))
+
+    def test_shortest_path(self):
+        start, goal = self.c_tree[0][0], self.c_tree[4][2]
+        path = self.graph.shortest_path(start, goal)
+        self.assertEqual(path[0], start)
+        self.assertEqual(path[-1], goal)
+        self.assertEqual(len(path) - 1, self.graph.distances(start)[self.graph.cells.index(goal)])
+        for first, second in zip(path, path[1:]):
+            self.assertIn(second, self.graph.neighbours(first))
+        self.assertTrue((self.graph.distances(start) >= 0).all())
+
+    def test_random_walk(self):
+        start = self.c_tree[2][1]
+        walk = list(self.graph.random_walk(start, steps=50, seed=7))
+        self.assertEqual(len(walk), 50)
+        self.assertEqual(walk, list(self.graph.random_walk(start, steps=50, seed=7)))
+        previous = start
+        for cell in walk:
+            self.assertIn(cell, self.graph.neighbours(previous))
+            previous = cell
+
+    def test_random_walk_with_moves(self):
+        walk = list(self.graph.random_walk(self.c_tree[2][1], steps=20, moves=["fifth_up"], seed=1))
+        self.assertEqual([cell.level for cell in walk], [3] * 20)
+        self.assertEqual(walk[11].root, Note.C)
+        # Dal livello 1 non si può scendere: la passeggiata termina subito
+        self.assertEqual(list(self.graph.random_walk(self.c_tree[0][0], steps=5, moves=["remove_below"])), [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
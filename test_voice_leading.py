@@ -0,0 +1,90 @@
+"""
+Test per la matrice di voice leading
+Verifica i costi, la cache su disco e le interrogazioni k-nearest
+"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+from cell_index import all_cells, cell_count, cell_id, cell_masks
+from chord_generator import ChordGenerator, Note
+from voice_leading import VoiceLeadingIndex, build_matrix, load_matrix, matrix_path
+
+
+def make_mask(*notes):
+    """Maschera a 12 bit da una lista di note"""
+    return sum(1 << note.value for note in notes)
+
+
+class TestCellIndex(unittest.TestCase):
+    """Test per l'enumerazione delle celle"""
+
+    def test_enumeration(self):
+        # 67 celle per root: livelli 1-11 con "livello" celle più la scala cromatica
+        self.assertEqual(cell_count(), 12 * 67)
+        cell = ChordGenerator().generate_color_tree(Note.G)[2][1]
+        self.assertEqual(all_cells()[cell_id(cell)].notes, cell.notes)
+        self.assertEqual(cell_masks()[cell_id(cell)], cell.to_bitmask())
+
+
+class TestVoiceLeadingMatrix(unittest.TestCase):
+    """Test per la costruzione della matrice"""
+
+    def test_equal_size_uses_best_rotation(self):
+        masks = np.array([make_mask(Note.C, Note.E, Note.G), make_mask(Note.C, Note.F, Note.A),
+                          make_mask(Note.B, Note.D, Note.G)], dtype=np.uint16)
+        matrix = build_matrix(masks)
+        # C-E-G -> C-F-A: E->F e G->A
+        self.assertEqual(matrix[0, 1], 3)
+        # C-E-G -> B-D-G: C->B, E->D
+        self.assertEqual(matrix[0, 2], 3)
+        self.assertTrue((matrix == matrix.T).all())
+        self.assertEqual(int(matrix.trace()), 0)
+
+    def test_different_sizes(self):
+        masks = np.array([make_mask(Note.C, Note.G), make_mask(Note.C, Note.E, Note.G)], dtype=np.uint16)
+        # E va sulla nota più vicina (G, 3 semitoni); C e G restano ferme
+        self.assertEqual(build_matrix(masks)[0, 1], 3)
+
+    def test_disk_cache_is_memory_mapped(self):
+        cache_dir = tempfile.mkdtemp()
+        masks = cell_masks()[:40]
+        first = load_matrix(cache_dir, masks)
+        self.assertTrue(os.path.exists(matrix_path(cache_dir, masks)))
+        second = load_matrix(cache_dir, masks)
+        self.assertIsInstance(second, np.memmap)
+        self.assertTrue(np.array_equal(first, build_matrix(masks)))
+
+
+class TestSmoothestNext(unittest.TestCase):
+    """Test per le interrogazioni sulle celle più vicine"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = VoiceLeadingIndex(cache_dir=tempfile.mkdtemp())
+        cls.cell = ChordGenerator().generate_color_tree(Note.C)[2][1]
+
+    def test_results_sorted_and_distinct(self):
+        results = self.index.smoothest_next(self.cell, k=6)
+        self.assertEqual(len(results), 6)
+        costs = [cost for _, cost in results]
+        self.assertEqual(costs, sorted(costs))
+        masks = [cell.to_bitmask() for cell, _ in results]
+        self.assertEqual(len(set(masks)), len(masks))
+        self.assertNotIn(self.cell.to_bitmask(), masks)
+
+    def test_matches_brute_force(self):
+        row = self.index.matrix[cell_id(self.cell)]
+        results = self.index.smoothest_next(self.cell, k=3, distinct=False)
+        others = np.delete(row, cell_id(self.cell))
+        self.assertEqual([cost for _, cost in results], sorted(others.tolist())[:3])
+
+    def test_level_filter(self):
+        results = self.index.smoothest_next(self.cell, k=4, levels=[4])
+        self.assertTrue(all(cell.level == 4 for cell, _ in results))
+        self.assertEqual(self.index.cost(self.cell, self.cell), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
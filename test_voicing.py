@@ -0,0 +1,87 @@
+"""
+Test per il motore di voicing
+Verifica i tipi di voicing, i rivolti, il range e la scelta per voice leading
+"""
+
+import unittest
+from chord_generator import ChordGenerator, MIDIScaleGenerator, Note, SoundCell
+from pattern_engine import PatternEngine, PatternType
+from voicing import VoicingEngine, voice_leading_distance
+
+
+def make_cell(notes, root=Note.C):
+    """Crea una sound cell di test con le note indicate"""
+    return SoundCell(notes=notes, root=root, level=len(notes), position=0,
+                     fifths_below=0, fifths_above=len(notes) - 1, brightness=0.5)
+
+
+class TestVoicingEngine(unittest.TestCase):
+    """Test per VoicingEngine"""
+
+    def setUp(self):
+        self.engine = VoicingEngine()
+        self.seventh = make_cell([Note.C, Note.E, Note.G, Note.B])
+
+    def test_close_inversions(self):
+        inversions = self.engine.close_inversions(make_cell([Note.C, Note.E, Note.G]), octave=4)
+        self.assertEqual(inversions, [(60, 64, 67), (64, 67, 72), (67, 72, 76)])
+
+    def test_drop2_and_drop3(self):
+        self.assertEqual(self.engine.voicings(self.seventh, "drop2")[0], (55, 60, 64, 71))
+        self.assertEqual(self.engine.voicings(self.seventh, "drop3")[0], (52, 60, 67, 71))
+
+    def test_open_and_spread(self):
+        self.assertEqual(self.engine.voicings(self.seventh, "open")[0], (60, 67, 71, 76))
+        self.assertEqual(self.engine.voicings(self.seventh, "spread")[0], (48, 64, 67, 83))
+
+    def test_fit_range(self):
+        engine = VoicingEngine(low_note=48, high_note=72)
+        self.assertEqual(engine.fit_range((40, 44, 47)), (52, 56, 59))
+        self.assertTrue(all(48 <= note <= 72 for note in engine.fit_range((30, 60, 100))))
+
+    def test_voicings_are_cached(self):
+        first = self.engine.voicings(self.seventh, "close")
+        self.assertIs(first, self.engine.voicings(self.seventh, "close"))
+
+    def test_voice_leading_choice(self):
+        c_major = make_cell([Note.C, Note.E, Note.G])
+        f_major = make_cell([Note.F, Note.A, Note.C], root=Note.F)
+        previous = self.engine.voice(c_major, "close", "inversion", octave=4)
+        following = self.engine.voice(f_major, "close", "inversion", octave=4, previous=previous)
+        # Da C-E-G il movimento minimo porta a C-F-A (secondo rivolto di F)
+        self.assertEqual(following, (60, 65, 69))
+        self.assertEqual(voice_leading_distance(previous, following), 3)
+
+    def test_extension_doubles_bass(self):
+        voiced = self.engine.voice(make_cell([Note.C, Note.E, Note.G]), "close", "extension")
+        self.assertEqual(voiced, (60, 64, 67, 72))
+
+
+class TestVoicedPatterns(unittest.TestCase):
+    """Test per il chord generator nel Pattern Engine"""
+
+    def setUp(self):
+        self.engine = PatternEngine(MIDIScaleGenerator())
+        self.cell = ChordGenerator().generate_color_tree(Note.C)[2][1]
+
+    def test_arpeggio_uses_voicing(self):
+        self.engine.update_parameters(sound_cell=self.cell, pattern_type=PatternType.UP,
+                                      chord_gen_enabled=True, voicing="spread",
+                                      chord_variation="voicing")
+        buffer = self.engine.render_pattern_events()
+        expected = self.engine.voicing_engine.voicings(self.cell, "spread")[0]
+        self.assertEqual(tuple(buffer.notes.tolist()), expected)
+
+    def test_block_chords_share_onsets(self):
+        self.engine.update_parameters(sound_cell=self.cell, pattern_type=PatternType.UP,
+                                      base_duration=0.5, chord_gen_enabled=True,
+                                      chord_variation="voicing", chord_play_mode="block")
+        buffer = self.engine.render_pattern_events()
+        size = len(self.cell.notes)
+        self.assertEqual(len(buffer), size * size)
+        self.assertEqual(buffer.onsets[:size].tolist(), [0.0] * size)
+        self.assertEqual(buffer.total_steps, size)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
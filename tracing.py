@@ -0,0 +1,255 @@
+"""
+Tracing opzionale dell'attività del motore in formato Chrome Trace Event (Perfetto)
+Span (inizio/fine) ed eventi istantanei finiscono in un ring buffer preallocato: scheduler,
+compilazione dei pattern, stadi degli effetti, invii MIDI e callback Tk su un'unica timeline.
+
+Si attiva con enable_tracing() o impostando COLOR_TREE_TRACE=percorso.json (il file viene
+scritto all'uscita); da spento ogni punto di tracing costa un solo controllo.
+"""
+
+import atexit
+import functools
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from config import TRACE_CONFIG
+from metrics import write_json
+
+
+DEFAULT_CAPACITY = 65536
+
+# Fasi del formato Chrome Trace: evento completo (span con durata) e istantaneo
+PHASE_COMPLETE = "X"
+PHASE_INSTANT = "i"
+
+
+class TraceBuffer:
+    """Ring buffer preallocato di eventi; i più vecchi vengono sovrascritti"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError(f"Capacità del buffer di tracing non valida: {capacity}")
+        self.capacity = capacity
+        self.phases = [None] * capacity
+        self.names = [None] * capacity
+        self.categories = [None] * capacity
+        self.timestamps = [0] * capacity
+        self.durations = [0] * capacity
+        self.threads = [0] * capacity
+        self.args = [None] * capacity
+        self.thread_names: Dict[int, str] = {}
+        self.origin = time.perf_counter_ns()
+        self.recorded = 0
+        # next() su itertools.count è atomico: i thread non si contendono lo stesso slot
+        self._counter = itertools.count()
+
+    def record(self, phase: str, name: str, category: str, start_ns: int, duration_ns: int = 0,
+               args: Optional[dict] = None):
+        """Scrive un evento nel prossimo slot del ring"""
+        index = next(self._counter)
+        slot = index % self.capacity
+        thread = threading.get_ident()
+        # Gli identificativi dei thread terminati vengono riusati: vale l'ultimo nome
+        self.thread_names[thread] = threading.current_thread().name
+        self.phases[slot] = None  # slot incompleto finché non è scritto del tutto
+        self.names[slot] = name
+        self.categories[slot] = category
+        self.timestamps[slot] = start_ns
+        self.durations[slot] = duration_ns
+        self.threads[slot] = thread
+        self.args[slot] = args
+        self.phases[slot] = phase
+        if index >= self.recorded:
+            self.recorded = index + 1
+
+    def instant(self, name: str, category: str, args: Optional[dict] = None):
+        self.record(PHASE_INSTANT, name, category, time.perf_counter_ns(), 0, args)
+
+    @property
+    def dropped(self) -> int:
+        """Eventi sovrascritti perché il ring era pieno"""
+        return max(0, self.recorded - self.capacity)
+
+    def __len__(self) -> int:
+        return min(self.recorded, self.capacity)
+
+    def events(self) -> Iterator[Tuple]:
+        """Eventi presenti, dal più vecchio: (fase, nome, categoria, inizio ns, durata ns, thread, args)"""
+        recorded = self.recorded
+        first = max(0, recorded - self.capacity)
+        for index in range(first, recorded):
+            slot = index % self.capacity
+            phase = self.phases[slot]
+            if phase is not None:
+                yield (phase, self.names[slot], self.categories[slot], self.timestamps[slot],
+                       self.durations[slot], self.threads[slot], self.args[slot])
+
+    def clear(self):
+        for slot in range(self.capacity):
+            self.phases[slot] = None
+        self.recorded = 0
+        self._counter = itertools.count()
+        self.origin = time.perf_counter_ns()
+
+    def to_chrome_trace(self) -> dict:
+        """Documento Chrome Trace Event (JSON Object Format), apribile in Perfetto o chrome://tracing"""
+        pid = os.getpid()
+        trace_events = [{'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': thread, 'args': {'name': name}}
+                        for thread, name in list(self.thread_names.items())]
+        for phase, name, category, start, duration, thread, args in sorted(self.events(), key=lambda e: e[3]):
+            event = {'name': name, 'cat': category, 'ph': phase, 'pid': pid, 'tid': thread,
+                     'ts': (start - self.origin) / 1000}
+            if phase == PHASE_COMPLETE:
+                event['dur'] = duration / 1000
+            else:
+                event['s'] = "t"
+            if args:
+                event['args'] = args
+            trace_events.append(event)
+        return {'traceEvents': trace_events, 'displayTimeUnit': "ms",
+                'otherData': {'capacity': self.capacity, 'dropped': self.dropped}}
+
+    def dump(self, path: str):
+        """Scrive la timeline in un file JSON"""
+        write_json(self.to_chrome_trace(), path)
+
+
+_tracer: Optional[TraceBuffer] = None
+
+
+def enable_tracing(capacity: int = DEFAULT_CAPACITY) -> TraceBuffer:
+    """Attiva il tracing con un nuovo buffer"""
+    global _tracer
+    _tracer = TraceBuffer(capacity)
+    return _tracer
+
+
+def disable_tracing() -> Optional[TraceBuffer]:
+    """Disattiva il tracing; restituisce il buffer con gli eventi raccolti"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def get_tracer() -> Optional[TraceBuffer]:
+    """Buffer attivo (None se il tracing è spento)"""
+    return _tracer
+
+
+class _NullSpan:
+    """Span vuoto restituito a tracing spento (nessuna allocazione)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer: TraceBuffer, name: str, category: str, args: Optional[dict]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(PHASE_COMPLETE, self.name, self.category, self.start,
+                           time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+def trace_span(name: str, category: str, args: Optional[dict] = None):
+    """Context manager che registra uno span con inizio e durata"""
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return _Span(tracer, name, category, args)
+
+
+def trace_instant(name: str, category: str, args: Optional[dict] = None):
+    """Registra un evento istantaneo"""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.instant(name, category, args)
+
+
+def traced(name: Optional[str] = None, category: str = "app") -> Callable:
+    """Decoratore che registra uno span a ogni chiamata (nome di default: qualname della funzione)"""
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.record(PHASE_COMPLETE, span_name, category, start, time.perf_counter_ns() - start)
+        return wrapper
+    return decorator
+
+
+_tk_installed = False
+
+
+def _callback_name(func) -> str:
+    """Nome del callback Tk; per after() quello della funzione avvolta da Misc.after"""
+    code = getattr(func, '__code__', None)
+    if code is not None and func.__qualname__.endswith("after.<locals>.callit") and 'func' in code.co_freevars:
+        func = func.__closure__[code.co_freevars.index('func')].cell_contents
+    return getattr(func, '__qualname__', None) or repr(func)
+
+
+def install_tk_tracing():
+    """Registra uno span per ogni callback Tk (comandi, binding e after) mentre il tracing è attivo"""
+    global _tk_installed
+    if _tk_installed:
+        return
+    import tkinter
+    original = tkinter.CallWrapper.__call__
+
+    def call(self, *args):
+        tracer = _tracer
+        if tracer is None:
+            return original(self, *args)
+        start = time.perf_counter_ns()
+        try:
+            return original(self, *args)
+        finally:
+            name = _callback_name(self.func)
+            tracer.record(PHASE_COMPLETE, name, "tk", start, time.perf_counter_ns() - start)
+
+    tkinter.CallWrapper.__call__ = call
+    _tk_installed = True
+
+
+def _dump_at_exit(path: str):
+    tracer = get_tracer()
+    if tracer is None:
+        return
+    try:
+        tracer.dump(path)
+        print(f"Timeline di tracing salvata in {path} ({len(tracer)} eventi)")
+    except OSError as e:
+        print(f"Errore nel salvataggio della timeline di tracing: {e}")
+
+
+if TRACE_CONFIG['trace_file']:
+    enable_tracing(TRACE_CONFIG['capacity'])
+    atexit.register(_dump_at_exit, TRACE_CONFIG['trace_file'])
@@ -0,0 +1,168 @@
+"""
+Grafo delle adiacenze della Color Tree
+Rende esplicita la struttura implicita in fifths_below / fifths_above: spostarsi di una posizione
+scambia una quinta sopra con una quinta sotto, salire di livello aggiunge una quinta, trasporre
+la root di una quinta sposta l'intera cella sul circolo
+"""
+
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence
+import numpy as np
+from cell_index import CellKey, all_cells, cell_id, cell_key
+from chord_generator import SoundCell
+
+
+# Mosse possibili da una cella, colonne della tabella delle mosse
+MOVES = (
+    "left",          # una quinta sotto in meno, una sopra in più (posizione - 1)
+    "right",         # una quinta sotto in più, una sopra in meno (posizione + 1)
+    "add_above",     # livello + 1 aggiungendo una quinta sopra
+    "add_below",     # livello + 1 aggiungendo una quinta sotto
+    "remove_above",  # livello - 1 togliendo una quinta sopra
+    "remove_below",  # livello - 1 togliendo una quinta sotto
+    "fifth_up",      # stessa cella con la root una quinta sopra
+    "fifth_down",    # stessa cella con la root una quinta sotto
+)
+
+# Livello della scala cromatica, raggiunto aggiungendo una quinta a qualsiasi cella del livello 11
+CHROMATIC_LEVEL = 12
+
+NO_CELL = -1
+
+
+def _move_target(key: CellKey, move: str) -> Optional[CellKey]:
+    """Chiave della cella raggiunta con una mossa, None se la mossa esce dalla Color Tree"""
+    root, level, position = key
+    if move == "fifth_up":
+        return ((root + 7) % 12, level, position)
+    if move == "fifth_down":
+        return ((root + 5) % 12, level, position)
+    if level == CHROMATIC_LEVEL:
+        # La scala cromatica non ha quinte sopra o sotto da scambiare o togliere singolarmente
+        return None
+
+    below, above = position, level - 1 - position
+    if move == "left":
+        below, above = below - 1, above + 1
+    elif move == "right":
+        below, above = below + 1, above - 1
+    elif move == "add_above":
+        above += 1
+    elif move == "add_below":
+        below += 1
+    elif move == "remove_above":
+        above -= 1
+    elif move == "remove_below":
+        below -= 1
+    if below < 0 or above < 0:
+        return None
+    new_level = below + above + 1
+    if new_level == CHROMATIC_LEVEL:
+        return (root, CHROMATIC_LEVEL, 0)
+    return (root, new_level, below)
+
+
+class TreeGraph:
+    """Adiacenze precalcolate di tutte le celle della Color Tree
+
+    moves è una tabella (celle x MOVES) con l'indice della cella raggiunta o NO_CELL;
+    indptr / indices sono le liste di adiacenza in formato CSR, simmetriche e senza duplicati.
+    """
+
+    def __init__(self):
+        self.cells = all_cells()
+        index: Dict[CellKey, int] = {cell_key(cell): i for i, cell in enumerate(self.cells)}
+
+        self.moves = np.full((len(self.cells), len(MOVES)), NO_CELL, dtype=np.int32)
+        for i, cell in enumerate(self.cells):
+            for column, move in enumerate(MOVES):
+                target = _move_target(cell_key(cell), move)
+                if target is not None:
+                    self.moves[i, column] = index[target]
+        self.moves.setflags(write=False)
+
+        # Adiacenze simmetriche: la scala cromatica diventa vicina di tutte le celle del livello 11
+        neighbours: List[set] = [set(row[row != NO_CELL].tolist()) for row in self.moves]
+        for i, row in enumerate(neighbours):
+            for j in row:
+                neighbours[j].add(i)
+        lengths = np.array([len(row) for row in neighbours])
+        self.indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+        self.indices = np.array([j for row in neighbours for j in sorted(row)], dtype=np.int32)
+        self.indptr.setflags(write=False)
+        self.indices.setflags(write=False)
+
+    def neighbour_ids(self, index: int) -> np.ndarray:
+        """Indici dei vicini di una cella (vista sull'array CSR)"""
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def neighbours(self, sound_cell: SoundCell) -> List[SoundCell]:
+        """Celle adiacenti a una cella"""
+        return [self.cells[i] for i in self.neighbour_ids(cell_id(sound_cell))]
+
+    def move(self, sound_cell: SoundCell, move: str) -> Optional[SoundCell]:
+        """Cella raggiunta con una mossa, None se la mossa non è possibile"""
+        target = self.moves[cell_id(sound_cell), MOVES.index(move)]
+        return self.cells[target] if target != NO_CELL else None
+
+    def distances(self, start: SoundCell) -> np.ndarray:
+        """Numero minimo di mosse da start a ogni cella (BFS); -1 per le celle irraggiungibili"""
+        distance = np.full(len(self.cells), -1, dtype=np.int32)
+        origin = cell_id(start)
+        distance[origin] = 0
+        queue = deque([origin])
+        while queue:
+            node = queue.popleft()
+            for neighbour in self.neighbour_ids(node).tolist():
+                if distance[neighbour] < 0:
+                    distance[neighbour] = distance[node] + 1
+                    queue.append(neighbour)
+        return distance
+
+    def shortest_path(self, start: SoundCell, goal: SoundCell) -> Optional[List[SoundCell]]:
+        """Percorso con il minor numero di mosse da start a goal (BFS), estremi compresi"""
+        origin, target = cell_id(start), cell_id(goal)
+        parent = np.full(len(self.cells), NO_CELL, dtype=np.int32)
+        parent[origin] = origin
+        queue = deque([origin])
+        while queue and parent[target] == NO_CELL:
+            node = queue.popleft()
+            for neighbour in self.neighbour_ids(node).tolist():
+                if parent[neighbour] == NO_CELL:
+                    parent[neighbour] = node
+                    queue.append(neighbour)
+        if parent[target] == NO_CELL:
+            return None
+        path = [target]
+        while path[-1] != origin:
+            path.append(int(parent[path[-1]]))
+        return [self.cells[i] for i in reversed(path)]
+
+    def random_walk(self, start: SoundCell, steps: Optional[int] = None,
+                    moves: Optional[Sequence[str]] = None, seed: Optional[int] = None) -> Iterator[SoundCell]:
+        """Passeggiata casuale sul grafo, una cella per passo (start escluso), in O(1) per passo
+
+        Con moves la passeggiata usa solo le mosse indicate; steps=None non termina mai.
+        """
+        rng = np.random.default_rng(seed)
+        columns = [MOVES.index(move) for move in moves] if moves is not None else None
+        node = cell_id(start)
+        taken = 0
+        while steps is None or taken < steps:
+            if columns is None:
+                options = self.neighbour_ids(node)
+            else:
+                options = self.moves[node, columns]
+                options = options[options != NO_CELL]
+            if not len(options):
+                return
+            node = int(options[rng.integers(len(options))])
+            taken += 1
+            yield self.cells[node]
+
+
+@lru_cache(maxsize=1)
+def get_graph() -> TreeGraph:
+    """Grafo condiviso, costruito alla prima richiesta"""
+    return TreeGraph()
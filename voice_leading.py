@@ -0,0 +1,136 @@
+"""
+Matrice delle distanze di voice leading tra tutte le sound cells
+Costo = movimento minimo totale in semitoni tra le classi di altezza delle due celle, con il
+voicing migliore (ogni voce si muove nell'ottava più vicina). La matrice viene costruita una
+volta, salvata su disco e mappata in memoria ai riavvii successivi.
+"""
+
+import os
+import zlib
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from cell_index import all_cells, cell_id, cell_masks, masks_to_matrix
+from chord_generator import SoundCell
+from config import CACHE_CONFIG
+
+
+# Versione della matrice su disco: va incrementata se cambia la definizione del costo
+MATRIX_VERSION = 1
+
+# Distanza circolare tra classi di altezza (0-6 semitoni)
+_PITCH_CLASSES = np.arange(12)
+CIRCULAR_DISTANCE = np.minimum(np.abs(_PITCH_CLASSES[:, None] - _PITCH_CLASSES[None, :]),
+                               12 - np.abs(_PITCH_CLASSES[:, None] - _PITCH_CLASSES[None, :]))
+
+
+def build_matrix(masks: np.ndarray) -> np.ndarray:
+    """Calcola la matrice dei costi di voice leading (uint8, celle x celle)
+
+    Con lo stesso numero di note il costo è la migliore corrispondenza voce per voce, che per
+    classi di altezza su un cerchio è una delle rotazioni dell'ordine crescente. Con un numero
+    di note diverso ogni nota va sulla nota più vicina dell'altro accordo, in entrambe le
+    direzioni, come in voicing.voice_leading_distance.
+    """
+    members = masks_to_matrix(masks)
+    sizes = members.sum(axis=1)
+
+    # Distanza di ogni classe di altezza dalla nota più vicina di ogni cella
+    nearest = np.where(members[:, None, :], CIRCULAR_DISTANCE[None, :, :], 12).min(axis=2)
+    forward = members.astype(np.int32) @ nearest.T.astype(np.int32)
+    matrix = forward + forward.T
+
+    for size in np.unique(sizes):
+        indices = np.flatnonzero(sizes == size)
+        pitch_classes = np.nonzero(members[indices])[1].reshape(len(indices), size)
+        best = None
+        for shift in range(size):
+            rotated = np.roll(pitch_classes, -shift, axis=1)
+            cost = CIRCULAR_DISTANCE[pitch_classes[:, None, :], rotated[None, :, :]].sum(axis=2)
+            best = cost if best is None else np.minimum(best, cost)
+        matrix[np.ix_(indices, indices)] = best
+
+    return matrix.astype(np.uint8)
+
+
+def matrix_path(cache_dir: str, masks: np.ndarray) -> str:
+    """File della matrice per l'enumerazione di celle indicata"""
+    checksum = zlib.crc32(masks.tobytes())
+    return os.path.join(cache_dir, f"voice_leading_v{MATRIX_VERSION}_{checksum:08x}.npy")
+
+
+def load_matrix(cache_dir: Optional[str] = None, masks: Optional[np.ndarray] = None) -> np.ndarray:
+    """Matrice mappata in memoria dalla cache su disco; la costruisce e salva se manca"""
+    masks = cell_masks() if masks is None else masks
+    cache_dir = cache_dir or CACHE_CONFIG['cache_dir']
+    path = matrix_path(cache_dir, masks)
+    expected = (len(masks), len(masks))
+
+    if os.path.exists(path):
+        try:
+            matrix = np.load(path, mmap_mode='r')
+            if matrix.shape == expected and matrix.dtype == np.uint8:
+                return matrix
+        except (OSError, ValueError) as e:
+            print(f"Errore nella lettura della cache di voice leading: {e}")
+
+    matrix = build_matrix(masks)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Scrittura atomica: un processo concorrente non legge mai un file a metà
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as handle:
+            np.save(handle, matrix)
+        os.replace(temporary, path)
+        return np.load(path, mmap_mode='r')
+    except OSError as e:
+        print(f"Errore nel salvataggio della cache di voice leading: {e}")
+        return matrix
+
+
+class VoiceLeadingIndex:
+    """Interrogazioni sulla matrice di voice leading di tutte le celle"""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cells = all_cells()
+        self.masks = cell_masks()
+        self.levels = np.array([cell.level for cell in self.cells], dtype=np.int8)
+        self.matrix = load_matrix(cache_dir, self.masks)
+
+    def cost(self, first: SoundCell, second: SoundCell) -> int:
+        """Costo di voice leading tra due celle"""
+        return int(self.matrix[cell_id(first), cell_id(second)])
+
+    def smoothest_next(self, sound_cell: SoundCell, k: int = 5, distinct: bool = True,
+                       levels: Optional[Sequence[int]] = None) -> List[Tuple[SoundCell, int]]:
+        """Le k celle raggiungibili con il minor movimento delle voci
+
+        Con distinct=True esclude le celle con le stesse note della cella di partenza e
+        restituisce una sola cella per insieme di note; levels limita i livelli ammessi.
+        """
+        index = cell_id(sound_cell)
+        costs = self.matrix[index].astype(np.int32)
+        allowed = np.ones(len(costs), dtype=bool)
+        allowed[index] = False
+        if distinct:
+            allowed &= self.masks != self.masks[index]
+        if levels is not None:
+            allowed &= np.isin(self.levels, list(levels))
+        candidates = np.flatnonzero(allowed)
+        if distinct:
+            # Una sola cella per insieme di note: la prima nell'enumerazione
+            _, first = np.unique(self.masks[candidates], return_index=True)
+            candidates = candidates[np.sort(first)]
+        if k <= 0 or not len(candidates):
+            return []
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(costs[candidates], k - 1)[:k]]
+        # Ordine per costo e, a parità, per posizione nell'enumerazione
+        order = np.lexsort((candidates, costs[candidates]))
+        return [(self.cells[i], int(costs[i])) for i in candidates[order]]
+
+
+@lru_cache(maxsize=1)
+def get_index() -> VoiceLeadingIndex:
+    """Indice condiviso, costruito alla prima richiesta"""
+    return VoiceLeadingIndex()
@@ -0,0 +1,155 @@
+"""
+Motore di voicing per le sound cells
+Genera voicing close, open, drop-2, drop-3 e spread con i rivolti, in un range MIDI suonabile
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+from chord_generator import SoundCell
+
+
+VOICING_TYPES = ("close", "open", "drop2", "drop3", "spread")
+CHORD_VARIATIONS = ("inversion", "extension", "substitution", "voicing")
+
+# Range MIDI suonabile di default (C2 - C7)
+DEFAULT_LOW_NOTE = 36
+DEFAULT_HIGH_NOTE = 96
+
+Voicing = Tuple[int, ...]
+
+
+def voice_leading_distance(first: Sequence[int], second: Sequence[int]) -> int:
+    """Movimento totale in semitoni tra due voicing
+
+    Con lo stesso numero di voci accoppia le note in ordine; altrimenti ogni nota
+    viene accoppiata alla nota più vicina dell'altro accordo (in entrambe le direzioni).
+    """
+    if not first or not second:
+        return 0
+    if len(first) == len(second):
+        return sum(abs(a - b) for a, b in zip(sorted(first), sorted(second)))
+    forward = sum(min(abs(a - b) for b in second) for a in first)
+    backward = sum(min(abs(b - a) for a in first) for b in second)
+    return forward + backward
+
+
+class VoicingEngine:
+    """Calcola e memorizza i voicing di ogni sound cell"""
+
+    def __init__(self, low_note: int = DEFAULT_LOW_NOTE, high_note: int = DEFAULT_HIGH_NOTE):
+        self.low_note = low_note
+        self.high_note = high_note
+        self._cache: Dict[tuple, Tuple[Voicing, ...]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _cell_key(sound_cell: SoundCell) -> tuple:
+        return (sound_cell.root.value, tuple(note.value for note in sound_cell.notes))
+
+    def close_inversions(self, sound_cell: SoundCell, octave: int = 4) -> List[Voicing]:
+        """Voicing in posizione stretta: fondamentale e tutti i rivolti"""
+        pitch_classes = [note.value for note in sound_cell.notes]
+        if not pitch_classes:
+            return []
+        # MIDI della root come in MIDIScaleGenerator.note_to_midi_number
+        base = pitch_classes[0] + octave * 12 + 12
+        inversions = []
+        for start in range(len(pitch_classes)):
+            rotated = pitch_classes[start:] + pitch_classes[:start]
+            pitch = base + (rotated[0] - pitch_classes[0]) % 12
+            voicing = [pitch]
+            for pitch_class in rotated[1:]:
+                pitch = pitch + ((pitch_class - pitch) % 12 or 12)
+                voicing.append(pitch)
+            inversions.append(tuple(voicing))
+        return inversions
+
+    @staticmethod
+    def apply_voicing(close: Voicing, voicing: str) -> Voicing:
+        """Trasforma un voicing stretto nel tipo richiesto"""
+        notes = sorted(close)
+        count = len(notes)
+        if voicing == "open" and count >= 3:
+            # Alza di un'ottava le voci interne alternate
+            notes = [note + 12 if 0 < i < count - 1 and i % 2 == 1 else note
+                     for i, note in enumerate(notes)]
+        elif voicing == "drop2" and count >= 3:
+            # Abbassa di un'ottava la seconda voce dall'alto
+            notes[-2] -= 12
+        elif voicing == "drop3" and count >= 4:
+            # Abbassa di un'ottava la terza voce dall'alto
+            notes[-3] -= 12
+        elif voicing == "spread" and count >= 3:
+            # Basso un'ottava sotto e voce superiore un'ottava sopra
+            notes[0] -= 12
+            notes[-1] += 12
+        return tuple(sorted(notes))
+
+    def fit_range(self, voicing: Voicing) -> Voicing:
+        """Sposta il voicing di ottave per farlo rientrare nel range suonabile"""
+        notes = list(voicing)
+        while notes and min(notes) < self.low_note and max(notes) + 12 <= self.high_note:
+            notes = [note + 12 for note in notes]
+        while notes and max(notes) > self.high_note and min(notes) - 12 >= self.low_note:
+            notes = [note - 12 for note in notes]
+        # Se l'accordo è più largo del range, ripiega le singole note
+        folded = []
+        for note in notes:
+            while note < self.low_note:
+                note += 12
+            while note > self.high_note:
+                note -= 12
+            folded.append(note)
+        return tuple(sorted(set(folded)))
+
+    def voicings(self, sound_cell: SoundCell, voicing: str = "close", octave: int = 4) -> Tuple[Voicing, ...]:
+        """Tutti i rivolti della cella nel voicing indicato (precalcolati e memorizzati)"""
+        key = (self._cell_key(sound_cell), voicing, octave)
+        cached = self._cache.get(key)
+        if cached is None:
+            self.misses += 1
+            cached = tuple(self.fit_range(self.apply_voicing(close, voicing))
+                           for close in self.close_inversions(sound_cell, octave))
+            self._cache[key] = cached
+        else:
+            self.hits += 1
+        return cached
+
+    def precompute(self, sound_cells: Sequence[SoundCell], octave: int = 4):
+        """Precalcola tutti i tipi di voicing per un insieme di celle"""
+        for sound_cell in sound_cells:
+            for voicing in VOICING_TYPES:
+                self.voicings(sound_cell, voicing, octave)
+
+    def candidates(self, sound_cell: SoundCell, voicing: str = "close",
+                   variation: str = "inversion", octave: int = 4) -> List[Voicing]:
+        """Voicing candidati secondo la variazione scelta"""
+        inversions = self.voicings(sound_cell, voicing, octave)
+        if not inversions:
+            return []
+        if variation == "inversion":
+            return list(inversions)
+        elif variation == "substitution":
+            # Qualsiasi tipo di voicing e rivolto: sceglie il più vicino
+            return [candidate for kind in VOICING_TYPES
+                    for candidate in self.voicings(sound_cell, kind, octave)]
+        elif variation == "extension":
+            # Primo rivolto del voicing con il basso raddoppiato sopra la voce più acuta
+            root_position = inversions[0]
+            octaves_above = (root_position[-1] - root_position[0]) // 12 + 1
+            return [self.fit_range(root_position + (root_position[0] + 12 * octaves_above,))]
+        return [inversions[0]]
+
+    def voice(self, sound_cell: SoundCell, voicing: str = "close", variation: str = "inversion",
+              octave: int = 4, previous: Optional[Voicing] = None) -> Voicing:
+        """Sceglie il voicing della cella con il minor movimento rispetto all'accordo precedente"""
+        options = self.candidates(sound_cell, voicing, variation, octave)
+        if not options:
+            return ()
+        if previous is None:
+            return options[0]
+        # Considera anche ogni candidato un'ottava sopra e sotto, se resta nel range
+        shifted = [tuple(note + shift for note in candidate)
+                   for candidate in options for shift in (0, -12, 12)
+                   if candidate[0] + shift >= self.low_note and candidate[-1] + shift <= self.high_note]
+        return min(shifted or options, key=lambda candidate: voice_leading_distance(previous, candidate))